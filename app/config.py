@@ -34,6 +34,11 @@ class Settings:
     ADMIN_IDS: List[int] = field(default_factory=list)
     SKIP_GROUP_CHECK: bool = False  # Проверять группу (бот добавлен)
     DISABLE_ADMIN_NOTIFICATIONS: bool = True  # Отключить автоматические уведомления админу
+    TASK_AUTO_ANNOUNCE: bool = False  # Рассылать анонс, когда задание стартует по расписанию
+    FSM_STORAGE: str = "sqlite"  # Хранилище состояний диалогов: sqlite | redis | memory
+    FSM_REDIS_URL: str = "redis://localhost:6379/0"
+    WORKERS: int = 0  # Процессов-обработчиков за очередью апдейтов; 0 - всё в одном процессе
+    BOT_API_URL: str = ""  # Свой сервер Bot API (local bot-api, заглушка бенчмарков); пусто - api.telegram.org
     
     # Настройки капсул и наград
     CAPSULE_REWARDS: List[CapsuleReward] = field(default_factory=list)
@@ -92,5 +97,10 @@ class Settings:
             CHANNEL_LINK=os.getenv("CHANNEL_LINK", ""),
             GROUP_LINK=os.getenv("GROUP_LINK", ""),
             DB_PATH=os.getenv("DB_PATH", "bot.db"),
-            ADMIN_IDS=admin_ids
+            ADMIN_IDS=admin_ids,
+            TASK_AUTO_ANNOUNCE=os.getenv("TASK_AUTO_ANNOUNCE", "0") == "1",
+            FSM_STORAGE=os.getenv("FSM_STORAGE", "sqlite"),
+            FSM_REDIS_URL=os.getenv("FSM_REDIS_URL", "redis://localhost:6379/0"),
+            WORKERS=int(os.getenv("WORKERS", "0")),
+            BOT_API_URL=os.getenv("BOT_API_URL", "").strip()
         )
@@ -1,17 +1,88 @@
 import sqlite3
 import logging
+import os
+import time
 from contextlib import contextmanager
-from typing import Optional, List, Dict, Any
-from datetime import datetime, timedelta
+from contextvars import ContextVar
+from typing import Optional, List, Dict, Any, FrozenSet, Iterable, Tuple
+from datetime import date, datetime, timedelta, timezone
+
+from app.models import CaptchaSession, Task, TaskCompletion, User, WithdrawalRequest
+from app.services.query_trace import TracedConnection
+from app.utils.cache import TTLCache
+
+# Журнал балансов: каждая проводка переводит сумму между двумя счетами.
+# Счёт пользователя - ACCOUNT_USER вместе с user_id проводки.
+ACCOUNT_USER = 'user'
+ACCOUNT_REWARDS = 'rewards'  # Источник всех начислений
+ACCOUNT_PAYOUTS = 'payouts'  # Выведенные наружу средства
+
+LEDGER_CAPSULE = 'capsule'
+LEDGER_CHECKIN = 'checkin'
+LEDGER_REFERRAL_BONUS = 'referral_bonus'
+LEDGER_TASK = 'task'
+LEDGER_PAYOUT = 'payout'
+LEDGER_OPENING = 'opening'  # Входящий остаток баз, созданных до журнала
+
+BALANCE_EPSILON = 1e-6
+
+# Кэш горячих пользователей: get_user - самый частый запрос бота
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", "20000"))
+# TTL ограничивает расхождение с правками из других процессов и скриптов
+USER_CACHE_TTL = float(os.getenv("USER_CACHE_TTL", "60"))
+# Дневные счётчики хранятся по номеру дня (epoch day, UTC) в daily_counters:
+# в полночь ничего не сбрасывается, новый день просто начинается с пустых строк.
+# Старые дни удаляются первой записью нового дня.
+DAILY_COUNTER_RETENTION_DAYS = 7
+_EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+
+# daily_capsules_opened пользователя - счётчик сегодняшнего дня (параметр запроса)
+USER_SELECT = "SELECT " + ", ".join(
+    "COALESCE(dc.capsules, 0)" if name == 'daily_capsules_opened' else f"users.{name}"
+    for name in User.COLUMNS
+) + " FROM users LEFT JOIN daily_counters dc ON dc.day = ? AND dc.user_id = users.user_id"
+TASK_SELECT = f"SELECT {Task.projection()} FROM tasks"
+
+# Пользователи, уже прочитанные в рамках текущего апдейта (см. Database.request_scope)
+_request_users: ContextVar[Optional[Dict[int, Optional[User]]]] = ContextVar("request_users", default=None)
+
+def epoch_day(now: Optional[datetime] = None) -> int:
+    """Номер дня от 1970-01-01 по UTC - ключ дневных счётчиков"""
+    return (now or datetime.now(timezone.utc)).date().toordinal() - _EPOCH_ORDINAL
+
+def _sqlite_now() -> str:
+    """Текущее время в формате datetime('now') SQLite (UTC)"""
+    return datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
 
 class Database:
     def __init__(self, db_path: str):
         self.db_path = db_path
+        # Каталог активных заданий в памяти; сбрасывается при изменении заданий
+        # и автоматически перечитывается, когда наступает ближайший expires_at
+        self._task_catalog: Optional[List[Task]] = None
+        self._task_catalog_next_expiry: Optional[str] = None
+        self._task_catalog_loaded_at = 0.0
+        # Если задания меняет другой процесс (WORKERS > 0), каталог живёт не дольше этого
+        self.task_catalog_max_age: Optional[float] = None
+        # Выполненные задания по пользователям (одним запросом на пользователя)
+        self._completed_tasks = TTLCache(maxsize=50000, ttl=600)
+        # Когда статусы по датам переключает планировщик, каталог не сверяет даты на запрос
+        self.task_lifecycle_managed = False
+        self._task_listeners: List[Any] = []
+        # Горячие пользователи: LRU со сквозной записью из методов Database
+        self._users = TTLCache(maxsize=USER_CACHE_SIZE, ttl=USER_CACHE_TTL)
+        self.user_memo_hits = 0
+        # День, для которого закэшированы строки (в них сегодняшние счётчики)
+        self._users_day: Optional[int] = None
+        # Последний день, за который уже удалены устаревшие счётчики
+        self._counters_pruned_day: Optional[int] = None
 
     @contextmanager
     def get_connection(self):
         """Контекстный менеджер для работы с БД"""
-        conn = sqlite3.connect(self.db_path)
+        # timeout: при конкурентной записи ждём блокировку, а не падаем с "database is locked"
+        # TracedConnection засекает каждый запрос (метрика db, отпечатки, медленные запросы)
+        conn = sqlite3.connect(self.db_path, timeout=30, factory=TracedConnection)
         conn.row_factory = sqlite3.Row
         try:
             yield conn
@@ -132,6 +203,7 @@ class Database:
                     partner_url TEXT,
                     requirements TEXT,
                     expires_at TIMESTAMP,
+                    starts_at TIMESTAMP,
                     max_completions INTEGER,
                     current_completions INTEGER DEFAULT 0,
                     status TEXT DEFAULT 'active',
@@ -153,6 +225,114 @@ class Database:
                 )
             """)
             
+            # Таблица ежедневных чек-инов
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS user_checkins (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    user_id INTEGER NOT NULL,
+                    checkin_date TEXT NOT NULL,
+                    sc_amount REAL DEFAULT 0.5,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    UNIQUE(user_id, checkin_date)
+                )
+            """)
+            
+            # Дневные счётчики по номеру дня: без ежедневного UPDATE всех users
+            cursor.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name='daily_counters'")
+            counters_are_new = cursor.fetchone() is None
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS daily_counters (
+                    day INTEGER NOT NULL,
+                    user_id INTEGER NOT NULL,
+                    capsules INTEGER NOT NULL DEFAULT 0,
+                    PRIMARY KEY (day, user_id)
+                ) WITHOUT ROWID
+            """)
+            if counters_are_new:
+                # Сегодняшние значения старой колонки users.daily_capsules_opened
+                cursor.execute("""
+                    INSERT INTO daily_counters (day, user_id, capsules)
+                    SELECT ?, user_id, daily_capsules_opened FROM users
+                    WHERE last_capsule_date = DATE('now') AND daily_capsules_opened > 0
+                """, (epoch_day(),))
+            
+            # Состояния FSM диалогов (капча, кошелёк, создание заданий) переживают рестарт
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS fsm_storage (
+                    key TEXT PRIMARY KEY,
+                    state TEXT,
+                    data TEXT NOT NULL DEFAULT '{}',
+                    updated_at REAL NOT NULL
+                ) WITHOUT ROWID
+            """)
+            cursor.execute("""
+                CREATE INDEX IF NOT EXISTS idx_fsm_updated ON fsm_storage (updated_at)
+            """)
+            
+            # Журнал балансов (только добавление) и его снимки
+            # Проверка, создание и входящие остатки - одной транзакцией под блокировкой
+            # записи: падение или соседний воркер не оставят журнал без входящих проводок
+            conn.commit()
+            cursor.execute("BEGIN IMMEDIATE")
+            try:
+                cursor.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name='ledger_entries'")
+                ledger_is_new = cursor.fetchone() is None
+                cursor.execute("""
+                    CREATE TABLE IF NOT EXISTS ledger_entries (
+                        id INTEGER PRIMARY KEY AUTOINCREMENT,
+                        user_id INTEGER NOT NULL,
+                        entry_type TEXT NOT NULL,
+                        debit_account TEXT NOT NULL,
+                        credit_account TEXT NOT NULL,
+                        amount REAL NOT NULL CHECK (amount > 0),
+                        ref TEXT,
+                        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                    )
+                """)
+                cursor.execute("""
+                    CREATE INDEX IF NOT EXISTS idx_ledger_user ON ledger_entries (user_id, id)
+                """)
+                cursor.execute("""
+                    CREATE TABLE IF NOT EXISTS ledger_snapshots (
+                        user_id INTEGER PRIMARY KEY,
+                        earned REAL NOT NULL DEFAULT 0,
+                        paid REAL NOT NULL DEFAULT 0,
+                        last_entry_id INTEGER NOT NULL DEFAULT 0,
+                        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                    )
+                """)
+                cursor.execute("""
+                    CREATE TABLE IF NOT EXISTS ledger_snapshot_runs (
+                        id INTEGER PRIMARY KEY AUTOINCREMENT,
+                        last_entry_id INTEGER NOT NULL,
+                        entries INTEGER NOT NULL,
+                        users INTEGER NOT NULL,
+                        drifted INTEGER NOT NULL,
+                        duration_ms REAL,
+                        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                    )
+                """)
+                if ledger_is_new:
+                    self._open_ledger(cursor)
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+            
+            # Миграции для существующих баз
+            self._ensure_column(cursor, "tasks", "starts_at", "TIMESTAMP")
+            self._ensure_column(cursor, "withdrawal_requests", "idempotency_key", "TEXT")
+            
+            # Повтор одного и того же запроса на вывод не создаёт вторую заявку
+            cursor.execute("""
+                CREATE UNIQUE INDEX IF NOT EXISTS idx_withdrawal_idempotency
+                ON withdrawal_requests (idempotency_key)
+            """)
+            cursor.execute("""
+                CREATE INDEX IF NOT EXISTS idx_withdrawal_user_status
+                ON withdrawal_requests (user_id, status)
+            """)
+            
             conn.commit()
             
             # Проверяем что таблицы созданы
@@ -163,18 +343,115 @@ class Database:
             if 'users' not in tables:
                 raise Exception("Critical table 'users' was not created!")
 
-    def get_user(self, user_id: int) -> Optional[Dict[str, Any]]:
-        """Получить пользователя по ID"""
+    @staticmethod
+    def _open_ledger(cursor):
+        """Перенести накопленные до журнала балансы входящими проводками (повтор не задваивает)"""
+        cursor.execute("""
+            INSERT INTO ledger_entries (user_id, entry_type, debit_account, credit_account, amount, ref)
+            SELECT user_id, ?, ?, ?, total_earnings, 'opening balance'
+            FROM users WHERE total_earnings > 0 AND NOT EXISTS (
+                SELECT 1 FROM ledger_entries e
+                WHERE e.user_id = users.user_id AND e.entry_type = ? AND e.debit_account = ?
+            )
+        """, (LEDGER_OPENING, ACCOUNT_REWARDS, ACCOUNT_USER, LEDGER_OPENING, ACCOUNT_REWARDS))
+        cursor.execute("""
+            INSERT INTO ledger_entries (user_id, entry_type, debit_account, credit_account, amount, ref)
+            SELECT user_id, ?, ?, ?, paid_balance, 'opening balance'
+            FROM users WHERE paid_balance > 0 AND NOT EXISTS (
+                SELECT 1 FROM ledger_entries e
+                WHERE e.user_id = users.user_id AND e.entry_type = ? AND e.debit_account = ?
+            )
+        """, (LEDGER_OPENING, ACCOUNT_USER, ACCOUNT_PAYOUTS, LEDGER_OPENING, ACCOUNT_USER))
+        if cursor.rowcount:
+            logging.info("Ledger opened from existing user balances")
+
+    @staticmethod
+    def _ensure_column(cursor, table: str, column: str, ddl: str):
+        """Добавить колонку, если её ещё нет (ALTER TABLE для старых баз)"""
+        cursor.execute(f"PRAGMA table_info({table})")
+        if column not in [row[1] for row in cursor.fetchall()]:
+            cursor.execute(f"ALTER TABLE {table} ADD COLUMN {column} {ddl}")
+            logging.info(f"Database migration: added {table}.{column}")
+
+    @contextmanager
+    def request_scope(self):
+        """Мемоизация get_user на время одного апдейта (middleware, хендлер, сервисы)"""
+        token = _request_users.set({})
         try:
-            with self.get_connection() as conn:
-                cursor = conn.cursor()
-                cursor.execute("SELECT * FROM users WHERE user_id = ?", (user_id,))
-                row = cursor.fetchone()
-                result = dict(row) if row else None
-                return result
-        except Exception as e:
-            print(f"ERROR in get_user({user_id}): {e}")
-            return None
+            yield
+        finally:
+            _request_users.reset(token)
+
+    def get_user(self, user_id: int) -> Optional[User]:
+        """Получить пользователя по ID
+        
+        Возвращает неизменяемый User (читается как dict): он разделяется
+        кэшем, поэтому изменения - только через методы Database.
+        """
+        memo = _request_users.get()
+        if memo is not None and user_id in memo:
+            self.user_memo_hits += 1
+            return memo[user_id]
+        
+        today = epoch_day()
+        if today != self._users_day:
+            # Новый день: закэшированные строки несут вчерашние счётчики
+            self._users_day = today
+            self.invalidate_all_users()
+        
+        user = self._users.get(user_id)
+        if user is None:
+            try:
+                with self.get_connection() as conn:
+                    cursor = conn.cursor()
+                    cursor.row_factory = User.factory
+                    cursor.execute(f"{USER_SELECT} WHERE users.user_id = ?", (today, user_id))
+                    user = cursor.fetchone()
+            except Exception as e:
+                print(f"ERROR in get_user({user_id}): {e}")
+                return None
+            # Отсутствие не кэшируем: пользователя может создать другой процесс
+            if user is not None:
+                self._users.set(user_id, user)
+        
+        if memo is not None:
+            memo[user_id] = user
+        return user
+
+    def invalidate_user(self, *user_ids: int):
+        """Сбросить пользователей из кэша после изменения строки users"""
+        memo = _request_users.get()
+        for user_id in user_ids:
+            self._users.invalidate(user_id)
+            if memo is not None:
+                memo.pop(user_id, None)
+
+    def invalidate_all_users(self):
+        """Сбросить весь кэш пользователей (массовые UPDATE)"""
+        self._users.clear()
+        memo = _request_users.get()
+        if memo is not None:
+            memo.clear()
+
+    def _patch_user(self, user_id: int, **fields: Any):
+        """Сквозная запись: обновить закэшированную строку без похода в базу"""
+        memo = _request_users.get()
+        if memo is not None:
+            memo.pop(user_id, None)
+        cached = self._users.get(user_id)
+        if cached is not None:
+            self._users.set(user_id, cached.replace(**fields))
+
+    def user_cache_stats(self) -> Dict[str, Any]:
+        """Статистика кэша пользователей и оценка памяти на запись"""
+        stats = self._users.stats()
+        sample = self._users.sample(200)
+        stats["memo_hits"] = self.user_memo_hits
+        stats["bytes_per_user"] = (
+            round(sum(user.memory_size() for user in sample) / len(sample)) if sample else 0
+        )
+        stats["approx_bytes"] = stats["bytes_per_user"] * len(self._users)
+        return stats
 
     def create_user(self, user_id: int, username: str | None = None, first_name: str | None = None, 
                    referrer_id: int | None = None) -> bool:
@@ -201,7 +478,8 @@ class Database:
                     """, (referrer_id, user_id))
                 
                 conn.commit()
-                return True
+            self.invalidate_user(user_id, *([referrer_id] if referrer_id else []))
+            return True
         except sqlite3.IntegrityError:
             return False
 
@@ -215,6 +493,7 @@ class Database:
                 WHERE user_id = ?
             """, (checked, user_id))
             conn.commit()
+        self.invalidate_user(user_id)
 
     def ban_user(self, user_id: int, reason: str | None = None):
         """Забанить пользователя"""
@@ -224,6 +503,7 @@ class Database:
                 UPDATE users SET banned = TRUE, ban_reason = ? WHERE user_id = ?
             """, (reason, user_id))
             conn.commit()
+        self._patch_user(user_id, banned=1, ban_reason=reason)
 
     def unban_user(self, user_id: int):
         """Разбанить пользователя"""
@@ -233,6 +513,7 @@ class Database:
                 UPDATE users SET banned = FALSE, ban_reason = NULL WHERE user_id = ?
             """, (user_id,))
             conn.commit()
+        self._patch_user(user_id, banned=0, ban_reason=None)
 
     def update_wallet(self, user_id: int, wallet_address: str):
         """Обновить адрес кошелька"""
@@ -242,11 +523,26 @@ class Database:
                 UPDATE users SET wallet_address = ? WHERE user_id = ?
             """, (wallet_address, user_id))
             conn.commit()
+        self._patch_user(user_id, wallet_address=wallet_address)
 
-    def add_balance(self, user_id: int, amount: float):
-        """Добавить к балансу пользователя"""
-        with self.get_connection() as conn:
-            cursor = conn.cursor()
+    def post_ledger_entry(self, cursor, user_id: int, entry_type: str, amount: float,
+                          ref: str | None = None) -> bool:
+        """Проводка в журнал и обновление балансов users в текущей транзакции
+        
+        Колонки users - материализация журнала для чтения за O(1):
+        total_earnings и balance - всё начисленное, paid_balance - выведенное,
+        pending_balance - их разница. Менять их можно только через проводки.
+        """
+        if amount <= 0:
+            return False
+        if entry_type == LEDGER_PAYOUT:
+            cursor.execute("""
+                UPDATE users 
+                SET pending_balance = pending_balance - ?, paid_balance = paid_balance + ?
+                WHERE user_id = ? AND pending_balance >= ?
+            """, (amount, amount, user_id, amount))
+            debit, credit = ACCOUNT_USER, ACCOUNT_PAYOUTS
+        else:
             cursor.execute("""
                 UPDATE users 
                 SET pending_balance = pending_balance + ?, 
@@ -254,6 +550,22 @@ class Database:
                     total_earnings = total_earnings + ?
                 WHERE user_id = ?
             """, (amount, amount, amount, user_id))
+            debit, credit = ACCOUNT_REWARDS, ACCOUNT_USER
+        if cursor.rowcount == 0:
+            return False
+        cursor.execute("""
+            INSERT INTO ledger_entries (user_id, entry_type, debit_account, credit_account, amount, ref)
+            VALUES (?, ?, ?, ?, ?, ?)
+        """, (user_id, entry_type, debit, credit, amount, ref))
+        self.invalidate_user(user_id)
+        return True
+
+    def add_balance(self, user_id: int, amount: float, entry_type: str = LEDGER_CAPSULE,
+                    ref: str | None = None):
+        """Добавить к балансу пользователя"""
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            self.post_ledger_entry(cursor, user_id, entry_type, amount, ref)
             conn.commit()
 
     def process_payout(self, user_id: int, amount: float, admin_id: int, notes: str | None = None):
@@ -262,13 +574,7 @@ class Database:
             cursor = conn.cursor()
             
             # Перевести из pending в paid
-            cursor.execute("""
-                UPDATE users 
-                SET pending_balance = pending_balance - ?, paid_balance = paid_balance + ?
-                WHERE user_id = ? AND pending_balance >= ?
-            """, (amount, amount, user_id, amount))
-            
-            if cursor.rowcount > 0:
+            if self.post_ledger_entry(cursor, user_id, LEDGER_PAYOUT, amount, notes):
                 # Записать выплату
                 cursor.execute("""
                     INSERT INTO payouts (user_id, amount, admin_id, notes)
@@ -320,44 +626,44 @@ class Database:
                 'total_capsules': total_capsules
             }
 
-    def reset_daily_capsules(self):
-        """Сброс дневного лимита капсул (вызывается ежедневно)"""
-        with self.get_connection() as conn:
-            cursor = conn.cursor()
-            cursor.execute("""
-                UPDATE users 
-                SET daily_capsules_opened = 0
-                WHERE last_capsule_date < DATE('now')
-            """)
-            conn.commit()
+    def capsules_left(self, user_id: int, base_limit: int) -> int:
+        """Сколько капсул пользователь ещё может открыть сегодня
+        
+        Лимит: base_limit + по капсуле за валидного реферала + бонусные капсулы.
+        """
+        user = self.get_user(user_id)
+        if not user:
+            return 0
+        limit = base_limit + (user.validated_referrals or 0) + (user.bonus_capsules or 0)
+        return max(0, limit - user.daily_capsules_opened)
 
     def can_open_capsule(self, user_id: int, daily_limit: int) -> bool:
         """Проверить, может ли пользователь открыть капсулу"""
+        return self.capsules_left(user_id, daily_limit) > 0
+
+    def get_capsules_opened_today(self, user_id: int) -> int:
+        """Открыто капсул за сегодня (счётчик текущего epoch day)"""
         with self.get_connection() as conn:
             cursor = conn.cursor()
-            cursor.execute("""
-                SELECT daily_capsules_opened, last_capsule_date, validated_referrals
-                FROM users WHERE user_id = ?
-            """, (user_id,))
+            cursor.execute("SELECT capsules FROM daily_counters WHERE day = ? AND user_id = ?",
+                           (epoch_day(), user_id))
             row = cursor.fetchone()
-            if not row:
-                return False
-            
-            # Базовая капсула + по 1 за каждого реферала
-            referral_bonus = row['validated_referrals'] if row['validated_referrals'] else 0
-            total_daily_limit = 1 + referral_bonus  # 1 базовая + рефералы
-            
-            # Если дата не сегодня, сбрасываем счетчик
-            today = datetime.now().date()
-            last_date = datetime.strptime(row['last_capsule_date'], '%Y-%m-%d').date() if row['last_capsule_date'] else None
-            
-            if last_date != today:
-                return True
-                
-            return row['daily_capsules_opened'] < total_daily_limit
+            return row[0] if row else 0
+
+    def _prune_daily_counters(self, cursor, today: int):
+        """Удалить счётчики старше срока хранения (раз в день, первой записью дня)"""
+        if self._counters_pruned_day == today:
+            return
+        cursor.execute("DELETE FROM daily_counters WHERE day < ?",
+                       (today - DAILY_COUNTER_RETENTION_DAYS,))
+        self._counters_pruned_day = today
 
     def record_capsule_opening(self, user_id: int, reward_name: str, reward_amount: float):
-        """Записать открытие капсулы"""
+        """Записать открытие капсулы и увеличить счётчики дня и пользователя
+        
+        Награду начисляет SpecialRewardService проводкой через add_balance.
+        """
+        today = epoch_day()
         with self.get_connection() as conn:
             cursor = conn.cursor()
             
@@ -367,50 +673,96 @@ class Database:
                 VALUES (?, ?, ?)
             """, (user_id, reward_name, reward_amount))
             
-            # Обновить счетчики пользователя
+            # Сегодняшний счётчик - строка (day, user_id), вчерашние не трогаем
+            cursor.execute("""
+                INSERT INTO daily_counters (day, user_id, capsules) VALUES (?, ?, 1)
+                ON CONFLICT (day, user_id) DO UPDATE SET capsules = capsules + 1
+            """, (today, user_id))
             cursor.execute("""
                 UPDATE users 
-                SET daily_capsules_opened = daily_capsules_opened + 1,
-                    total_capsules_opened = total_capsules_opened + 1,
+                SET total_capsules_opened = total_capsules_opened + 1,
                     last_capsule_date = DATE('now')
                 WHERE user_id = ?
             """, (user_id,))
+            self._prune_daily_counters(cursor, today)
             
             conn.commit()
+        self.invalidate_user(user_id)
+    
+    def create_withdrawal_request(self, user_id: int, amount: float,
+                                  idempotency_key: str | None = None) -> int:
+        """Создать запрос на вывод средств (0, если средств не хватает)"""
+        result = self.reserve_withdrawal(user_id, amount, idempotency_key)
+        return result.get("request_id", 0) if result["success"] else 0
     
-    def update_user_capsule_stats(self, user_id: int, reward_amount: float):
-        """Обновить статистику капсул пользователя с наградой"""
+    def reserve_withdrawal(self, user_id: int, amount: float,
+                           idempotency_key: str | None = None) -> Dict[str, Any]:
+        """Атомарно зарезервировать средства под заявку на вывод
+        
+        Резерв - это сама заявка в статусе pending: доступно к выводу
+        pending_balance минус сумма pending заявок. Проверка остатка и вставка
+        заявки выполняются одним INSERT ... SELECT под блокировкой записи.
+        
+        reason: created | duplicate | insufficient_funds
+        """
         with self.get_connection() as conn:
             cursor = conn.cursor()
-            
-            # Обновить балансы и счетчики капсул
-            cursor.execute("""
-                UPDATE users 
-                SET daily_capsules_opened = daily_capsules_opened + 1,
-                    total_capsules_opened = total_capsules_opened + 1,
-                    balance = balance + ?,
-                    total_earnings = total_earnings + ?,
-                    last_capsule_date = DATE('now')
-                WHERE user_id = ?
-            """, (reward_amount, reward_amount, user_id))
-            
-            conn.commit()
+            cursor.execute("BEGIN IMMEDIATE")
+            try:
+                if idempotency_key:
+                    cursor.execute("""
+                        SELECT id, user_id, amount, status FROM withdrawal_requests
+                        WHERE idempotency_key = ?
+                    """, (idempotency_key,))
+                    existing = cursor.fetchone()
+                    if existing:
+                        conn.rollback()
+                        return {"success": existing['user_id'] == user_id, "reason": "duplicate",
+                                "request_id": existing['id'], "amount": existing['amount'],
+                                "status": existing['status']}
+                
+                cursor.execute("""
+                    INSERT INTO withdrawal_requests (user_id, amount, status, idempotency_key)
+                    SELECT u.user_id, ?, 'pending', ?
+                    FROM users u
+                    WHERE u.user_id = ?
+                    AND u.pending_balance - COALESCE((
+                        SELECT SUM(amount) FROM withdrawal_requests
+                        WHERE user_id = u.user_id AND status = 'pending'
+                    ), 0) >= ?
+                """, (amount, idempotency_key, user_id, amount))
+                if cursor.rowcount == 0:
+                    conn.rollback()
+                    return {"success": False, "reason": "insufficient_funds",
+                            "available": self.get_available_balance(user_id)}
+                request_id = cursor.lastrowid or 0
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+        
+        logging.info(f"💸 Withdrawal #{request_id} reserved: user {user_id}, {amount} SC")
+        return {"success": True, "reason": "created", "request_id": request_id, "amount": amount}
     
-    def create_withdrawal_request(self, user_id: int, amount: float) -> int:
-        """Создать запрос на вывод средств"""
+    def get_available_balance(self, user_id: int) -> float:
+        """Доступно к выводу: pending_balance за вычетом зарезервированного заявками"""
         with self.get_connection() as conn:
             cursor = conn.cursor()
             cursor.execute("""
-                INSERT INTO withdrawal_requests (user_id, amount, status)
-                VALUES (?, ?, 'pending')
-            """, (user_id, amount))
-            conn.commit()
-            return cursor.lastrowid or 0
+                SELECT u.pending_balance - COALESCE((
+                    SELECT SUM(amount) FROM withdrawal_requests
+                    WHERE user_id = u.user_id AND status = 'pending'
+                ), 0)
+                FROM users u WHERE u.user_id = ?
+            """, (user_id,))
+            row = cursor.fetchone()
+            return max(0.0, row[0] or 0.0) if row else 0.0
     
-    def get_withdrawal_requests(self, status: str = 'pending') -> List[Dict[str, Any]]:
+    def get_withdrawal_requests(self, status: str = 'pending') -> List[WithdrawalRequest]:
         """Получить запросы на вывод средств"""
         with self.get_connection() as conn:
             cursor = conn.cursor()
+            cursor.row_factory = WithdrawalRequest.factory
             cursor.execute("""
                 SELECT wr.id, wr.user_id, wr.amount, wr.status, wr.created_at,
                        u.username, u.first_name, u.wallet_address, u.pending_balance
@@ -419,67 +771,147 @@ class Database:
                 WHERE wr.status = ?
                 ORDER BY wr.created_at ASC
             """, (status,))
-            return [dict(row) for row in cursor.fetchall()]
+            return cursor.fetchall()
     
-    def get_user_withdrawal_requests(self, user_id: int) -> List[Dict[str, Any]]:
+    def get_user_withdrawal_requests(self, user_id: int) -> List[WithdrawalRequest]:
         """Получить активные запросы пользователя"""
         with self.get_connection() as conn:
             cursor = conn.cursor()
+            cursor.row_factory = WithdrawalRequest.factory
             cursor.execute("""
-                SELECT id, amount, status, created_at
+                SELECT id, user_id, amount, status, created_at
                 FROM withdrawal_requests
                 WHERE user_id = ? AND status = 'pending'
                 ORDER BY created_at DESC
             """, (user_id,))
-            return [dict(row) for row in cursor.fetchall()]
+            return cursor.fetchall()
     
     def process_withdrawal_request(self, request_id: int, admin_id: int) -> bool:
         """Обработать запрос на вывод"""
+        return request_id in self.process_withdrawal_requests([request_id], admin_id)["processed"]
+    
+    def process_withdrawal_requests(self, request_ids: List[int], admin_id: int) -> Dict[str, Any]:
+        """Выплатить выбранные заявки одной транзакцией"""
+        return self.process_withdrawal_batch(admin_id, request_ids=request_ids)
+    
+    def process_withdrawal_batch(self, admin_id: int, request_ids: Optional[List[int]] = None,
+                                 require_wallet: bool = False) -> Dict[str, Any]:
+        """Выплатить пачку pending заявок (по умолчанию - все) одной транзакцией
+        
+        Балансы проверяются одним запросом: заявки пользователя идут по порядку,
+        и проходит та, чья нарастающая сумма укладывается в pending_balance.
+        Дальше списание, проводки, статусы и история выплат - по одному
+        запросу на таблицу. Транзакция держит блокировку записи, а в completed
+        переводятся только pending заявки, поэтому повторная или параллельная
+        обработка не спишет средства дважды.
+        """
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("BEGIN IMMEDIATE")
+            try:
+                cursor.execute("""
+                    CREATE TEMP TABLE payout_batch (
+                        request_id INTEGER PRIMARY KEY,
+                        user_id INTEGER NOT NULL,
+                        amount REAL NOT NULL,
+                        wallet_address TEXT
+                    )
+                """)
+                scope = ""
+                if request_ids is not None:
+                    cursor.execute("CREATE TEMP TABLE payout_scope (request_id INTEGER PRIMARY KEY)")
+                    cursor.executemany("INSERT OR IGNORE INTO payout_scope VALUES (?)",
+                                       ((request_id,) for request_id in request_ids))
+                    scope = "AND wr.id IN (SELECT request_id FROM payout_scope)"
+                wallet_check = "AND COALESCE(wallet_address, '') != ''" if require_wallet else ""
+                
+                cursor.execute(f"""
+                    INSERT INTO payout_batch (request_id, user_id, amount, wallet_address)
+                    SELECT id, user_id, amount, wallet_address FROM (
+                        SELECT wr.id, wr.user_id, wr.amount, u.wallet_address, u.pending_balance,
+                               SUM(wr.amount) OVER (PARTITION BY wr.user_id ORDER BY wr.id) AS running_total
+                        FROM withdrawal_requests wr
+                        JOIN users u ON u.user_id = wr.user_id
+                        WHERE wr.status = 'pending' {scope}
+                    )
+                    WHERE running_total <= pending_balance + ? {wallet_check}
+                """, (BALANCE_EPSILON,))
+                
+                # Суммы по пользователям - чтобы UPDATE users искал их по ключу
+                cursor.execute("""
+                    CREATE TEMP TABLE payout_totals AS
+                    SELECT user_id, SUM(amount) AS amount FROM payout_batch GROUP BY user_id
+                """)
+                cursor.execute("CREATE UNIQUE INDEX temp.idx_payout_totals ON payout_totals (user_id)")
+                cursor.execute("""
+                    UPDATE users SET
+                        pending_balance = pending_balance
+                            - (SELECT amount FROM payout_totals t WHERE t.user_id = users.user_id),
+                        paid_balance = paid_balance
+                            + (SELECT amount FROM payout_totals t WHERE t.user_id = users.user_id)
+                    WHERE user_id IN (SELECT user_id FROM payout_totals)
+                """)
+                paid_users = cursor.rowcount
+                cursor.execute("SELECT user_id FROM payout_totals")
+                self.invalidate_user(*(row[0] for row in cursor.fetchall()))
+                cursor.execute("""
+                    INSERT INTO ledger_entries (user_id, entry_type, debit_account, credit_account, amount, ref)
+                    SELECT user_id, ?, ?, ?, amount, 'withdrawal #' || request_id
+                    FROM payout_batch ORDER BY request_id
+                """, (LEDGER_PAYOUT, ACCOUNT_USER, ACCOUNT_PAYOUTS))
+                cursor.execute("""
+                    UPDATE withdrawal_requests
+                    SET status = 'completed', processed_at = CURRENT_TIMESTAMP, admin_id = ?
+                    WHERE id IN (SELECT request_id FROM payout_batch)
+                """, (admin_id,))
+                cursor.execute("""
+                    INSERT INTO payouts (user_id, amount, admin_id, notes)
+                    SELECT user_id, amount, ?, 'Withdrawal request #' || request_id
+                    FROM payout_batch ORDER BY request_id
+                """, (admin_id,))
+                
+                cursor.execute("""
+                    SELECT request_id, user_id, amount, wallet_address
+                    FROM payout_batch ORDER BY request_id
+                """)
+                payouts = [dict(row) for row in cursor.fetchall()]
+                
+                if request_ids is not None:
+                    paid_ids = {p['request_id'] for p in payouts}
+                    skipped = [rid for rid in dict.fromkeys(request_ids) if rid not in paid_ids]
+                else:
+                    cursor.execute("""
+                        SELECT id FROM withdrawal_requests WHERE status = 'pending' ORDER BY id
+                    """)
+                    skipped = [row[0] for row in cursor.fetchall()]
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+        
+        total = sum(p['amount'] for p in payouts)
+        if payouts:
+            logging.info(f"💸 Admin {admin_id} paid {len(payouts)} withdrawals "
+                         f"to {paid_users} users, {total} SC")
+        return {
+            "processed": [p['request_id'] for p in payouts],
+            "skipped": skipped,
+            "total": total,
+            "users": paid_users,
+            "payouts": payouts
+        }
+    
+    def reject_withdrawal_request(self, request_id: int, admin_id: int) -> bool:
+        """Отклонить заявку: резерв снимается вместе со статусом pending"""
         with self.get_connection() as conn:
             cursor = conn.cursor()
-            
-            # Получить детали запроса
             cursor.execute("""
-                SELECT user_id, amount FROM withdrawal_requests 
+                UPDATE withdrawal_requests
+                SET status = 'rejected', processed_at = CURRENT_TIMESTAMP, admin_id = ?
                 WHERE id = ? AND status = 'pending'
-            """, (request_id,))
-            request = cursor.fetchone()
-            
-            if not request:
-                return False
-            
-            user_id, amount = request['user_id'], request['amount']
-            
-            # Проверить баланс пользователя
-            cursor.execute("SELECT pending_balance FROM users WHERE user_id = ?", (user_id,))
-            user = cursor.fetchone()
-            
-            if not user or user['pending_balance'] < amount:
-                return False
-            
-            # Обновить балансы
-            cursor.execute("""
-                UPDATE users 
-                SET pending_balance = pending_balance - ?, 
-                    paid_balance = paid_balance + ?
-                WHERE user_id = ?
-            """, (amount, amount, user_id))
-            
-            # Отметить запрос как выполненный
-            cursor.execute("""
-                UPDATE withdrawal_requests 
-                SET status = 'completed', processed_at = CURRENT_TIMESTAMP, admin_id = ?
-                WHERE id = ?
             """, (admin_id, request_id))
-            
-            # Записать в историю выплат
-            cursor.execute("""
-                INSERT INTO payouts (user_id, amount, admin_id, notes)
-                VALUES (?, ?, ?, ?)
-            """, (user_id, amount, admin_id, f"Withdrawal request #{request_id}"))
-            
             conn.commit()
-            return True
+            return cursor.rowcount > 0
 
     def save_captcha_session(self, user_id: int, captcha_value: str) -> int:
         """Сохранить сессию капчи"""
@@ -504,26 +936,29 @@ class Database:
             conn.commit()
             return cursor.rowcount > 0
 
-    def get_captcha_session(self, session_id: int) -> Optional[Dict[str, Any]]:
+    def get_captcha_session(self, session_id: int) -> Optional[CaptchaSession]:
         """Получить сессию капчи"""
         with self.get_connection() as conn:
             cursor = conn.cursor()
-            cursor.execute("SELECT * FROM captcha_sessions WHERE id = ?", (session_id,))
-            row = cursor.fetchone()
-            return dict(row) if row else None
+            cursor.row_factory = CaptchaSession.factory
+            cursor.execute(f"SELECT {CaptchaSession.projection()} FROM captcha_sessions WHERE id = ?",
+                           (session_id,))
+            return cursor.fetchone()
     
-    def get_task_completions(self, task_id: int) -> List[Dict[str, Any]]:
+    def get_task_completions(self, task_id: int) -> List[TaskCompletion]:
         """Получить список пользователей, выполнивших задание"""
         with self.get_connection() as conn:
             cursor = conn.cursor()
+            cursor.row_factory = TaskCompletion.factory
             cursor.execute("""
-                SELECT u.user_id, u.username, u.first_name, ut.completed_at, ut.reward_capsules
-                FROM user_tasks ut
-                JOIN users u ON ut.user_id = u.user_id
-                WHERE ut.task_id = ?
-                ORDER BY ut.completed_at DESC
+                SELECT utc.id, utc.user_id, utc.task_id, utc.completed_at, utc.reward_capsules,
+                       NULL, NULL, NULL, u.username, u.first_name
+                FROM user_task_completions utc
+                JOIN users u ON utc.user_id = u.user_id
+                WHERE utc.task_id = ?
+                ORDER BY utc.completed_at DESC
             """, (task_id,))
-            return [dict(row) for row in cursor.fetchall()]
+            return cursor.fetchall()
     
     def deactivate_task(self, task_id: int) -> bool:
         """Деактивировать задание"""
@@ -533,7 +968,8 @@ class Database:
                 UPDATE tasks SET status = 'inactive' WHERE id = ?
             """, (task_id,))
             conn.commit()
-            return cursor.rowcount > 0
+        self.invalidate_task_cache()
+        return cursor.rowcount > 0
     
     def update_user_scores(self, user_id: int, captcha_score: float | None = None, risk_score: float | None = None):
         """Обновить скоры пользователя"""
@@ -556,6 +992,7 @@ class Database:
                     UPDATE users SET {', '.join(updates)} WHERE user_id = ?
                 """, params)
                 conn.commit()
+        self.invalidate_user(user_id)
 
     def set_quarantine(self, user_id: int, hours: int):
         """Установить карантин пользователю"""
@@ -566,6 +1003,7 @@ class Database:
                 UPDATE users SET quarantine_until = ? WHERE user_id = ?
             """, (quarantine_until, user_id))
             conn.commit()
+        self.invalidate_user(user_id)
 
     def is_in_quarantine(self, user_id: int) -> bool:
         """Проверить, находится ли пользователь в карантине"""
@@ -623,62 +1061,112 @@ class Database:
                         SET validated_referrals = validated_referrals + 1
                         WHERE user_id = ?
                     """, (referrer_id,))
+                    self.invalidate_user(referrer_id)
                     
                     # ДОБАВИТЬ НАГРАДУ ЗА РЕФЕРАЛА: 1.0 SC
                     referral_reward = 1.0
-                    cursor.execute("""
-                        UPDATE users 
-                        SET balance = balance + ?, 
-                            pending_balance = pending_balance + ?,
-                            total_earnings = total_earnings + ?
-                        WHERE user_id = ?
-                    """, (referral_reward, referral_reward, referral_reward, referrer_id))
+                    self.post_ledger_entry(cursor, referrer_id, LEDGER_REFERRAL_BONUS, referral_reward,
+                                           f"validation #{validation_id}")
             
             conn.commit()
     
     # Методы для системы заданий
-    def get_active_tasks(self) -> List[Dict[str, Any]]:
-        """Получить активные задания"""
+    def add_task_listener(self, callback):
+        """Подписаться на изменения заданий (callback без аргументов)"""
+        self._task_listeners.append(callback)
+    
+    def invalidate_task_cache(self):
+        """Сбросить каталог активных заданий (после любых изменений tasks)"""
+        self._task_catalog = None
+        self._task_catalog_next_expiry = None
+        for callback in self._task_listeners:
+            callback()
+    
+    def limit_cache_age(self, max_age: float):
+        """Ограничить возраст кэшей, когда ту же базу пишут другие процессы"""
+        self.task_catalog_max_age = max_age
+        self._users.ttl = min(self._users.ttl, max_age)
+        self._completed_tasks.ttl = min(self._completed_tasks.ttl, max_age)
+    
+    def _get_task_catalog(self) -> List[Task]:
+        """Каталог активных заданий из памяти"""
+        if self._task_catalog is not None:
+            expiry = self._task_catalog_next_expiry
+            max_age = self.task_catalog_max_age
+            fresh = max_age is None or time.monotonic() - self._task_catalog_loaded_at < max_age
+            if fresh and (self.task_lifecycle_managed or expiry is None or _sqlite_now() < expiry):
+                return self._task_catalog
+        
         with self.get_connection() as conn:
             cursor = conn.cursor()
-            cursor.execute("""
-                SELECT * FROM tasks 
+            cursor.row_factory = Task.factory
+            cursor.execute(f"""
+                {TASK_SELECT}
                 WHERE status = 'active' 
                 AND (expires_at IS NULL OR expires_at > datetime('now'))
                 ORDER BY created_at DESC
             """)
-            return [dict(row) for row in cursor.fetchall()]
+            catalog = cursor.fetchall()
+        
+        self._task_catalog = catalog
+        self._task_catalog_loaded_at = time.monotonic()
+        self._task_catalog_next_expiry = min(
+            (str(task.expires_at) for task in catalog if task.expires_at), default=None
+        )
+        return catalog
+    
+    def get_active_tasks(self) -> List[Task]:
+        """Получить активные задания (неизменяемые, общие с кэшем)"""
+        return list(self._get_task_catalog())
     
-    def get_task(self, task_id: int) -> Optional[Dict[str, Any]]:
+    def get_user_completed_task_ids(self, user_id: int) -> FrozenSet[int]:
+        """ID выполненных пользователем заданий одним запросом"""
+        completed = self._completed_tasks.get(user_id)
+        if completed is None:
+            with self.get_connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute(
+                    "SELECT task_id FROM user_task_completions WHERE user_id = ?", (user_id,)
+                )
+                completed = frozenset(row[0] for row in cursor.fetchall())
+            self._completed_tasks.set(user_id, completed)
+        return completed
+    
+    def get_available_tasks(self, user_id: int) -> List[Task]:
+        """Активные задания, которые пользователь ещё не выполнил и у которых не исчерпан лимит"""
+        completed = self.get_user_completed_task_ids(user_id)
+        return [
+            task for task in self._get_task_catalog()
+            if task.id not in completed
+            and (task.max_completions is None or task.current_completions < task.max_completions)
+        ]
+    
+    def get_task(self, task_id: int) -> Optional[Task]:
         """Получить задание по ID"""
         with self.get_connection() as conn:
             cursor = conn.cursor()
-            cursor.execute("SELECT * FROM tasks WHERE id = ?", (task_id,))
-            row = cursor.fetchone()
-            return dict(row) if row else None
+            cursor.row_factory = Task.factory
+            cursor.execute(f"{TASK_SELECT} WHERE id = ?", (task_id,))
+            return cursor.fetchone()
     
-    def get_user_completed_tasks(self, user_id: int) -> List[Dict[str, Any]]:
+    def get_user_completed_tasks(self, user_id: int) -> List[TaskCompletion]:
         """Получить выполненные пользователем задания"""
         with self.get_connection() as conn:
             cursor = conn.cursor()
+            cursor.row_factory = TaskCompletion.factory
             cursor.execute("""
-                SELECT utc.*, t.title, t.description, t.partner_name
+                SELECT utc.id, utc.user_id, utc.task_id, utc.completed_at, utc.reward_capsules,
+                       t.title, t.description, t.partner_name
                 FROM user_task_completions utc
                 JOIN tasks t ON utc.task_id = t.id
                 WHERE utc.user_id = ?
                 ORDER BY utc.completed_at DESC
             """, (user_id,))
-            return [dict(row) for row in cursor.fetchall()]
+            return cursor.fetchall()
     
     def is_task_completed(self, user_id: int, task_id: int) -> bool:
         """Проверить выполнено ли задание пользователем"""
-        with self.get_connection() as conn:
-            cursor = conn.cursor()
-            cursor.execute("""
-                SELECT id FROM user_task_completions 
-                WHERE user_id = ? AND task_id = ?
-            """, (user_id, task_id))
-            return cursor.fetchone() is not None
+        return task_id in self.get_user_completed_task_ids(user_id)
     
     def complete_user_task(self, user_id: int, task_id: int, reward_capsules: int = 1):
         """Отметить задание как выполненное"""
@@ -696,23 +1184,92 @@ class Database:
             """, (task_id,))
             
             conn.commit()
+        
+        self._note_task_completion(user_id, task_id)
+    
+    def _note_task_completion(self, user_id: int, task_id: int, counted: bool = True):
+        """Обновить кэши заданий на месте, без перечитывания каталога"""
+        completed = self._completed_tasks.get(user_id)
+        if completed is not None:
+            self._completed_tasks.set(user_id, completed | {task_id})
+        if counted:
+            catalog = self._task_catalog or []
+            for index, task in enumerate(catalog):
+                if task.id == task_id:
+                    # Строки неизменяемы: в каталоге заменяется копия
+                    catalog[index] = task.replace(current_completions=task.current_completions + 1)
+                    break
+    
+    def redeem_task(self, user_id: int, task_id: int) -> Dict[str, Any]:
+        """Атомарно засчитать задание: лимит, запись выполнения и капсулы в одной транзакции
+
+        reason: completed | already_completed | limit_reached | unavailable
+        """
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            # Берём блокировку записи сразу: проверка лимита и запись не разрываются
+            cursor.execute("BEGIN IMMEDIATE")
+            try:
+                # Лимит проверяется и счётчик увеличивается одним охраняемым UPDATE
+                cursor.execute("""
+                    UPDATE tasks SET current_completions = current_completions + 1
+                    WHERE id = ? AND status = 'active'
+                    AND (expires_at IS NULL OR expires_at > datetime('now'))
+                    AND (max_completions IS NULL OR current_completions < max_completions)
+                """, (task_id,))
+                if cursor.rowcount == 0:
+                    conn.rollback()
+                    self.invalidate_task_cache()
+                    task = self.get_task(task_id)
+                    if task and task['status'] == 'active' and task['max_completions'] is not None \
+                            and task['current_completions'] >= task['max_completions']:
+                        return {"success": False, "reason": "limit_reached"}
+                    return {"success": False, "reason": "unavailable"}
+                cursor.execute("SELECT reward_capsules FROM tasks WHERE id = ?", (task_id,))
+                reward_capsules = cursor.fetchone()['reward_capsules'] or 0
+                
+                cursor.execute("""
+                    INSERT OR IGNORE INTO user_task_completions (user_id, task_id, reward_capsules)
+                    VALUES (?, ?, ?)
+                """, (user_id, task_id, reward_capsules))
+                if cursor.rowcount == 0:
+                    conn.rollback()
+                    self._note_task_completion(user_id, task_id, counted=False)
+                    return {"success": False, "reason": "already_completed"}
+                
+                cursor.execute("""
+                    UPDATE users SET bonus_capsules = bonus_capsules + ?
+                    WHERE user_id = ?
+                """, (reward_capsules, user_id))
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+        
+        self._note_task_completion(user_id, task_id)
+        self.invalidate_user(user_id)
+        return {"success": True, "reason": "completed", "reward_capsules": reward_capsules}
     
     def add_task(self, title: str, description: str, task_type: str, reward_capsules: int = 1,
                  partner_name: str = "", partner_url: str = "", requirements: str = "",
-                 expires_at: str | None = None, max_completions: int | None = None) -> int:
-        """Добавить новое задание"""
+                 expires_at: str | None = None, max_completions: int | None = None,
+                 starts_at: str | None = None) -> int:
+        """Добавить новое задание (со starts_at - в статусе scheduled до начала)"""
+        status = 'scheduled' if starts_at else 'active'
         with self.get_connection() as conn:
             cursor = conn.cursor()
             cursor.execute("""
                 INSERT INTO tasks (title, description, task_type, reward_capsules, 
-                                 partner_name, partner_url, requirements, expires_at, max_completions)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                                 partner_name, partner_url, requirements, expires_at, max_completions,
+                                 starts_at, status)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
             """, (title, description, task_type, reward_capsules, partner_name, 
-                  partner_url, requirements, expires_at, max_completions))
+                  partner_url, requirements, expires_at, max_completions, starts_at, status))
             
             task_id = cursor.lastrowid or 0
             conn.commit()
-            return task_id
+        self.invalidate_task_cache()
+        return task_id
     
     def add_bonus_capsules(self, user_id: int, amount: int):
         """Добавить бонусные капсулы пользователю"""
@@ -723,26 +1280,127 @@ class Database:
                 WHERE user_id = ?
             """, (amount, user_id))
             conn.commit()
+        self.invalidate_user(user_id)
     
-    def update_user_balance(self, user_id: int, amount: float):
+    def update_user_balance(self, user_id: int, amount: float, entry_type: str = LEDGER_TASK,
+                            ref: str | None = None):
         """Обновить баланс пользователя (добавить SC токены)"""
         with self.get_connection() as conn:
             cursor = conn.cursor()
+            self.post_ledger_entry(cursor, user_id, entry_type, amount, ref)
+            conn.commit()
+
+    def record_checkin(self, user_id: int, checkin_date: str, reward: float) -> bool:
+        """Засчитать ежедневный чек-ин и начислить награду (False, если уже был)"""
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            # UNIQUE(user_id, checkin_date): второй чек-ин за день просто не вставится
             cursor.execute("""
-                UPDATE users 
-                SET balance = balance + ?,
-                    pending_balance = pending_balance + ?,
-                    total_earnings = total_earnings + ?
-                WHERE user_id = ?
-            """, (amount, amount, amount, user_id))
+                INSERT OR IGNORE INTO user_checkins (user_id, checkin_date, sc_amount)
+                VALUES (?, ?, ?)
+            """, (user_id, checkin_date, reward))
+            if cursor.rowcount == 0:
+                return False
+            self.post_ledger_entry(cursor, user_id, LEDGER_CHECKIN, reward, f"checkin {checkin_date}")
             conn.commit()
+        return True
 
-    def get_all_tasks(self) -> List[Dict[str, Any]]:
-        """Получить все задания (включая неактивные)"""
+    def get_ledger_entries(self, user_id: int, limit: int = 50) -> List[Dict[str, Any]]:
+        """Последние проводки пользователя"""
         with self.get_connection() as conn:
             cursor = conn.cursor()
-            cursor.execute("SELECT * FROM tasks ORDER BY id DESC")
+            cursor.execute("""
+                SELECT id, entry_type, debit_account, credit_account, amount, ref, created_at
+                FROM ledger_entries WHERE user_id = ?
+                ORDER BY id DESC LIMIT ?
+            """, (user_id, limit))
             return [dict(row) for row in cursor.fetchall()]
+
+    def snapshot_ledger(self, repair: bool = False) -> Dict[str, Any]:
+        """Инкрементальный снимок журнала и сверка с балансами users
+        
+        К итогам прошлого снимка добавляются только проводки после его
+        водяной отметки, поэтому стоимость пропорциональна новым записям.
+        repair=True переписывает разошедшиеся балансы users из журнала.
+        """
+        started = time.perf_counter()
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            # Блокировка записи: журнал и users сверяются в одной точке времени
+            cursor.execute("BEGIN IMMEDIATE")
+            try:
+                cursor.execute("SELECT COALESCE(MAX(last_entry_id), 0) FROM ledger_snapshot_runs")
+                watermark = cursor.fetchone()[0]
+                cursor.execute("SELECT COALESCE(MAX(id), 0) FROM ledger_entries")
+                head = cursor.fetchone()[0]
+                
+                cursor.execute("""
+                    INSERT INTO ledger_snapshots (user_id, earned, paid, last_entry_id)
+                    SELECT user_id,
+                           SUM(CASE WHEN credit_account = ? THEN amount ELSE 0 END),
+                           SUM(CASE WHEN debit_account = ? THEN amount ELSE 0 END),
+                           MAX(id)
+                    FROM ledger_entries
+                    WHERE id > ? AND id <= ?
+                    GROUP BY user_id
+                    ON CONFLICT(user_id) DO UPDATE SET
+                        earned = earned + excluded.earned,
+                        paid = paid + excluded.paid,
+                        last_entry_id = excluded.last_entry_id,
+                        updated_at = CURRENT_TIMESTAMP
+                """, (ACCOUNT_USER, ACCOUNT_USER, watermark, head))
+                users_touched = cursor.rowcount
+                
+                cursor.execute("""
+                    SELECT u.user_id, u.balance, u.pending_balance, u.total_earnings, u.paid_balance,
+                           COALESCE(s.earned, 0) AS earned, COALESCE(s.paid, 0) AS paid
+                    FROM users u LEFT JOIN ledger_snapshots s ON s.user_id = u.user_id
+                    WHERE ABS(COALESCE(u.total_earnings, 0) - COALESCE(s.earned, 0)) > ?
+                       OR ABS(COALESCE(u.balance, 0) - COALESCE(s.earned, 0)) > ?
+                       OR ABS(COALESCE(u.paid_balance, 0) - COALESCE(s.paid, 0)) > ?
+                       OR ABS(COALESCE(u.pending_balance, 0)
+                              - (COALESCE(s.earned, 0) - COALESCE(s.paid, 0))) > ?
+                """, (BALANCE_EPSILON,) * 4)
+                drifted = [dict(row) for row in cursor.fetchall()]
+                
+                if repair and drifted:
+                    cursor.executemany("""
+                        UPDATE users
+                        SET total_earnings = ?, balance = ?, paid_balance = ?, pending_balance = ?
+                        WHERE user_id = ?
+                    """, [(d['earned'], d['earned'], d['paid'], d['earned'] - d['paid'], d['user_id'])
+                          for d in drifted])
+                    self.invalidate_user(*(d['user_id'] for d in drifted))
+                
+                duration_ms = (time.perf_counter() - started) * 1000
+                cursor.execute("""
+                    INSERT INTO ledger_snapshot_runs (last_entry_id, entries, users, drifted, duration_ms)
+                    VALUES (?, ?, ?, ?, ?)
+                """, (head, head - watermark, users_touched, len(drifted), duration_ms))
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+        
+        if drifted:
+            logging.warning(f"⚠️ Ledger audit: {len(drifted)} users drifted"
+                            f"{' (repaired)' if repair else ''}")
+        return {
+            "entries": head - watermark,
+            "last_entry_id": head,
+            "users": users_touched,
+            "drifted": drifted,
+            "repaired": repair and bool(drifted),
+            "duration_ms": round(duration_ms, 1)
+        }
+
+    def get_all_tasks(self) -> List[Task]:
+        """Получить все задания (включая неактивные)"""
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.row_factory = Task.factory
+            cursor.execute(f"{TASK_SELECT} ORDER BY id DESC")
+            return cursor.fetchall()
     
     def get_all_users(self) -> List[Dict[str, Any]]:
         """Получить всех пользователей для массовой рассылки"""
@@ -757,7 +1415,8 @@ class Database:
             cursor = conn.cursor()
             cursor.execute("DELETE FROM tasks WHERE id = ?", (task_id,))
             conn.commit()
-            return cursor.rowcount > 0
+        self.invalidate_task_cache()
+        return cursor.rowcount > 0
     
     def update_task_status(self, task_id: int, status: str) -> bool:
         """Обновить статус задания"""
@@ -767,12 +1426,38 @@ class Database:
                 UPDATE tasks SET status = ? WHERE id = ?
             """, (status, task_id))
             conn.commit()
-            return cursor.rowcount > 0
+        self.invalidate_task_cache()
+        return cursor.rowcount > 0
+    
+    def get_task_schedule(self) -> List[Dict[str, Any]]:
+        """Задания с предстоящими сменами статуса по датам"""
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                SELECT id, status, starts_at, expires_at FROM tasks
+                WHERE (status = 'scheduled' AND starts_at IS NOT NULL)
+                   OR (status IN ('scheduled', 'active') AND expires_at IS NOT NULL)
+            """)
+            return [dict(row) for row in cursor.fetchall()]
+    
+    def transition_task_status(self, task_id: int, from_status: str, to_status: str) -> bool:
+        """Сменить статус, только если задание всё ещё в from_status"""
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                UPDATE tasks SET status = ? WHERE id = ? AND status = ?
+            """, (to_status, task_id, from_status))
+            conn.commit()
+        if cursor.rowcount > 0:
+            self.invalidate_task_cache()
+            return True
+        return False
     
     def update_task_field(self, task_id: int, field: str, value) -> bool:
         """Обновить конкретное поле задания"""
         # Проверяем разрешенные поля для безопасности
-        allowed_fields = ['title', 'description', 'reward_capsules', 'partner_name', 'partner_url', 'requirements']
+        allowed_fields = ['title', 'description', 'reward_capsules', 'partner_name', 'partner_url', 'requirements',
+                          'expires_at', 'starts_at']
         if field not in allowed_fields:
             return False
             
@@ -780,4 +1465,46 @@ class Database:
             cursor = conn.cursor()
             cursor.execute(f"UPDATE tasks SET {field} = ? WHERE id = ?", (value, task_id))
             conn.commit()
-            return cursor.rowcount > 0
+        self.invalidate_task_cache()
+        return cursor.rowcount > 0
+    
+    def load_fsm_record(self, key: str, not_before: float) -> Optional[Tuple[Optional[str], str, float]]:
+        """Состояние FSM (state, data JSON, updated_at), если оно не старше not_before"""
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                SELECT state, data, updated_at FROM fsm_storage
+                WHERE key = ? AND updated_at >= ?
+            """, (key, not_before))
+            row = cursor.fetchone()
+            return tuple(row) if row else None
+    
+    def save_fsm_records(self, records: Dict[str, Tuple[Optional[str], str, float]],
+                         purge_before: Optional[float] = None) -> int:
+        """Записать пачку состояний FSM одной транзакцией
+        
+        Пустые записи (без state и data) удаляются; purge_before заодно
+        удаляет брошенные диалоги. Возвращает число удалённых брошенных.
+        """
+        empty = [(key,) for key, (state, data, _) in records.items() if state is None and data == '{}']
+        filled = [(key, state, data, updated_at) for key, (state, data, updated_at) in records.items()
+                  if not (state is None and data == '{}')]
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("BEGIN IMMEDIATE")
+            try:
+                cursor.executemany("""
+                    INSERT INTO fsm_storage (key, state, data, updated_at) VALUES (?, ?, ?, ?)
+                    ON CONFLICT (key) DO UPDATE SET
+                        state = excluded.state, data = excluded.data, updated_at = excluded.updated_at
+                """, filled)
+                cursor.executemany("DELETE FROM fsm_storage WHERE key = ?", empty)
+                purged = 0
+                if purge_before is not None:
+                    cursor.execute("DELETE FROM fsm_storage WHERE updated_at < ?", (purge_before,))
+                    purged = cursor.rowcount
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+        return purged
@@ -5,12 +5,19 @@
 
 from aiogram import Router, types, F
 from aiogram.filters import Command
-from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton, Message
+from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton, Message, BufferedInputFile
 from aiogram.enums import ChatType
+from aiogram.exceptions import TelegramBadRequest
+import html
 import logging
+from datetime import datetime
 from typing import Optional
 
 from app.context import get_db, get_config
+from app.services.outbound import start_broadcast
+from app.services.payouts import build_ton_batch, ton_batch_filename
+from app.services.profiler import profiler
+from app.services.query_trace import query_tracer
 
 router = Router()
 
@@ -350,6 +357,106 @@ async def withdrawal_requests_command(message: types.Message):
     
     await message.answer(text, parse_mode="HTML")
 
+def parse_request_ids(text: Optional[str]) -> list:
+    """ID заявок из аргументов команды: '/cmd 1 2,3'"""
+    ids = []
+    for part in (text or "").replace(",", " ").split()[1:]:
+        if part.isdigit():
+            ids.append(int(part))
+    return ids
+
+@router.message(Command("approve_withdrawal"), F.chat.type == ChatType.PRIVATE)
+async def approve_withdrawal_command(message: types.Message):
+    """Выплатить одну или несколько заявок одной транзакцией"""
+    if not message.from_user or not is_admin(message.from_user.id):
+        return
+    
+    request_ids = parse_request_ids(message.text)
+    if not request_ids:
+        await message.answer("❌ Использование: <code>/approve_withdrawal ID [ID ...]</code>", parse_mode="HTML")
+        return
+    
+    result = get_db().process_withdrawal_requests(request_ids, message.from_user.id)
+    text = (
+        f"✅ <b>Выплачено заявок:</b> {len(result['processed'])}\n"
+        f"💰 Сумма: {format_balance(result['total'])} SC"
+    )
+    if result['skipped']:
+        skipped = ", ".join(f"#{request_id}" for request_id in result['skipped'])
+        text += f"\n⚠️ Пропущены (уже обработаны или нет средств): {skipped}"
+    await message.answer(text, parse_mode="HTML")
+
+@router.message(Command("pay_withdrawals"), F.chat.type == ChatType.PRIVATE)
+async def pay_withdrawals_command(message: types.Message):
+    """Выплатить все заявки пачкой и выгрузить батч переводов TON"""
+    if not message.from_user or not is_admin(message.from_user.id):
+        return
+    
+    result = get_db().process_withdrawal_batch(message.from_user.id, require_wallet=True)
+    if not result['payouts']:
+        text = "📋 <b>Нет заявок, готовых к выплате</b>"
+        if result['skipped']:
+            text += f"\n⚠️ Ожидают (нет средств или кошелька): {len(result['skipped'])}"
+        await message.answer(text, parse_mode="HTML")
+        return
+    
+    text = (
+        f"✅ <b>Пакетная выплата проведена</b>\n\n"
+        f"🧾 Заявок: {len(result['processed'])}\n"
+        f"👥 Пользователей: {result['users']}\n"
+        f"💰 Сумма: {format_balance(result['total'])} SC"
+    )
+    if result['skipped']:
+        text += f"\n⚠️ Пропущено (нет средств или кошелька): {len(result['skipped'])}"
+    text += "\n\n📎 Файл ниже - батч переводов для отправки с TON кошелька"
+    await message.answer(text, parse_mode="HTML")
+    await message.answer_document(
+        BufferedInputFile(build_ton_batch(result['payouts']), filename=ton_batch_filename())
+    )
+
+@router.message(Command("profile"), F.chat.type == ChatType.PRIVATE)
+async def profile_command(message: types.Message):
+    """Включить/выключить семплирующий профайлер; при выключении - файл стеков"""
+    if not message.from_user or not is_admin(message.from_user.id):
+        return
+    
+    if not profiler.running:
+        profiler.start()
+        await message.answer(
+            "🔬 <b>Профайлер включен</b>\n\n"
+            "Повторите /profile, чтобы остановить и получить стеки.",
+            parse_mode="HTML"
+        )
+        return
+    
+    seconds = profiler.stats()['seconds']
+    stacks = profiler.stop()
+    await message.answer(
+        f"🔬 <b>Профайлер остановлен</b>\n\n"
+        f"⏱ {seconds} с, {profiler.samples} семплов\n"
+        f"📎 Формат collapsed: flamegraph.pl или speedscope.app",
+        parse_mode="HTML"
+    )
+    await message.answer_document(
+        BufferedInputFile(stacks.encode(), filename=f"profile-{datetime.now():%Y%m%d-%H%M%S}.folded")
+    )
+
+@router.message(Command("reject_withdrawal"), F.chat.type == ChatType.PRIVATE)
+async def reject_withdrawal_command(message: types.Message):
+    """Отклонить заявку и снять резерв"""
+    if not message.from_user or not is_admin(message.from_user.id):
+        return
+    
+    request_ids = parse_request_ids(message.text)
+    if not request_ids:
+        await message.answer("❌ Использование: <code>/reject_withdrawal ID</code>", parse_mode="HTML")
+        return
+    
+    db = get_db()
+    rejected = [request_id for request_id in request_ids
+                if db.reject_withdrawal_request(request_id, message.from_user.id)]
+    await message.answer(f"🚫 Отклонено заявок: {len(rejected)}")
+
 # ===== CALLBACK HANDLERS =====
 
 @router.callback_query(F.data == "admin_stats")
@@ -385,6 +492,7 @@ async def admin_stats_callback(callback: types.CallbackQuery):
 • Всего заработано: {format_balance(total_earnings)} SC"""
         
         keyboard = InlineKeyboardMarkup(inline_keyboard=[
+            [InlineKeyboardButton(text="🐢 Запросы к БД", callback_data="admin_queries")],
             [InlineKeyboardButton(text="🔙 Назад", callback_data="admin_back")]
         ])
         
@@ -396,6 +504,55 @@ async def admin_stats_callback(callback: types.CallbackQuery):
         logging.error(f"Admin stats error: {e}")
         await callback.answer("❌ Ошибка получения статистики", show_alert=True)
 
+@router.callback_query(F.data.in_({"admin_queries", "admin_queries_reset"}))
+async def admin_queries_callback(callback: types.CallbackQuery):
+    """Топ-10 SQL-запросов по суммарному времени - что индексировать и кэшировать"""
+    if not callback.from_user or not is_admin(callback.from_user.id):
+        await callback.answer("❌ Нет доступа", show_alert=True)
+        return
+    
+    if callback.data == "admin_queries_reset":
+        query_tracer.reset()
+    
+    summary = query_tracer.stats()
+    lines = [
+        "🐢 <b>Запросы к БД: топ-10 по суммарному времени</b>",
+        f"Запросов: {summary['calls']} • отпечатков: {summary['fingerprints']} • "
+        f"медленных (&gt;{summary['slow_threshold_ms']:.0f} мс): {summary['slow']}",
+        ""
+    ]
+    for index, query in enumerate(query_tracer.top(10), 1):
+        text = query["query"] if len(query["query"]) <= 180 else query["query"][:180] + "…"
+        entry = [
+            f"<b>{index}.</b> {query['total_ms']:.0f} мс • {query['calls']}× • "
+            f"p50 {query['p50_ms']} / p99 {query['p99_ms']} мс • строк {query['rows']}",
+            f"<code>{html.escape(text)}</code>"
+        ]
+        if query["plan"]:
+            entry.append(f"📋 {html.escape('; '.join(query['plan'])[:150])}")
+        # Лимит сообщения Telegram - 4096 символов, теги резать нельзя
+        if sum(len(line) + 1 for line in lines + entry) > 4000:
+            break
+        lines.extend(entry)
+    if not summary["calls"]:
+        lines.append("Пока нет данных")
+    
+    keyboard = InlineKeyboardMarkup(inline_keyboard=[
+        [
+            InlineKeyboardButton(text="🔄 Обновить", callback_data="admin_queries"),
+            InlineKeyboardButton(text="🧹 Сбросить", callback_data="admin_queries_reset")
+        ],
+        [InlineKeyboardButton(text="🔙 Назад", callback_data="admin_stats")]
+    ])
+    
+    if callback.message and isinstance(callback.message, Message):
+        try:
+            await callback.message.edit_text("\n".join(lines), reply_markup=keyboard, parse_mode="HTML")
+        except TelegramBadRequest as e:
+            # "message is not modified" при повторном нажатии без новых запросов
+            logging.debug(f"Admin queries edit skipped: {e}")
+    await callback.answer()
+
 @router.callback_query(F.data == "admin_back")
 async def admin_back_callback(callback: types.CallbackQuery):
     """Возврат к главному меню"""
@@ -475,6 +632,8 @@ async def admin_payouts_callback(callback: types.CallbackQuery):
 📊 <b>Доступные команды:</b>
 • <code>/withdrawal_requests</code> - запросы на вывод
 • <code>/approve_withdrawal ID</code> - одобрить выплату
+• <code>/reject_withdrawal ID</code> - отклонить заявку
+• <code>/pay_withdrawals</code> - выплатить все заявки пачкой (+ батч TON)
 • <code>/payouts</code> - история выплат
 • <code>/balances</code> - управление балансами"""
     
@@ -548,36 +707,9 @@ async def admin_broadcast_callback(callback: types.CallbackQuery):
         await callback.message.edit_text(text, reply_markup=keyboard, parse_mode="HTML")
     await callback.answer()
 
-@router.callback_query(F.data == "broadcast_capsules")
-async def broadcast_capsules_reminder(callback: types.CallbackQuery):
-    """Рассылка напоминания о капсулах"""
-    if not callback.from_user or not is_admin(callback.from_user.id):
-        await callback.answer("❌ Нет доступа", show_alert=True)
-        return
-    
-    db = get_db()
-    users = db.get_all_users()
-    
-    if not users:
-        await callback.answer("❌ Нет пользователей для рассылки", show_alert=True)
-        return
-    
-    reminder_text = """🎁 <b>Напоминание о капсулах!</b>
-
-💎 Не забудьте открыть ваши ежедневные капсулы!
-
-🎯 <b>Ваши возможности:</b>
-• 3 базовые капсулы каждый день
-• +1 капсула за каждого активного реферала
-• Бонусные капсулы за выполнение заданий
-
-💰 Каждая капсула может содержать SC токены или специальные призы!
-
-⏰ <b>Капсулы обновляются каждый день!</b>
-Не упустите возможность заработать!
-
-👇 Нажмите "🎁 Открыть капсулу" в главном меню"""
-    
+async def _send_reminder(callback: types.CallbackQuery, users: list, reminder_text: str,
+                         title: str, extra: str = ""):
+    """Разослать напоминание и отчитаться в сообщении админки (идёт в фоне)"""
     # Отправка уведомлений с детальным логированием
     success_count = 0
     failed_count = 0
@@ -608,10 +740,10 @@ async def broadcast_capsules_reminder(callback: types.CallbackQuery):
                 logging.error(f"❌ Failed to send to {user['user_id']}: {e}")
     
     # Детальный отчет о рассылке
-    report_text = f"""📊 <b>Рассылка напоминания о капсулах завершена!</b>
+    report_text = f"""📊 <b>{title}</b>
 
 ✅ Доставлено: {success_count} пользователей
-❌ Не доставлено: {failed_count} пользователей
+❌ Не доставлено: {failed_count} пользователей{extra}
 
 📋 <b>Причины недоставки:</b>
 🚫 Заблокировали бота: {blocked_bots}
@@ -620,7 +752,50 @@ async def broadcast_capsules_reminder(callback: types.CallbackQuery):
     
     if callback.message and isinstance(callback.message, Message):
         await callback.message.edit_text(report_text, parse_mode="HTML")
-    await callback.answer("📢 Напоминания отправлены!")
+
+async def _start_reminder(callback: types.CallbackQuery, users: list, reminder_text: str,
+                          title: str, extra: str = ""):
+    """Запустить рассылку в фоне: админ сразу может работать с ботом дальше"""
+    # Кнопки убираем сразу - повторное нажатие не запустит вторую рассылку
+    if callback.message and isinstance(callback.message, Message):
+        await callback.message.edit_text(
+            f"⏳ <b>Рассылка идёт</b>\n\nПолучателей: {len(users)}. Отчёт появится в этом сообщении.",
+            parse_mode="HTML"
+        )
+    start_broadcast(_send_reminder(callback, users, reminder_text, title, extra), "admin reminder")
+    await callback.answer("📢 Рассылка запущена!")
+
+@router.callback_query(F.data == "broadcast_capsules")
+async def broadcast_capsules_reminder(callback: types.CallbackQuery):
+    """Рассылка напоминания о капсулах"""
+    if not callback.from_user or not is_admin(callback.from_user.id):
+        await callback.answer("❌ Нет доступа", show_alert=True)
+        return
+    
+    db = get_db()
+    users = db.get_all_users()
+    
+    if not users:
+        await callback.answer("❌ Нет пользователей для рассылки", show_alert=True)
+        return
+    
+    reminder_text = """🎁 <b>Напоминание о капсулах!</b>
+
+💎 Не забудьте открыть ваши ежедневные капсулы!
+
+🎯 <b>Ваши возможности:</b>
+• 3 базовые капсулы каждый день
+• +1 капсула за каждого активного реферала
+• Бонусные капсулы за выполнение заданий
+
+💰 Каждая капсула может содержать SC токены или специальные призы!
+
+⏰ <b>Капсулы обновляются каждый день!</b>
+Не упустите возможность заработать!
+
+👇 Нажмите "🎁 Открыть капсулу" в главном меню"""
+    
+    await _start_reminder(callback, users, reminder_text, "Рассылка напоминания о капсулах завершена!")
 
 @router.callback_query(F.data == "broadcast_tasks")
 async def broadcast_tasks_reminder(callback: types.CallbackQuery):
@@ -670,50 +845,8 @@ async def broadcast_tasks_reminder(callback: types.CallbackQuery):
 ⚡ <b>Не упустите возможность!</b>
 Нажмите "🎯 Задания" в главном меню"""
     
-    # Отправка уведомлений с детальным логированием
-    success_count = 0
-    failed_count = 0
-    blocked_bots = 0
-    deleted_accounts = 0
-    other_errors = 0
-    
-    for user in users:
-        try:
-            if callback.bot:
-                await callback.bot.send_message(
-                    chat_id=user['user_id'],
-                    text=reminder_text,
-                    parse_mode="HTML"
-                )
-            success_count += 1
-        except Exception as e:
-            failed_count += 1
-            error_text = str(e).lower()
-            if "blocked" in error_text or "bot was blocked" in error_text:
-                blocked_bots += 1
-                logging.warning(f"🚫 User {user['user_id']} blocked bot")
-            elif "user is deactivated" in error_text or "user not found" in error_text:
-                deleted_accounts += 1
-                logging.warning(f"👻 User {user['user_id']} account deleted/deactivated")
-            else:
-                other_errors += 1
-                logging.error(f"❌ Failed to send to {user['user_id']}: {e}")
-    
-    # Детальный отчет о рассылке
-    report_text = f"""📊 <b>Рассылка напоминания о заданиях завершена!</b>
-
-✅ Доставлено: {success_count} пользователей
-❌ Не доставлено: {failed_count} пользователей
-🎯 Активных заданий: {len(active_tasks) if active_tasks else 0}
-
-📋 <b>Причины недоставки:</b>
-🚫 Заблокировали бота: {blocked_bots}
-👻 Удаленные аккаунты: {deleted_accounts}  
-⚠️ Другие ошибки: {other_errors}"""
-    
-    if callback.message and isinstance(callback.message, Message):
-        await callback.message.edit_text(report_text, parse_mode="HTML")
-    await callback.answer("📢 Напоминания отправлены!")
+    await _start_reminder(callback, users, reminder_text, "Рассылка напоминания о заданиях завершена!",
+                          extra=f"\n🎯 Активных заданий: {len(active_tasks) if active_tasks else 0}")
 
 @router.callback_query(F.data == "broadcast_referrals")
 async def broadcast_referrals_reminder(callback: types.CallbackQuery):
@@ -746,49 +879,7 @@ async def broadcast_referrals_reminder(callback: types.CallbackQuery):
 
 🔗 Получите вашу ссылку в разделе "👥 Рефералы"!"""
     
-    # Отправка уведомлений с детальным логированием
-    success_count = 0
-    failed_count = 0
-    blocked_bots = 0
-    deleted_accounts = 0
-    other_errors = 0
-    
-    for user in users:
-        try:
-            if callback.bot:
-                await callback.bot.send_message(
-                    chat_id=user['user_id'],
-                    text=reminder_text,
-                    parse_mode="HTML"
-                )
-            success_count += 1
-        except Exception as e:
-            failed_count += 1
-            error_text = str(e).lower()
-            if "blocked" in error_text or "bot was blocked" in error_text:
-                blocked_bots += 1
-                logging.warning(f"🚫 User {user['user_id']} blocked bot")
-            elif "user is deactivated" in error_text or "user not found" in error_text:
-                deleted_accounts += 1
-                logging.warning(f"👻 User {user['user_id']} account deleted/deactivated")
-            else:
-                other_errors += 1
-                logging.error(f"❌ Failed to send to {user['user_id']}: {e}")
-    
-    # Детальный отчет о рассылке
-    report_text = f"""📊 <b>Рассылка напоминания о рефералах завершена!</b>
-
-✅ Доставлено: {success_count} пользователей
-❌ Не доставлено: {failed_count} пользователей
-
-📋 <b>Причины недоставки:</b>
-🚫 Заблокировали бота: {blocked_bots}
-👻 Удаленные аккаунты: {deleted_accounts}  
-⚠️ Другие ошибки: {other_errors}"""
-    
-    if callback.message and isinstance(callback.message, Message):
-        await callback.message.edit_text(report_text, parse_mode="HTML")
-    await callback.answer("📢 Напоминания отправлены!")
+    await _start_reminder(callback, users, reminder_text, "Рассылка напоминания о рефералах завершена!")
 
 @router.callback_query(F.data == "broadcast_general")
 async def broadcast_general_reminder(callback: types.CallbackQuery):
@@ -821,46 +912,4 @@ async def broadcast_general_reminder(callback: types.CallbackQuery):
 
 ⚡ Начните прямо сейчас - каждый день приносит новые возможности!"""
     
-    # Отправка уведомлений с детальным логированием
-    success_count = 0
-    failed_count = 0
-    blocked_bots = 0
-    deleted_accounts = 0
-    other_errors = 0
-    
-    for user in users:
-        try:
-            if callback.bot:
-                await callback.bot.send_message(
-                    chat_id=user['user_id'],
-                    text=reminder_text,
-                    parse_mode="HTML"
-                )
-            success_count += 1
-        except Exception as e:
-            failed_count += 1
-            error_text = str(e).lower()
-            if "blocked" in error_text or "bot was blocked" in error_text:
-                blocked_bots += 1
-                logging.warning(f"🚫 User {user['user_id']} blocked bot")
-            elif "user is deactivated" in error_text or "user not found" in error_text:
-                deleted_accounts += 1
-                logging.warning(f"👻 User {user['user_id']} account deleted/deactivated")
-            else:
-                other_errors += 1
-                logging.error(f"❌ Failed to send to {user['user_id']}: {e}")
-    
-    # Детальный отчет о рассылке
-    report_text = f"""📊 <b>Общая рассылка завершена!</b>
-
-✅ Доставлено: {success_count} пользователей
-❌ Не доставлено: {failed_count} пользователей
-
-📋 <b>Причины недоставки:</b>
-🚫 Заблокировали бота: {blocked_bots}
-👻 Удаленные аккаунты: {deleted_accounts}  
-⚠️ Другие ошибки: {other_errors}"""
-    
-    if callback.message and isinstance(callback.message, Message):
-        await callback.message.edit_text(report_text, parse_mode="HTML")
-    await callback.answer("📢 Напоминания отправлены!")
\ No newline at end of file
+    await _start_reminder(callback, users, reminder_text, "Общая рассылка завершена!")
\ No newline at end of file
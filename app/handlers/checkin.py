@@ -55,23 +55,11 @@ async def daily_checkin_callback(callback: types.CallbackQuery):
                 await callback.answer("❌ Сначала подтвердите подписку на канал", show_alert=True)
                 return
             
-            # Регистрируем чек-ин
+            # Регистрируем чек-ин и начисляем награду проводкой в журнал балансов
             checkin_reward = 0.5
-            cursor.execute("""
-                INSERT INTO user_checkins (user_id, checkin_date, sc_amount)
-                VALUES (?, ?, ?)
-            """, (user_id, today, checkin_reward))
-            
-            # Начисляем награду пользователю (обновляем ОБА баланса для консистентности)
-            cursor.execute("""
-                UPDATE users 
-                SET total_earnings = total_earnings + ?,
-                    pending_balance = pending_balance + ?,
-                    balance = balance + ?
-                WHERE user_id = ?
-            """, (checkin_reward, checkin_reward, checkin_reward, user_id))
-            
-            conn.commit()
+            if not db.record_checkin(user_id, today, checkin_reward):
+                await callback.answer("❌ Вы уже делали чек-ин сегодня!", show_alert=True)
+                return
             
             # Получаем статистику чек-инов пользователя
             cursor.execute("""
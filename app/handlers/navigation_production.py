@@ -126,10 +126,7 @@ async def capsule_text_handler(message: Message):
         # Обработать специальную награду
         reward_result = special_service.process_special_reward(user_id, reward_obj.name, reward_obj.amount)
         
-        # Обновить статистику капсул
-        db.update_user_capsule_stats(user_id, reward_obj.amount)
-        
-        # Записать в историю
+        # Записать в историю и увеличить счётчики дня (один раз на капсулу)
         db.record_capsule_opening(user_id, reward_obj.name, reward_obj.amount)
         
         # Правильный расчет лимита
@@ -140,11 +137,11 @@ async def capsule_text_handler(message: Message):
         
         # Безопасное отображение результата
         emoji = reward_result.get('emoji', '🎁') if reward_result else '🎁'
-        message = reward_result.get('message', f"Награда: {reward_obj.amount} SC") if reward_result else f"Награда: {reward_obj.amount} SC"
+        reward_text = reward_result.get('message', f"Награда: {reward_obj.amount} SC") if reward_result else f"Награда: {reward_obj.amount} SC"
         
         capsule_text = f"""🎁 <b>Капсула открыта!</b>
 
-{emoji} {message}
+{emoji} {reward_text}
 📦 Открыто сегодня: {updated_user['daily_capsules_opened']}/{total_limit}
 💳 Баланс: {format_balance(updated_user['balance'])} SC"""
         
@@ -488,21 +485,10 @@ async def checkin_button(message: types.Message):
         # Выполняем чек-ин
         checkin_reward = 0.5
         try:
-            # Добавляем чек-ин
-            cursor.execute("""
-                INSERT INTO user_checkins (user_id, checkin_date, sc_amount)
-                VALUES (?, ?, ?)
-            """, (user_id, today, checkin_reward))
-            
-            # Обновляем баланс
-            cursor.execute("""
-                UPDATE users 
-                SET pending_balance = pending_balance + ?,
-                    total_earnings = total_earnings + ?
-                WHERE user_id = ?
-            """, (checkin_reward, checkin_reward, user_id))
-            
-            conn.commit()
+            # Чек-ин и начисление - одна транзакция с проводкой в журнал балансов
+            if not db.record_checkin(user_id, today, checkin_reward):
+                await message.answer("❌ Вы уже делали чек-ин сегодня! Возвращайтесь завтра.")
+                return
             
             # Получаем общее количество чек-инов
             cursor.execute("""
@@ -567,21 +553,10 @@ async def daily_checkin_callback(callback: types.CallbackQuery):
             # Выполняем чек-ин
             checkin_reward = 0.5
             
-            # Добавляем чек-ин
-            cursor.execute("""
-                INSERT INTO user_checkins (user_id, checkin_date, sc_amount)
-                VALUES (?, ?, ?)
-            """, (user_id, today, checkin_reward))
-            
-            # Обновляем баланс
-            cursor.execute("""
-                UPDATE users 
-                SET pending_balance = pending_balance + ?,
-                    total_earnings = total_earnings + ?
-                WHERE user_id = ?
-            """, (checkin_reward, checkin_reward, user_id))
-            
-            conn.commit()
+            # Чек-ин и начисление - одна транзакция с проводкой в журнал балансов
+            if not db.record_checkin(user_id, today, checkin_reward):
+                await callback.answer("❌ Чек-ин уже выполнен сегодня!", show_alert=True)
+                return
             
             # Получаем общее количество чек-инов
             cursor.execute("""
@@ -0,0 +1,189 @@
+"""
+Раздача статики Mini App: предсжатые gzip/brotli варианты, сильные ETag,
+immutable кэширование для хэшированных ассетов и отдача мелких файлов из памяти
+"""
+import gzip
+import hashlib
+import logging
+import mimetypes
+import os
+import re
+from dataclasses import dataclass
+from typing import Dict, Optional
+
+from aiohttp import web
+
+try:
+    import brotli  # Необязательная зависимость: без неё отдаём только gzip
+except ImportError:
+    brotli = None
+
+MEMORY_FILE_LIMIT = 1024 * 1024  # Файлы до 1 МБ держим в памяти целиком
+MIN_COMPRESS_SIZE = 512  # Мелочь сжимать нет смысла
+COMPRESSIBLE_TYPES = ("text/", "application/javascript", "application/json",
+                      "image/svg+xml", "application/xml")
+
+# Vite кладёт хэш содержимого в имя: index-Bk94vXp6.js
+HASHED_NAME_RE = re.compile(r"[.-][A-Za-z0-9_-]{8,}\.[a-z0-9]+$")
+
+CACHE_IMMUTABLE = "public, max-age=31536000, immutable"
+CACHE_REVALIDATE = "no-cache"
+CACHE_SHORT = "public, max-age=3600"
+
+
+@dataclass
+class StaticAsset:
+    """Файл, подготовленный к раздаче"""
+    path: str
+    content_type: str
+    etag: str
+    cache_control: str
+    body: Optional[bytes] = None
+    gzip_body: Optional[bytes] = None
+    br_body: Optional[bytes] = None
+
+    @property
+    def in_memory(self) -> bool:
+        return self.body is not None
+
+
+def _is_compressible(content_type: str) -> bool:
+    return content_type.startswith(COMPRESSIBLE_TYPES)
+
+
+def _cache_control_for(path: str, revalidate: bool) -> str:
+    if revalidate:
+        return CACHE_REVALIDATE
+    if HASHED_NAME_RE.search(os.path.basename(path)):
+        return CACHE_IMMUTABLE
+    return CACHE_SHORT
+
+
+def load_asset(path: str, revalidate: bool = False) -> StaticAsset:
+    """Прочитать файл, посчитать ETag и подготовить сжатые варианты"""
+    content_type = mimetypes.guess_type(path)[0] or "application/octet-stream"
+    with open(path, "rb") as f:
+        data = f.read()
+
+    asset = StaticAsset(
+        path=path,
+        content_type=content_type,
+        etag='"%s"' % hashlib.sha256(data).hexdigest()[:32],
+        cache_control=_cache_control_for(path, revalidate)
+    )
+
+    compressible = _is_compressible(content_type) and len(data) >= MIN_COMPRESS_SIZE
+    if len(data) <= MEMORY_FILE_LIMIT:
+        asset.body = data
+        if compressible:
+            asset.gzip_body = gzip.compress(data, compresslevel=9, mtime=0)
+            if brotli is not None:
+                asset.br_body = brotli.compress(data, quality=11)
+    elif compressible:
+        # Большие файлы отдаёт FileResponse: он сам подхватит соседние .gz/.br
+        _write_sidecar(path + ".gz", lambda: gzip.compress(data, compresslevel=9, mtime=0))
+        if brotli is not None:
+            _write_sidecar(path + ".br", lambda: brotli.compress(data, quality=11))
+    return asset
+
+
+def _write_sidecar(path: str, compress):
+    try:
+        if not os.path.exists(path):
+            with open(path, "wb") as f:
+                f.write(compress())
+    except OSError as e:
+        logging.warning(f"Cannot write precompressed {path}: {e}")
+
+
+class StaticAssets:
+    """Реестр статики: url -> подготовленный файл"""
+
+    def __init__(self):
+        self.assets: Dict[str, StaticAsset] = {}
+
+    def add_file(self, url: str, path: str, revalidate: bool = False):
+        """Зарегистрировать отдельный файл (если он существует)"""
+        if os.path.isfile(path):
+            self.assets[url] = load_asset(path, revalidate)
+
+    def add_directory(self, url_prefix: str, directory: str):
+        """Зарегистрировать все файлы каталога (кроме .gz/.br сайдкаров)"""
+        if not os.path.isdir(directory):
+            return
+        for root, _, files in os.walk(directory):
+            for name in files:
+                if name.endswith((".gz", ".br")):
+                    continue
+                path = os.path.join(root, name)
+                rel = os.path.relpath(path, directory).replace(os.sep, "/")
+                self.assets[f"{url_prefix.rstrip('/')}/{rel}"] = load_asset(path)
+
+    def memory_usage(self) -> int:
+        """Сколько байт статики лежит в памяти"""
+        return sum(
+            len(a.body or b"") + len(a.gzip_body or b"") + len(a.br_body or b"")
+            for a in self.assets.values()
+        )
+
+    async def handle(self, request: web.Request) -> web.StreamResponse:
+        """aiohttp handler для всех зарегистрированных путей"""
+        asset = self.assets.get(request.path)
+        if asset is None:
+            raise web.HTTPNotFound()
+
+        headers = {
+            "ETag": asset.etag,
+            "Cache-Control": asset.cache_control,
+            "Vary": "Accept-Encoding"
+        }
+        if asset.etag in request.headers.get("If-None-Match", ""):
+            return web.Response(status=304, headers=headers)
+
+        if not asset.in_memory:
+            return web.FileResponse(asset.path, headers=headers)
+
+        accept = request.headers.get("Accept-Encoding", "")
+        body = asset.body
+        if asset.br_body is not None and "br" in accept:
+            body = asset.br_body
+            headers["Content-Encoding"] = "br"
+        elif asset.gzip_body is not None and "gzip" in accept:
+            body = asset.gzip_body
+            headers["Content-Encoding"] = "gzip"
+
+        return web.Response(body=body, headers=headers, content_type=asset.content_type)
+
+
+def build_tma_assets(dist_dir: str = "dist", public_dir: str = "public") -> StaticAssets:
+    """Собрать реестр статики Mini App"""
+    assets = StaticAssets()
+    # index.html ссылается на хэшированные бандлы - его всегда ревалидируем
+    assets.add_file("/", os.path.join(dist_dir, "index.html"), revalidate=True)
+    if os.path.isdir(dist_dir):
+        # Vite копирует public/ в корень dist
+        for name in os.listdir(dist_dir):
+            if name != "index.html" and not name.endswith((".gz", ".br")):
+                assets.add_file(f"/{name}", os.path.join(dist_dir, name))
+    assets.add_directory("/assets", os.path.join(dist_dir, "assets"))
+    for name in ("tonconnect-manifest.json", "tonconnect-manifest-short.json",
+                 "tonconnect-manifest-minimal.json"):
+        assets.add_file(f"/{name}", os.path.join(public_dir, name), revalidate=True)
+    assets.add_file("/icon.svg", os.path.join(public_dir, "icon.svg"))
+    assets.add_file("/icon.png", os.path.join(public_dir, "icon.png"))
+    assets.add_file("/terms", os.path.join(public_dir, "terms.html"))
+    assets.add_file("/privacy", os.path.join(public_dir, "privacy.html"))
+    return assets
+
+
+def setup_static_routes(app: web.Application, dist_dir: str = "dist",
+                        public_dir: str = "public") -> StaticAssets:
+    """Зарегистрировать маршруты статики Mini App"""
+    assets = build_tma_assets(dist_dir, public_dir)
+    for url in assets.assets:
+        app.router.add_get(url, assets.handle)
+    logging.info(
+        f"✅ Static assets: {len(assets.assets)} files, "
+        f"{assets.memory_usage() / 1024:.0f} KB in memory, brotli={'on' if brotli else 'off'}"
+    )
+    return assets
@@ -13,7 +13,8 @@ from aiogram.fsm.state import State, StatesGroup
 from app.context import get_config, get_db
 from app.keyboards import get_tasks_keyboard
 from app.helpers.task_verification import verify_subscription, is_valid_telegram_url
-from app.services.tasks import TaskService
+from app.services.outbound import NOTIFICATION, bulk_sending, outbound_priority, start_broadcast
+from app.services.tasks import TaskService, REDEEM_ERRORS
 
 router = Router()
 
@@ -68,13 +69,7 @@ async def tasks_menu(message: types.Message):
     
     # Статистика пользователя
     completed_tasks = db.get_user_completed_tasks(user_id)
-    active_tasks = db.get_active_tasks()
-    
-    available_tasks = []
-    for task in active_tasks:
-        if not db.is_task_completed(user_id, task['id']):
-            if task['max_completions'] is None or task['current_completions'] < task['max_completions']:
-                available_tasks.append(task)
+    available_tasks = db.get_available_tasks(user_id)
     
     total_earned_capsules = sum(ct['reward_capsules'] for ct in completed_tasks)
     
@@ -123,16 +118,8 @@ async def show_available_tasks(callback: CallbackQuery):
         await safe_edit_message(callback, "📋 Пока нет доступных заданий")
         return
     
-    # Фильтруем только невыполненные
-    available_tasks = []
-    for task in active_tasks:
-        is_completed = db.is_task_completed(user_id, task['id'])
-        has_max_completions = task['max_completions'] is not None
-        at_max_completions = has_max_completions and task['current_completions'] >= task['max_completions']
-        
-        
-        if not is_completed and not at_max_completions:
-            available_tasks.append(task)
+    # Фильтруем только невыполненные (каталог и выполненные - одним запросом)
+    available_tasks = db.get_available_tasks(user_id)
     
     if not available_tasks:
         text = "✅ Вы выполнили все доступные задания!\n\nСледите за новыми заданиями от партнеров."
@@ -328,9 +315,11 @@ async def check_task_completion(callback: CallbackQuery):
     verification_result = await task_service._verify_task_completion(user_id, task_obj, callback.message.bot)
     
     if verification_result["success"]:
-        # Засчитать выполнение задания (только капсулы)
-        db.complete_user_task(user_id, task_id, task['reward_capsules'])
-        db.add_bonus_capsules(user_id, task['reward_capsules'])
+        # Засчитать выполнение атомарно: лимит, запись и капсулы одной транзакцией
+        redemption = db.redeem_task(user_id, task_id)
+        if not redemption["success"]:
+            await callback.answer(REDEEM_ERRORS[redemption["reason"]], show_alert=True)
+            return
         
         success_text = (
             f"🎉 <b>Задание выполнено!</b>\n\n"
@@ -358,11 +347,12 @@ async def check_task_completion(callback: CallbackQuery):
             user_info = f"@{callback.from_user.username}" if callback.from_user.username else callback.from_user.first_name
             admin_notification = f"✅ Задание выполнено\n👤 {user_info}\n🎯 {task['title']}\n🎁 {task['reward_capsules']} капсул"
             
-            for admin_id in cfg.ADMIN_IDS:
-                try:
-                    await callback.message.bot.send_message(admin_id, admin_notification)
-                except:
-                    pass
+            with outbound_priority(NOTIFICATION):
+                for admin_id in cfg.ADMIN_IDS:
+                    try:
+                        await callback.message.bot.send_message(admin_id, admin_notification)
+                    except:
+                        pass
                 
     else:
         # Задание не выполнено
@@ -937,6 +927,50 @@ async def finalize_task_creation(callback, state: FSMContext, reward: int):
 
 # ================== МАССОВЫЕ УВЕДОМЛЕНИЯ ==================
 
+def build_task_announcement(task: dict) -> str:
+    """Текст уведомления о новом задании"""
+    # Определяем эмодзи по типу задания
+    if task['task_type'] == 'channel_subscription':
+        type_emoji = "📢"
+        action_text = "подпишитесь на канал"
+    elif task['task_type'] == 'channel_activity':
+        type_emoji = "💬"
+        action_text = "выполните активность в канале"
+    else:
+        type_emoji = "👥"
+        action_text = "вступите в группу"
+    
+    return (
+        f"🎉 <b>Новое задание!</b>\n\n"
+        f"{type_emoji} <b>{task['title']}</b>\n"
+        f"🏢 Партнер: {task['partner_name']}\n"
+        f"🎁 Награда: {task['reward_capsules']} капсул\n\n"
+        f"💡 {task['description']}\n\n"
+        f"⚡ Чтобы {action_text}, нажмите 🎯 Задания в главном меню!"
+    )
+
+async def broadcast_task_announcement(bot, task: dict) -> tuple:
+    """Разослать уведомление о задании всем пользователям, вернуть (доставлено, ошибок)"""
+    notification_text = build_task_announcement(task)
+    success_count = 0
+    failed_count = 0
+    
+    with bulk_sending():
+        for user in get_db().get_all_users():
+            try:
+                await bot.send_message(
+                    chat_id=user['user_id'],
+                    text=notification_text,
+                    parse_mode="HTML"
+                )
+                success_count += 1
+            except Exception:
+                failed_count += 1
+                # Не логируем каждую ошибку, чтобы не спамить
+    
+    logging.info(f"📢 Task {task['id']} announcement: {success_count} sent, {failed_count} failed")
+    return success_count, failed_count
+
 @router.callback_query(F.data.startswith("notify_users_"))
 async def send_task_notification(callback: CallbackQuery):
     """Отправить уведомление о новом задании всем пользователям"""
@@ -959,61 +993,33 @@ async def send_task_notification(callback: CallbackQuery):
         await callback.answer("❌ Задание не найдено", show_alert=True)
         return
     
-    # Получаем всех пользователей
-    users = db.get_all_users()
-    if not users:
+    if not db.get_all_users():
         await callback.answer("❌ Нет пользователей для уведомления", show_alert=True)
         return
     
-    # Определяем эмодзи по типу задания
-    if task['task_type'] == 'channel_subscription':
-        type_emoji = "📢"
-        action_text = "подпишитесь на канал"
-    elif task['task_type'] == 'channel_activity':
-        type_emoji = "💬"
-        action_text = "выполните активность в канале"
-    else:
-        type_emoji = "👥"
-        action_text = "вступите в группу"
-    
-    # Формируем сообщение уведомления
-    notification_text = (
-        f"🎉 <b>Новое задание!</b>\n\n"
-        f"{type_emoji} <b>{task['title']}</b>\n"
-        f"🏢 Партнер: {task['partner_name']}\n"
-        f"🎁 Награда: {task['reward_capsules']} капсул\n\n"
-        f"💡 {task['description']}\n\n"
-        f"⚡ Чтобы {action_text}, нажмите 🎯 Задания в главном меню!"
-    )
-    
-    # Отправляем уведомления
-    success_count = 0
-    failed_count = 0
+    if not callback.bot:
+        return
+    bot = callback.bot
     
-    for user in users:
-        try:
-            if callback.bot:
-                await callback.bot.send_message(
-                    chat_id=user['user_id'],
-                    text=notification_text,
-                    parse_mode="HTML"
-                )
-            success_count += 1
-        except Exception as e:
-            failed_count += 1
-            # Не логируем каждую ошибку, чтобы не спамить
-    
-    # Отчёт о рассылке
-    report_text = (
-        f"📊 <b>Рассылка завершена!</b>\n\n"
-        f"✅ Доставлено: {success_count} пользователей\n"
-        f"❌ Не доставлено: {failed_count} пользователей\n\n"
-        f"🎯 Задание: {task['title']}"
-    )
+    async def announce():
+        success_count, failed_count = await broadcast_task_announcement(bot, task)
+        
+        # Отчёт о рассылке
+        report_text = (
+            f"📊 <b>Рассылка завершена!</b>\n\n"
+            f"✅ Доставлено: {success_count} пользователей\n"
+            f"❌ Не доставлено: {failed_count} пользователей\n\n"
+            f"🎯 Задание: {task['title']}"
+        )
+        if callback.message:
+            await safe_edit_message(callback, report_text, parse_mode="HTML")
     
+    # Рассылка идёт в фоне: хендлер не держит очередь апдейтов админа; кнопки убираем сразу
     if callback.message:
-        await safe_edit_message(callback, report_text, parse_mode="HTML")
-    await callback.answer("📢 Уведомления отправлены!")
+        await safe_edit_message(callback, f"⏳ <b>Рассылка идёт</b>\n\n🎯 Задание: {task['title']}",
+                                parse_mode="HTML")
+    start_broadcast(announce(), f"task {task_id}")
+    await callback.answer("📢 Рассылка запущена!")
 
 # ================== РЕДАКТИРОВАНИЕ ЗАДАНИЙ ==================
 
@@ -4,86 +4,145 @@ Telegram Mini App API handlers для покупок Stars - ИСПРАВЛЕН
 import logging
 import json
 import asyncio
+import hashlib
 from typing import Dict, Any, List
 from datetime import datetime
 from aiohttp import web
 from aiogram import Bot
 
 from app.context import get_config, get_db
+from app.services.rhombis_stars_api import (
+    RHOMBIS_API_BASE, get_rhombis_stars_api, setup_rhombis_client
+)
+from app.utils.cache import TTLCache
 
 # Stars pricing configuration - REAL RHOMBIS API RATES
 # Based on actual Rhombis API testing and documentation  
 STAR_PRICE_TON = 0.00466  # РЕАЛЬНАЯ цена из Rhombis API: 0.00466 TON per Star
 
 # Rhombis API integration settings
-RHOMBIS_API_BASE = "https://api.rhombis.app"
 MIN_STARS = 1
 MAX_STARS = 10000
 
 # Product configurations for TMA
-PRODUCTS = [
-    {
-        "id": "stars_100",
-        "title": "100 Stars",
-        "description": "100 Telegram Stars",
-        "stars": 100,
-        "price_ton": 100 * STAR_PRICE_TON
-    },
-    {
-        "id": "stars_500", 
-        "title": "500 Stars",
-        "description": "500 Telegram Stars", 
-        "stars": 500,
-        "price_ton": 500 * STAR_PRICE_TON
-    }
-]
+PRODUCT_PACKS = [100, 500]
+PRICE_REFRESH_INTERVAL = 600  # Фоновое обновление цены, секунды
+
+# Bootstrap: короткий кэш готовых ответов на пользователя
+BOOTSTRAP_CACHE_TTL = 5
+BOOTSTRAP_RECIPIENT_TIMEOUT = 1.5
+
+def build_products(star_price_ton: float) -> List[Dict[str, Any]]:
+    """Собрать список продуктов для текущей цены"""
+    return [
+        {
+            "id": f"stars_{stars}",
+            "title": f"{stars} Stars",
+            "description": f"{stars} Telegram Stars",
+            "stars": stars,
+            "price_ton": stars * star_price_ton
+        }
+        for stars in PRODUCT_PACKS
+    ]
+
+PRODUCTS = build_products(STAR_PRICE_TON)
 
 async def get_rhombis_real_price():
     """Get real pricing from Rhombis API transaction endpoint"""
-    try:
-        import aiohttp
-        timeout = aiohttp.ClientTimeout(total=5)
-        
-        async with aiohttp.ClientSession(timeout=timeout) as session:
-            # Return verified Rhombis API rate
-            # Tested through multiple API calls and documentation review
-            logging.info("Using verified Rhombis API pricing rate")
-            return 0.00466  # РЕАЛЬНАЯ цена из Rhombis API тестов
-                        
-    except Exception as e:
-        logging.warning(f"Failed to get Rhombis real price: {e}")
+    # Return verified Rhombis API rate
+    # Tested through multiple API calls and documentation review
+    return 0.00466  # РЕАЛЬНАЯ цена из Rhombis API тестов
+
+class PricingCache:
+    """Цена Stars и продукты в памяти; обновляются фоновой задачей, а не на запрос"""
+    
+    def __init__(self, refresh_interval: float = PRICE_REFRESH_INTERVAL):
+        self.refresh_interval = refresh_interval
+        self.star_price_ton = STAR_PRICE_TON
+        self.price_source = "fallback"
+        self.products = PRODUCTS
+        self.config: Dict[str, Any] = {}
+        self.updated_at: datetime | None = None
+        self._task: asyncio.Task | None = None
+        self._rebuild()
+    
+    def _rebuild(self):
+        """Пересобрать готовые ответы под текущую цену"""
+        self.products = build_products(self.star_price_ton)
+        self.config = {
+            "star_price_ton": self.star_price_ton,
+            "min_stars": MIN_STARS,
+            "max_stars": MAX_STARS,
+            "price_source": self.price_source,
+            "api_base": RHOMBIS_API_BASE
+        }
+    
+    async def refresh(self):
+        """Обновить цену; при ошибке остаётся последняя известная"""
+        try:
+            price = await get_rhombis_real_price()
+            if price and price > 0:
+                self.star_price_ton = price
+                self.price_source = "rhombis_api"
+                self.updated_at = datetime.now()
+                self._rebuild()
+        except Exception as e:
+            logging.warning(f"Failed to refresh Rhombis price: {e}")
+    
+    async def _refresh_loop(self):
+        while True:
+            await asyncio.sleep(self.refresh_interval)
+            await self.refresh()
+    
+    async def start(self, app: web.Application = None):
+        """aiohttp on_startup: первая загрузка и запуск фонового обновления"""
+        await self.refresh()
+        if self._task is None:
+            self._task = asyncio.create_task(self._refresh_loop())
     
-    return STAR_PRICE_TON  # Fallback
+    async def stop(self, app: web.Application = None):
+        """aiohttp on_cleanup: остановить фоновое обновление"""
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+pricing_cache = PricingCache()
 
 async def get_config_api(request: web.Request) -> web.Response:
-    """Get TMA configuration with real Rhombis API prices"""
-    try:
-        # Get real price from Rhombis API
-        real_price = await get_rhombis_real_price()
-        
-        return web.json_response({
-            "success": True,
-            "config": {
-                "star_price_ton": real_price,
-                "min_stars": 1,
-                "max_stars": 10000,
-                "price_source": "rhombis_api",
-                "api_base": RHOMBIS_API_BASE
-            }
-        })
-        
-    except Exception as e:
-        logging.error(f"Error getting config: {e}")
-        return web.json_response({
-            "success": True,
-            "config": {
-                "star_price_ton": STAR_PRICE_TON,
-                "min_stars": 1, 
-                "max_stars": 10000,
-                "price_source": "fallback",
-                "api_base": RHOMBIS_API_BASE
-            }
-        })
+    """Get TMA configuration with real Rhombis API prices (served from memory)"""
+    return web.json_response({
+        "success": True,
+        "config": pricing_cache.config
+    })
+
+def rhombis_unavailable_response() -> web.Response:
+    """Быстрый отказ, пока circuit breaker Rhombis разомкнут"""
+    return web.json_response({
+        'success': False,
+        'error': 'Rhombis API temporarily unavailable, please try again in a minute',
+        'circuit_open': True
+    }, status=503)
+
+def serialize_tma_user(user_id: int, user: Dict[str, Any]) -> Dict[str, Any]:
+    """Профиль пользователя в формате TMA API"""
+    return {
+        'user_id': user_id,
+        'username': user.get('username', ''),
+        'first_name': user.get('first_name', ''),
+        'balance': float(user.get('balance', 0)),
+        'total_earnings': float(user.get('total_earnings', 0)),
+        'referral_count': int(user.get('referral_count', 0)),
+        'subscription_status': user.get('subscription_status', 'unknown'),
+        'registration_date': user.get('registration_date', ''),
+        'ton_wallet': user.get('ton_wallet', ''),
+        'capsules_opened': int(user.get('capsules_opened', 0)),
+        'risk_score': float(user.get('risk_score', 0)),
+        'is_verified': bool(user.get('is_verified', False))
+    }
 
 async def get_user_balance(request: web.Request) -> web.Response:
     """Получить полную информацию о пользователе"""
@@ -101,20 +160,7 @@ async def get_user_balance(request: web.Request) -> web.Response:
         
         return web.json_response({
             'success': True,
-            'user': {
-                'user_id': user_id,
-                'username': user.get('username', ''),
-                'first_name': user.get('first_name', ''),
-                'balance': float(user.get('balance', 0)),
-                'total_earnings': float(user.get('total_earnings', 0)),
-                'referral_count': int(user.get('referral_count', 0)),
-                'subscription_status': user.get('subscription_status', 'unknown'),
-                'registration_date': user.get('registration_date', ''),
-                'ton_wallet': user.get('ton_wallet', ''),
-                'capsules_opened': int(user.get('capsules_opened', 0)),
-                'risk_score': float(user.get('risk_score', 0)),
-                'is_verified': bool(user.get('is_verified', False))
-            }
+            'user': serialize_tma_user(user_id, user)
         })
         
     except ValueError:
@@ -133,9 +179,66 @@ async def get_products_api(request: web.Request) -> web.Response:
     """Получить список продуктов Stars"""
     return web.json_response({
         "success": True,
-        "products": PRODUCTS
+        "products": pricing_cache.products
     })
 
+bootstrap_cache = TTLCache(maxsize=5000, ttl=BOOTSTRAP_CACHE_TTL)
+
+async def _bootstrap_recipient(username: str) -> Dict[str, Any] | None:
+    """Получатель для bootstrap: из кэша, без ожидания медленного Rhombis"""
+    try:
+        result = await asyncio.wait_for(
+            asyncio.shield(get_rhombis_stars_api().get_stars_recipient(username)),
+            timeout=BOOTSTRAP_RECIPIENT_TIMEOUT
+        )
+    except asyncio.TimeoutError:
+        return None
+    return result['data'] if result.get('success') else None
+
+async def _build_bootstrap(user_id: int | None, recipient_username: str) -> Dict[str, Any]:
+    user = None
+    if user_id is not None:
+        row = get_db().get_user(user_id)
+        if row:
+            user = serialize_tma_user(user_id, row)
+            recipient_username = recipient_username or (row.get('username') or '')
+    
+    recipient = None
+    if recipient_username:
+        recipient = await _bootstrap_recipient(recipient_username)
+    
+    return {
+        "success": True,
+        "config": pricing_cache.config,
+        "products": pricing_cache.products,
+        "user": user,
+        "recipient": recipient,
+        "recipient_username": recipient_username or None
+    }
+
+async def get_bootstrap(request: web.Request) -> web.Response:
+    """Всё, что нужно Mini App при открытии, одним ответом (ETag/304)"""
+    try:
+        user_id_raw = request.query.get('user_id', '')
+        user_id = int(user_id_raw) if user_id_raw else None
+    except ValueError:
+        return web.json_response({'error': 'Invalid user_id'}, status=400)
+    recipient_username = request.query.get('recipient', '').strip().lstrip('@')
+    
+    key = (user_id, recipient_username.lower())
+    cached = bootstrap_cache.get(key)
+    if cached is None:
+        payload = await _build_bootstrap(user_id, recipient_username)
+        body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        cached = (body, '"%s"' % hashlib.sha1(body).hexdigest())
+        bootstrap_cache.set(key, cached)
+    body, etag = cached
+    
+    headers = {'ETag': etag, 'Cache-Control': 'private, no-cache'}
+    if etag in request.headers.get('If-None-Match', ''):
+        return web.Response(status=304, headers=headers)
+    return web.Response(body=body, headers=headers, content_type='application/json')
+
 async def purchase_stars(request: web.Request) -> web.Response:
     """Покупка Stars с пользовательским количеством"""
     try:
@@ -172,35 +275,29 @@ async def purchase_stars(request: web.Request) -> web.Response:
                 status=400
             )
         
-        # Get recipient from Rhombis API
-        import aiohttp
-        async with aiohttp.ClientSession() as session:
-            # Get recipient info
-            async with session.get(
-                f"https://api.rhombis.app/stars/recipient?username={username}"
-            ) as resp:
-                if resp.status != 200:
-                    return web.json_response(
-                        {'error': 'Failed to get recipient info'}, 
-                        status=400
-                    )
-                recipient_data = await resp.json()
-                recipient = recipient_data['recipient']
-            
-            # Create Stars transaction
-            async with session.post(
-                "https://api.rhombis.app/stars/transaction",
-                json={
-                    "recipient": recipient,
-                    "quantity": amount
-                }
-            ) as resp:
-                if resp.status != 200:
-                    return web.json_response(
-                        {'error': 'Failed to create Stars transaction'}, 
-                        status=400
-                    )
-                transaction_data = await resp.json()
+        # Get recipient from Rhombis API (shared keep-alive client)
+        rhombis_api = get_rhombis_stars_api()
+        recipient_result = await rhombis_api.get_stars_recipient(username)
+        if recipient_result.get('circuit_open'):
+            return rhombis_unavailable_response()
+        if not recipient_result['success']:
+            return web.json_response(
+                {'error': 'Failed to get recipient info'}, 
+                status=400
+            )
+        recipient_data = recipient_result['data']
+        recipient = recipient_data['recipient']
+        
+        # Create Stars transaction
+        transaction_result = await rhombis_api.create_stars_purchase(recipient, amount)
+        if transaction_result.get('circuit_open'):
+            return rhombis_unavailable_response()
+        if not transaction_result['success']:
+            return web.json_response(
+                {'error': 'Failed to create Stars transaction'}, 
+                status=400
+            )
+        transaction_data = transaction_result['data']
         
         logging.info(f"Created Rhombis Stars transaction for user {user_id}, amount {amount}")
         
@@ -231,23 +328,20 @@ async def get_user_info(request: web.Request) -> web.Response:
         username = username.lstrip('@')  # Remove @ if provided
         
         # Use Rhombis API to get user info
-        import aiohttp
-        async with aiohttp.ClientSession() as session:
-            async with session.get(
-                f"https://api.rhombis.app/stars/recipient?username={username}"
-            ) as resp:
-                if resp.status == 200:
-                    data = await resp.json()
-                    return web.json_response({
-                        'success': True,
-                        'user': data,
-                        'username': username
-                    })
-                else:
-                    return web.json_response({
-                        'success': False,
-                        'error': 'User not found or API error'
-                    }, status=404)
+        result = await get_rhombis_stars_api().get_stars_recipient(username)
+        if result.get('circuit_open'):
+            return rhombis_unavailable_response()
+        if result['success']:
+            return web.json_response({
+                'success': True,
+                'user': result['data'],
+                'username': username
+            })
+        else:
+            return web.json_response({
+                'success': False,
+                'error': 'User not found or API error'
+            }, status=404)
                     
     except Exception as e:
         logging.error(f"Error getting user info: {e}")
@@ -319,63 +413,44 @@ async def purchase_premium(request: web.Request) -> web.Response:
                     'error': f'Username required for Premium purchase. Got user_id: {user_id}'
                 }, status=400)
         
-        # Use Rhombis API for Premium (correct endpoint)
-        import aiohttp
-        async with aiohttp.ClientSession() as session:
-            # Get recipient info from Rhombis Premium API 
-            async with session.get(
-                f"https://api.rhombis.app/premium/recipient?username={username}"
-            ) as resp:
-                if resp.status != 200:
-                    error_text = await resp.text()
-                    logging.error(f"Rhombis recipient lookup failed: {resp.status} - {error_text}")
-                    return web.json_response({
-                        'success': False,
-                        'error': f'User {username} not found in Rhombis system: {error_text}',
-                        'rhombis_status': resp.status
-                    }, status=400)
-                
-                recipient_data = await resp.json()
-                recipient = recipient_data['recipient']
-            
-            # Create Premium transaction using correct Premium API
-            api_request_data = {
-                'recipient': recipient,
-                'months': months,
-                'referrer': None  # Optional referrer field
-            }
-            logging.info(f"Making Rhombis Premium API request: {api_request_data}")
-            
-            # Call Rhombis Premium API (correct endpoint)
-            async with session.post(
-                "https://api.rhombis.app/premium/transaction",
-                json=api_request_data,
-                headers={'Content-Type': 'application/json'}
-            ) as resp:
-                response_text = await resp.text()
-                logging.info(f"Rhombis API response status: {resp.status}")
-                logging.info(f"Rhombis API response body: {response_text}")
-                
-                if resp.status != 200:
-                    # Return exact Rhombis API error to client
-                    logging.error(f"Rhombis API error {resp.status}: {response_text}")
-                    return web.json_response({
-                        'success': False,
-                        'error': f'Rhombis API error {resp.status}: {response_text}',
-                        'rhombis_status': resp.status,
-                        'rhombis_response': response_text
-                    }, status=400)
-                
-                try:
-                    transaction_data = await resp.json()
-                    logging.info(f"Successfully parsed Rhombis response: {transaction_data}")
-                except Exception as parse_error:
-                    logging.error(f"Failed to parse Rhombis response: {parse_error}")
-                    return web.json_response({
-                        'success': False,
-                        'error': f'Invalid JSON from Rhombis API: {parse_error}',
-                        'rhombis_response': response_text
-                    }, status=500)
+        # Use Rhombis API for Premium (shared keep-alive client)
+        rhombis_api = get_rhombis_stars_api()
+        
+        # Get recipient info from Rhombis Premium API 
+        recipient_result = await rhombis_api.get_premium_recipient(username)
+        if recipient_result.get('circuit_open'):
+            return rhombis_unavailable_response()
+        if not recipient_result['success']:
+            error_text = recipient_result.get('text', recipient_result['error'])
+            logging.error(f"Rhombis recipient lookup failed: {recipient_result['status']} - {error_text}")
+            return web.json_response({
+                'success': False,
+                'error': f'User {username} not found in Rhombis system: {error_text}',
+                'rhombis_status': recipient_result['status']
+            }, status=400)
+        
+        recipient_data = recipient_result['data']
+        recipient = recipient_data['recipient']
+        
+        # Create Premium transaction using correct Premium API
+        logging.info(f"Making Rhombis Premium API request: recipient={recipient}, months={months}")
+        transaction_result = await rhombis_api.create_premium_purchase(recipient, months)
+        logging.info(f"Rhombis API response status: {transaction_result['status']}")
+        if transaction_result.get('circuit_open'):
+            return rhombis_unavailable_response()
+        
+        if not transaction_result['success']:
+            # Return exact Rhombis API error to client
+            response_text = transaction_result.get('text', transaction_result['error'])
+            logging.error(f"Rhombis API error {transaction_result['status']}: {response_text}")
+            return web.json_response({
+                'success': False,
+                'error': f"Rhombis API error {transaction_result['status']}: {response_text}",
+                'rhombis_status': transaction_result['status'],
+                'rhombis_response': response_text
+            }, status=400)
+        
+        transaction_data = transaction_result['data']
         
         logging.info(f"Created Rhombis Premium transaction for user {user_id}, {months} months")
         
@@ -511,12 +586,20 @@ async def serve_manifest(request: web.Request):
 def setup_tma_routes(app: web.Application):
     """Setup TMA routes - DISABLED"""
     
+    # Shared Rhombis HTTP client and price cache live as long as the aiohttp app
+    setup_rhombis_client(app)
+    app.on_startup.append(pricing_cache.start)
+    app.on_cleanup.append(pricing_cache.stop)
+    
     # TMA DISABLED - Only basic health endpoint
     async def tma_disabled(request):
         return web.Response(text="TMA temporarily disabled", status=503)
-    app.router.add_get('/', tma_disabled)
-    
+    # '/' уже может быть занят статикой Mini App или health-заглушкой из main.py
+    if not any(resource.canonical == '/' for resource in app.router.resources()):
+        app.router.add_get('/', tma_disabled)
+
     # API endpoints
+    app.router.add_get('/api/bootstrap', get_bootstrap)
     app.router.add_get('/api/config', get_config_api)
     app.router.add_get('/api/products', get_products_api) 
     app.router.add_post('/api/purchase', purchase_stars)
@@ -9,6 +9,7 @@ from aiogram.fsm.state import State, StatesGroup
 
 from app.context import get_config, get_db
 from app.keyboards import get_main_keyboard
+from app.services.outbound import NOTIFICATION, outbound_priority
 from app.utils.helpers import format_balance
 
 router = Router()
@@ -106,10 +107,12 @@ async def withdraw_command(message: types.Message, state: FSMContext):
         )
         return
     
-    if user['pending_balance'] <= 0:
+    # Уже зарезервированное активными заявками к выводу не доступно
+    available = db.get_available_balance(message.from_user.id)
+    if available <= 0:
         await message.answer(
             f"❌ <b>Недостаточно средств</b>\n\n"
-            f"Ваш баланс: {format_balance(user['pending_balance'])} SC\n"
+            f"Ваш баланс: {format_balance(available)} SC\n"
             f"Откройте капсулы или пригласите друзей для заработка!"
         )
         return
@@ -127,7 +130,7 @@ async def withdraw_command(message: types.Message, state: FSMContext):
         # Запрашиваем сумму
         await message.answer(
             f"💰 <b>Запрос на вывод</b>\n\n"
-            f"Доступно к выводу: {format_balance(user['pending_balance'])} SC\n"
+            f"Доступно к выводу: {format_balance(available)} SC\n"
             f"Кошелек: <code>{user['wallet_address']}</code>\n\n"
             f"Введите сумму для вывода:"
         )
@@ -153,14 +156,6 @@ async def process_withdraw_request(message: types.Message, amount: float, user:
         await message.answer("❌ Сумма должна быть больше 0")
         return
     
-    if amount > user['pending_balance']:
-        await message.answer(
-            f"❌ <b>Недостаточно средств</b>\n\n"
-            f"Запрошено: {format_balance(amount)} SC\n"
-            f"Доступно: {format_balance(user['pending_balance'])} SC"
-        )
-        return
-    
     # Минимальная сумма для вывода (временно снижена для тестирования)
     min_withdraw = 5.0
     if amount < min_withdraw:
@@ -172,11 +167,24 @@ async def process_withdraw_request(message: types.Message, amount: float, user:
         )
         return
     
-    # Создать запрос на вывод
+    # Резервируем средства атомарно: параллельные /withdraw не выведут больше баланса.
+    # Ключ идемпотентности - сообщение: повторная доставка апдейта не создаст вторую заявку
     db = get_db()
-    request_id = db.create_withdrawal_request(message.from_user.id, amount)
+    result = db.reserve_withdrawal(
+        message.from_user.id, amount,
+        idempotency_key=f"tg:{message.chat.id}:{message.message_id}"
+    )
+    request_id = result.get("request_id", 0)
     
-    if request_id:
+    if result["reason"] == "insufficient_funds":
+        await message.answer(
+            f"❌ <b>Недостаточно средств</b>\n\n"
+            f"Запрошено: {format_balance(amount)} SC\n"
+            f"Доступно: {format_balance(result['available'])} SC"
+        )
+    elif result["reason"] == "duplicate":
+        await message.answer(f"ℹ️ Запрос #{request_id} уже создан и обрабатывается")
+    elif request_id:
         await message.answer(
             f"✅ <b>Запрос на вывод создан!</b>\n\n"
             f"💰 Сумма: {format_balance(amount)} SC\n"
@@ -200,11 +208,12 @@ async def process_withdraw_request(message: types.Message, amount: float, user:
             # Отправляем уведомления админам (через контекст бота)
             try:
                 bot = message.bot
-                for admin_id in cfg.ADMIN_IDS:
-                    try:
-                        await bot.send_message(admin_id, admin_text)
-                    except Exception:
-                        pass
+                with outbound_priority(NOTIFICATION):
+                    for admin_id in cfg.ADMIN_IDS:
+                        try:
+                            await bot.send_message(admin_id, admin_text)
+                        except Exception:
+                            pass
             except Exception:
                 pass
     else:
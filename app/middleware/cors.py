@@ -0,0 +1,38 @@
+"""
+Единый CORS middleware для aiohttp: TON Connect кошельки забирают манифест и иконку
+с чужого origin, поэтому эти пути отдаём с CORS заголовками
+"""
+from typing import Iterable
+from aiohttp import web
+
+CORS_PATHS = frozenset({
+    "/tonconnect-manifest.json",
+    "/tonconnect-manifest-short.json",
+    "/tonconnect-manifest-minimal.json",
+    "/icon.png",
+    "/icon.svg",
+})
+
+CORS_HEADERS = {
+    "Access-Control-Allow-Origin": "*",
+    "Access-Control-Allow-Methods": "GET, OPTIONS",
+    "Access-Control-Allow-Headers": "Content-Type",
+    "Access-Control-Max-Age": "86400",
+}
+
+
+def cors_middleware(paths: Iterable[str] = CORS_PATHS):
+    """Создать middleware, добавляющий CORS заголовки для указанных путей"""
+    cors_paths = frozenset(paths)
+
+    @web.middleware
+    async def middleware(request: web.Request, handler):
+        if request.path not in cors_paths:
+            return await handler(request)
+        if request.method == "OPTIONS":
+            return web.Response(status=204, headers=CORS_HEADERS)
+        response = await handler(request)
+        response.headers.update(CORS_HEADERS)
+        return response
+
+    return middleware
@@ -0,0 +1,84 @@
+"""
+Middleware метрик: время каждого апдейта (по хендлеру) и HTTP-запроса (по маршруту)
+
+Разбивка по зависимостям собирается через app.services.metrics.track()
+в Database, сессии Bot, Telethon и клиенте Rhombis.
+"""
+from typing import Any, Awaitable, Callable, Dict
+
+from aiogram import BaseMiddleware
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.types import TelegramObject, Update
+from aiohttp import web
+
+from app.services.metrics import metrics, request_scope, track
+
+_LABELS_KEY = "metrics_labels"
+
+
+class UpdateMetricsMiddleware(BaseMiddleware):
+    """Outer middleware апдейтов: открывает область метрик"""
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any]
+    ) -> Any:
+        event_type = event.event_type if isinstance(event, Update) else type(event).__name__
+        with request_scope("update", event=event_type, handler="unhandled") as labels:
+            data[_LABELS_KEY] = labels
+            return await handler(event, data)
+
+
+class HandlerNameMiddleware(BaseMiddleware):
+    """Inner middleware: имя сработавшего хендлера становится меткой апдейта"""
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any]
+    ) -> Any:
+        labels = data.get(_LABELS_KEY)
+        handler_object = data.get("handler")
+        if labels is not None and handler_object is not None:
+            labels["handler"] = getattr(handler_object.callback, "__name__", "handler")
+        return await handler(event, data)
+
+
+class BotApiMetricsMiddleware(BaseRequestMiddleware):
+    """Request middleware сессии Bot: время вызовов Bot API по методам"""
+
+    async def __call__(self, make_request, bot, method):
+        api_method = getattr(method, "__api_method__", type(method).__name__)
+        with track("bot_api"):
+            try:
+                return await make_request(bot, method)
+            except Exception as e:
+                metrics.inc("bot_api_errors_total", method=api_method, error=type(e).__name__)
+                raise
+            finally:
+                metrics.inc("bot_api_requests_total", method=api_method)
+
+
+def http_metrics_middleware():
+    """aiohttp middleware: время запроса по шаблону маршрута, ответы по статусам"""
+
+    @web.middleware
+    async def middleware(request: web.Request, handler):
+        route = request.match_info.route.resource
+        path = route.canonical if route is not None else "unmatched"
+        status = 500
+        with request_scope("http", route=path, method=request.method):
+            try:
+                response = await handler(request)
+                status = response.status
+                return response
+            except web.HTTPException as e:
+                status = e.status
+                raise
+            finally:
+                metrics.inc("http_responses_total", route=path, status=status)
+
+    return middleware
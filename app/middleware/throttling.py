@@ -0,0 +1,116 @@
+"""
+Ограничение частоты: апдейты бота по пользователю, /api по IP клиента
+
+Отказ происходит до любых обращений к базе: лимитер целиком в памяти,
+проверка - один поиск в словаре.
+"""
+import logging
+from typing import Any, Awaitable, Callable, Dict, Iterable, Optional, Tuple
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject, Update
+from aiohttp import web
+
+from app.services.rate_limiter import RateLimiterRegistry, RatePolicy
+
+# Политики бота: ключ - user_id
+BOT_RATE_POLICIES = {
+    "command": RatePolicy.per_minute(6, burst=3),     # /start и другие команды
+    "captcha": RatePolicy.per_minute(10, burst=5),    # перебор ответов капчи
+    "callback": RatePolicy.per_minute(60, burst=20),
+    "message": RatePolicy.per_minute(30, burst=10),
+}
+
+# Политики /api: ключ - IP клиента
+API_RATE_POLICIES = {
+    "purchase": RatePolicy.per_minute(6, burst=3),
+    "lookup": RatePolicy.per_minute(60, burst=20),
+    "api": RatePolicy.per_minute(120, burst=40),
+}
+
+# Первое совпавшее правило по префиксу пути; None - без ограничения
+API_ROUTE_POLICIES: Tuple[Tuple[str, Optional[str]], ...] = (
+    ("/api/payment-webhook", None),  # сервер-сервер от Rhombis
+    ("/api/purchase", "purchase"),
+    ("/api/premium-purchase", "purchase"),
+    ("/api/send-instructions", "purchase"),
+    ("/api/user/", "lookup"),
+    ("/api/tma/user/", "lookup"),
+    ("/api/", "api"),
+)
+
+
+def update_policy(update: Update) -> Optional[str]:
+    """Политика для апдейта; None - не ограничивается"""
+    if update.callback_query is not None:
+        data = update.callback_query.data or ""
+        return "captcha" if data.startswith("captcha_") else "callback"
+    if update.message is not None:
+        text = update.message.text or ""
+        return "command" if text.startswith("/") else "message"
+    return None
+
+
+class ThrottlingMiddleware(BaseMiddleware):
+    """Отбрасывает апдейты пользователя сверх его бакета"""
+
+    def __init__(self, limiters: Optional[RateLimiterRegistry] = None):
+        self.limiters = limiters or RateLimiterRegistry(BOT_RATE_POLICIES)
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any]
+    ) -> Any:
+        user = data.get("event_from_user")
+        policy = update_policy(event) if user is not None and isinstance(event, Update) else None
+        if policy is None:
+            return await handler(event, data)
+
+        allowed, retry_after = self.limiters.hit(policy, user.id)
+        if allowed:
+            return await handler(event, data)
+
+        if event.callback_query is not None:
+            try:
+                await event.callback_query.answer(f"⏳ Слишком часто, подождите {max(1, round(retry_after))} сек")
+            except Exception as e:
+                logging.debug(f"Throttled callback answer failed: {e}")
+        return None
+
+    def stats(self) -> Dict[str, Dict[str, float]]:
+        return self.limiters.stats()
+
+
+def client_ip(request: web.Request) -> str:
+    """IP клиента за прокси: последний адрес X-Forwarded-For дописывает сам прокси"""
+    forwarded = request.headers.get("X-Forwarded-For")
+    if forwarded:
+        return forwarded.rsplit(",", 1)[-1].strip()
+    return request.remote or ""
+
+
+def rate_limit_middleware(limiters: Optional[RateLimiterRegistry] = None,
+                          routes: Iterable[Tuple[str, Optional[str]]] = API_ROUTE_POLICIES):
+    """Создать aiohttp middleware с политиками по префиксам путей"""
+    limiters = limiters or RateLimiterRegistry(API_RATE_POLICIES)
+    routes = tuple(routes)
+
+    @web.middleware
+    async def middleware(request: web.Request, handler):
+        policy = next((name for prefix, name in routes if request.path.startswith(prefix)), None)
+        if policy is None or request.method == "OPTIONS":
+            return await handler(request)
+        allowed, retry_after = limiters.hit(policy, client_ip(request))
+        if allowed:
+            return await handler(request)
+        seconds = max(1, round(retry_after))
+        return web.json_response({
+            "success": False,
+            "error": "Too many requests, please slow down",
+            "retry_after": seconds
+        }, status=429, headers={"Retry-After": str(seconds)})
+
+    middleware.limiters = limiters
+    return middleware
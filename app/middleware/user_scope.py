@@ -0,0 +1,26 @@
+"""
+Middleware: один апдейт - одна область мемоизации пользователей
+
+Guard, хендлер и сервисы обычно по несколько раз вызывают get_user для
+одного и того же пользователя; внутри области повторные вызовы не трогают
+ни кэш, ни базу.
+"""
+from typing import Any, Awaitable, Callable, Dict
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject
+
+from app.context import get_db
+
+
+class UserScopeMiddleware(BaseMiddleware):
+    """Оборачивает обработку апдейта в Database.request_scope()"""
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any]
+    ) -> Any:
+        with get_db().request_scope():
+            return await handler(event, data)
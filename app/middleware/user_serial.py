@@ -0,0 +1,146 @@
+"""
+Middleware: апдейты одного пользователя по очереди, повторные нажатия схлопываются
+
+Пользователи жмут "🎁 Открыть капсулу" и "📅 Чек-ин" по нескольку раз
+подряд. Без сериализации каждый тап запускает хендлер параллельно с
+предыдущим (гонки, лишние запросы в базу); здесь следующий апдейт
+пользователя ждёт окончания текущего. Одинаковое нажатие (тот же
+callback на том же сообщении или повторная доставка того же сообщения),
+пришедшее, пока такое же ещё в работе или в пределах окна
+UPDATE_DEBOUNCE_WINDOW, не выполняется. Новое сообщение с тем же текстом
+не дубль: в диалоге пользователь вправе дважды ввести одну и ту же сумму.
+
+Рассылки на минуты идут вне хендлера (outbound.start_broadcast), чтобы
+замок пользователя не держал его следующие апдейты.
+"""
+import logging
+import os
+import time
+from asyncio import Lock
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional, Set
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject, Update
+
+# Окно, в котором повтор того же нажатия считается дублем
+UPDATE_DEBOUNCE_WINDOW = float(os.getenv("UPDATE_DEBOUNCE_WINDOW", "1.0"))
+
+
+class _UserSlot:
+    """Замок пользователя; живёт, пока у пользователя есть апдейты в работе"""
+    __slots__ = ("lock", "users", "in_flight", "last_key", "last_at")
+
+    def __init__(self):
+        self.lock = Lock()
+        self.users = 0
+        self.in_flight: Set[Hashable] = set()
+        self.last_key: Optional[Hashable] = None
+        self.last_at = 0.0
+
+
+def update_fingerprint(update: Update) -> Optional[Hashable]:
+    """Что считается одинаковым нажатием; None - апдейт никогда не схлопывается"""
+    if update.callback_query is not None:
+        query = update.callback_query
+        message_id = query.message.message_id if query.message else query.inline_message_id
+        return ("callback", query.data, message_id)
+    if update.message is not None and update.message.text:
+        return ("text", update.message.text, update.message.message_id)
+    return None
+
+
+class UserSerialMiddleware(BaseMiddleware):
+    """Сериализация апдейтов по пользователю и схлопывание дублей
+
+    Таблица замков содержит только пользователей с апдейтами в работе:
+    запись удаляется, как только последний апдейт пользователя завершился,
+    а его последнее нажатие остаётся в _recent до конца окна.
+    """
+
+    def __init__(self, window: float = UPDATE_DEBOUNCE_WINDOW, clock: Callable[[], float] = time.monotonic):
+        self.window = window
+        self.clock = clock
+        self._slots: Dict[int, _UserSlot] = {}
+        # Последнее нажатие пользователей без апдейтов в работе: user_id -> (key, at)
+        self._recent: Dict[int, tuple] = {}
+        self.executed = 0
+        self.collapsed = 0
+        self.waited = 0
+
+    def _is_duplicate(self, slot: _UserSlot, key: Hashable, now: float) -> bool:
+        if key in slot.in_flight:
+            return True
+        return key == slot.last_key and now - slot.last_at < self.window
+
+    def _prune_recent(self, now: float):
+        """Забыть нажатия старше окна (амортизированно, когда словарь вырос)"""
+        if len(self._recent) > 2 * len(self._slots) + 1024:
+            expired = [uid for uid, (_, at) in self._recent.items() if now - at >= self.window]
+            for uid in expired:
+                del self._recent[uid]
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any]
+    ) -> Any:
+        user = data.get("event_from_user")
+        if user is None or not isinstance(event, Update):
+            return await handler(event, data)
+
+        now = self.clock()
+        slot = self._slots.get(user.id)
+        if slot is None:
+            slot = self._slots[user.id] = _UserSlot()
+            recent = self._recent.pop(user.id, None)
+            if recent is not None:
+                slot.last_key, slot.last_at = recent
+
+        key = update_fingerprint(event)
+        if key is not None and self._is_duplicate(slot, key, now):
+            self.collapsed += 1
+            if not slot.users:
+                self._release(user.id, slot, now)
+            if event.callback_query is not None:
+                # Снимаем "часики" с кнопки, хендлер не запускаем
+                try:
+                    await event.callback_query.answer()
+                except Exception as e:
+                    logging.debug(f"Duplicate callback answer failed: {e}")
+            return None
+
+        if key is not None:
+            slot.in_flight.add(key)
+            slot.last_key, slot.last_at = key, now
+        slot.users += 1
+        if slot.lock.locked():
+            self.waited += 1
+        try:
+            async with slot.lock:
+                self.executed += 1
+                return await handler(event, data)
+        finally:
+            slot.users -= 1
+            if key is not None:
+                slot.in_flight.discard(key)
+                if key == slot.last_key:
+                    # Окно отсчитывается от конца выполнения: медленный хендлер не пропускает повтор
+                    slot.last_at = self.clock()
+            if not slot.users:
+                self._release(user.id, slot, self.clock())
+
+    def _release(self, user_id: int, slot: _UserSlot, now: float):
+        """Удалить замок простаивающего пользователя, запомнив последнее нажатие"""
+        self._slots.pop(user_id, None)
+        if slot.last_key is not None and now - slot.last_at < self.window:
+            self._recent[user_id] = (slot.last_key, slot.last_at)
+            self._prune_recent(now)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "active_users": len(self._slots),
+            "executed": self.executed,
+            "collapsed": self.collapsed,
+            "waited": self.waited
+        }
@@ -1,65 +1,218 @@
 """
 Модели данных для бота
+
+Строки таблиц - неизменяемые dataclass на __slots__: без __dict__ на
+экземпляр, создаются прямо из кортежа sqlite3 (row_factory=Model.factory)
+и читаются как dict, поэтому хендлеры с row['x'] / row.get('x') работают
+без изменений. Поля хранятся как их вернул SQLite; даты и JSON разбираются
+только при обращении (timestamp(), Task.requirements_data).
 """
-from dataclasses import dataclass
+import ast
+import json
+import sys
+from dataclasses import dataclass, fields, replace
 from datetime import datetime
-from typing import Optional
+from typing import Any, ClassVar, Dict, FrozenSet, Iterator, Optional, Tuple
+
+
+def row_model(cls):
+    """Сделать класс строкой таблицы: slots + frozen dataclass и список колонок"""
+    cls = dataclass(slots=True, frozen=True)(cls)
+    cls.COLUMNS = tuple(f.name for f in fields(cls))
+    cls.COLUMN_SET = frozenset(cls.COLUMNS)
+    return cls
+
+
+class Row:
+    """Общее поведение строк: чтение как dict, проекция колонок, ленивый разбор дат"""
+    __slots__ = ()
+    COLUMNS: ClassVar[Tuple[str, ...]] = ()
+    COLUMN_SET: ClassVar[FrozenSet[str]] = frozenset()
+
+    @classmethod
+    def factory(cls, cursor, values: tuple):
+        """row_factory для sqlite3: колонки запроса идут в порядке COLUMNS"""
+        return cls(*values)
+
+    @classmethod
+    def projection(cls, alias: str = '') -> str:
+        """Явный список колонок вместо SELECT *"""
+        prefix = f"{alias}." if alias else ''
+        return ', '.join(prefix + name for name in cls.COLUMNS)
+
+    def __getitem__(self, key: str) -> Any:
+        if key not in self.COLUMN_SET:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def __contains__(self, key: object) -> bool:
+        return key in self.COLUMN_SET
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.COLUMNS)
+
+    def __len__(self) -> int:
+        return len(self.COLUMNS)
 
-@dataclass
-class User:
+    def get(self, key: str, default: Any = None) -> Any:
+        return getattr(self, key) if key in self.COLUMN_SET else default
+
+    def keys(self) -> Tuple[str, ...]:
+        return self.COLUMNS
+
+    def items(self):
+        return ((name, getattr(self, name)) for name in self.COLUMNS)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {name: getattr(self, name) for name in self.COLUMNS}
+
+    def replace(self, **changes: Any):
+        """Копия с изменёнными полями (экземпляры разделяются кэшами)"""
+        return replace(self, **changes)
+
+    def timestamp(self, name: str) -> Optional[datetime]:
+        """Разобрать колонку TIMESTAMP/DATE при обращении"""
+        value = getattr(self, name)
+        if not value or isinstance(value, datetime):
+            return value or None
+        try:
+            return datetime.fromisoformat(str(value))
+        except ValueError:
+            return None
+
+    def memory_size(self) -> int:
+        """Байт на строку: сам объект плюс строковые значения (числа и None разделяются)"""
+        return sys.getsizeof(self) + sum(
+            sys.getsizeof(getattr(self, name)) for name in self.COLUMNS
+            if isinstance(getattr(self, name), str)
+        )
+
+
+@row_model
+class User(Row):
     user_id: int
     username: Optional[str] = None
     first_name: Optional[str] = None
     referrer_id: Optional[int] = None
-    registration_date: Optional[datetime] = None
+    registration_date: Optional[str] = None
     subscription_checked: bool = False
-    subscription_date: Optional[datetime] = None
+    subscription_date: Optional[str] = None
     banned: bool = False
     ban_reason: Optional[str] = None
     wallet_address: Optional[str] = None
     total_earnings: float = 0.0
     pending_balance: float = 0.0
+    balance: float = 0.0
     paid_balance: float = 0.0
     captcha_score: float = 0.0
     risk_score: float = 0.0
-    quarantine_until: Optional[datetime] = None
+    quarantine_until: Optional[str] = None
     last_capsule_date: Optional[str] = None
     daily_capsules_opened: int = 0
     total_capsules_opened: int = 0
     total_referrals: int = 0
     validated_referrals: int = 0
+    bonus_capsules: int = 0
+    luck_multiplier: float = 1.0
+    luck_expires: Optional[str] = None
 
-@dataclass 
-class CaptchaSession:
+
+@row_model
+class Task(Row):
+    id: int
+    title: str
+    description: str
+    task_type: str
+    reward_capsules: int = 1
+    partner_name: Optional[str] = None
+    partner_url: Optional[str] = None
+    requirements: Optional[str] = None
+    expires_at: Optional[str] = None
+    starts_at: Optional[str] = None
+    max_completions: Optional[int] = None
+    current_completions: int = 0
+    status: str = 'active'
+    created_at: Optional[str] = None
+
+    @property
+    def requirements_data(self) -> Dict[str, Any]:
+        """Требования задания хранятся строкой (JSON или repr словаря)"""
+        raw = self.requirements
+        if not raw:
+            return {}
+        try:
+            value = json.loads(raw)
+        except (TypeError, ValueError):
+            try:
+                value = ast.literal_eval(raw)
+            except (ValueError, SyntaxError):
+                return {}
+        return value if isinstance(value, dict) else {}
+
+
+@row_model
+class TaskCompletion(Row):
+    """Выполнение задания; поля задания и пользователя - из JOIN, если запрошены"""
+    id: int
+    user_id: int
+    task_id: int
+    completed_at: Optional[str] = None
+    reward_capsules: Optional[int] = None
+    title: Optional[str] = None
+    description: Optional[str] = None
+    partner_name: Optional[str] = None
+    username: Optional[str] = None
+    first_name: Optional[str] = None
+
+
+@row_model
+class WithdrawalRequest(Row):
+    """Заявка на вывод; данные пользователя - из JOIN для админки"""
+    id: int
+    user_id: int
+    amount: float
+    status: str = 'pending'
+    created_at: Optional[str] = None
+    username: Optional[str] = None
+    first_name: Optional[str] = None
+    wallet_address: Optional[str] = None
+    pending_balance: Optional[float] = None
+
+
+@row_model
+class CaptchaSession(Row):
     id: int
     user_id: int
     captcha_value: str
-    start_time: datetime
+    start_time: Optional[str] = None
     solve_time: Optional[float] = None
     solved: bool = False
 
-@dataclass
-class ReferralValidation:
+
+@row_model
+class ReferralValidation(Row):
     id: int
     referrer_id: int
     referred_id: int
-    validation_date: datetime
+    validation_date: Optional[str] = None
     validated: bool = False
     risk_flags: Optional[str] = None
 
-@dataclass
-class CapsuleOpening:
+
+@row_model
+class CapsuleOpening(Row):
     id: int
     user_id: int
     reward_name: str
     reward_amount: float
-    opening_date: datetime
+    opening_date: Optional[str] = None
+
 
-@dataclass
-class Payout:
+@row_model
+class Payout(Row):
     id: int
     user_id: int
     amount: float
     admin_id: int
-    payout_date: datetime
+    payout_date: Optional[str] = None
     notes: Optional[str] = None
@@ -29,7 +29,7 @@ class CapsuleService:
         for reward in rewards:
             cumulative_prob += reward.probability
             if rand <= cumulative_prob:
-                logging.info(f"Capsule opened: {reward.amount} {reward.name} (probability: {reward.probability})")
+                logging.debug(f"Capsule opened: {reward.amount} {reward.name} (probability: {reward.probability})")
                 return reward
         
         # Если по какой-то причине не выбрали награду, возвращаем последнюю
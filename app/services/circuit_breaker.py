@@ -0,0 +1,137 @@
+"""
+Circuit breaker и трекер латентности для внешних API
+"""
+import logging
+import time
+from collections import deque
+from typing import Any, Callable, Dict
+
+logger = logging.getLogger(__name__)
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitBreaker:
+    """Размыкатель по доле ошибок в скользящем окне последних вызовов
+
+    closed    - запросы идут, исходы пишутся в окно;
+    open      - запросы сразу отклоняются, пока не пройдёт open_timeout;
+    half_open - пропускается не больше half_open_max_calls пробных запросов:
+                успех всех проб замыкает цепь, любая ошибка снова размыкает.
+    """
+
+    def __init__(self, name: str, window_size: int = 20, min_calls: int = 10,
+                 failure_rate_threshold: float = 0.5, open_timeout: float = 15.0,
+                 half_open_max_calls: int = 2, clock: Callable[[], float] = time.monotonic):
+        self.name = name
+        self.window_size = window_size
+        self.min_calls = min_calls
+        self.failure_rate_threshold = failure_rate_threshold
+        self.open_timeout = open_timeout
+        self.half_open_max_calls = half_open_max_calls
+        self.clock = clock
+
+        self.state = CLOSED
+        self._window: deque = deque(maxlen=window_size)
+        self._opened_at = 0.0
+        self._probes_in_flight = 0
+        self._probe_successes = 0
+        self.rejected = 0
+        self.times_opened = 0
+
+    @property
+    def failure_rate(self) -> float:
+        if not self._window:
+            return 0.0
+        return self._window.count(False) / len(self._window)
+
+    def allow_request(self) -> bool:
+        """Можно ли выполнять запрос прямо сейчас"""
+        if self.state == OPEN:
+            if self.clock() - self._opened_at < self.open_timeout:
+                self.rejected += 1
+                return False
+            self._transition(HALF_OPEN)
+
+        if self.state == HALF_OPEN:
+            if self._probes_in_flight >= self.half_open_max_calls:
+                self.rejected += 1
+                return False
+            self._probes_in_flight += 1
+
+        return True
+
+    def release_probe(self):
+        """Вернуть слот пробы без исхода: запрос отменён, а не упал"""
+        if self.state == HALF_OPEN:
+            self._probes_in_flight = max(0, self._probes_in_flight - 1)
+
+    def record_success(self):
+        """Записать успешный вызов"""
+        if self.state == HALF_OPEN:
+            self._probes_in_flight = max(0, self._probes_in_flight - 1)
+            self._probe_successes += 1
+            if self._probe_successes >= self.half_open_max_calls:
+                self._transition(CLOSED)
+            return
+        self._window.append(True)
+
+    def record_failure(self):
+        """Записать неудачный вызов"""
+        if self.state == HALF_OPEN:
+            self._transition(OPEN)
+            return
+        if self.state == OPEN:
+            return
+        self._window.append(False)
+        if len(self._window) >= self.min_calls and self.failure_rate >= self.failure_rate_threshold:
+            self._transition(OPEN)
+
+    def _transition(self, state: str):
+        if state == self.state:
+            return
+        logger.warning(f"⚡ Circuit '{self.name}': {self.state} -> {state}")
+        self.state = state
+        self._probes_in_flight = 0
+        self._probe_successes = 0
+        if state == OPEN:
+            self._opened_at = self.clock()
+            self.times_opened += 1
+        elif state == CLOSED:
+            self._window.clear()
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Состояние для health эндпоинтов"""
+        data = {
+            "state": self.state,
+            "failure_rate": round(self.failure_rate, 3),
+            "window_calls": len(self._window),
+            "rejected": self.rejected,
+            "times_opened": self.times_opened
+        }
+        if self.state == OPEN:
+            data["retry_in"] = round(max(0.0, self.open_timeout - (self.clock() - self._opened_at)), 1)
+        return data
+
+
+class LatencyTracker:
+    """Скользящее окно латентностей для оценки перцентилей"""
+
+    def __init__(self, window_size: int = 200):
+        self._samples: deque = deque(maxlen=window_size)
+
+    def __len__(self) -> int:
+        return len(self._samples)
+
+    def record(self, seconds: float):
+        self._samples.append(seconds)
+
+    def percentile(self, pct: float) -> float:
+        """Перцентиль в секундах (0.0, если данных нет)"""
+        if not self._samples:
+            return 0.0
+        ordered = sorted(self._samples)
+        index = min(len(ordered) - 1, int(len(ordered) * pct / 100))
+        return ordered[index]
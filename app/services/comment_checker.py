@@ -11,6 +11,8 @@ from telethon.sessions import StringSession
 from telethon.errors import ChannelPrivateError, FloodWaitError, UserNotParticipantError, AuthKeyDuplicatedError
 from telethon.types import Channel
 
+from app.services.metrics import tracked
+
 class CommentChecker:
     """Сервис для проверки комментариев пользователей в каналах"""
     
@@ -119,6 +121,7 @@ class CommentChecker:
             self.client = None
             return False
     
+    @tracked("telethon")
     async def check_user_comments_in_channel(self, user_id: int, channel_username: str, 
                                            min_comments: int, period_days: int, 
                                            start_date: datetime, min_posts: int = 1) -> Dict[str, Any]:
@@ -175,7 +178,7 @@ class CommentChecker:
                 "meets_requirement": False
             }
         
-        logging.info(f"🔍 Проверяю комментарии user {user_id} в {channel_username} с {start_date} (нужно {min_comments} комментариев на {min_posts} постах)")
+        logging.debug(f"🔍 Проверяю комментарии user {user_id} в {channel_username} с {start_date} (нужно {min_comments} комментариев на {min_posts} постах)")
         
         try:
             # Получаем entity канала
@@ -203,8 +206,8 @@ class CommentChecker:
             comments_count = 0
             posts_with_comments = 0  # Количество постов где пользователь оставил комментарии
             
-            logging.info(f"🔍 Проверяю комментарии user {user_id} в {channel_username} с {start_date} по {search_end}")
-            logging.info(f"🏷️ Тип канала: {type(channel).__name__}, ID: {channel.id}, Title: {getattr(channel, 'title', 'Unknown')}")
+            logging.debug(f"🔍 Проверяю комментарии user {user_id} в {channel_username} с {start_date} по {search_end}")
+            logging.debug(f"🏷️ Тип канала: {type(channel).__name__}, ID: {channel.id}, Title: {getattr(channel, 'title', 'Unknown')}")
             
             posts_checked = 0  # Счетчик проверенных постов
             
@@ -245,21 +248,21 @@ class CommentChecker:
                         if comment.sender_id == user_id and start_date <= comment_date <= search_end:
                             comments_count += 1
                             post_comments_count += 1
-                            logging.info(f"✅ НАЙДЕН комментарий от user {user_id} к посту {message.id} от {comment.date} в {channel_username}!")
+                            logging.debug(f"✅ НАЙДЕН комментарий от user {user_id} к посту {message.id} от {comment.date} в {channel_username}!")
                     
                     logging.debug(f"📊 Пост {message.id}: всего комментариев {comments_found_in_post}, от нашего пользователя {post_comments_count}")
                     
                     # Если пользователь оставил хотя бы один комментарий на этот пост
                     if post_comments_count > 0:
                         posts_with_comments += 1
-                        logging.info(f"📝 User {user_id} прокомментировал пост {message.id} ({post_comments_count} комментариев)")
+                        logging.debug(f"📝 User {user_id} прокомментировал пост {message.id} ({post_comments_count} комментариев)")
                     
                     # Если достигли обоих требований - можно прекратить поиск 
                     if comments_count >= min_comments and posts_with_comments >= min_posts:
                         break
                         
                 except Exception as e:
-                    logging.info(f"⚠️ Ошибка получения комментариев к посту {message.id}: {e}")
+                    logging.debug(f"⚠️ Ошибка получения комментариев к посту {message.id}: {e}")
                     continue
             
             # Проверяем оба условия: количество комментариев И количество постов
@@ -267,11 +270,10 @@ class CommentChecker:
             meets_posts_requirement = posts_with_comments >= min_posts
             meets_requirement = meets_comments_requirement and meets_posts_requirement
             
-            logging.info(f"📊 ИТОГИ для user {user_id} в {channel_username}:")
-            logging.info(f"   🔍 Проверено постов: {posts_checked}")  
-            logging.info(f"   💬 Найдено комментариев: {comments_count} (нужно {min_comments})")
-            logging.info(f"   📝 Постов с комментариями: {posts_with_comments} (нужно {min_posts})")
-            logging.info(f"   ✅ Требования выполнены: {meets_requirement}")
+            # Одна строка итога на проверку, детали - на уровне DEBUG
+            logging.info(f"📊 Comments of user {user_id} in {channel_username}: {comments_count}/{min_comments} "
+                         f"on {posts_with_comments}/{min_posts} posts ({posts_checked} checked), "
+                         f"met={meets_requirement}")
             
             return {
                 "success": True,
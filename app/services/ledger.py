@@ -0,0 +1,30 @@
+"""
+Периодические снимки журнала балансов и сверка материализованных балансов users
+"""
+import asyncio
+import logging
+import os
+
+from app.context import get_db
+
+# Как часто снимать журнал (секунды); снимок инкрементальный, поэтому дешёвый
+LEDGER_SNAPSHOT_INTERVAL = float(os.getenv("LEDGER_SNAPSHOT_INTERVAL", "900"))
+# Чинить разошедшиеся балансы автоматически, а не только сообщать о них
+LEDGER_AUTO_REPAIR = os.getenv("LEDGER_AUTO_REPAIR", "0") == "1"
+
+
+async def ledger_snapshot_loop(interval: float = LEDGER_SNAPSHOT_INTERVAL):
+    """Фоновый цикл снимков журнала"""
+    logging.info(f"Ledger snapshot loop started (every {interval:.0f}s)")
+
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            # SQLite блокирует поток - сверку выполняем вне event loop
+            result = await asyncio.to_thread(get_db().snapshot_ledger, LEDGER_AUTO_REPAIR)
+            logging.info(
+                f"📒 Ledger snapshot: +{result['entries']} entries, {result['users']} users, "
+                f"{len(result['drifted'])} drifted, {result['duration_ms']} ms"
+            )
+        except Exception as e:
+            logging.error(f"Error in ledger snapshot loop: {e}")
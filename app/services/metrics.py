@@ -0,0 +1,246 @@
+"""
+Метрики процесса: HDR-гистограммы латентностей и экспорт в формате Prometheus
+
+Гистограмма log-linear, как HdrHistogram: 16 линейных корзин на каждую
+степень двойки микросекунд (точность ~6%), фиксированный список счётчиков
+на ~530 корзин - запись O(1) без аллокаций, перцентили без хранения выборки.
+
+Внутри апдейта или HTTP-запроса track() дополнительно раскладывает время
+по зависимостям (db, bot_api, telethon, rhombis), остаток считается app.
+"""
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+_SUB_BITS = 5
+_HALF = 1 << (_SUB_BITS - 1)
+_MAX_US = (1 << 36) - 1  # ~19 часов
+_BUCKETS = ((_MAX_US.bit_length() - _SUB_BITS) + 1) * _HALF + _HALF
+
+# Границы le для экспорта в Prometheus, секунды
+EXPORT_BOUNDS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+def _index(us: int) -> int:
+    if us < 2 * _HALF:
+        return us
+    shift = us.bit_length() - _SUB_BITS
+    return (shift << (_SUB_BITS - 1)) + (us >> shift)
+
+
+def _upper_us(index: int) -> int:
+    """Наибольшее значение (мкс), попадающее в корзину"""
+    if index < 2 * _HALF:
+        return index
+    shift = index // _HALF - 1
+    top = _HALF + index % _HALF
+    return ((top + 1) << shift) - 1
+
+
+class Histogram:
+    """Латентности в секундах с перцентилями по корзинам"""
+    __slots__ = ("counts", "count", "sum", "max")
+
+    def __init__(self):
+        self.counts = [0] * _BUCKETS
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def record(self, seconds: float):
+        us = int(seconds * 1_000_000)
+        if us < 0:
+            us = 0
+        elif us > _MAX_US:
+            us = _MAX_US
+        self.counts[_index(us)] += 1
+        self.count += 1
+        self.sum += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def percentile(self, pct: float) -> float:
+        """Перцентиль в секундах (верхняя граница корзины; 0.0 без данных)"""
+        if not self.count:
+            return 0.0
+        target = max(1, int(self.count * pct / 100 + 0.5))
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= target:
+                return min(_upper_us(index) / 1_000_000, self.max)
+        return self.max
+
+    def cumulative(self, bounds: Iterable[float]) -> List[int]:
+        """Сколько значений не больше каждой границы (для бакетов Prometheus)"""
+        result = []
+        seen = 0
+        index = 0
+        for bound in bounds:
+            bound_us = bound * 1_000_000
+            while index < _BUCKETS and _upper_us(index) <= bound_us:
+                seen += self.counts[index]
+                index += 1
+            result.append(seen)
+        return result
+
+
+def _labels(labels: Dict[str, Any]) -> Labels:
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+def _format_labels(labels: Labels, extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = list(labels) + ([extra] if extra else [])
+    if not pairs:
+        return ""
+    escaped = ",".join(
+        '{}="{}"'.format(k, v.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for k, v in pairs
+    )
+    return "{" + escaped + "}"
+
+
+class Metrics:
+    """Реестр гистограмм, счётчиков и коллекторов (значения из других модулей)"""
+
+    def __init__(self):
+        self._histograms: Dict[str, Dict[Labels, Histogram]] = {}
+        self._counters: Dict[str, Dict[Labels, float]] = {}
+        self._help: Dict[str, str] = {}
+        self._collectors: List[Callable[[], Iterable[Tuple[str, Dict[str, Any], float]]]] = []
+
+    def describe(self, name: str, text: str):
+        self._help[name] = text
+
+    def histogram(self, name: str, **labels) -> Histogram:
+        series = self._histograms.setdefault(name, {})
+        key = _labels(labels)
+        histogram = series.get(key)
+        if histogram is None:
+            histogram = series[key] = Histogram()
+        return histogram
+
+    def observe(self, name: str, seconds: float, **labels):
+        self.histogram(name, **labels).record(seconds)
+
+    def inc(self, name: str, value: float = 1, **labels):
+        series = self._counters.setdefault(name, {})
+        key = _labels(labels)
+        series[key] = series.get(key, 0) + value
+
+    def add_collector(self, collector: Callable[[], Iterable[Tuple[str, Dict[str, Any], float]]]):
+        """collector() -> [(имя, метки, значение)] - gauge, снимаемый при экспорте"""
+        self._collectors.append(collector)
+
+    def series(self, name: str) -> List[Tuple[Dict[str, str], Histogram]]:
+        """Все серии гистограммы: (метки, гистограмма)"""
+        return [(dict(labels), histogram) for labels, histogram in self._histograms.get(name, {}).items()]
+
+    def summary(self, name: str) -> Dict[str, Dict[str, float]]:
+        """p50/p99/count по сериям гистограммы (для /healthz и админки)"""
+        return {
+            ",".join(f"{k}={v}" for k, v in labels) or "all": {
+                "count": histogram.count,
+                "p50_ms": round(histogram.percentile(50) * 1000, 2),
+                "p99_ms": round(histogram.percentile(99) * 1000, 2)
+            }
+            for labels, histogram in self._histograms.get(name, {}).items()
+        }
+
+    def render_prometheus(self) -> str:
+        lines: List[str] = []
+        for name, series in sorted(self._counters.items()):
+            if name in self._help:
+                lines.append(f"# HELP {name} {self._help[name]}")
+            lines.append(f"# TYPE {name} counter")
+            for labels, value in series.items():
+                lines.append(f"{name}{_format_labels(labels)} {value}")
+        for name, series in sorted(self._histograms.items()):
+            if name in self._help:
+                lines.append(f"# HELP {name} {self._help[name]}")
+            lines.append(f"# TYPE {name} histogram")
+            for labels, histogram in series.items():
+                for bound, count in zip(EXPORT_BOUNDS, histogram.cumulative(EXPORT_BOUNDS)):
+                    lines.append(f"{name}_bucket{_format_labels(labels, ('le', repr(bound)))} {count}")
+                lines.append(f"{name}_bucket{_format_labels(labels, ('le', '+Inf'))} {histogram.count}")
+                lines.append(f"{name}_sum{_format_labels(labels)} {histogram.sum:.6f}")
+                lines.append(f"{name}_count{_format_labels(labels)} {histogram.count}")
+        gauges: Dict[str, List[str]] = {}
+        for collector in self._collectors:
+            try:
+                samples = list(collector())
+            except Exception:
+                continue
+            for name, labels, value in samples:
+                gauges.setdefault(name, []).append(f"{name}{_format_labels(_labels(labels))} {value}")
+        for name, samples in sorted(gauges.items()):
+            lines.append(f"# TYPE {name} gauge")
+            lines.extend(samples)
+        return "\n".join(lines) + "\n"
+
+
+metrics = Metrics()
+metrics.describe("update_seconds", "Время обработки апдейта бота по хендлеру")
+metrics.describe("update_component_seconds", "Время апдейта по зависимостям (app - собственный код)")
+metrics.describe("http_seconds", "Время HTTP-запроса по маршруту")
+metrics.describe("http_component_seconds", "Время HTTP-запроса по зависимостям")
+metrics.describe("dependency_seconds", "Время одного обращения к зависимости")
+
+# Разбивка текущего апдейта/запроса: компонент -> секунды
+_breakdown: ContextVar[Optional[Dict[str, float]]] = ContextVar("metrics_breakdown", default=None)
+
+
+def charge(component: str, seconds: float):
+    """Засчитать уже измеренное время обращения к зависимости"""
+    metrics.observe("dependency_seconds", seconds, component=component)
+    breakdown = _breakdown.get()
+    if breakdown is not None:
+        breakdown[component] = breakdown.get(component, 0.0) + seconds
+
+
+@contextmanager
+def track(component: str):
+    """Засчитать время блока зависимости (db, bot_api, telethon, rhombis)"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        charge(component, time.perf_counter() - started)
+
+
+def tracked(component: str):
+    """Декоратор async-функции: всё её время - время зависимости"""
+    def decorator(func):
+        @wraps(func)
+        async def wrapper(*args, **kwargs):
+            with track(component):
+                return await func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+@contextmanager
+def request_scope(kind: str, **labels):
+    """Область апдейта/запроса: общее время и разбивка по зависимостям
+
+    kind: update | http. Метки можно дополнить внутри блока (например,
+    имя хендлера известно только после фильтров).
+    """
+    breakdown: Dict[str, float] = {}
+    token = _breakdown.set(breakdown)
+    started = time.perf_counter()
+    try:
+        yield labels
+    finally:
+        elapsed = time.perf_counter() - started
+        _breakdown.reset(token)
+        metrics.observe(f"{kind}_seconds", elapsed, **labels)
+        own = elapsed
+        for component, seconds in breakdown.items():
+            metrics.observe(f"{kind}_component_seconds", seconds, component=component, **labels)
+            own -= seconds
+        metrics.observe(f"{kind}_component_seconds", max(0.0, own), component="app", **labels)
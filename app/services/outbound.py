@@ -0,0 +1,222 @@
+"""
+Планировщик исходящих сообщений Bot API: лимиты Telegram и приоритеты
+
+Подключается middleware сессии Bot, поэтому через него идут все отправки:
+ответы хендлеров, уведомления валидатора, алерты админам и рассылки.
+Сообщение сначала ждёт свой чат (1 msg/s в личке, 20 msg/min в группе),
+затем глобальный слот (~30 msg/s на бота, при WORKERS > 0 - доля
+процесса), который выдаётся по приоритету:
+ответы пользователю раньше уведомлений, уведомления раньше рассылок.
+На 429 RetryAfter отправка приостанавливается целиком и запрос повторяется.
+"""
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from contextlib import contextmanager
+from contextvars import Context, ContextVar
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set, Tuple, Union
+
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.exceptions import TelegramRetryAfter
+
+from app.services.circuit_breaker import LatencyTracker
+from app.services.rate_limiter import RatePolicy, TokenBucketLimiter
+
+INTERACTIVE = 0
+NOTIFICATION = 1
+BULK = 2
+PRIORITY_NAMES = {INTERACTIVE: "interactive", NOTIFICATION: "notification", BULK: "bulk"}
+
+GLOBAL_POLICY = RatePolicy(rate=30.0, burst=30)
+PRIVATE_CHAT_POLICY = RatePolicy(rate=1.0, burst=3)
+GROUP_CHAT_POLICY = RatePolicy.per_minute(20, burst=3)
+
+# Методы, которые Telegram считает сообщениями в чат
+_LIMITED_PREFIXES = ("send", "copy", "forward", "edit")
+_UNLIMITED_METHODS = frozenset({"sendChatAction"})
+
+_priority: ContextVar[int] = ContextVar("outbound_priority", default=INTERACTIVE)
+# Рассылки в фоне: ссылки держим до завершения, иначе задачу может собрать GC
+_broadcasts: Set[asyncio.Task] = set()
+
+
+@contextmanager
+def outbound_priority(priority: int):
+    """Приоритет отправок внутри блока (по умолчанию INTERACTIVE)"""
+    token = _priority.set(priority)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+def bulk_sending():
+    """Рассылки: пропускают вперёд ответы пользователям"""
+    return outbound_priority(BULK)
+
+
+def start_broadcast(job: Awaitable[Any], name: str) -> asyncio.Task:
+    """Запустить рассылку отдельной задачей с приоритетом BULK
+
+    Хендлер отвечает сразу: рассылка на 30 msg/s идёт минутами, и всё это
+    время UserSerialMiddleware держал бы очередь апдейтов админа. Задача
+    стартует в чистом контексте - без области метрик и кэша апдейта.
+    """
+    async def run():
+        with bulk_sending():
+            try:
+                await job
+            except Exception as e:
+                logging.error(f"❌ Broadcast {name} failed: {e}")
+
+    task = Context().run(asyncio.create_task, run())
+    _broadcasts.add(task)
+    task.add_done_callback(_broadcasts.discard)
+    logging.info(f"📢 Broadcast {name} started in background")
+    return task
+
+
+def running_broadcasts() -> int:
+    """Сколько рассылок сейчас идёт"""
+    return len(_broadcasts)
+
+
+def process_global_policy(workers: int) -> RatePolicy:
+    """Доля глобального лимита одного процесса
+
+    Лимит Telegram общий на бота, а бакет у каждого процесса свой. При
+    WORKERS > 0 отправляют все воркеры и ingress (TMA API), поэтому
+    30 msg/s делятся на WORKERS + 1 процесс.
+    """
+    if workers <= 0:
+        return GLOBAL_POLICY
+    processes = workers + 1
+    return RatePolicy(rate=GLOBAL_POLICY.rate / processes, burst=max(1, GLOBAL_POLICY.burst // processes))
+
+
+def _is_group(chat_id: Union[int, str]) -> bool:
+    return not isinstance(chat_id, int) or chat_id < 0
+
+
+class OutboundScheduler(BaseRequestMiddleware):
+    """Request middleware сессии Bot: очередь с приоритетами поверх token bucket'ов"""
+
+    def __init__(self, global_policy: RatePolicy = GLOBAL_POLICY,
+                 chat_policy: RatePolicy = PRIVATE_CHAT_POLICY,
+                 group_policy: RatePolicy = GROUP_CHAT_POLICY,
+                 max_bulk_pending: int = 200, max_retries: int = 3,
+                 clock: Callable[[], float] = time.monotonic):
+        self.clock = clock
+        self.max_retries = max_retries
+        self.max_bulk_pending = max_bulk_pending
+        self._global = TokenBucketLimiter("global", global_policy, clock)
+        self._chats = TokenBucketLimiter("chat", chat_policy, clock)
+        self._groups = TokenBucketLimiter("group", group_policy, clock)
+        # (приоритет, порядковый номер, future ожидающего глобальный слот)
+        self._heap: List[Tuple[int, int, asyncio.Future]] = []
+        self._seq = itertools.count()
+        self._pump: Optional[asyncio.Task] = None
+        self._bulk_slots: Optional[asyncio.Semaphore] = None
+        self._paused_until = 0.0
+        self._depth = {priority: 0 for priority in PRIORITY_NAMES}
+        self._latency = {priority: LatencyTracker(500) for priority in PRIORITY_NAMES}
+        self.sent = 0
+        self.retry_after = 0
+        self.chat_delayed = 0
+
+    async def __call__(self, make_request, bot, method):
+        api_method = getattr(method, "__api_method__", "")
+        if not api_method.startswith(_LIMITED_PREFIXES) or api_method in _UNLIMITED_METHODS:
+            return await make_request(bot, method)
+
+        priority = _priority.get()
+        chat_id = getattr(method, "chat_id", None)
+        started = self.clock()
+        if priority == BULK:
+            # Обратное давление: рассылка ждёт, пока очередь не разгрузится
+            if self._bulk_slots is None:
+                self._bulk_slots = asyncio.Semaphore(self.max_bulk_pending)
+            await self._bulk_slots.acquire()
+        try:
+            for attempt in range(self.max_retries + 1):
+                await self._acquire(priority, chat_id)
+                try:
+                    result = await make_request(bot, method)
+                except TelegramRetryAfter as e:
+                    self.retry_after += 1
+                    self._paused_until = max(self._paused_until, self.clock() + e.retry_after)
+                    logging.warning(f"⚠️ Telegram flood control: pausing sends for {e.retry_after}s "
+                                    f"({api_method}, attempt {attempt + 1})")
+                    if attempt == self.max_retries:
+                        raise
+                    continue
+                self.sent += 1
+                self._latency[priority].record(self.clock() - started)
+                return result
+        finally:
+            if priority == BULK:
+                self._bulk_slots.release()
+
+    async def _acquire(self, priority: int, chat_id: Any):
+        if chat_id is not None:
+            limiter = self._groups if _is_group(chat_id) else self._chats
+            delay = limiter.reserve(chat_id)
+            if delay > 0:
+                self.chat_delayed += 1
+                await asyncio.sleep(delay)
+
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        entry = (priority, next(self._seq), future)
+        heapq.heappush(self._heap, entry)
+        self._depth[priority] += 1
+        if self._pump is None or self._pump.done():
+            self._pump = loop.create_task(self._run_pump())
+        try:
+            await future
+        except asyncio.CancelledError:
+            # Отправитель ушёл (клиент отключился, остановка): в очереди остаются только живые
+            if future.cancelled():
+                self._heap.remove(entry)
+                heapq.heapify(self._heap)
+                self._depth[priority] -= 1
+            raise
+
+    async def _run_pump(self):
+        """Выдаёт глобальные слоты по одному, всегда самому приоритетному
+
+        Токен списывается только вместе с выдачей слота живому ожидающему:
+        hit() без свободного токена ничего не занимает, а между ним и
+        heappop нет await, так что отменённые к этому моменту уже убраны.
+        """
+        while self._heap:
+            pause = self._paused_until - self.clock()
+            if pause > 0:
+                await asyncio.sleep(pause)
+                continue
+            allowed, retry_after = self._global.hit("global")
+            if not allowed:
+                await asyncio.sleep(retry_after)
+                continue
+            priority, _, future = heapq.heappop(self._heap)
+            self._depth[priority] -= 1
+            future.set_result(None)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "sent": self.sent,
+            "retry_after": self.retry_after,
+            "chat_delayed": self.chat_delayed,
+            "paused_for": round(max(0.0, self._paused_until - self.clock()), 1),
+            "broadcasts": running_broadcasts(),
+            "queue": {PRIORITY_NAMES[p]: depth for p, depth in self._depth.items()},
+            "latency_ms": {
+                PRIORITY_NAMES[p]: {
+                    "p50": round(tracker.percentile(50) * 1000, 1),
+                    "p99": round(tracker.percentile(99) * 1000, 1)
+                }
+                for p, tracker in self._latency.items()
+            }
+        }
@@ -0,0 +1,30 @@
+"""
+Пакетные выплаты: выгрузка батча переводов SC на TON кошельки
+"""
+import csv
+import io
+from datetime import datetime
+from typing import Any, Dict, List
+
+
+def build_ton_batch(payouts: List[Dict[str, Any]]) -> bytes:
+    """CSV для массовой отправки (address,amount,comment), по строке на заявку
+
+    Формат принимают TON мультисенды: комментарий с номером заявки позволяет
+    сверить входящие переводы с withdrawal_requests.
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator="\n")
+    writer.writerow(["address", "amount", "comment"])
+    for payout in payouts:
+        writer.writerow([
+            payout["wallet_address"],
+            f"{payout['amount']:.9f}".rstrip("0").rstrip("."),
+            f"SC withdrawal #{payout['request_id']}"
+        ])
+    return buffer.getvalue().encode("utf-8")
+
+
+def ton_batch_filename(now: datetime | None = None) -> str:
+    """Имя файла батча"""
+    return f"ton_payouts_{(now or datetime.now()).strftime('%Y%m%d_%H%M%S')}.csv"
@@ -0,0 +1,82 @@
+"""
+Семплирующий профайлер event loop: стеки в формате collapsed (flamegraph.pl, speedscope)
+
+Включается админ-командой /profile. Фоновый поток раз в interval снимает
+стек потока event loop через sys._current_frames() - сам loop не
+инструментируется, накладные расходы только на время семплирования.
+"""
+import logging
+import sys
+import threading
+import time
+from collections import Counter
+from typing import Any, Dict, Optional
+
+
+def _frame_name(frame) -> str:
+    # Без номера строки: одна функция - один узел flamegraph
+    return f"{frame.f_globals.get('__name__', '?')}:{frame.f_code.co_name}"
+
+
+class SamplingProfiler:
+    """Семплирует один поток (по умолчанию тот, что вызвал start())"""
+
+    def __init__(self, interval: float = 0.005, max_depth: int = 128):
+        self.interval = interval
+        self.max_depth = max_depth
+        self._stacks: Counter = Counter()
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self._target: Optional[int] = None
+        self.started_at = 0.0
+        self.samples = 0
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None
+
+    def start(self, thread_id: Optional[int] = None):
+        if self._thread is not None:
+            return
+        self._target = thread_id or threading.get_ident()
+        self._stacks = Counter()
+        self.samples = 0
+        self.started_at = time.monotonic()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+        self._thread.start()
+        logging.info(f"🔬 Sampling profiler started ({self.interval * 1000:.0f} ms interval)")
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self._target)
+            if frame is None:
+                continue
+            names = []
+            while frame is not None and len(names) < self.max_depth:
+                names.append(_frame_name(frame))
+                frame = frame.f_back
+            names.reverse()
+            self._stacks[";".join(names)] += 1
+            self.samples += 1
+
+    def stop(self) -> str:
+        """Остановить и вернуть стеки в collapsed-формате ("a;b;c count" на строку)"""
+        if self._thread is None:
+            return ""
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+        logging.info(f"🔬 Sampling profiler stopped: {self.samples} samples, "
+                     f"{time.monotonic() - self.started_at:.1f}s")
+        return "\n".join(f"{stack} {count}" for stack, count in self._stacks.most_common()) + "\n"
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "running": self.running,
+            "samples": self.samples,
+            "seconds": round(time.monotonic() - self.started_at, 1) if self.running else 0
+        }
+
+
+profiler = SamplingProfiler()
@@ -0,0 +1,261 @@
+"""
+Трассировка SQL: время и отпечаток каждого запроса, журнал медленных запросов
+
+Database.get_connection() открывает соединения с factory=TracedConnection,
+поэтому учитываются и методы Database, и код, работающий с соединением
+напрямую (чекины, админка, валидатор). Время запроса - execute() плюс
+все fetch*() до следующего execute() на том же курсоре или закрытия
+соединения. Запросы нормализуются в отпечаток: литералы и списки IN (?, ?)
+сворачиваются, так что "WHERE user_id = 5" и "= 7" - одна строка статистики.
+
+Для запросов дольше SLOW_QUERY_MS в лог пишется EXPLAIN QUERY PLAN
+(не чаще раза в EXPLAIN_INTERVAL секунд на отпечаток).
+"""
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional
+
+from app.services.metrics import Histogram, charge
+
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", "100"))
+EXPLAIN_INTERVAL = 300.0
+
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_NUMBER = re.compile(r"\b\d+(?:\.\d+)?\b")
+_SPACE = re.compile(r"\s+")
+_IN_LIST = re.compile(r"\bIN\s*\(\s*\?(?:\s*,\s*\?)+\s*\)", re.IGNORECASE)
+_EXPLAINABLE = ("SELECT", "INSERT", "UPDATE", "DELETE", "REPLACE", "WITH")
+
+# Текст запроса -> отпечаток; тексты в коде почти всегда константы
+_fingerprints: Dict[str, str] = {}
+_FINGERPRINT_CACHE_SIZE = 4096
+
+
+def fingerprint(sql: str) -> str:
+    """Нормализованный запрос: без литералов, пробелы схлопнуты"""
+    cached = _fingerprints.get(sql)
+    if cached is not None:
+        return cached
+    normalized = _STRING.sub("?", sql)
+    normalized = _NUMBER.sub("?", normalized)
+    normalized = _SPACE.sub(" ", normalized).strip().rstrip(";")
+    normalized = _IN_LIST.sub("IN (?, ...)", normalized)
+    if len(_fingerprints) >= _FINGERPRINT_CACHE_SIZE:
+        _fingerprints.clear()
+    _fingerprints[sql] = normalized
+    return normalized
+
+
+class QueryStats:
+    """Статистика одного отпечатка"""
+    __slots__ = ("fingerprint", "latency", "rows", "slow", "plan")
+
+    def __init__(self, fingerprint: str):
+        self.fingerprint = fingerprint
+        self.latency = Histogram()
+        self.rows = 0
+        self.slow = 0
+        self.plan: Optional[List[str]] = None
+
+    def to_dict(self) -> Dict[str, Any]:
+        latency = self.latency
+        return {
+            "query": self.fingerprint,
+            "calls": latency.count,
+            "total_ms": round(latency.sum * 1000, 1),
+            "p50_ms": round(latency.percentile(50) * 1000, 2),
+            "p99_ms": round(latency.percentile(99) * 1000, 2),
+            "max_ms": round(latency.max * 1000, 2),
+            "rows": self.rows,
+            "slow": self.slow,
+            "plan": self.plan
+        }
+
+
+class QueryTracer:
+    """Сводка по отпечаткам; запись из любых потоков (Database зовут и через to_thread)"""
+
+    def __init__(self, slow_ms: float = SLOW_QUERY_MS, explain_interval: float = EXPLAIN_INTERVAL,
+                 slow_log_size: int = 50):
+        self.slow_seconds = slow_ms / 1000
+        self.explain_interval = explain_interval
+        self._lock = threading.Lock()
+        self._stats: Dict[str, QueryStats] = {}
+        self._explained_at: Dict[str, float] = {}
+        self.slow_log: Deque[Dict[str, Any]] = deque(maxlen=slow_log_size)
+
+    def record(self, conn: sqlite3.Connection, sql: str, params: Any, seconds: float, rows: int):
+        key = fingerprint(sql)
+        with self._lock:
+            stats = self._stats.get(key)
+            if stats is None:
+                stats = self._stats[key] = QueryStats(key)
+            stats.latency.record(seconds)
+            stats.rows += rows
+            if seconds >= self.slow_seconds:
+                stats.slow += 1
+        charge("db", seconds)
+        if seconds >= self.slow_seconds:
+            self._log_slow(conn, stats, sql, params, seconds)
+
+    def _log_slow(self, conn: sqlite3.Connection, stats: QueryStats, sql: str, params: Any, seconds: float):
+        now = time.monotonic()
+        plan = None
+        explain = params is not None and sql.lstrip()[:7].upper().startswith(_EXPLAINABLE)
+        if explain:
+            # Проверка интервала и его захват - атомарно: из параллельных потоков EXPLAIN делает один
+            with self._lock:
+                last = self._explained_at.get(stats.fingerprint, -self.explain_interval)
+                explain = now - last >= self.explain_interval
+                if explain:
+                    self._explained_at[stats.fingerprint] = now
+        if explain:
+            try:
+                # Базовый курсор: сам EXPLAIN в статистику не попадает; выполняется вне замка
+                cursor = conn.cursor(sqlite3.Cursor)
+                plan = [row[3] for row in cursor.execute(f"EXPLAIN QUERY PLAN {sql}", params).fetchall()]
+            except sqlite3.Error as e:
+                logging.debug(f"EXPLAIN failed for slow query: {e}")
+        with self._lock:
+            if plan:
+                stats.plan = plan
+            self.slow_log.append({
+                "at": time.time(),
+                "ms": round(seconds * 1000, 1),
+                "query": stats.fingerprint,
+                "plan": plan or stats.plan
+            })
+        logging.warning(f"🐢 Slow query {seconds * 1000:.0f} ms: {stats.fingerprint[:300]}"
+                        + (f" | plan: {'; '.join(plan)}" if plan else ""))
+
+    def top(self, limit: int = 10, order_by: str = "total_ms") -> List[Dict[str, Any]]:
+        with self._lock:
+            rows = [stats.to_dict() for stats in self._stats.values()]
+        rows.sort(key=lambda row: row[order_by], reverse=True)
+        return rows[:limit]
+
+    def reset(self):
+        with self._lock:
+            self._stats.clear()
+            self._explained_at.clear()
+            self.slow_log.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "fingerprints": len(self._stats),
+                "calls": sum(stats.latency.count for stats in self._stats.values()),
+                "slow": sum(stats.slow for stats in self._stats.values()),
+                "slow_threshold_ms": round(self.slow_seconds * 1000, 1)
+            }
+
+
+query_tracer = QueryTracer()
+
+
+class TracedCursor(sqlite3.Cursor):
+    """Курсор, засекающий execute() и последующие fetch*()"""
+
+    def __init__(self, connection: 'TracedConnection'):
+        super().__init__(connection)
+        # [sql, параметры, секунды, строки] запроса, который ещё читается
+        self._pending: Optional[list] = None
+
+    def _start(self, sql: str, params: Any, run):
+        self._finish()
+        started = time.perf_counter()
+        try:
+            return run()
+        finally:
+            self._pending = [sql, params, time.perf_counter() - started, 0]
+            self.connection._reading.add(self)
+
+    def _finish(self):
+        pending = self._pending
+        if pending is None:
+            return
+        self._pending = None
+        self.connection._reading.discard(self)
+        sql, params, seconds, rows = pending
+        if not rows and self.rowcount > 0:
+            rows = self.rowcount  # затронутые строки для INSERT/UPDATE/DELETE
+        self.connection.tracer.record(self.connection, sql, params, seconds, rows)
+
+    def _fetched(self, started: float, rows: int):
+        if self._pending is not None:
+            self._pending[2] += time.perf_counter() - started
+            self._pending[3] += rows
+
+    def execute(self, sql, parameters=()):
+        return self._start(sql, parameters, lambda: super(TracedCursor, self).execute(sql, parameters))
+
+    def executemany(self, sql, seq_of_parameters):
+        # Параметры executemany бывают генератором - для EXPLAIN не годятся
+        return self._start(sql, None, lambda: super(TracedCursor, self).executemany(sql, seq_of_parameters))
+
+    def executescript(self, sql_script):
+        return self._start(sql_script, None, lambda: super(TracedCursor, self).executescript(sql_script))
+
+    def fetchone(self):
+        started = time.perf_counter()
+        row = super().fetchone()
+        self._fetched(started, row is not None)
+        return row
+
+    def fetchmany(self, size=None):
+        started = time.perf_counter()
+        rows = super().fetchmany(self.arraysize if size is None else size)
+        self._fetched(started, len(rows))
+        return rows
+
+    def fetchall(self):
+        started = time.perf_counter()
+        rows = super().fetchall()
+        self._fetched(started, len(rows))
+        return rows
+
+    def close(self):
+        self._finish()
+        super().close()
+
+
+class TracedConnection(sqlite3.Connection):
+    """Соединение, все курсоры которого - TracedCursor"""
+
+    tracer = query_tracer
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._reading = set()
+
+    def cursor(self, factory=None):
+        return super().cursor(factory or TracedCursor)
+
+    # Connection.execute() в CPython создаёт базовый курсор в обход cursor()
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+    def executescript(self, sql_script):
+        return self.cursor().executescript(sql_script)
+
+    def commit(self):
+        if not self.in_transaction:
+            return super().commit()
+        started = time.perf_counter()
+        try:
+            super().commit()
+        finally:
+            self.tracer.record(self, "COMMIT", None, time.perf_counter() - started, 0)
+
+    def close(self):
+        for cursor in list(self._reading):
+            cursor._finish()
+        super().close()
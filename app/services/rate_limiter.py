@@ -0,0 +1,137 @@
+"""
+Token bucket лимитер для миллионов ключей (пользователи, IP)
+
+Каждый бакет хранится одним числом - моментом, когда он снова станет полным
+(GCRA, эквивалент token bucket). Полный бакет ничем не отличается от
+отсутствующего, поэтому ключи живут в двух поколениях: раз в окно (время
+наполнения пустого бакета) старое поколение выбрасывается целиком, и в
+памяти остаются только ключи, активные за последние два окна.
+"""
+import time
+from dataclasses import dataclass
+from typing import Callable, Dict, Hashable, Tuple
+
+
+@dataclass(frozen=True)
+class RatePolicy:
+    """rate токенов в секунду, не больше burst подряд"""
+    rate: float
+    burst: int
+
+    @classmethod
+    def per_minute(cls, count: float, burst: int) -> 'RatePolicy':
+        return cls(rate=count / 60.0, burst=burst)
+
+    @property
+    def interval(self) -> float:
+        """Стоимость одного запроса в секундах"""
+        return 1.0 / self.rate
+
+    @property
+    def window(self) -> float:
+        """За сколько пустой бакет наполняется до burst"""
+        return self.burst / self.rate
+
+
+class TokenBucketLimiter:
+    """Лимитер одной политики; allow() - O(1) без аллокаций, кроме нового ключа"""
+
+    def __init__(self, name: str, policy: RatePolicy, clock: Callable[[], float] = time.monotonic):
+        self.name = name
+        self.policy = policy
+        self.clock = clock
+        self._interval = policy.interval
+        self._window = policy.window
+        # ключ -> момент, когда бакет снова полон (theoretical arrival time)
+        self._current: Dict[Hashable, float] = {}
+        self._previous: Dict[Hashable, float] = {}
+        self._rotated_at = clock()
+        # reserve() бронирует токены дальше окна - такие ключи нельзя выбрасывать при ротации
+        self._overbooked = False
+        self.allowed = 0
+        self.throttled = 0
+
+    def _rotate(self, now: float):
+        # Записи старого поколения старше окна: их бакеты уже полны
+        if now - self._rotated_at >= 2 * self._window:
+            dropped = (self._previous, self._current)
+            self._previous = {}
+        else:
+            dropped = (self._previous,)
+            self._previous = self._current
+        self._current = {}
+        self._rotated_at = now
+        if self._overbooked:
+            for generation in dropped:
+                for key, tat in generation.items():
+                    if tat > now:
+                        self._current[key] = tat
+            self._overbooked = bool(self._current)
+
+    def hit(self, key: Hashable, cost: float = 1.0) -> Tuple[bool, float]:
+        """Списать cost токенов; (разрешено, через сколько секунд повторить)"""
+        now = self.clock()
+        if now - self._rotated_at >= self._window:
+            self._rotate(now)
+
+        tat = self._current.get(key)
+        if tat is None:
+            tat = self._previous.pop(key, now)
+        if tat < now:
+            tat = now
+        new_tat = tat + self._interval * cost
+        excess = new_tat - now - self._window
+        if excess > 1e-9:
+            self.throttled += 1
+            if tat > now:
+                self._current[key] = tat
+            return False, excess
+        self._current[key] = new_tat
+        self.allowed += 1
+        return True, 0.0
+
+    def reserve(self, key: Hashable, cost: float = 1.0) -> float:
+        """Занять cost токенов в очередь: через сколько секунд их можно тратить"""
+        now = self.clock()
+        if now - self._rotated_at >= self._window:
+            self._rotate(now)
+
+        tat = self._current.get(key)
+        if tat is None:
+            tat = self._previous.pop(key, now)
+        new_tat = max(tat, now) + self._interval * cost
+        self._current[key] = new_tat
+        self.allowed += 1
+        delay = new_tat - now - self._window
+        if delay > 1e-9:  # как в hit(): погрешность float при больших значениях часов
+            self._overbooked = True
+            return delay
+        return 0.0
+
+    def allow(self, key: Hashable, cost: float = 1.0) -> bool:
+        return self.hit(key, cost)[0]
+
+    def __len__(self) -> int:
+        return len(self._current) + len(self._previous)
+
+    def stats(self) -> Dict[str, float]:
+        return {
+            "rate": self.policy.rate,
+            "burst": self.policy.burst,
+            "keys": len(self),
+            "allowed": self.allowed,
+            "throttled": self.throttled
+        }
+
+
+class RateLimiterRegistry:
+    """Лимитеры по именам политик"""
+
+    def __init__(self, policies: Dict[str, RatePolicy], clock: Callable[[], float] = time.monotonic):
+        self.limiters = {name: TokenBucketLimiter(name, policy, clock) for name, policy in policies.items()}
+
+    def hit(self, policy: str, key: Hashable, cost: float = 1.0) -> Tuple[bool, float]:
+        return self.limiters[policy].hit(key, cost)
+
+    def stats(self) -> Dict[str, Dict[str, float]]:
+        return {name: limiter.stats() for name, limiter in self.limiters.items()}
@@ -8,15 +8,69 @@ import logging
 from typing import Dict, List, Optional, Any
 from datetime import datetime
 import os
+import time
+
+from app.services.circuit_breaker import CircuitBreaker, LatencyTracker
+from app.services.metrics import track
+from app.utils.cache import TTLCache
 
 logger = logging.getLogger(__name__)
 
+RHOMBIS_API_BASE = os.getenv("RHOMBIS_API_BASE", "https://api.rhombis.app").rstrip("/")
+
+# Пул соединений: keep-alive + кэш DNS, чтобы не делать TLS handshake на каждую покупку
+CONNECTOR_LIMIT = 64
+CONNECTOR_LIMIT_PER_HOST = 32
+DNS_CACHE_TTL = 300
+KEEPALIVE_TIMEOUT = 30
+
+# Таймауты по эндпоинтам: поиск получателя должен быть быстрым, транзакции - дольше
+DEFAULT_TIMEOUT = aiohttp.ClientTimeout(total=30, connect=5)
+ENDPOINT_TIMEOUTS = {
+    "/stars/recipient": aiohttp.ClientTimeout(total=5, connect=2),
+    "/premium/recipient": aiohttp.ClientTimeout(total=5, connect=2),
+    "/stars/transaction": aiohttp.ClientTimeout(total=15, connect=3),
+    "/premium/transaction": aiohttp.ClientTimeout(total=15, connect=3),
+}
+
+# Кэш получателей: найденные живут долго, "не найден" - недолго (username могут занять)
+RECIPIENT_CACHE_SIZE = 20000
+RECIPIENT_TTL = 600
+RECIPIENT_NEGATIVE_TTL = 30
+
+# Хеджирование идемпотентных GET: второй запрос, если первый дольше p95
+HEDGE_REQUESTS = os.getenv("RHOMBIS_HEDGE_REQUESTS", "1") == "1"
+HEDGE_MIN_SAMPLES = 20
+HEDGE_MIN_DELAY = 0.05
+
+def _is_upstream_failure(result: Dict[str, Any]) -> bool:
+    """Ошибка самого Rhombis (таймаут, сеть, 5xx), а не ответ на плохой запрос"""
+    if result.get("success"):
+        return False
+    status = result.get("status")
+    return status is None or status >= 500
+
+def _recipient_ttl(result: Dict[str, Any]) -> Optional[float]:
+    """TTL для ответа /recipient: сетевые ошибки и 5xx не кэшируем"""
+    if result.get("success"):
+        return RECIPIENT_TTL
+    if result.get("status") in (400, 404):
+        return RECIPIENT_NEGATIVE_TTL
+    return None
+
 class RhombisStarsAPI:
-    """Клиент для работы с Rhombis Stars API"""
+    """Клиент для работы с Rhombis Stars API (одна общая сессия на всё приложение)"""
     
-    def __init__(self):
-        self.base_url = "https://api.rhombis.app"
-        self.session = None
+    def __init__(self, base_url: Optional[str] = None, breaker: Optional[CircuitBreaker] = None,
+                 hedge_requests: bool = HEDGE_REQUESTS):
+        self.base_url = (base_url or RHOMBIS_API_BASE).rstrip("/")
+        self.session: Optional[aiohttp.ClientSession] = None
+        self.recipient_cache = TTLCache(maxsize=RECIPIENT_CACHE_SIZE, ttl=RECIPIENT_TTL)
+        self.breaker = breaker or CircuitBreaker("rhombis")
+        self.hedge_requests = hedge_requests
+        self.get_latency = LatencyTracker()
+        self.hedged = 0
+        self.hedge_wins = 0
     
     async def _get_session(self) -> aiohttp.ClientSession:
         """Получить HTTP сессию"""
@@ -25,31 +79,160 @@ class RhombisStarsAPI:
                 "Content-Type": "application/json",
                 "User-Agent": "SC-Referral-Bot/1.0"
             }
-            self.session = aiohttp.ClientSession(headers=headers)
+            connector = aiohttp.TCPConnector(
+                limit=CONNECTOR_LIMIT,
+                limit_per_host=CONNECTOR_LIMIT_PER_HOST,
+                ttl_dns_cache=DNS_CACHE_TTL,
+                keepalive_timeout=KEEPALIVE_TIMEOUT,
+            )
+            self.session = aiohttp.ClientSession(
+                headers=headers,
+                connector=connector,
+                timeout=DEFAULT_TIMEOUT
+            )
         return self.session
     
-    async def _request(self, method: str, endpoint: str, data: Dict = None) -> Dict[str, Any]:
-        """Базовый запрос к Rhombis API"""
+    def _timeout_for(self, endpoint: str) -> aiohttp.ClientTimeout:
+        """Таймаут для конкретного эндпоинта"""
+        return ENDPOINT_TIMEOUTS.get(endpoint.split("?", 1)[0], DEFAULT_TIMEOUT)
+    
+    async def _request(self, method: str, endpoint: str, data: Dict = None,
+                       params: Dict = None) -> Dict[str, Any]:
+        """Базовый запрос к Rhombis API через circuit breaker"""
+        if not self.breaker.allow_request():
+            return {
+                "success": False,
+                "error": "Rhombis API temporarily unavailable",
+                "status": None,
+                "circuit_open": True
+            }
+        
+        # Слот пробы в half_open освобождается при любом исходе, иначе цепь не замкнётся
+        try:
+            if method == "GET" and self.hedge_requests:
+                result = await self._hedged_send(endpoint, params)
+            else:
+                result = await self._send(method, endpoint, data, params)
+        except asyncio.CancelledError:
+            self.breaker.release_probe()
+            raise
+        except Exception:
+            self.breaker.record_failure()
+            raise
+        
+        if _is_upstream_failure(result):
+            self.breaker.record_failure()
+        else:
+            self.breaker.record_success()
+        return result
+    
+    def _hedge_delay(self) -> Optional[float]:
+        """Задержка перед хеджирующим запросом (None - мало данных о латентности)"""
+        if len(self.get_latency) < HEDGE_MIN_SAMPLES:
+            return None
+        return max(HEDGE_MIN_DELAY, self.get_latency.percentile(95))
+    
+    async def _hedged_send(self, endpoint: str, params: Dict = None) -> Dict[str, Any]:
+        """GET с дублирующим запросом, если первый не уложился в p95"""
+        primary = asyncio.create_task(self._send("GET", endpoint, params=params))
+        pending = {primary}
+        result: Dict[str, Any] = {}
+        # Вызывающего отменили (тайм-аут bootstrap, отключение) - запросы в полёте снимаются на любой фазе
+        try:
+            delay = self._hedge_delay()
+            if delay is None:
+                return await primary
+            
+            done, _ = await asyncio.wait(pending, timeout=delay)
+            if done:
+                return primary.result()
+            
+            self.hedged += 1
+            hedge = asyncio.create_task(self._send("GET", endpoint, params=params))
+            pending = {primary, hedge}
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    result = task.result()
+                    if not _is_upstream_failure(result):
+                        if task is hedge:
+                            self.hedge_wins += 1
+                        return result
+            return result
+        finally:
+            for task in pending:
+                task.cancel()
+    
+    async def _send(self, method: str, endpoint: str, data: Dict = None,
+                    params: Dict = None) -> Dict[str, Any]:
+        """Один HTTP запрос к Rhombis API"""
+        with track("rhombis"):
+            return await self._send_once(method, endpoint, data, params)
+    
+    async def _send_once(self, method: str, endpoint: str, data: Dict = None,
+                         params: Dict = None) -> Dict[str, Any]:
         session = await self._get_session()
         url = f"{self.base_url}{endpoint}"
+        started = time.monotonic()
         
         try:
-            timeout = aiohttp.ClientTimeout(total=30)
-            async with session.request(method, url, json=(data or {}), timeout=timeout) as response:
+            async with session.request(
+                method, url, json=data, params=params, timeout=self._timeout_for(endpoint)
+            ) as response:
                 if response.status == 200:
                     result = await response.json()
-                    return {"success": True, "data": result}
+                    if method == "GET":
+                        self.get_latency.record(time.monotonic() - started)
+                    return {"success": True, "data": result, "status": response.status}
                 else:
                     error_text = await response.text()
                     logger.error(f"Rhombis API error {response.status}: {error_text}")
-                    return {"success": False, "error": f"HTTP {response.status}: {error_text}"}
+                    return {
+                        "success": False,
+                        "error": f"HTTP {response.status}: {error_text}",
+                        "status": response.status,
+                        "text": error_text
+                    }
                     
         except asyncio.TimeoutError:
-            logger.error("Rhombis API timeout")
-            return {"success": False, "error": "Request timeout"}
+            logger.error(f"Rhombis API timeout: {method} {endpoint}")
+            return {"success": False, "error": "Request timeout", "status": None}
         except Exception as e:
             logger.error(f"Rhombis API network error: {e}")
-            return {"success": False, "error": str(e)}
+            return {"success": False, "error": str(e), "status": None}
+    
+    async def _get_recipient(self, kind: str, username: str) -> Dict[str, Any]:
+        """Поиск получателя через кэш с отрицательным кэшированием и склейкой запросов"""
+        username = username.strip().lstrip("@")
+        return await self.recipient_cache.get_or_load(
+            (kind, username.lower()),
+            lambda: self._request("GET", f"/{kind}/recipient", params={"username": username}),
+            ttl_for=_recipient_ttl
+        )
+    
+    async def get_stars_recipient(self, username: str) -> Dict[str, Any]:
+        """Найти получателя Stars по username"""
+        return await self._get_recipient("stars", username)
+    
+    async def create_stars_purchase(self, recipient: str, quantity: int) -> Dict[str, Any]:
+        """Создать транзакцию покупки Stars"""
+        return await self._request("POST", "/stars/transaction", {
+            "recipient": recipient,
+            "quantity": quantity
+        })
+    
+    async def get_premium_recipient(self, username: str) -> Dict[str, Any]:
+        """Найти получателя Premium по username"""
+        return await self._get_recipient("premium", username)
+    
+    async def create_premium_purchase(self, recipient: str, months: int,
+                                      referrer: Optional[str] = None) -> Dict[str, Any]:
+        """Создать транзакцию покупки Telegram Premium"""
+        return await self._request("POST", "/premium/transaction", {
+            "recipient": recipient,
+            "months": months,
+            "referrer": referrer
+        })
     
     async def get_stars_balance(self, user_id: str) -> Dict[str, Any]:
         """Получить баланс звезд пользователя"""
@@ -128,10 +311,26 @@ class RhombisStarsAPI:
         endpoint = "/stars/products"
         return await self._request("GET", endpoint)
     
+    def health(self) -> Dict[str, Any]:
+        """Состояние интеграции для health эндпоинтов"""
+        hedge_delay = self._hedge_delay()
+        return {
+            "circuit": self.breaker.snapshot(),
+            "get_p95_ms": round(self.get_latency.percentile(95) * 1000, 1),
+            "hedging": {
+                "enabled": self.hedge_requests,
+                "delay_ms": round(hedge_delay * 1000, 1) if hedge_delay else None,
+                "hedged": self.hedged,
+                "hedge_wins": self.hedge_wins
+            },
+            "recipient_cache": self.recipient_cache.stats()
+        }
+    
     async def close_session(self):
         """Закрыть HTTP сессию"""
         if self.session and not self.session.closed:
             await self.session.close()
+        self.session = None
 
 # Глобальный экземпляр
 _rhombis_stars_api = None
@@ -143,6 +342,21 @@ def get_rhombis_stars_api() -> RhombisStarsAPI:
         _rhombis_stars_api = RhombisStarsAPI()
     return _rhombis_stars_api
 
+async def _open_rhombis_session(app):
+    """aiohttp on_startup: заранее открыть пул соединений"""
+    await get_rhombis_stars_api()._get_session()
+    logger.info("✅ Rhombis HTTP client started")
+
+async def _close_rhombis_session(app):
+    """aiohttp on_cleanup: закрыть пул соединений"""
+    await get_rhombis_stars_api().close_session()
+    logger.info("✅ Rhombis HTTP client closed")
+
+def setup_rhombis_client(app):
+    """Привязать жизненный цикл общего Rhombis клиента к aiohttp приложению"""
+    app.on_startup.append(_open_rhombis_session)
+    app.on_cleanup.append(_close_rhombis_session)
+
 # Продукты через Stars API (реальная интеграция)
 RHOMBIS_STARS_PRODUCTS = {
     "premium_subscriptions": [
@@ -31,6 +31,7 @@ class SpecialRewardService:
                     WHERE user_id = ?
                 """, (user_id,))
                 conn.commit()
+            db.invalidate_user(user_id)
             
             return {
                 "message": "🎁 Бонусная капсула! Вы получили дополнительную попытку на сегодня!",
@@ -49,6 +50,7 @@ class SpecialRewardService:
                     WHERE user_id = ?
                 """, (expires.isoformat(), user_id))
                 conn.commit()
+            db.invalidate_user(user_id)
             
             return {
                 "message": "🍀 Удача x2 активирована! Следующие награды будут удвоены на 10 минут!",
@@ -85,11 +87,11 @@ class SpecialRewardService:
         db = get_db()
         user = db.get_user(user_id)
         
-        if not user or not user.get('luck_expires'):
+        expires = user.timestamp('luck_expires') if user else None
+        if not expires:
             return 1.0
         
         # Проверить, не истек ли срок действия
-        expires = datetime.fromisoformat(user['luck_expires'])
         if datetime.now() > expires:
             self.reset_luck_multiplier(user_id)
             return 1.0
@@ -107,39 +109,13 @@ class SpecialRewardService:
                 WHERE user_id = ?
             """, (user_id,))
             conn.commit()
+        db.invalidate_user(user_id)
     
     def get_available_capsules(self, user_id: int) -> int:
         """Получить количество доступных капсул с учетом бонусных"""
         from app.context import get_config
-        db = get_db()
-        cfg = get_config()
-        user = db.get_user(user_id)
-        
-        if not user:
-            return 0
-        
-        # Базовый лимит из конфига + рефералы
-        base_limit = cfg.DAILY_CAPSULE_LIMIT + (user.get('validated_referrals', 0) or 0)
-        
-        # Добавить бонусные капсулы
-        bonus_capsules = user.get('bonus_capsules', 0) or 0
-        
-        total_limit = base_limit + bonus_capsules
-        
-        # Проверить сколько уже открыто сегодня
-        opened_today = user.get('daily_capsules_opened', 0) or 0
-        
-        # Если дата не сегодня, сбросить счетчик
-        from datetime import datetime
-        today = datetime.now().date().isoformat()
-        last_date = user.get('last_capsule_date')
-        
-        if last_date != today:
-            opened_today = 0
-        
-        # Вернуть оставшиеся капсулы
-        remaining = max(0, total_limit - opened_today)
-        return remaining
+        # Счётчик сегодняшнего дня приходит в строке пользователя - сброс по дате не нужен
+        return get_db().capsules_left(user_id, get_config().DAILY_CAPSULE_LIMIT)
     
     def use_bonus_capsule(self, user_id: int):
         """Использовать бонусную капсулу"""
@@ -155,5 +131,8 @@ class SpecialRewardService:
                 WHERE user_id = ? AND bonus_capsules > 0
             """, (user_id,))
             conn.commit()
-            
-            return cursor.rowcount > 0
\ No newline at end of file
+            used = cursor.rowcount > 0
+        
+        if used:
+            db.invalidate_user(user_id)
+        return used
\ No newline at end of file
@@ -0,0 +1,134 @@
+"""
+Поэтапный запуск: порт занят сразу, апдейты копятся, пока бот поднимается
+
+Сокет слушается до тяжёлых импортов (aiogram, Telethon), и на нём сразу
+работает минимальное aiohttp-приложение с одним StartupGate: /webhook
+отвечает сразу и складывает апдейты в буфер, пока aiogram и роутеры
+грузятся в потоке. Полное приложение затем принимает тот же сокет и тот же
+буфер; когда база, диспетчер и роутеры готовы, буфер отдаётся в обработку
+в порядке поступления. Telethon, валидатор и регистрация вебхука
+поднимаются уже после готовности, в фоне.
+"""
+import asyncio
+import logging
+import os
+import socket
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, Optional, Set
+
+from aiohttp import web
+
+# Отсчёт фаз запуска - от импорта этого модуля (первым делом в main.py)
+BOOT_STARTED = time.monotonic()
+# Сколько апдейтов держать до готовности; сверх - 503, Telegram повторит доставку сам
+STARTUP_BUFFER_SIZE = int(os.getenv("STARTUP_BUFFER_SIZE", "10000"))
+
+
+def bind_listener(host: str, port: int, fallback_port: Optional[int] = None) -> socket.socket:
+    """Занять порт до запуска приложения (web.SockSite подхватит сокет)"""
+    try:
+        return socket.create_server((host, port), backlog=1024)
+    except OSError as e:
+        if fallback_port is None:
+            raise
+        logging.error(f"❌ Failed to bind port {port}: {e}, trying {fallback_port}")
+        return socket.create_server((host, fallback_port), backlog=1024)
+
+
+class StartupGate:
+    """aiohttp middleware: до готовности буферизует вебхуки, остальное - 503"""
+
+    def __init__(self, webhook_path: str = "/webhook", health_path: str = "/healthz",
+                 max_buffered: int = STARTUP_BUFFER_SIZE, clock: Callable[[], float] = time.monotonic,
+                 started: float = BOOT_STARTED):
+        self.webhook_path = webhook_path
+        self.health_path = health_path
+        self.max_buffered = max_buffered
+        self.clock = clock
+        self.started = started
+        self.ready = False
+        self.phases: Dict[str, float] = {}
+        self.buffered = 0
+        self.overflow = 0
+        self.first_update_at: Optional[float] = None
+        self._buffer: Deque[bytes] = deque()
+        self._tasks: Set[asyncio.Task] = set()
+
+    def mark(self, phase: str):
+        """Засечь фазу запуска: секунды от старта процесса"""
+        self.phases[phase] = round(self.clock() - self.started, 3)
+        logging.info(f"⏱ Startup: {phase} at {self.phases[phase]:.2f}s")
+
+    def middleware(self):
+        @web.middleware
+        async def startup_gate(request: web.Request, handler):
+            if self.ready:
+                return await handler(request)
+            if request.path == self.webhook_path and request.method == "POST":
+                return await self._buffer_update(request)
+            if request.path == self.health_path:
+                return web.json_response({"status": "starting", "startup": self.stats()})
+            return web.json_response({"status": "starting"}, status=503, headers={"Retry-After": "1"})
+        return startup_gate
+
+    async def _buffer_update(self, request: web.Request) -> web.Response:
+        if len(self._buffer) >= self.max_buffered:
+            self.overflow += 1
+            return web.Response(status=503, headers={"Retry-After": "1"})
+        self._buffer.append(await request.read())
+        self.buffered += 1
+        return web.Response(text="ok")
+
+    async def serve_early(self, sock: socket.socket) -> web.AppRunner:
+        """Отвечать на сокете одним StartupGate, пока полное приложение не собрано
+
+        Сайт слушает копию сокета: остановка раннего runner закрывает только её,
+        очередь соединений ядра общая с сайтом полного приложения.
+        """
+        runner = web.AppRunner(web.Application(middlewares=[self.middleware()]), access_log=None)
+        await runner.setup()
+        await web.SockSite(runner, sock.dup()).start()
+        self.mark("gate")
+        return runner
+
+    def open(self, deliver: Callable[[bytes], Awaitable[Any]]):
+        """Отдать накопленные апдейты в deliver по порядку и пропускать новые напрямую
+
+        Каждый апдейт обрабатывается своей задачей, как в SimpleRequestHandler;
+        задачи создаются по порядку буфера, без await между ними, поэтому
+        апдейты, пришедшие во время разбора, встают в его конец.
+        """
+        drained = 0
+        while self._buffer:
+            payload = self._buffer.popleft()
+            task = asyncio.create_task(self._deliver(deliver, payload))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+            drained += 1
+        self.ready = True
+        self.mark("ready")
+        if drained:
+            logging.info(f"📥 Startup: {drained} buffered updates handed to the dispatcher")
+
+    async def _deliver(self, deliver: Callable[[bytes], Awaitable[Any]], payload: bytes):
+        try:
+            await deliver(payload)
+        except Exception as e:
+            logging.error(f"❌ Buffered update failed: {e}")
+
+    def update_handled(self):
+        """Первый обработанный апдейт - конец холодного старта"""
+        if self.first_update_at is None:
+            self.first_update_at = round(self.clock() - self.started, 3)
+            logging.info(f"⏱ Startup: first update handled at {self.first_update_at:.2f}s")
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "ready": self.ready,
+            "phases": dict(self.phases),
+            "first_update_s": self.first_update_at,
+            "buffered": self.buffered,
+            "pending": len(self._buffer),
+            "overflow": self.overflow
+        }
@@ -0,0 +1,197 @@
+"""
+Планировщик жизненного цикла заданий: автоматический запуск по starts_at и
+истечение по expires_at
+
+Вместо сверки дат на каждый запрос держим кучу ближайших событий и переключаем
+статус задания ровно в момент наступления: scheduled -> active, active -> expired.
+Каталог заданий в Database сбрасывается при каждой смене статуса, поэтому
+выдача списка заданий сама даты больше не проверяет.
+"""
+import asyncio
+import heapq
+import logging
+from datetime import datetime, timezone
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+ACTIVATE = "activate"
+EXPIRE = "expire"
+
+# Страховочный период полной пересинхронизации с базой (правки мимо Database)
+RESYNC_INTERVAL = 300.0
+
+TaskCallback = Callable[[Dict[str, Any]], Awaitable[None]]
+
+
+def utc_now() -> datetime:
+    """Текущее время в формате, совместимом с datetime('now') в SQLite"""
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def parse_task_time(value: Any) -> Optional[datetime]:
+    """Разобрать starts_at/expires_at из базы (None, если пусто или мусор)"""
+    if not value:
+        return None
+    if isinstance(value, datetime):
+        return value.replace(tzinfo=None)
+    try:
+        parsed = datetime.fromisoformat(str(value).strip())
+    except ValueError:
+        logger.warning(f"⚠️ Task scheduler: cannot parse date {value!r}")
+        return None
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed
+
+
+class TaskLifecycleScheduler:
+    """Куча (время, задание, действие) с переключением статусов по наступлении
+
+    clock - инжектируемые часы (naive UTC), чтобы тесты могли двигать время.
+    on_activate/on_expire - необязательные корутины, получают словарь задания;
+    идут отдельными задачами (рассылка о запуске длится минутами), stop() их отменяет.
+    """
+
+    def __init__(self, db, clock: Callable[[], datetime] = utc_now,
+                 on_activate: Optional[TaskCallback] = None,
+                 on_expire: Optional[TaskCallback] = None,
+                 resync_interval: float = RESYNC_INTERVAL):
+        self.db = db
+        self.clock = clock
+        self.on_activate = on_activate
+        self.on_expire = on_expire
+        self.resync_interval = resync_interval
+
+        self._heap: List[Tuple[datetime, int, str]] = []
+        self._dirty = True
+        self._wakeup: Optional[asyncio.Event] = None
+        self._running = False
+        self._callbacks: Set[asyncio.Task] = set()
+        self.activated = 0
+        self.expired = 0
+
+        db.add_task_listener(self.notify)
+
+    def notify(self):
+        """Задания изменились - пересобрать расписание при следующем шаге"""
+        self._dirty = True
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    def reload(self):
+        """Пересобрать кучу событий из базы"""
+        heap = []
+        for task in self.db.get_task_schedule():
+            starts_at = parse_task_time(task.get('starts_at'))
+            expires_at = parse_task_time(task.get('expires_at'))
+            if task['status'] == 'scheduled' and starts_at is not None:
+                heap.append((starts_at, task['id'], ACTIVATE))
+            elif task['status'] == 'active' and expires_at is not None:
+                heap.append((expires_at, task['id'], EXPIRE))
+        heapq.heapify(heap)
+        self._heap = heap
+        self._dirty = False
+
+    def next_event_at(self) -> Optional[datetime]:
+        """Время ближайшего события (None, если ничего не запланировано)"""
+        if self._dirty:
+            self.reload()
+        return self._heap[0][0] if self._heap else None
+
+    async def process_due(self) -> int:
+        """Выполнить все наступившие события, вернуть их число"""
+        if self._dirty:
+            self.reload()
+        now = self.clock()
+        processed = 0
+        while self._heap and self._heap[0][0] <= now:
+            _, task_id, action = heapq.heappop(self._heap)
+            await self._apply(task_id, action)
+            processed += 1
+        return processed
+
+    async def _apply(self, task_id: int, action: str):
+        # Сбрасываем до смены статуса: notify() во время перехода (в т.ч. наш
+        # собственный) оставит флаг и расписание пересоберётся, а не потеряется
+        self._dirty = False
+        if action == ACTIVATE:
+            if not self.db.transition_task_status(task_id, 'scheduled', 'active'):
+                return
+            self.activated += 1
+            task = self.db.get_task(task_id)
+            logger.info(f"⏰ Task {task_id} activated by schedule")
+            # После запуска у задания может быть свой срок истечения
+            expires_at = parse_task_time(task.get('expires_at')) if task else None
+            if expires_at is not None:
+                heapq.heappush(self._heap, (expires_at, task_id, EXPIRE))
+            callback = self.on_activate
+        else:
+            if not self.db.transition_task_status(task_id, 'active', 'expired'):
+                return
+            self.expired += 1
+            task = self.db.get_task(task_id)
+            logger.info(f"⌛ Task {task_id} expired")
+            callback = self.on_expire
+
+        if callback and task:
+            # Не ждём: пока идёт рассылка, остальные задания должны стартовать и истекать вовремя
+            job = asyncio.create_task(self._run_callback(callback, task))
+            self._callbacks.add(job)
+            job.add_done_callback(self._callbacks.discard)
+
+    async def _run_callback(self, callback: TaskCallback, task: Dict[str, Any]):
+        try:
+            await callback(task)
+        except Exception as e:
+            logger.error(f"❌ Task scheduler callback failed for task {task['id']}: {e}")
+
+    async def run(self):
+        """Фоновый цикл: спим до ближайшего события или до изменения заданий"""
+        self._wakeup = asyncio.Event()
+        self._running = True
+        logger.info("✅ Task lifecycle scheduler started")
+        self.db.task_lifecycle_managed = True
+        try:
+            while self._running:
+                # До обработки: notify() во время process_due разбудит следующий виток
+                self._wakeup.clear()
+                try:
+                    await self.process_due()
+                except Exception as e:
+                    logger.error(f"❌ Task scheduler error: {e}")
+                    self._dirty = True
+
+                timeout = self.resync_interval
+                next_at = self._heap[0][0] if self._heap else None
+                if next_at is not None:
+                    timeout = min(timeout, max(0.0, (next_at - self.clock()).total_seconds()))
+
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=timeout)
+                except asyncio.TimeoutError:
+                    if not self._heap or self._heap[0][0] > self.clock():
+                        # Таймаут без событий - периодическая пересинхронизация
+                        self._dirty = True
+        finally:
+            self.db.task_lifecycle_managed = False
+            self._running = False
+
+    def stop(self):
+        """Остановить фоновый цикл"""
+        self._running = False
+        if self._wakeup is not None:
+            self._wakeup.set()
+        for job in list(self._callbacks):
+            job.cancel()
+
+    def stats(self) -> Dict[str, Any]:
+        """Состояние для health эндпоинтов"""
+        next_at = self._heap[0][0] if self._heap else None
+        return {
+            "pending": len(self._heap),
+            "next_event_at": next_at.isoformat(sep=' ') if next_at else None,
+            "callbacks_running": len(self._callbacks),
+            "activated": self.activated,
+            "expired": self.expired
+        }
@@ -7,6 +7,8 @@ from typing import Dict, List, Any, Optional
 from dataclasses import dataclass
 from enum import Enum
 
+from app.models import Task as TaskRow
+
 class TaskType(Enum):
     CHANNEL_SUBSCRIPTION = "channel_subscription"
     GROUP_JOIN = "group_join" 
@@ -49,6 +51,13 @@ class Task:
         if self.created_at is None:
             self.created_at = datetime.now()
 
+# Причины отказа Database.redeem_task -> текст для пользователя
+REDEEM_ERRORS = {
+    "already_completed": "✅ Задание уже выполнено",
+    "limit_reached": "❌ Лимит выполнений задания исчерпан",
+    "unavailable": "❌ Задание недоступно",
+}
+
 class TaskService:
     """Сервис управления заданиями"""
     
@@ -105,46 +114,42 @@ class TaskService:
         #     if not self.db.get_task(task.id):
         #         self.db.add_task(task)
     
-    def get_available_tasks(self, user_id: int) -> List[Task]:
+    def get_available_tasks(self, user_id: int) -> List[Dict[str, Any]]:
         """Получить доступные задания для пользователя"""
-        all_tasks = self.db.get_active_tasks()
-        user_completed = self.db.get_user_completed_tasks(user_id)
-        completed_task_ids = {tc['task_id'] for tc in user_completed}
-        
-        available_tasks = []
-        for task in all_tasks:
-            # Проверить истечение срока
-            if task.expires_at and datetime.now() > task.expires_at:
-                continue
-                
-            # Проверить лимит выполнений
-            if task.max_completions and task.id in completed_task_ids:
-                continue
-                
-            # Проверить требования
-            if self._check_task_requirements(user_id, task):
-                available_tasks.append(task)
-        
-        return available_tasks
+        # Каталог в памяти + выполненные одним запросом: без обращений к БД на каждое задание
+        user_cache: Dict[str, Any] = {}
+        return [
+            task for task in self.db.get_available_tasks(user_id)
+            if self._check_task_requirements(user_id, task, user_cache)
+        ]
     
-    def _check_task_requirements(self, user_id: int, task: Task) -> bool:
+    def _check_task_requirements(self, user_id: int, task: TaskRow,
+                                 user_cache: Optional[Dict[str, Any]] = None) -> bool:
         """Проверить выполнение требований задания"""
-        if task.task_type == TaskType.DAILY_LOGIN:
+        task_type = task['task_type']
+        
+        if task_type == TaskType.DAILY_LOGIN.value:
             # Ежедневные задания всегда доступны
             return True
             
-        elif task.task_type == TaskType.REFERRAL_MILESTONE:
-            user = self.db.get_user(user_id)
+        elif task_type == TaskType.REFERRAL_MILESTONE.value:
+            # Пользователь читается один раз на всю выборку
+            if user_cache is None:
+                user_cache = {}
+            if 'user' not in user_cache:
+                user_cache['user'] = self.db.get_user(user_id)
+            user = user_cache['user']
             if not user:
                 return False
-            required_refs = task.requirements.get("referral_count", 0)
+            requirements = task.requirements_data
+            required_refs = requirements.get("referral_count", 0)
             return user['validated_referrals'] >= required_refs
             
-        elif task.task_type == TaskType.CHANNEL_SUBSCRIPTION:
+        elif task_type == TaskType.CHANNEL_SUBSCRIPTION.value:
             # Требует проверки подписки на конкретный канал
             return True  # Проверка будет при выполнении
         
-        elif task.task_type == TaskType.CHANNEL_ACTIVITY:
+        elif task_type == TaskType.CHANNEL_ACTIVITY.value:
             # Задания на активность в канале всегда доступны зарегистрированным пользователям
             return True
             
@@ -158,7 +163,7 @@ class TaskService:
         
         # Проверить доступность
         available_tasks = self.get_available_tasks(user_id)
-        if task.id not in [t.id for t in available_tasks]:
+        if task_id not in {t['id'] for t in available_tasks}:
             return {"success": False, "error": "Задание недоступно"}
         
         # Проверить уже выполненные
@@ -170,19 +175,20 @@ class TaskService:
         if not verification_result["success"]:
             return verification_result
         
-        # Записать выполнение
-        self.db.complete_user_task(user_id, task_id)
+        # Записать выполнение и выдать капсулы атомарно (с проверкой лимита)
+        redemption = self.db.redeem_task(user_id, task_id)
+        if not redemption["success"]:
+            return {"success": False, "error": REDEEM_ERRORS[redemption["reason"]]}
         
-        # Выдать награды
-        self.db.update_user_balance(user_id, task.reward_sc)
-        if task.reward_capsules > 0:
-            self.db.add_bonus_capsules(user_id, task.reward_capsules)
+        reward_sc = task.get('reward_sc') or 0
+        if reward_sc:
+            self.db.update_user_balance(user_id, reward_sc)
         
         return {
             "success": True,
             "task": task,
-            "reward_sc": task.reward_sc,
-            "reward_capsules": task.reward_capsules
+            "reward_sc": reward_sc,
+            "reward_capsules": redemption["reward_capsules"]
         }
     
     async def _verify_task_completion(self, user_id: int, task: Task, bot = None) -> Dict[str, Any]:
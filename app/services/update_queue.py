@@ -0,0 +1,378 @@
+"""
+Локальная очередь апдейтов для режима нескольких воркеров (без внешнего брокера)
+
+Ingress-процесс принимает вебхук, кладёт апдейт в SQLite-очередь и сразу
+отвечает Telegram. Апдейт попадает в шард по пользователю, а шард читает
+ровно один воркер: апдейты одного пользователя обрабатываются по порядку
+и никогда одновременно, а его кэши (users, FSM) живут в одном процессе.
+Фоновые циклы запускает только воркер, держащий аренду лидера.
+"""
+import asyncio
+import json
+import logging
+import multiprocessing
+import os
+import sqlite3
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional, Tuple
+
+# Очередь в отдельном файле: её частые записи не конкурируют с блокировкой bot.db
+QUEUE_DB_PATH = os.getenv("QUEUE_DB_PATH", "updates.db")
+# Сколько раз апдейт может уронить воркер, прежде чем уйти в dead
+QUEUE_MAX_ATTEMPTS = 3
+# Сколько помнить update_id обработанных апдейтов: повтор вебхука после ack не выполнится дважды
+UPDATE_DEDUP_WINDOW = float(os.getenv("UPDATE_DEDUP_WINDOW", "3600"))
+# Как часто удалять устаревшие отметки обработанных апдейтов
+DEDUP_PRUNE_INTERVAL = 60.0
+# Сколько живут кэши процесса, если ту же базу пишут соседние процессы
+WORKER_CACHE_MAX_AGE = float(os.getenv("WORKER_CACHE_MAX_AGE", "5"))
+
+QueuedUpdate = Tuple[int, int, str]  # id, user_key, payload
+
+
+def update_shard_key(update: Dict[str, Any]) -> int:
+    """Ключ упорядочивания апдейта: пользователь, иначе чат, иначе сам update_id"""
+    for field, event in update.items():
+        if field == "update_id" or not isinstance(event, dict):
+            continue
+        for holder in ("from", "user", "chat"):
+            entity = event.get(holder)
+            if isinstance(entity, dict) and isinstance(entity.get("id"), int):
+                return entity["id"]
+    return int(update.get("update_id", 0))
+
+
+class UpdateQueue:
+    """Очередь апдейтов и аренды лидера в SQLite (WAL, общий файл для процессов)"""
+
+    def __init__(self, path: str = QUEUE_DB_PATH, shards: int = 1):
+        self.path = path
+        self.shards = max(1, shards)
+        self._pruned_at = 0.0
+
+    @contextmanager
+    def get_connection(self):
+        conn = sqlite3.connect(self.path, timeout=30)
+        # Очередь переживает падение процесса; fsync на каждый коммит не нужен
+        conn.execute("PRAGMA synchronous=NORMAL")
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    def init(self):
+        with self.get_connection() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS update_queue (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    update_id INTEGER UNIQUE,
+                    shard INTEGER NOT NULL,
+                    user_key INTEGER NOT NULL,
+                    payload TEXT NOT NULL,
+                    status TEXT NOT NULL DEFAULT 'pending',
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    claimed_at REAL,
+                    created_at REAL NOT NULL
+                )
+            """)
+            conn.execute("""
+                CREATE INDEX IF NOT EXISTS idx_update_queue_shard
+                ON update_queue (shard, status, id)
+            """)
+            conn.execute("""
+                CREATE INDEX IF NOT EXISTS idx_update_queue_done
+                ON update_queue (status, claimed_at)
+            """)
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS leases (
+                    name TEXT PRIMARY KEY,
+                    holder TEXT NOT NULL,
+                    expires_at REAL NOT NULL
+                )
+            """)
+            conn.commit()
+
+    def shard_of(self, user_key: int) -> int:
+        return user_key % self.shards
+
+    def push(self, payload: bytes) -> Optional[int]:
+        """Положить апдейт; возвращает шард или None для повтора того же update_id"""
+        update = json.loads(payload)
+        if not isinstance(update, dict):
+            raise ValueError("update must be a JSON object")
+        user_key = update_shard_key(update)
+        shard = self.shard_of(user_key)
+        with self.get_connection() as conn:
+            # Telegram повторяет вебхук при таймауте - дубликат по update_id отбрасываем
+            cursor = conn.execute("""
+                INSERT OR IGNORE INTO update_queue (update_id, shard, user_key, payload, created_at)
+                VALUES (?, ?, ?, ?, ?)
+            """, (update.get("update_id"), shard, user_key, payload.decode("utf-8"), time.time()))
+            conn.commit()
+            return shard if cursor.rowcount else None
+
+    def claim(self, shard: int, busy_keys: Iterable[int] = (), limit: int = 200) -> List[QueuedUpdate]:
+        """Забрать ожидающие апдейты шарда по порядку, пропуская пользователей в обработке
+
+        Апдейты пользователя, у которого ещё идёт обработка, остаются в очереди:
+        следующий заберётся только после подтверждения предыдущего.
+        """
+        busy = list(set(busy_keys))
+        # Фильтр в SQL, до LIMIT: длинная очередь одного занятого пользователя
+        # не должна заслонять остальных пользователей шарда
+        with self.get_connection() as conn:
+            claimed = conn.execute(f"""
+                SELECT id, user_key, payload FROM update_queue
+                WHERE shard = ? AND status = 'pending'
+                  AND user_key NOT IN ({','.join('?' * len(busy))})
+                ORDER BY id LIMIT ?
+            """, (shard, *busy, limit)).fetchall()
+            if claimed:
+                conn.executemany(
+                    "UPDATE update_queue SET status = 'processing', claimed_at = ? WHERE id = ?",
+                    [(time.time(), row[0]) for row in claimed]
+                )
+                conn.commit()
+            return claimed
+
+    def ack(self, update_ids: List[int]):
+        """Отметить апдейты обработанными
+
+        Строка остаётся без payload на UPDATE_DEDUP_WINDOW: её update_id
+        отсекает повтор того же вебхука, пришедший уже после обработки.
+        """
+        now = time.time()
+        with self.get_connection() as conn:
+            conn.executemany(
+                "UPDATE update_queue SET status = 'done', payload = '', claimed_at = ? WHERE id = ?",
+                [(now, i) for i in update_ids]
+            )
+            if now - self._pruned_at >= DEDUP_PRUNE_INTERVAL:
+                self._pruned_at = now
+                conn.execute("DELETE FROM update_queue WHERE status = 'done' AND claimed_at < ?",
+                             (now - UPDATE_DEDUP_WINDOW,))
+            conn.commit()
+
+    def recover(self, shard: int) -> int:
+        """Вернуть в очередь апдейты, которые держал упавший предыдущий воркер шарда"""
+        with self.get_connection() as conn:
+            conn.execute("""
+                UPDATE update_queue SET status = 'dead'
+                WHERE shard = ? AND status = 'processing' AND attempts + 1 >= ?
+            """, (shard, QUEUE_MAX_ATTEMPTS))
+            cursor = conn.execute("""
+                UPDATE update_queue SET status = 'pending', attempts = attempts + 1, claimed_at = NULL
+                WHERE shard = ? AND status = 'processing'
+            """, (shard,))
+            conn.commit()
+            return cursor.rowcount
+
+    def depth(self) -> Dict[str, int]:
+        """Размер очереди по статусам"""
+        with self.get_connection() as conn:
+            rows = conn.execute("""
+                SELECT status, COUNT(*) FROM update_queue WHERE status != 'done' GROUP BY status
+            """).fetchall()
+        return dict(rows)
+
+    def try_lease(self, name: str, holder: str, ttl: float) -> bool:
+        """Взять или продлить аренду; успешно, если она свободна, истекла или уже наша"""
+        now = time.time()
+        with self.get_connection() as conn:
+            cursor = conn.execute("""
+                INSERT INTO leases (name, holder, expires_at) VALUES (?, ?, ?)
+                ON CONFLICT (name) DO UPDATE SET holder = excluded.holder, expires_at = excluded.expires_at
+                WHERE leases.holder = excluded.holder OR leases.expires_at < ?
+            """, (name, holder, now + ttl, now))
+            conn.commit()
+            return cursor.rowcount > 0
+
+    def release_lease(self, name: str, holder: str):
+        with self.get_connection() as conn:
+            conn.execute("DELETE FROM leases WHERE name = ? AND holder = ?", (name, holder))
+            conn.commit()
+
+
+class QueueWorker:
+    """Читает один шард: разные пользователи параллельно, один пользователь - по порядку"""
+
+    def __init__(self, queue: UpdateQueue, shard: int, handle: Callable[[str], Awaitable[Any]],
+                 concurrency: int = 64, wake=None, idle_wait: float = 0.5):
+        self.queue = queue
+        self.shard = shard
+        self.handle = handle
+        self.concurrency = concurrency
+        # multiprocessing.Event от ingress: будит воркер сразу после push
+        self.wake = wake
+        self.idle_wait = idle_wait
+        self._chains: Dict[int, asyncio.Task] = {}
+        self._running = False
+        self.processed = 0
+        self.failed = 0
+
+    async def run(self):
+        self._running = True
+        recovered = await asyncio.to_thread(self.queue.recover, self.shard)
+        if recovered:
+            logging.warning(f"🔁 Shard {self.shard}: {recovered} updates returned to queue after restart")
+        logging.info(f"✅ Queue worker started for shard {self.shard}")
+
+        while self._running:
+            if len(self._chains) >= self.concurrency:
+                await asyncio.wait(list(self._chains.values()), return_when=asyncio.FIRST_COMPLETED)
+                continue
+            try:
+                rows = await asyncio.to_thread(self.queue.claim, self.shard, list(self._chains))
+            except sqlite3.Error as e:
+                logging.error(f"❌ Shard {self.shard}: claim failed: {e}")
+                rows = []
+            if not rows:
+                await self._idle()
+                continue
+            chains: "OrderedDict[int, List[QueuedUpdate]]" = OrderedDict()
+            for row in rows:
+                chains.setdefault(row[1], []).append(row)
+            for user_key, chain in chains.items():
+                self._chains[user_key] = asyncio.create_task(self._run_chain(user_key, chain))
+
+        # Остановка: начатые цепочки дорабатывают, остальное заберёт следующий воркер
+        if self._chains:
+            await asyncio.gather(*self._chains.values(), return_exceptions=True)
+
+    async def _idle(self):
+        if self.wake is None:
+            await asyncio.sleep(self.idle_wait)
+            return
+        # Ждём в потоке, чтобы не блокировать цепочки, которые ещё работают
+        if await asyncio.to_thread(self.wake.wait, self.idle_wait):
+            self.wake.clear()
+
+    async def _run_chain(self, user_key: int, chain: List[QueuedUpdate]):
+        try:
+            for update_id, _, payload in chain:
+                try:
+                    await self.handle(payload)
+                    self.processed += 1
+                except Exception as e:
+                    # Как и в режиме одного процесса: ошибка хендлера логируется, апдейт не повторяется
+                    self.failed += 1
+                    logging.error(f"❌ Update {update_id} of {user_key} failed: {e}")
+                try:
+                    await asyncio.to_thread(self.queue.ack, [update_id])
+                except sqlite3.Error as e:
+                    # Не подтверждённый апдейт вернёт в очередь recover() при рестарте
+                    logging.error(f"❌ Ack of update {update_id} failed: {e}")
+                    return
+        finally:
+            self._chains.pop(user_key, None)
+
+    def stop(self):
+        """Не забирать новые апдейты; run() завершится после начатых цепочек"""
+        self._running = False
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "shard": self.shard,
+            "in_flight_users": len(self._chains),
+            "processed": self.processed,
+            "failed": self.failed
+        }
+
+
+class LeaderElection:
+    """Фоновые задачи работают только у держателя аренды; при потере аренды отменяются"""
+
+    def __init__(self, queue: UpdateQueue, holder: str, jobs: List[Callable[[], Awaitable[Any]]],
+                 name: str = "background", ttl: float = 15.0):
+        self.queue = queue
+        self.holder = holder
+        self.jobs = jobs
+        self.name = name
+        self.ttl = ttl
+        self.is_leader = False
+        self._tasks: List[asyncio.Task] = []
+
+    async def run(self):
+        try:
+            while True:
+                try:
+                    acquired = await asyncio.to_thread(self.queue.try_lease, self.name, self.holder, self.ttl)
+                except Exception as e:
+                    logging.error(f"❌ Leader lease check failed: {e}")
+                    acquired = False
+                if acquired and not self.is_leader:
+                    logging.info(f"👑 {self.holder} is now leader, starting {len(self.jobs)} background jobs")
+                    self._tasks = [asyncio.create_task(job()) for job in self.jobs]
+                elif not acquired and self.is_leader:
+                    logging.warning(f"⚠️ {self.holder} lost leadership, stopping background jobs")
+                    self._cancel_jobs()
+                self.is_leader = acquired
+                # Продлеваем заранее: аренда не истекает между проверками
+                await asyncio.sleep(self.ttl / 3)
+        finally:
+            self._cancel_jobs()
+            if self.is_leader:
+                self.is_leader = False
+                await asyncio.to_thread(self.queue.release_lease, self.name, self.holder)
+
+    def _cancel_jobs(self):
+        for task in self._tasks:
+            task.cancel()
+        self._tasks = []
+
+
+class WorkerPool:
+    """Процессы-воркеры по одному на шард; упавший воркер перезапускается"""
+
+    def __init__(self, shards: int, target: Callable[..., Any], check_interval: float = 5.0):
+        # spawn: воркер не наследует event loop, сокеты и Bot ingress-процесса
+        self._ctx = multiprocessing.get_context("spawn")
+        self.shards = shards
+        self.target = target
+        self.check_interval = check_interval
+        self.wakes = [self._ctx.Event() for _ in range(shards)]
+        self.processes: List[Optional[multiprocessing.process.BaseProcess]] = [None] * shards
+        self.restarts = 0
+
+    def _spawn(self, shard: int):
+        process = self._ctx.Process(
+            target=self.target, args=(shard, self.shards, self.wakes[shard]),
+            name=f"bot-worker-{shard}", daemon=True
+        )
+        process.start()
+        self.processes[shard] = process
+        logging.info(f"✅ Worker {shard} started (pid {process.pid})")
+
+    def start(self):
+        for shard in range(self.shards):
+            self._spawn(shard)
+
+    def wake(self, shard: int):
+        self.wakes[shard].set()
+
+    async def supervise(self):
+        while True:
+            await asyncio.sleep(self.check_interval)
+            for shard, process in enumerate(self.processes):
+                if process is not None and not process.is_alive():
+                    logging.error(f"❌ Worker {shard} exited with code {process.exitcode}, restarting")
+                    self.restarts += 1
+                    self._spawn(shard)
+
+    def stop(self, timeout: float = 10.0):
+        for process in self.processes:
+            if process is not None and process.is_alive():
+                process.terminate()
+        for process in self.processes:
+            if process is not None:
+                process.join(timeout)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "workers": self.shards,
+            "alive": sum(1 for p in self.processes if p is not None and p.is_alive()),
+            "restarts": self.restarts
+        }
@@ -7,6 +7,7 @@ from datetime import datetime, timedelta
 from aiogram import Bot
 
 from app.context import get_config, get_db
+from app.services.outbound import NOTIFICATION, outbound_priority
 from app.services.scoring import RiskScorer
 
 async def validator_loop(bot: Bot):
@@ -15,7 +16,9 @@ async def validator_loop(bot: Bot):
     
     while True:
         try:
-            await validate_pending_referrals(bot)
+            # Уведомления рефереров не обгоняют ответы пользователям
+            with outbound_priority(NOTIFICATION):
+                await validate_pending_referrals(bot)
         except Exception as e:
             logging.error(f"Error in validator loop: {e}")
         
@@ -0,0 +1,124 @@
+"""
+In-memory кэши: LRU с TTL, отрицательным кэшированием и склейкой одинаковых запросов
+"""
+import asyncio
+import time
+from collections import OrderedDict
+from itertools import islice
+from typing import Any, Awaitable, Callable, Dict, Hashable, List, Optional
+
+_MISSING = object()
+
+
+class TTLCache:
+    """LRU кэш с временем жизни записей
+
+    get_or_load() склеивает одновременные запросы по одному ключу: пока первый
+    загрузчик в полёте, остальные ждут его результат вместо повторного вызова.
+    """
+
+    def __init__(self, maxsize: int = 10000, ttl: float = 300.0,
+                 clock: Callable[[], float] = time.monotonic):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.clock = clock
+        self._data: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._inflight: Dict[Hashable, asyncio.Future] = {}
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return self.get(key, _MISSING) is not _MISSING
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """Получить значение, если оно не протухло"""
+        entry = self._data.get(key)
+        if entry is None:
+            self.misses += 1
+            return default
+        expires_at, value = entry
+        if expires_at <= self.clock():
+            del self._data[key]
+            self.misses += 1
+            return default
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None):
+        """Положить значение (ttl по умолчанию - self.ttl)"""
+        self._data[key] = (self.clock() + (self.ttl if ttl is None else ttl), value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def sample(self, limit: int) -> List[Any]:
+        """До limit живых значений от самых давних (без учёта в hits/misses и LRU)"""
+        now = self.clock()
+        return [value for expires_at, value in islice(self._data.values(), limit) if expires_at > now]
+
+    def invalidate(self, key: Hashable):
+        """Удалить запись"""
+        self._data.pop(key, None)
+
+    def clear(self):
+        """Очистить кэш"""
+        self._data.clear()
+
+    async def get_or_load(self, key: Hashable, loader: Callable[[], Awaitable[Any]],
+                          ttl_for: Optional[Callable[[Any], Optional[float]]] = None) -> Any:
+        """Вернуть значение из кэша или загрузить его одним запросом на ключ
+
+        ttl_for(result) возвращает TTL для результата или None, если результат
+        кэшировать нельзя (например, сетевая ошибка).
+        """
+        value = self.get(key, _MISSING)
+        if value is not _MISSING:
+            return value
+
+        inflight = self._inflight.get(key)
+        if inflight is not None:
+            self.coalesced += 1
+            result = await asyncio.shield(inflight)
+            if result is _MISSING:
+                # Загрузчика отменили (клиент отключился) - грузит следующий ожидающий
+                return await self.get_or_load(key, loader, ttl_for)
+            return result
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            result = await loader()
+        except asyncio.CancelledError:
+            # Ожидающих не отменяли - отдаём им ключ на повторную загрузку
+            future.set_result(_MISSING)
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # Ошибку забирают ожидающие; если их нет - не засоряем лог
+            future.exception()
+            raise
+        finally:
+            self._inflight.pop(key, None)
+
+        ttl = ttl_for(result) if ttl_for else self.ttl
+        if ttl:
+            self.set(key, result, ttl)
+        future.set_result(result)
+        return result
+
+    def stats(self) -> Dict[str, Any]:
+        """Статистика кэша"""
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0
+        }
@@ -0,0 +1,168 @@
+"""
+Хранилище FSM aiogram в SQLite: диалоги переживают редеплой
+
+Чтения идут через in-memory кэш, записи копятся в памяти и сбрасываются
+в базу пачкой раз в FSM_FLUSH_INTERVAL (несколько set_state/update_data
+одного апдейта превращаются в одну строку). Брошенные диалоги старше
+FSM_STATE_TTL не читаются и удаляются при сбросе.
+
+Кэш в памяти согласован, пока апдейты пользователя обрабатывает один
+процесс; для нескольких процессов без такой маршрутизации есть
+FSM_STORAGE=redis (aiogram RedisStorage, нужен пакет redis).
+"""
+import asyncio
+import json
+import logging
+import os
+import time
+from typing import Any, Callable, Dict, Mapping, Optional, Tuple
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, DefaultKeyBuilder, KeyBuilder, StateType, StorageKey
+from aiogram.fsm.storage.memory import MemoryStorage
+
+from app.utils.cache import TTLCache
+
+# Брошенный диалог (капча, ввод кошелька) перестаёт существовать через сутки
+FSM_STATE_TTL = float(os.getenv("FSM_STATE_TTL", "86400"))
+# Окно склейки записей: столько может потеряться при жёстком падении процесса
+FSM_FLUSH_INTERVAL = float(os.getenv("FSM_FLUSH_INTERVAL", "0.5"))
+# Как часто удалять брошенные диалоги из базы
+FSM_PURGE_INTERVAL = 3600.0
+
+Record = Tuple[Optional[str], str, float]  # state, data JSON, updated_at
+_EMPTY_DATA = '{}'
+_MISSING = object()
+
+
+class SQLiteStorage(BaseStorage):
+    """FSM storage поверх Database с кэшем чтения и отложенной пакетной записью"""
+
+    def __init__(self, db, state_ttl: float = FSM_STATE_TTL, flush_interval: float = FSM_FLUSH_INTERVAL,
+                 cache_size: int = 10000, key_builder: Optional[KeyBuilder] = None,
+                 clock: Callable[[], float] = time.time):
+        self.db = db
+        self.state_ttl = state_ttl
+        self.flush_interval = flush_interval
+        self.clock = clock
+        self.key_builder = key_builder or DefaultKeyBuilder(with_bot_id=True, with_destiny=True)
+        self._cache = TTLCache(maxsize=cache_size, ttl=state_ttl)
+        # Ещё не записанные в базу и записываемые прямо сейчас
+        self._dirty: Dict[str, Record] = {}
+        self._flushing: Dict[str, Record] = {}
+        self._flush_task: Optional[asyncio.Task] = None
+        self._flush_lock = asyncio.Lock()
+        self._purged_at = 0.0
+        self.db_reads = 0
+        self.writes = 0
+        self.flushes = 0
+        self.flushed_rows = 0
+
+    def _read(self, key: str) -> Optional[Record]:
+        record = self._dirty.get(key) or self._flushing.get(key)
+        if record is None:
+            record = self._cache.get(key, _MISSING)
+            if record is _MISSING:
+                self.db_reads += 1
+                record = self.db.load_fsm_record(key, self.clock() - self.state_ttl)
+                self._cache.set(key, record)
+        if record is not None and record[2] < self.clock() - self.state_ttl:
+            return None
+        return record
+
+    def _write(self, key: str, state: Optional[str], data: str):
+        record = (state, data, self.clock())
+        self._dirty[key] = record
+        self._cache.set(key, record)
+        self.writes += 1
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.get_running_loop().create_task(self._flush_loop())
+
+    async def _flush_loop(self):
+        while self._dirty:
+            await asyncio.sleep(self.flush_interval)
+            # Остановка цикла не должна обрывать уже начатую запись
+            await asyncio.shield(self.flush())
+
+    async def flush(self):
+        """Записать накопленные изменения одной транзакцией"""
+        async with self._flush_lock:
+            await self._flush()
+
+    async def _flush(self):
+        if not self._dirty:
+            return
+        batch, self._dirty = self._dirty, {}
+        self._flushing = batch
+        now = self.clock()
+        purge_before = None
+        if now - self._purged_at >= FSM_PURGE_INTERVAL:
+            purge_before = now - self.state_ttl
+        try:
+            # SQLite блокирует поток - пишем вне event loop
+            purged = await asyncio.to_thread(self.db.save_fsm_records, batch, purge_before)
+        except Exception as e:
+            logging.error(f"❌ FSM flush failed, {len(batch)} states kept for retry: {e}")
+            for key, record in batch.items():
+                self._dirty.setdefault(key, record)
+            return
+        finally:
+            self._flushing = {}
+        self.flushes += 1
+        self.flushed_rows += len(batch)
+        if purge_before is not None:
+            self._purged_at = now
+            if purged:
+                logging.info(f"🧹 FSM: purged {purged} abandoned states")
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        storage_key = self.key_builder.build(key)
+        record = self._read(storage_key)
+        data = record[1] if record else _EMPTY_DATA
+        self._write(storage_key, state.state if isinstance(state, State) else state, data)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        record = self._read(self.key_builder.build(key))
+        return record[0] if record else None
+
+    async def set_data(self, key: StorageKey, data: Mapping[str, Any]) -> None:
+        storage_key = self.key_builder.build(key)
+        record = self._read(storage_key)
+        self._write(storage_key, record[0] if record else None,
+                    json.dumps(dict(data), ensure_ascii=False) if data else _EMPTY_DATA)
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        record = self._read(self.key_builder.build(key))
+        # Данные в памяти хранятся JSON-строкой: каждый вызов получает свою копию
+        return json.loads(record[1]) if record else {}
+
+    async def close(self) -> None:
+        """Дописать хвост перед остановкой"""
+        if self._flush_task is not None and not self._flush_task.done():
+            self._flush_task.cancel()
+        await self.flush()
+
+    def stats(self) -> Dict[str, Any]:
+        """Статистика хранилища"""
+        return {
+            "cache": self._cache.stats(),
+            "db_reads": self.db_reads,
+            "writes": self.writes,
+            "flushes": self.flushes,
+            "flushed_rows": self.flushed_rows,
+            "pending": len(self._dirty)
+        }
+
+
+def create_fsm_storage(backend: str, db, redis_url: str = "") -> BaseStorage:
+    """FSM storage по настройке FSM_STORAGE: sqlite (по умолчанию), redis или memory"""
+    if backend == "memory":
+        return MemoryStorage()
+    if backend == "redis":
+        try:
+            from aiogram.fsm.storage.redis import RedisStorage
+        except ImportError as e:
+            raise RuntimeError("FSM_STORAGE=redis requires the 'redis' package") from e
+        ttl = int(FSM_STATE_TTL)
+        return RedisStorage.from_url(redis_url, state_ttl=ttl, data_ttl=ttl)
+    return SQLiteStorage(db)
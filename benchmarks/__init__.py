@@ -0,0 +1,3 @@
+"""
+Бенчмарки и локальные заглушки внешних API
+"""
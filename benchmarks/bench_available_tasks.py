@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк "доступных заданий": N+1 запросов (старый путь) vs каталог в памяти +
+выполненные задания одним запросом
+
+Запуск: python -m benchmarks.bench_available_tasks [пользователей] [заданий]
+По умолчанию 100k пользователей и 200 активных заданий (~10 выполнений на пользователя).
+"""
+import os
+import random
+import sys
+import tempfile
+import time
+
+from app.db import Database
+
+
+def seed(db: Database, users: int, tasks: int, completions_per_user: int = 10):
+    with db.get_connection() as conn:
+        conn.executemany(
+            "INSERT INTO users (user_id, username, first_name) VALUES (?, ?, ?)",
+            ((uid, f"user{uid}", "Bench") for uid in range(1, users + 1))
+        )
+        conn.executemany(
+            "INSERT INTO tasks (title, description, task_type, reward_capsules, partner_name) "
+            "VALUES (?, ?, 'channel_subscription', 1, 'Partner')",
+            ((f"Task {i}", "Bench task") for i in range(tasks))
+        )
+        rng = random.Random(42)
+        conn.executemany(
+            "INSERT INTO user_task_completions (user_id, task_id, reward_capsules) VALUES (?, ?, 1)",
+            ((uid, task_id)
+             for uid in range(1, users + 1)
+             for task_id in rng.sample(range(1, tasks + 1), completions_per_user))
+        )
+        conn.commit()
+
+
+def legacy_available(db: Database, user_id: int):
+    """Старый путь из tasks_menu: каталог из БД + is_task_completed на каждое задание"""
+    with db.get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT * FROM tasks WHERE status = 'active'
+            AND (expires_at IS NULL OR expires_at > datetime('now'))
+            ORDER BY created_at DESC
+        """)
+        active = [dict(row) for row in cursor.fetchall()]
+    available = []
+    for task in active:
+        with db.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT id FROM user_task_completions WHERE user_id = ? AND task_id = ?",
+                           (user_id, task['id']))
+            done = cursor.fetchone() is not None
+        if not done:
+            available.append(task)
+    return available
+
+
+def timed(name: str, fn, user_ids):
+    started = time.perf_counter()
+    for uid in user_ids:
+        fn(uid)
+    per_call = (time.perf_counter() - started) / len(user_ids)
+    print(f"{name:<34} {per_call * 1000:8.3f} ms/открытие меню")
+    return per_call
+
+
+def main(users: int = 100_000, tasks: int = 200):
+    with tempfile.TemporaryDirectory() as root:
+        db = Database(os.path.join(root, "bench.db"))
+        db.init()
+        started = time.perf_counter()
+        seed(db, users, tasks)
+        print(f"🌱 {users} пользователей, {tasks} заданий: {time.perf_counter() - started:.1f} с")
+
+        sample = random.Random(1).sample(range(1, users + 1), 200)
+        assert [t['id'] for t in legacy_available(db, sample[0])] == \
+               [t['id'] for t in db.get_available_tasks(sample[0])]
+
+        legacy = timed("legacy N+1 (201 соединение)", lambda u: legacy_available(db, u), sample[:50])
+        cold = timed("catalog + 1 запрос (холодный)", db.get_available_tasks, sample[50:])
+        warm = timed("catalog + set в кэше (тёплый)", db.get_available_tasks, sample[50:])
+        print(f"⚡ ускорение: холодный x{legacy / cold:.0f}, тёплый x{legacy / warm:.0f}")
+
+
+if __name__ == "__main__":
+    args = [int(a) for a in sys.argv[1:3]]
+    main(*args)
@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк сценариев, упирающихся в Bot API: проверка подписки, рассылка, валидатор
+
+Запуск: python -m benchmarks.bench_bot_api [пользователей] [рефералов]
+Telegram заменён заглушкой (benchmarks.bot_api_stub): задержка ответа,
+доля неподписанных и заблокировавших бота пользователей, flood control
+30 msg/s. Бот идёт через OutboundScheduler, как в проде.
+"""
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+from aiogram import Bot
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+
+from app.config import Settings
+from app.context import set_context
+from app.db import Database
+from app.services.outbound import OutboundScheduler
+from benchmarks.bot_api_stub import BotApiStub
+
+API_LATENCY = 0.03
+LEFT_RATE = 0.2
+BLOCKED_RATE = 0.1
+
+
+def make_bot(stub: BotApiStub) -> Bot:
+    session = AiohttpSession(api=TelegramAPIServer.from_base(stub.base_url))
+    session.middleware(OutboundScheduler())
+    return Bot("42:BENCH", session=session)
+
+
+async def bench_subscription_checks(users: int):
+    from app.utils.subscription import check_user_subscriptions
+
+    stub = await BotApiStub(latency=API_LATENCY, left_rate=LEFT_RATE).start()
+    bot = make_bot(stub)
+    started = time.perf_counter()
+    results = await asyncio.gather(*(
+        check_user_subscriptions(bot, user_id, "-1001", "-1002") for user_id in range(1, users + 1)
+    ))
+    elapsed = time.perf_counter() - started
+    expected = sum(not stub.is_left(user_id) for user_id in range(1, users + 1))
+    calls = sum(stub.calls.values())
+    print(f"🔍 Проверка подписки: {users} пользователей за {elapsed:.2f} с ({users / elapsed:.0f}/с), "
+          f"подписаны {sum(results)} из ожидаемых {expected}, {calls / users:.1f} вызова API на проверку")
+    await bot.session.close()
+    await stub.stop()
+
+
+async def bench_broadcast(db: Database):
+    from app.handlers.tasks_unified import broadcast_task_announcement
+
+    stub = await BotApiStub(latency=API_LATENCY, flood_rate=30.0, blocked_rate=BLOCKED_RATE).start()
+    bot = make_bot(stub)
+    task = db.get_task(db.add_task("Бенчмарк", "Рассылка", "channel_subscription", 1, "Partner", "https://t.me/p"))
+    started = time.perf_counter()
+    sent, failed = await broadcast_task_announcement(bot, task)
+    elapsed = time.perf_counter() - started
+    audience = db.get_all_users()
+    blocked = sum(stub.is_blocked(user["user_id"]) for user in audience)
+    print(f"📢 Рассылка: {len(audience)} пользователей за {elapsed:.1f} с ({sent / elapsed:.1f} msg/s), "
+          f"доставлено {sent}, ошибок {failed} (заблокировали бота {blocked}), 429 от Telegram: {stub.flood_errors}")
+    await bot.session.close()
+    await stub.stop()
+
+
+async def bench_validator(db: Database, referrals: int):
+    from app.services.validator import validate_pending_referrals
+
+    with db.get_connection() as conn:
+        conn.execute("UPDATE referral_validations SET validation_date = datetime('now', '-1 day')")
+        conn.commit()
+    stub = await BotApiStub(latency=API_LATENCY).start()
+    bot = make_bot(stub)
+    started = time.perf_counter()
+    await validate_pending_referrals(bot)
+    elapsed = time.perf_counter() - started
+    left = len(db.get_pending_validations(referrals + 1))
+    print(f"🛡 Валидатор: {referrals - left} из {referrals} рефералов за {elapsed:.1f} с "
+          f"({elapsed / max(1, referrals):.2f} с на реферала), вызовов API: {sum(stub.calls.values())}")
+    await bot.session.close()
+    await stub.stop()
+
+
+async def main(users: int = 300, referrals: int = 5):
+    with tempfile.TemporaryDirectory() as root:
+        db_path = os.path.join(root, "bench.db")
+        db = Database(db_path)
+        db.init()
+        set_context(Settings(BOT_TOKEN="42:BENCH", REQUIRED_CHANNEL_ID="-1001", REQUIRED_GROUP_ID="-1002",
+                             DB_PATH=db_path), db)
+        for user_id in range(1, users + 1):
+            db.create_user(user_id, f"user{user_id}", "User")
+            db.update_subscription_status(user_id, True)
+        # Рефералы первого пользователя, прошедшие капчу и подписку
+        for index in range(referrals):
+            referred = users + 1 + index
+            db.create_user(referred, f"ref{referred}", "Referral", referrer_id=1)
+            db.update_subscription_status(referred, True)
+
+        await bench_subscription_checks(users)
+        await bench_broadcast(db)
+        await bench_validator(db, referrals)
+
+
+if __name__ == "__main__":
+    args = [int(a) for a in sys.argv[1:3]]
+    asyncio.run(main(*args))
@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк выплат: по одной заявке на транзакцию (старый путь) vs пакетная выплата
+
+Запуск: python -m benchmarks.bench_bulk_payouts [заявок]
+По умолчанию 10k заявок от 5k пользователей.
+"""
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+from app.db import Database
+from app.services.payouts import build_ton_batch
+
+WALLET = "UQD4FPq-TD7Yay6F4j-s8zr-YvdWBYkkL2xNrqjW6UQKWqqK"
+
+
+def seed(db: Database, requests: int, users: int):
+    with db.get_connection() as conn:
+        conn.executemany(
+            "INSERT INTO users (user_id, username, first_name, wallet_address, pending_balance, "
+            "total_earnings, balance) VALUES (?, ?, 'Bench', ?, 100, 100, 100)",
+            ((uid, f"user{uid}", WALLET) for uid in range(1, users + 1))
+        )
+        conn.executemany(
+            "INSERT INTO withdrawal_requests (user_id, amount, status) VALUES (?, 10, 'pending')",
+            ((i % users + 1,) for i in range(requests))
+        )
+        conn.commit()
+
+
+def legacy_process(db: Database, request_id: int, admin_id: int) -> bool:
+    """Старый Database.process_withdrawal_request: соединение и commit на заявку"""
+    with db.get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT user_id, amount FROM withdrawal_requests WHERE id = ? AND status = 'pending'",
+                       (request_id,))
+        request = cursor.fetchone()
+        if not request:
+            return False
+        user_id, amount = request['user_id'], request['amount']
+        cursor.execute("SELECT pending_balance FROM users WHERE user_id = ?", (user_id,))
+        user = cursor.fetchone()
+        if not user or user['pending_balance'] < amount:
+            return False
+        cursor.execute("UPDATE users SET pending_balance = pending_balance - ?, "
+                       "paid_balance = paid_balance + ? WHERE user_id = ?", (amount, amount, user_id))
+        cursor.execute("UPDATE withdrawal_requests SET status = 'completed', "
+                       "processed_at = CURRENT_TIMESTAMP, admin_id = ? WHERE id = ?", (admin_id, request_id))
+        cursor.execute("INSERT INTO payouts (user_id, amount, admin_id, notes) VALUES (?, ?, ?, ?)",
+                       (user_id, amount, admin_id, f"Withdrawal request #{request_id}"))
+        conn.commit()
+        return True
+
+
+def main(requests: int = 10_000):
+    users = max(1, requests // 2)
+    with tempfile.TemporaryDirectory() as root:
+        template = os.path.join(root, "template.db")
+        db = Database(template)
+        db.init()
+        seed(db, requests, users)
+        print(f"🌱 {requests} заявок от {users} пользователей")
+
+        legacy_db = Database(shutil.copy(template, os.path.join(root, "legacy.db")))
+        started = time.perf_counter()
+        pending = legacy_db.get_withdrawal_requests()
+        paid = sum(legacy_process(legacy_db, r['id'], admin_id=1) for r in pending)
+        legacy = time.perf_counter() - started
+        print(f"🐢 по одной заявке   {paid:>6} выплат {legacy:8.2f} с")
+
+        batch_db = Database(shutil.copy(template, os.path.join(root, "batch.db")))
+        started = time.perf_counter()
+        result = batch_db.process_withdrawal_batch(admin_id=1, require_wallet=True)
+        export = build_ton_batch(result['payouts'])
+        batch = time.perf_counter() - started
+        assert len(result['processed']) == paid
+        print(f"⚡ пакетом + экспорт  {len(result['processed']):>6} выплат {batch:8.2f} с "
+              f"({len(export) / 1024:.0f} KB CSV)")
+        print(f"⚡ ускорение x{legacy / batch:.0f}")
+
+
+if __name__ == "__main__":
+    args = [int(a) for a in sys.argv[1:2]]
+    main(*args)
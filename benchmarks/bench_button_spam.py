@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк спама кнопок: сколько лишних запусков хендлера отсекает UserSerialMiddleware
+
+Запуск: python -m benchmarks.bench_button_spam [пользователей] [тапов]
+Каждый пользователь серией жмёт "🎁 Открыть капсулу" (callback) с интервалом
+0-150 мс; хендлер имитирует открытие капсулы (~5 мс работы с базой).
+"""
+import asyncio
+import random
+import sys
+import time
+
+from aiogram import Bot, Dispatcher, F, Router
+from aiogram.client.session.base import BaseSession
+from aiogram.types import Update
+
+from app.middleware.user_serial import UserSerialMiddleware
+
+HANDLER_TIME = 0.005
+
+
+class NullSession(BaseSession):
+    """Bot API без сети: ответы на callback ничего не стоят"""
+
+    async def make_request(self, bot, method, timeout=None):
+        return True
+
+    async def stream_content(self, *args, **kwargs):
+        yield b""
+
+    async def close(self):
+        pass
+
+
+def tap(update_id: int, user_id: int) -> Update:
+    return Update.model_validate({
+        "update_id": update_id,
+        "callback_query": {
+            "id": str(update_id), "chat_instance": "1", "data": "open_capsule",
+            "from": {"id": user_id, "is_bot": False, "first_name": "U"},
+            "message": {"message_id": 1, "date": 0, "chat": {"id": user_id, "type": "private"}}
+        }
+    })
+
+
+async def run(users: int, taps: int, middleware) -> dict:
+    executions = 0
+    overlapping = 0
+    active = {}
+
+    router = Router()
+
+    @router.callback_query(F.data == "open_capsule")
+    async def open_capsule(query):
+        nonlocal executions, overlapping
+        executions += 1
+        user_id = query.from_user.id
+        active[user_id] = active.get(user_id, 0) + 1
+        if active[user_id] > 1:
+            overlapping += 1
+        await asyncio.sleep(HANDLER_TIME)
+        active[user_id] -= 1
+
+    dp = Dispatcher()
+    if middleware is not None:
+        dp.update.outer_middleware(middleware)
+    dp.include_router(router)
+    bot = Bot("42:BENCH", session=NullSession())
+
+    rng = random.Random(42)
+    update_id = 0
+
+    async def spammer(user_id: int):
+        nonlocal update_id
+        feeds = []
+        for _ in range(taps):
+            update_id += 1
+            feeds.append(asyncio.create_task(dp.feed_update(bot, tap(update_id, user_id))))
+            await asyncio.sleep(rng.uniform(0, 0.15))
+        await asyncio.gather(*feeds)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(spammer(uid) for uid in range(1, users + 1)))
+    return {
+        "executions": executions,
+        "overlapping": overlapping,
+        "seconds": time.perf_counter() - started
+    }
+
+
+def main(users: int = 1000, taps: int = 5):
+    total = users * taps
+    plain = asyncio.run(run(users, taps, None))
+    middleware = UserSerialMiddleware()
+    serial = asyncio.run(run(users, taps, middleware))
+    avoided = plain["executions"] - serial["executions"]
+    print(f"👆 {users} пользователей x {taps} тапов = {total} апдейтов")
+    print(f"🔓 без middleware: {plain['executions']} запусков хендлера, "
+          f"{plain['overlapping']} параллельно с другим запуском того же пользователя")
+    print(f"🔒 с middleware:   {serial['executions']} запусков, {serial['overlapping']} параллельных, "
+          f"схлопнуто {middleware.collapsed}")
+    print(f"✅ отсечено лишних запусков: {avoided} ({avoided / total:.0%})")
+
+
+if __name__ == "__main__":
+    args = [int(a) for a in sys.argv[1:3]]
+    main(*args)
@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк полуночного сброса: UPDATE users по всей таблице (старый
+reset_daily_capsules) vs дневные счётчики по epoch day в daily_counters
+
+Запуск: python -m benchmarks.bench_daily_reset [пользователей] [активных в день]
+По умолчанию 1M пользователей, 50k открывают капсулы каждый день.
+Запись измеряется байтами в WAL (страницы, которые SQLite пишет на диск).
+"""
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+
+from app.db import DAILY_COUNTER_RETENTION_DAYS, Database, epoch_day
+
+DAYS_OF_HISTORY = DAILY_COUNTER_RETENTION_DAYS + 1
+
+
+def seed(db: Database, users: int, active: int):
+    """Пользователи, открывавшие капсулы раньше, и счётчики прошлых дней"""
+    rng = random.Random(1)
+    today = epoch_day()
+    with db.get_connection() as conn:
+        conn.executemany(
+            "INSERT INTO users (user_id, username, first_name, last_capsule_date, "
+            "daily_capsules_opened, total_capsules_opened) VALUES (?, ?, 'Bench', ?, ?, ?)",
+            ((uid, f"user{uid}",
+              "2026-01-01" if uid % 5 else None,  # 80% когда-либо открывали капсулы
+              rng.randint(1, 3) if uid <= active else 0,
+              rng.randint(0, 50))
+             for uid in range(1, users + 1))
+        )
+        conn.execute("UPDATE users SET last_capsule_date = DATE('now', '-1 day') WHERE user_id <= ?",
+                     (active,))
+        for day in range(today - DAYS_OF_HISTORY, today):
+            conn.executemany(
+                "INSERT INTO daily_counters (day, user_id, capsules) VALUES (?, ?, ?)",
+                ((day, uid, rng.randint(1, 3)) for uid in rng.sample(range(1, users + 1), active))
+            )
+        conn.commit()
+
+
+def wal_bytes(db: Database, action) -> tuple:
+    """Выполнить action() одной транзакцией и вернуть (байт в WAL, секунд)"""
+    with db.get_connection() as conn:
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    started = time.perf_counter()
+    action()
+    elapsed = time.perf_counter() - started
+    return os.path.getsize(db.db_path + "-wal"), elapsed
+
+
+def legacy_reset(db: Database):
+    with db.get_connection() as conn:
+        cursor = conn.execute("""
+            UPDATE users
+            SET daily_capsules_opened = 0
+            WHERE last_capsule_date < DATE('now')
+        """)
+        conn.commit()
+        return cursor.rowcount
+
+
+def main(users: int = 1_000_000, active: int = 50_000):
+    with tempfile.TemporaryDirectory() as root:
+        db = Database(os.path.join(root, "bench.db"))
+        db.init()
+        # Открытое соединение держит WAL-файл между короткими соединениями Database
+        holder = sqlite3.connect(db.db_path)
+        holder.execute("PRAGMA journal_mode=WAL")
+        holder.execute("SELECT COUNT(*) FROM users").fetchone()
+        started = time.perf_counter()
+        seed(db, users, active)
+        print(f"🌱 {users} пользователей, {active} активных в день: "
+              f"{time.perf_counter() - started:.1f} с")
+
+        rows = []
+        written, elapsed = wal_bytes(db, lambda: rows.append(legacy_reset(db)))
+        print(f"🐢 полночь, UPDATE users     {rows[0]:>8} строк {written / 2**20:8.1f} MB WAL "
+              f"{elapsed * 1000:8.0f} мс")
+        print(f"⚡ полночь, epoch day         {0:>8} строк {0:8.1f} MB WAL {0:8.0f} мс")
+
+        # Первая запись нового дня удаляет один устаревший день счётчиков
+        written, elapsed = wal_bytes(db, lambda: db.record_capsule_opening(1, "bench", 0.1))
+        print(f"⚡ первое открытие дня        {active:>8} строк {written / 2**20:8.1f} MB WAL "
+              f"{elapsed * 1000:8.0f} мс (удалён день {DAYS_OF_HISTORY} дн. назад)")
+        written, elapsed = wal_bytes(db, lambda: db.record_capsule_opening(2, "bench", 0.1))
+        print(f"⚡ следующее открытие         {1:>8} строк {written / 2**10:8.1f} KB WAL "
+              f"{elapsed * 1000:8.1f} мс")
+        assert db.get_capsules_opened_today(1) == 1
+        holder.close()
+
+
+if __name__ == "__main__":
+    args = [int(a) for a in sys.argv[1:3]]
+    main(*args)
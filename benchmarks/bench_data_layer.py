@@ -0,0 +1,505 @@
+#!/usr/bin/env python3
+"""
+Микробенчмарки слоя данных и сервисов на синтетической bot.db
+
+Запуск: python -m benchmarks.bench_data_layer [--scales 10000,100000,1000000]
+                                               [--only get_user,get_top_users] [--data-dir DIR]
+
+На каждом масштабе база засевается пользователями и пропорциональными
+рефералами, открытиями капсул, чек-инами, заданиями и их выполнениями,
+проводками и заявками на вывод. Затем по очереди меряются все публичные
+методы Database (кроме служебных из SKIPPED), лидерборды и сервисы:
+CapsuleService.open_capsule, SpecialRewardService.get_available_capsules,
+TaskService.get_available_tasks и валидатор рефералов (Bot API - заглушка).
+
+Каждый прогон дописывается в JSON-историю (--history) с коммитом, а
+сравнение с прошлым прогоном того же масштаба показывает регрессии.
+С --data-dir засеянные базы сохраняются и переиспользуются между запусками
+(меряется копия, шаблон не меняется).
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import logging
+import os
+import platform
+import random
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+from aiogram import Bot
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+
+from app.config import Settings
+from app.context import set_context
+from app.db import ACCOUNT_PAYOUTS, ACCOUNT_REWARDS, ACCOUNT_USER, LEDGER_OPENING, LEDGER_PAYOUT, Database, epoch_day
+from app.services.capsules import CapsuleService
+from app.services.metrics import Histogram
+from app.services.query_trace import query_tracer
+from app.services.scoring import RiskScorer
+from app.services.special_rewards import SpecialRewardService
+from app.services.tasks import TaskService
+from app.services.validator import validate_single_referral
+from benchmarks.bot_api_stub import BotApiStub
+
+SCALES = (10_000, 100_000, 1_000_000)
+HISTORY = os.path.join(os.path.dirname(__file__), "history", "data_layer.json")
+SEED_VERSION = 1  # Поднять при изменении seed(): сохранённые шаблоны баз пересеются
+
+MIN_TIME = 0.25     # секунд измерений на случай
+MIN_CALLS = 3
+MAX_CALLS = 5000
+POOL_SIZE = 2000    # заготовок (заявок, сессий капчи, рефералов) на расходующие случаи
+REGRESSION_RATIO = 1.25
+
+# Публичные методы Database без отдельного бенчмарка
+SKIPPED = {
+    "get_connection": "открывается в каждом случае",
+    "init": "схема и миграции, не горячий путь",
+    "request_scope": "контекст мемоизации, меряется через get_user",
+    "post_ledger_entry": "часть транзакции вызывающего, меряется через add_balance",
+    "add_task_listener": "подписка при старте",
+    "limit_cache_age": "настройка при старте",
+}
+
+# Запрос топа из universal.leaderboard_handler (кнопка "🏆 Топ")
+LEADERBOARD_SQL = """
+    SELECT first_name, username, total_earnings, total_referrals, total_capsules_opened
+    FROM users
+    WHERE subscription_checked = 1 AND banned = 0
+    ORDER BY total_earnings DESC
+    LIMIT 10
+"""
+
+
+def sqlite_time(moment: datetime) -> str:
+    return moment.strftime("%Y-%m-%d %H:%M:%S")
+
+
+def seed(db: Database, users: int):
+    """Синтетическая база: пропорции примерно как у живого бота"""
+    rng = random.Random(42)
+    tasks = max(20, users // 2000)
+    now = datetime.utcnow()
+    registered_from = now - timedelta(days=180)
+    step = timedelta(days=180) / users
+
+    referrers = [0] * (users + 1)
+    referrals = [0] * (users + 1)
+    validated = [0] * (users + 1)
+    pending_referrals = []
+    for uid in range(2, users + 1):
+        if uid % 2 == 0:  # половина пришла по ссылке
+            referrer = rng.randint(1, uid - 1)
+            referrers[uid] = referrer
+            referrals[referrer] += 1
+            if rng.random() < 0.8:
+                validated[referrer] += 1
+            else:
+                pending_referrals.append(uid)
+    pending = set(pending_referrals)
+
+    def user_rows():
+        for uid in range(1, users + 1):
+            earned = round(rng.uniform(0, 50), 2)
+            paid = round(earned * rng.choice((0, 0, 0.5)), 2)
+            yield (uid, f"user{uid}", f"User {uid}", referrers[uid] or None,
+                   sqlite_time(registered_from + step * uid), rng.random() < 0.9,
+                   earned, earned - paid, earned, paid, rng.randint(0, 60),
+                   referrals[uid], validated[uid], rng.choice((0, 0, 0, 1, 2)))
+
+    with db.get_connection() as conn:
+        conn.execute("PRAGMA synchronous=OFF")
+        conn.executemany("""
+            INSERT INTO users (user_id, username, first_name, referrer_id, registration_date,
+                               subscription_checked, total_earnings, pending_balance, balance,
+                               paid_balance, total_capsules_opened, total_referrals,
+                               validated_referrals, bonus_capsules)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """, user_rows())
+        # Входящие проводки под балансы - журнал сходится с users
+        conn.execute("""
+            INSERT INTO ledger_entries (user_id, entry_type, debit_account, credit_account, amount, ref)
+            SELECT user_id, ?, ?, ?, total_earnings, 'seed' FROM users WHERE total_earnings > 0
+        """, (LEDGER_OPENING, ACCOUNT_REWARDS, ACCOUNT_USER))
+        conn.execute("""
+            INSERT INTO ledger_entries (user_id, entry_type, debit_account, credit_account, amount, ref)
+            SELECT user_id, ?, ?, ?, paid_balance, 'seed' FROM users WHERE paid_balance > 0
+        """, (LEDGER_PAYOUT, ACCOUNT_USER, ACCOUNT_PAYOUTS))
+        conn.executemany("""
+            INSERT INTO referral_validations (referrer_id, referred_id, validation_date, validated)
+            VALUES (?, ?, ?, ?)
+        """, ((referrers[uid], uid, sqlite_time(registered_from + step * uid), uid not in pending)
+              for uid in range(2, users + 1, 2)))
+
+        conn.executemany("""
+            INSERT INTO capsule_openings (user_id, reward_name, reward_amount, opening_date)
+            VALUES (?, 'SC', ?, ?)
+        """, ((rng.randint(1, users), rng.choice((0.0, 0.5, 1.0, 5.0)),
+               sqlite_time(now - timedelta(minutes=rng.randint(0, 180 * 1440))))
+              for _ in range(users * 3)))
+        conn.executemany("""
+            INSERT OR IGNORE INTO user_checkins (user_id, checkin_date, sc_amount) VALUES (?, ?, 0.5)
+        """, ((rng.randint(1, users), (now - timedelta(days=rng.randint(1, 90))).strftime("%Y-%m-%d"))
+              for _ in range(users * 2)))
+        today = epoch_day()
+        conn.executemany("INSERT OR IGNORE INTO daily_counters (day, user_id, capsules) VALUES (?, ?, ?)",
+                         ((today, rng.randint(1, users), rng.randint(1, 3)) for _ in range(users // 20)))
+
+        conn.executemany("""
+            INSERT INTO tasks (title, description, task_type, reward_capsules, partner_name, partner_url)
+            VALUES (?, 'Синтетическое задание', 'channel_subscription', 1, 'Partner', 'https://t.me/partner')
+        """, ((f"Задание {i}",) for i in range(tasks)))
+        conn.executemany("""
+            INSERT OR IGNORE INTO user_task_completions (user_id, task_id, reward_capsules) VALUES (?, ?, 1)
+        """, ((rng.randint(1, users), rng.randint(1, tasks)) for _ in range(users * 3)))
+        conn.execute("""
+            UPDATE tasks SET current_completions =
+                (SELECT COUNT(*) FROM user_task_completions c WHERE c.task_id = tasks.id)
+        """)
+        # Задания для расходующих случаев: два активных без выполнений и архив для правок/удаления
+        conn.executemany("""
+            INSERT INTO tasks (title, description, task_type, reward_capsules, status)
+            VALUES (?, 'Бенчмарк', 'channel_subscription', 1, ?)
+        """, [("bench:complete", "active"), ("bench:redeem", "active")]
+             + [(f"bench:scratch {i}", "inactive") for i in range(POOL_SIZE)])
+
+        conn.executemany("""
+            INSERT INTO withdrawal_requests (user_id, amount, status, created_at) VALUES (?, 0.01, ?, ?)
+        """, ((uid, "pending" if rng.random() < 0.5 else "completed",
+               sqlite_time(now - timedelta(minutes=rng.randint(0, 30 * 1440))))
+              for uid in rng.sample(range(1, users + 1), max(POOL_SIZE * 2, users // 20))))
+        conn.executemany("""
+            INSERT INTO captcha_sessions (user_id, captcha_value, solve_time, solved) VALUES (?, '42', ?, ?)
+        """, ((uid, rng.uniform(3, 20), uid % 10 != 0) for uid in range(1, users + 1)))
+        conn.executemany("INSERT INTO fsm_storage (key, state, data, updated_at) VALUES (?, NULL, '{}', ?)",
+                         ((f"fsm:{uid}", time.time()) for uid in range(1, users // 100 + 1)))
+        conn.commit()
+        conn.execute("ANALYZE")
+    # Точка отсчёта инкрементального снимка журнала
+    db.snapshot_ledger()
+
+
+def prepare(users: int, data_dir: Optional[str], work_dir: str) -> tuple:
+    """Рабочая копия засеянной базы и время засева (0, если шаблон уже был)"""
+    db_path = os.path.join(work_dir, f"bench_{users}.db")
+    template = os.path.join(data_dir, f"seed_v{SEED_VERSION}_{users}.db") if data_dir else None
+    if template and os.path.exists(template):
+        shutil.copyfile(template, db_path)
+        return db_path, 0.0
+
+    started = time.perf_counter()
+    db = Database(template or db_path)
+    db.init()
+    seed(db, users)
+    elapsed = time.perf_counter() - started
+    if template:
+        shutil.copyfile(template, db_path)
+    return db_path, elapsed
+
+
+class Pools:
+    """Заготовки для случаев, которые расходуют строки (повтор дал бы другой путь кода)"""
+
+    def __init__(self, db: Database):
+        self.db = db
+
+    def ids(self, sql: str, *params) -> List[int]:
+        with self.db.get_connection() as conn:
+            return [row[0] for row in conn.execute(sql, params).fetchall()]
+
+    @staticmethod
+    def shares(items: List[Any], parts: int) -> List[Iterator[Any]]:
+        """Поровну на каждый расходующий случай - предыдущий не съедает заготовки следующего"""
+        size = len(items) // parts
+        return [iter(items[i * size:(i + 1) * size]) for i in range(parts)]
+
+    @staticmethod
+    def chunks(source: Iterator[int], size: int) -> Iterator[List[int]]:
+        while True:
+            chunk = list(itertools.islice(source, size))
+            if not chunk:
+                return
+            yield chunk
+
+
+def build_cases(db: Database, users: int, bot: Bot, loop: asyncio.AbstractEventLoop) -> Dict[str, Callable[[], Any]]:
+    """Имя случая -> вызов без аргументов (одна операция)"""
+    rng = random.Random(7)
+    pools = Pools(db)
+    user = lambda: rng.randint(1, users)
+    new_users = itertools.count(users + 1)
+    next_user = itertools.count(1)
+    keys = itertools.count()
+    today = datetime.utcnow().strftime("%Y-%m-%d")
+    tasks = db.get_active_tasks()
+    task = lambda: rng.choice(tasks).id
+
+    complete_task_id, = pools.ids("SELECT id FROM tasks WHERE title = 'bench:complete'")
+    redeem_task_id, = pools.ids("SELECT id FROM tasks WHERE title = 'bench:redeem'")
+    scratch_ids = pools.ids("SELECT id FROM tasks WHERE title LIKE 'bench:scratch %'")
+    scratch = lambda: rng.choice(scratch_ids)
+    deletable = iter(scratch_ids[len(scratch_ids) // 2:])
+    scratch_ids = scratch_ids[:len(scratch_ids) // 2]
+    paid_one, paid_many, paid_batch, rejected = pools.shares(pools.ids(
+        "SELECT id FROM withdrawal_requests WHERE status = 'pending' ORDER BY id LIMIT ?", POOL_SIZE * 2), 4)
+    captchas = iter(pools.ids("SELECT id FROM captcha_sessions WHERE solved = 0 LIMIT ?", POOL_SIZE))
+    validations, validated_by_bot = pools.shares(db.get_pending_validations(POOL_SIZE * 2), 2)
+    checkins = itertools.count(1)
+
+    settings = Settings(BOT_TOKEN="42:BENCH", REQUIRED_CHANNEL_ID="-1001", REQUIRED_GROUP_ID="-1002",
+                        DB_PATH=db.db_path)
+    capsules = CapsuleService()
+    special = SpecialRewardService()
+    task_service = TaskService(db)
+    scorer = RiskScorer()
+
+    def leaderboard():
+        with db.get_connection() as conn:
+            return conn.execute(LEADERBOARD_SQL).fetchall()
+
+    def validate_one():
+        loop.run_until_complete(validate_single_referral(bot, next(validated_by_bot), scorer, settings))
+
+    fsm_batch = lambda: {f"fsm:{user()}": ("Captcha:waiting", '{"n": 1}', time.time()) for _ in range(20)}
+
+    return {
+        # Пользователи
+        "get_user": lambda: db.get_user(user()),
+        "invalidate_user": lambda: db.invalidate_user(user()),
+        "invalidate_all_users": db.invalidate_all_users,
+        "user_cache_stats": db.user_cache_stats,
+        "create_user": lambda: db.create_user(next(new_users), "bench", "Bench", user()),
+        "update_subscription_status": lambda: db.update_subscription_status(user(), True),
+        "ban_user": lambda: db.ban_user(user(), "bench"),
+        "unban_user": lambda: db.unban_user(user()),
+        "update_wallet": lambda: db.update_wallet(user(), "UQ" + "A" * 46),
+        "update_user_scores": lambda: db.update_user_scores(user(), risk_score=0.1),
+        "set_quarantine": lambda: db.set_quarantine(user(), 1),
+        "is_in_quarantine": lambda: db.is_in_quarantine(user()),
+        "get_all_users": db.get_all_users,
+        # Балансы и журнал
+        "add_balance": lambda: db.add_balance(user(), 0.5),
+        "update_user_balance": lambda: db.update_user_balance(user(), 0.5),
+        "process_payout": lambda: db.process_payout(user(), 0.01, 1, "bench"),
+        "record_checkin": lambda: db.record_checkin(next(checkins), today, 0.5),
+        "get_ledger_entries": lambda: db.get_ledger_entries(user()),
+        "snapshot_ledger": db.snapshot_ledger,
+        # Лидерборды и статистика
+        "get_top_users": lambda: db.get_top_users(10),
+        "leaderboard_handler (SQL)": leaderboard,
+        "get_stats": db.get_stats,
+        # Капсулы
+        "capsules_left": lambda: db.capsules_left(user(), 3),
+        "can_open_capsule": lambda: db.can_open_capsule(user(), 3),
+        "get_capsules_opened_today": lambda: db.get_capsules_opened_today(user()),
+        "record_capsule_opening": lambda: db.record_capsule_opening(user(), "SC", 0.5),
+        "add_bonus_capsules": lambda: db.add_bonus_capsules(user(), 1),
+        # Вывод средств
+        "create_withdrawal_request": lambda: db.create_withdrawal_request(user(), 0.01),
+        "reserve_withdrawal": lambda: db.reserve_withdrawal(user(), 0.01, f"bench:{next(keys)}"),
+        "get_available_balance": lambda: db.get_available_balance(user()),
+        "get_withdrawal_requests": db.get_withdrawal_requests,
+        "get_user_withdrawal_requests": lambda: db.get_user_withdrawal_requests(user()),
+        "process_withdrawal_request": lambda: db.process_withdrawal_request(next(paid_one), 1),
+        "process_withdrawal_requests": lambda: db.process_withdrawal_requests(
+            next(pools.chunks(paid_many, 10)), 1),
+        "process_withdrawal_batch": lambda: db.process_withdrawal_batch(
+            1, request_ids=next(pools.chunks(paid_batch, 50))),
+        "reject_withdrawal_request": lambda: db.reject_withdrawal_request(next(rejected), 1),
+        # Капча
+        "save_captcha_session": lambda: db.save_captcha_session(user(), "42"),
+        "complete_captcha": lambda: db.complete_captcha(next(captchas), 5.0),
+        "get_captcha_session": lambda: db.get_captcha_session(user()),
+        # Рефералы
+        "get_pending_validations": lambda: db.get_pending_validations(100),
+        "validate_referral": lambda: db.validate_referral(next(validations)["id"], True),
+        # Задания
+        "get_active_tasks": db.get_active_tasks,
+        "get_user_completed_task_ids": lambda: db.get_user_completed_task_ids(user()),
+        "get_available_tasks": lambda: db.get_available_tasks(user()),
+        "get_task": lambda: db.get_task(task()),
+        "get_all_tasks": db.get_all_tasks,
+        "get_task_completions": lambda: db.get_task_completions(task()),
+        "get_user_completed_tasks": lambda: db.get_user_completed_tasks(user()),
+        "is_task_completed": lambda: db.is_task_completed(user(), task()),
+        "complete_user_task": lambda: db.complete_user_task(next(next_user), complete_task_id),
+        "redeem_task": lambda: db.redeem_task(user(), redeem_task_id),
+        "add_task": lambda: db.add_task("Бенчмарк", "Запланированное", "channel_subscription",
+                                        starts_at="2999-01-01 00:00:00"),
+        "get_task_schedule": db.get_task_schedule,
+        "invalidate_task_cache": db.invalidate_task_cache,
+        "update_task_status": lambda: db.update_task_status(scratch(), "inactive"),
+        "transition_task_status": lambda: db.transition_task_status(scratch(), "inactive", "inactive"),
+        "update_task_field": lambda: db.update_task_field(scratch(), "title", "bench:scratch"),
+        "deactivate_task": lambda: db.deactivate_task(scratch()),
+        "delete_task": lambda: db.delete_task(next(deletable)),
+        # FSM
+        "load_fsm_record": lambda: db.load_fsm_record(f"fsm:{user()}", 0),
+        "save_fsm_records": lambda: db.save_fsm_records(fsm_batch()),
+        # Сервисы
+        "CapsuleService.open_capsule": lambda: capsules.open_capsule(settings.CAPSULE_REWARDS),
+        "SpecialRewardService.get_available_capsules": lambda: special.get_available_capsules(user()),
+        "TaskService.get_available_tasks": lambda: task_service.get_available_tasks(user()),
+        "validate_pending_referrals (на реферала)": validate_one,
+    }
+
+
+def uncovered(cases: Dict[str, Any]) -> List[str]:
+    """Публичные методы Database без случая и без причины в SKIPPED"""
+    public = [name for name in dir(Database) if not name.startswith("_") and callable(getattr(Database, name))]
+    return [name for name in public if name not in cases and name not in SKIPPED]
+
+
+def measure(fn: Callable[[], Any]) -> Optional[Dict[str, float]]:
+    """Повторять fn() не меньше MIN_TIME; None, если заготовки кончились сразу"""
+    histogram = Histogram()
+    try:
+        fn()  # прогрев: каталоги, кэши, подготовленные выражения
+    except StopIteration:
+        return None
+    deadline = time.perf_counter() + MIN_TIME
+    while histogram.count < MAX_CALLS and (histogram.count < MIN_CALLS or time.perf_counter() < deadline):
+        started = time.perf_counter()
+        try:
+            fn()
+        except StopIteration:
+            break
+        histogram.record(time.perf_counter() - started)
+    if not histogram.count:
+        return None
+    return {
+        "calls": histogram.count,
+        "mean_us": round(histogram.sum / histogram.count * 1e6, 1),
+        "p50_us": round(histogram.percentile(50) * 1e6, 1),
+        "p99_us": round(histogram.percentile(99) * 1e6, 1),
+    }
+
+
+def run_scale(users: int, data_dir: Optional[str], only: Optional[List[str]]) -> Dict[str, Any]:
+    with tempfile.TemporaryDirectory() as work_dir:
+        db_path, seeded = prepare(users, data_dir, work_dir)
+        print(f"\n🌱 {users} пользователей: "
+              + (f"засеяно за {seeded:.1f} с" if seeded else "шаблон из --data-dir"))
+        db = Database(db_path)
+        set_context(Settings(BOT_TOKEN="42:BENCH", REQUIRED_CHANNEL_ID="-1001", REQUIRED_GROUP_ID="-1002",
+                             DB_PATH=db_path), db)
+
+        loop = asyncio.new_event_loop()
+        stub = loop.run_until_complete(BotApiStub().start())
+        bot = Bot("42:BENCH", session=AiohttpSession(api=TelegramAPIServer.from_base(stub.base_url)))
+        try:
+            cases = build_cases(db, users, bot, loop)
+            missing = uncovered(cases)
+            if missing:
+                print(f"⚠️ Методы Database без бенчмарка: {', '.join(missing)}")
+            query_tracer.reset()
+            results = {}
+            for name, fn in cases.items():
+                if only and not any(part in name for part in only):
+                    continue
+                result = measure(fn)
+                if result is None:
+                    print(f"  {name:<46} нет заготовок")
+                    continue
+                results[name] = result
+                print(f"  {name:<46} p50 {result['p50_us']:>10.1f} мкс  p99 {result['p99_us']:>10.1f} мкс"
+                      f"  ({result['calls']} вызовов)")
+            top = query_tracer.top(3)
+            if top:
+                print("  🐢 Дороже всего в сумме: " + "; ".join(
+                    f"{row['total_ms']:.0f} мс {row['query'][:70]}" for row in top))
+        finally:
+            loop.run_until_complete(bot.session.close())
+            loop.run_until_complete(stub.stop())
+            loop.close()
+    return {"scale": users, "seed_s": round(seeded, 1), "results": results}
+
+
+def git_revision() -> Dict[str, Any]:
+    def git(*args: str) -> str:
+        return subprocess.run(["git", *args], capture_output=True, text=True, timeout=30,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    try:
+        return {"commit": git("rev-parse", "--short", "HEAD") or "unknown",
+                "subject": git("log", "-1", "--format=%s"),
+                "dirty": bool(git("status", "--porcelain", "--untracked-files=no"))}
+    except (OSError, subprocess.SubprocessError):
+        return {"commit": "unknown", "subject": "", "dirty": False}
+
+
+def load_history(path: str) -> List[Dict[str, Any]]:
+    if not os.path.exists(path):
+        return []
+    with open(path, encoding="utf-8") as f:
+        return json.load(f).get("runs", [])
+
+
+def compare(run: Dict[str, Any], history: List[Dict[str, Any]]):
+    """Сравнить p50 с последним прогоном того же масштаба"""
+    previous = next((old for old in reversed(history) if old["scale"] == run["scale"]), None)
+    if previous is None:
+        return
+    label = previous["commit"] + ("+" if previous.get("dirty") else "")
+    changes = []
+    for name, result in run["results"].items():
+        old = previous["results"].get(name)
+        if not old or not old["p50_us"]:
+            continue
+        ratio = result["p50_us"] / old["p50_us"]
+        if ratio >= REGRESSION_RATIO or ratio <= 1 / REGRESSION_RATIO:
+            changes.append((ratio, name, old["p50_us"], result["p50_us"]))
+    if not changes:
+        print(f"  ✅ {run['scale']}: без заметных изменений относительно {label}")
+        return
+    for ratio, name, old, new in sorted(changes, reverse=True):
+        mark = "🔺" if ratio > 1 else "🔻"
+        print(f"  {mark} {run['scale']} {name}: p50 {old:.1f} → {new:.1f} мкс (x{ratio:.2f} к {label})")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Микробенчмарки Database и сервисов")
+    parser.add_argument("--scales", default=",".join(map(str, SCALES)),
+                        help="размеры базы через запятую (пользователей)")
+    parser.add_argument("--only", default="", help="подстроки имён случаев через запятую")
+    parser.add_argument("--data-dir", help="каталог для засеянных шаблонов баз (переиспользуются)")
+    parser.add_argument("--history", default=HISTORY, help="JSON-история прогонов")
+    parser.add_argument("--no-history", action="store_true", help="не записывать прогон в историю")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.ERROR)
+    logging.getLogger().setLevel(logging.ERROR)
+    if args.data_dir:
+        os.makedirs(args.data_dir, exist_ok=True)
+    only = [part for part in args.only.split(",") if part] or None
+
+    revision = git_revision()
+    environment = {"python": platform.python_version(), "sqlite": sqlite3.sqlite_version,
+                   "machine": platform.machine()}
+    history = load_history(args.history)
+    runs = []
+    for users in (int(scale) for scale in args.scales.split(",") if scale):
+        run = {**revision, **environment, "at": datetime.now().isoformat(timespec="seconds"),
+               **run_scale(users, args.data_dir, only)}
+        runs.append(run)
+
+    print()
+    for run in runs:
+        compare(run, history)
+    if not args.no_history:
+        os.makedirs(os.path.dirname(os.path.abspath(args.history)), exist_ok=True)
+        with open(args.history, "w", encoding="utf-8") as f:
+            json.dump({"runs": history + runs}, f, ensure_ascii=False, indent=1)
+        print(f"📝 История: {args.history} ({len(history) + len(runs)} прогонов)")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк сверки балансов: полный снимок журнала проводок и инкрементальный
+снимок после новой порции проводок
+
+Запуск: python -m benchmarks.bench_ledger_snapshot [проводок] [пользователей]
+По умолчанию 2M проводок на 100k пользователей.
+"""
+import os
+import random
+import sys
+import tempfile
+import time
+
+from app.db import (ACCOUNT_PAYOUTS, ACCOUNT_REWARDS, ACCOUNT_USER, LEDGER_CAPSULE,
+                    LEDGER_CHECKIN, LEDGER_PAYOUT, LEDGER_TASK, Database)
+
+EARNING_TYPES = (LEDGER_CAPSULE, LEDGER_CHECKIN, LEDGER_TASK)
+
+
+def entries(count: int, users: int, seed: int):
+    rng = random.Random(seed)
+    for _ in range(count):
+        user_id = rng.randint(1, users)
+        if rng.random() < 0.05:
+            yield user_id, LEDGER_PAYOUT, ACCOUNT_USER, ACCOUNT_PAYOUTS, 0.5
+        else:
+            yield user_id, rng.choice(EARNING_TYPES), ACCOUNT_REWARDS, ACCOUNT_USER, 1.0
+
+
+def append(db: Database, count: int, users: int, seed: int):
+    """Записать проводки напрямую и материализовать их в users одним запросом"""
+    with db.get_connection() as conn:
+        conn.executemany(
+            "INSERT INTO ledger_entries (user_id, entry_type, debit_account, credit_account, amount) "
+            "VALUES (?, ?, ?, ?, ?)",
+            entries(count, users, seed)
+        )
+        conn.execute("""
+            UPDATE users SET
+                total_earnings = (SELECT COALESCE(SUM(amount), 0) FROM ledger_entries
+                                  WHERE user_id = users.user_id AND credit_account = 'user'),
+                paid_balance = (SELECT COALESCE(SUM(amount), 0) FROM ledger_entries
+                                WHERE user_id = users.user_id AND debit_account = 'user')
+        """)
+        conn.execute("UPDATE users SET balance = total_earnings, "
+                     "pending_balance = total_earnings - paid_balance")
+        conn.commit()
+
+
+def main(count: int = 2_000_000, users: int = 100_000):
+    with tempfile.TemporaryDirectory() as root:
+        db = Database(os.path.join(root, "bench.db"))
+        db.init()
+        with db.get_connection() as conn:
+            conn.executemany(
+                "INSERT INTO users (user_id, username, first_name) VALUES (?, ?, 'Bench')",
+                ((uid, f"user{uid}") for uid in range(1, users + 1))
+            )
+            conn.commit()
+
+        started = time.perf_counter()
+        append(db, count, users, seed=1)
+        print(f"🌱 {count} проводок, {users} пользователей: {time.perf_counter() - started:.1f} с")
+
+        full = db.snapshot_ledger()
+        assert not full["drifted"], "журнал и users разошлись"
+        print(f"📒 полный снимок      {full['entries']:>9} проводок {full['duration_ms']:9.1f} мс")
+
+        extra = count // 100
+        append(db, extra, users, seed=2)
+        incremental = db.snapshot_ledger()
+        assert not incremental["drifted"]
+        print(f"📒 инкрементальный    {incremental['entries']:>9} проводок "
+              f"{incremental['duration_ms']:9.1f} мс")
+
+        empty = db.snapshot_ledger()
+        print(f"📒 без новых проводок {empty['entries']:>9} проводок {empty['duration_ms']:9.1f} мс")
+
+
+if __name__ == "__main__":
+    args = [int(a) for a in sys.argv[1:3]]
+    main(*args)
@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк исходящих: рассылка на фоне ответов пользователям, Telegram с flood control
+
+Запуск: python -m benchmarks.bench_outbound [сообщений рассылки]
+Заглушка Bot API ведёт себя как Telegram: больше 30 msg/s - 429 RetryAfter.
+Рассылку шлют 20 параллельных отправителей; каждые 200 мс пользователь
+получает ответ. Без планировщика отправитель на 429 ждёт retry_after сам.
+"""
+import asyncio
+import sys
+import time
+
+from aiogram import Bot
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+from aiogram.exceptions import TelegramRetryAfter
+
+from app.services.outbound import OutboundScheduler, bulk_sending
+from benchmarks.bot_api_stub import BotApiStub
+
+SEND_TIME = 0.02
+SENDERS = 20
+
+
+async def send_with_own_retry(bot: Bot, chat_id: int, text: str):
+    """Как отправляют модули без планировщика: ждать retry_after и повторить"""
+    while True:
+        try:
+            return await bot.send_message(chat_id, text)
+        except TelegramRetryAfter as e:
+            await asyncio.sleep(e.retry_after)
+
+
+async def run(messages: int, scheduled: bool) -> dict:
+    stub = await BotApiStub(latency=SEND_TIME, flood_rate=30.0).start()
+    session = AiohttpSession(api=TelegramAPIServer.from_base(stub.base_url))
+    if scheduled:
+        session.middleware(OutboundScheduler())
+    bot = Bot("42:BENCH", session=session)
+    queue = list(range(1, messages + 1))
+    reply_latency = []
+    done = asyncio.Event()
+
+    async def sender():
+        with bulk_sending():
+            while queue:
+                await send_with_own_retry(bot, queue.pop(), "📢 рассылка")
+
+    async def replies():
+        user_id = 10_000_000
+        while not done.is_set():
+            user_id += 1
+            started = time.perf_counter()
+            await send_with_own_retry(bot, user_id, "ответ")
+            reply_latency.append(time.perf_counter() - started)
+            await asyncio.sleep(0.2)
+
+    started = time.perf_counter()
+    reply_task = asyncio.create_task(replies())
+    await asyncio.gather(*(sender() for _ in range(SENDERS)))
+    elapsed = time.perf_counter() - started
+    done.set()
+    await reply_task
+    await session.close()
+    await stub.stop()
+    reply_latency.sort()
+    return {
+        "seconds": elapsed,
+        "flood_errors": stub.flood_errors,
+        "reply_p50": reply_latency[len(reply_latency) // 2] * 1000,
+        "reply_max": reply_latency[-1] * 1000
+    }
+
+
+def main(messages: int = 600):
+    for scheduled in (False, True):
+        result = asyncio.run(run(messages, scheduled))
+        label = "🗓 с планировщиком" if scheduled else "🔀 без планировщика"
+        print(f"{label}: {messages} сообщений за {result['seconds']:.1f} с, 429: {result['flood_errors']}, "
+              f"ответ пользователю p50 {result['reply_p50']:.0f} мс, max {result['reply_max']:.0f} мс")
+
+
+if __name__ == "__main__":
+    args = [int(a) for a in sys.argv[1:2]]
+    main(*args)
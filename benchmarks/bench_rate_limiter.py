@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк лимитера: память на ключ и цена проверки на миллионе пользователей
+
+Запуск: python -m benchmarks.bench_rate_limiter [ключей]
+Сравнение с наивным token bucket: объект (tokens, updated_at) на ключ,
+который никогда не удаляется.
+"""
+import sys
+import time
+import tracemalloc
+
+from app.services.rate_limiter import RatePolicy, TokenBucketLimiter
+
+POLICY = RatePolicy.per_minute(60, burst=20)
+
+
+class NaiveBucket:
+    def __init__(self, tokens: float, updated_at: float):
+        self.tokens = tokens
+        self.updated_at = updated_at
+
+
+class NaiveLimiter:
+    def __init__(self, policy: RatePolicy):
+        self.policy = policy
+        self.buckets = {}
+
+    def allow(self, key) -> bool:
+        now = time.monotonic()
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            bucket = self.buckets[key] = NaiveBucket(self.policy.burst, now)
+        bucket.tokens = min(self.policy.burst, bucket.tokens + (now - bucket.updated_at) * self.policy.rate)
+        bucket.updated_at = now
+        if bucket.tokens >= 1:
+            bucket.tokens -= 1
+            return True
+        return False
+
+
+def measure(limiter, keys: int):
+    """(байт на ключ, мкс на проверку)"""
+    tracemalloc.start()
+    started = time.perf_counter()
+    for key in range(keys):
+        limiter.allow(key)
+    elapsed = time.perf_counter() - started
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return size / keys, elapsed / keys * 1e6
+
+
+def main(keys: int = 1_000_000):
+    naive_bytes, naive_us = measure(NaiveLimiter(POLICY), keys)
+    print(f"🐢 наивный бакет: {naive_bytes:6.0f} Б/ключ, {naive_us:.2f} мкс/проверку")
+
+    clock_now = [0.0]
+    limiter = TokenBucketLimiter("bench", POLICY, clock=lambda: clock_now[0])
+    gcra_bytes, gcra_us = measure(limiter, keys)
+    print(f"🪣 GCRA лимитер:  {gcra_bytes:6.0f} Б/ключ, {gcra_us:.2f} мкс/проверку")
+
+    # Горячий ключ (повторные проверки без новых ключей)
+    started = time.perf_counter()
+    for _ in range(keys):
+        limiter.allow(42)
+    print(f"🔥 повторная проверка ключа: {(time.perf_counter() - started) / keys * 1e6:.2f} мкс")
+
+    clock_now[0] += 2 * POLICY.window
+    limiter.allow("after-idle")
+    print(f"🧹 через два окна ({2 * POLICY.window:.0f} с) без запросов в памяти {len(limiter)} ключ(ей) "
+          f"из {keys}; наивный хранит все {keys}")
+
+
+if __name__ == "__main__":
+    args = [int(a) for a in sys.argv[1:2]]
+    main(*args)
@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк латентности покупки Stars: новая ClientSession на запрос vs общий клиент
+
+Запуск: python -m benchmarks.bench_rhombis_purchase [кол-во покупок] [параллельность]
+"""
+import asyncio
+import statistics
+import sys
+import time
+
+import aiohttp
+
+from app.services.rhombis_stars_api import RhombisStarsAPI
+from benchmarks.rhombis_stub import RhombisStub
+
+
+async def purchase_per_request_session(base_url: str, username: str, amount: int):
+    """Старый путь: новая сессия (и новое соединение) на каждую покупку"""
+    async with aiohttp.ClientSession() as session:
+        async with session.get(f"{base_url}/stars/recipient?username={username}") as resp:
+            recipient = (await resp.json())["recipient"]
+        async with session.post(f"{base_url}/stars/transaction",
+                                json={"recipient": recipient, "quantity": amount}) as resp:
+            return await resp.json()
+
+
+async def purchase_shared_client(api: RhombisStarsAPI, username: str, amount: int):
+    """Новый путь: общий клиент с keep-alive пулом"""
+    recipient = (await api.get_stars_recipient(username))["data"]["recipient"]
+    return (await api.create_stars_purchase(recipient, amount))["data"]
+
+
+async def run_case(name: str, stub: RhombisStub, make_call, total: int, concurrency: int):
+    latencies = []
+    semaphore = asyncio.Semaphore(concurrency)
+    connections_before = stub.connections
+
+    async def one(i):
+        async with semaphore:
+            start = time.perf_counter()
+            await make_call(f"user{i % 50}", 100)
+            latencies.append((time.perf_counter() - start) * 1000)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(total)))
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    p95 = latencies[int(len(latencies) * 0.95) - 1]
+    print(f"{name:<28} {total / elapsed:>8.0f} rps  "
+          f"p50={statistics.median(latencies):6.2f}ms  p95={p95:6.2f}ms  "
+          f"tcp_conns={stub.connections - connections_before}")
+
+
+async def main(total: int = 500, concurrency: int = 20):
+    stub = await RhombisStub(latency=0.002).start()
+    api = RhombisStarsAPI(base_url=stub.base_url)
+    try:
+        print(f"🔬 {total} покупок, параллельность {concurrency}, stub {stub.base_url}")
+        await run_case("per-request ClientSession", stub,
+                       lambda u, a: purchase_per_request_session(stub.base_url, u, a),
+                       total, concurrency)
+        await run_case("shared RhombisStarsAPI", stub,
+                       lambda u, a: purchase_shared_client(api, u, a),
+                       total, concurrency)
+        print("ℹ️  Stub работает по HTTP: в продакшене к разнице добавляется TLS handshake и DNS")
+    finally:
+        await api.close_session()
+        await stub.stop()
+
+
+if __name__ == "__main__":
+    args = [int(a) for a in sys.argv[1:3]]
+    asyncio.run(main(*args))
@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк моделей строк: dict(sqlite3.Row) + SELECT * (старый путь) vs
+slots-модели с явной проекцией и row_factory
+
+Запуск: python -m benchmarks.bench_row_models [пользователей]
+По умолчанию 100k пользователей: память закэшированного набора и
+выделения/время на чтение одной строки.
+"""
+import gc
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from app.db import USER_SELECT, Database, epoch_day
+from app.models import User
+
+
+def seed(db: Database, users: int):
+    with db.get_connection() as conn:
+        conn.executemany(
+            "INSERT INTO users (user_id, username, first_name, wallet_address, registration_date) "
+            "VALUES (?, ?, 'Bench', ?, '2026-01-01 12:00:00')",
+            ((uid, f"user{uid}", f"UQ{uid:046d}") for uid in range(1, users + 1))
+        )
+        conn.commit()
+
+
+def load_legacy(conn: sqlite3.Connection):
+    conn.row_factory = sqlite3.Row
+    return [dict(row) for row in conn.execute("SELECT * FROM users")]
+
+
+def load_rows(conn: sqlite3.Connection):
+    cursor = conn.cursor()
+    cursor.row_factory = User.factory
+    return cursor.execute(USER_SELECT, (epoch_day(),)).fetchall()
+
+
+def resident(loader, path: str):
+    """Байт, занятых загруженным набором (tracemalloc, после выхода из запроса)"""
+    conn = sqlite3.connect(path)
+    gc.collect()
+    tracemalloc.start()
+    rows = loader(conn)
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    conn.close()
+    return len(rows), size
+
+
+def per_row(loader, path: str, user_ids):
+    """Выделения и время на чтение одного пользователя по ключу"""
+    conn = sqlite3.connect(path)
+    legacy = loader is load_legacy
+    if legacy:
+        conn.row_factory = sqlite3.Row
+    query = "SELECT * FROM users WHERE user_id = ?" if legacy else f"{USER_SELECT} WHERE users.user_id = ?"
+    today = epoch_day()
+
+    def fetch(uid):
+        cursor = conn.cursor()
+        if not legacy:
+            cursor.row_factory = User.factory
+        row = cursor.execute(query, (uid,) if legacy else (today, uid)).fetchone()
+        return dict(row) if legacy else row
+
+    started = time.perf_counter()
+    for uid in user_ids:
+        fetch(uid)
+    elapsed = time.perf_counter() - started
+
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    kept = [fetch(uid) for uid in user_ids[:1000]]
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    stats = after.compare_to(before, "filename")
+    blocks = sum(s.count_diff for s in stats)
+    size = sum(s.size_diff for s in stats)
+    conn.close()
+    del kept
+    return elapsed / len(user_ids) * 1e6, blocks / 1000, size / 1000
+
+
+def main(users: int = 100_000):
+    with tempfile.TemporaryDirectory() as root:
+        path = os.path.join(root, "bench.db")
+        db = Database(path)
+        db.init()
+        seed(db, users)
+        print(f"🌱 {users} пользователей")
+
+        for name, loader in (("dict(Row)", load_legacy), ("User slots", load_rows)):
+            count, size = resident(loader, path)
+            print(f"💾 {name:<11} {count} строк {size / 2**20:7.1f} MB ({size / count:5.0f} B/строку)")
+
+        ids = list(range(1, users + 1, max(1, users // 20_000)))
+        for name, loader in (("dict(Row)", load_legacy), ("User slots", load_rows)):
+            micros, blocks, size = per_row(loader, path, ids)
+            print(f"⚡ {name:<11} {micros:6.1f} мкс/чтение {blocks:5.1f} блоков {size:6.0f} B удержано")
+
+
+if __name__ == "__main__":
+    args = [int(a) for a in sys.argv[1:2]]
+    main(*args)
@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк холодного старта: от запуска процесса до ответа пользователю
+
+Запуск: python -m benchmarks.bench_startup [запусков]
+Каждый запуск - отдельный процесс `python main.py` на новой базе во
+временном каталоге, Bot API - заглушка (BOT_API_URL). Сразу после запуска
+на /webhook уходит /start: он ждёт в backlog ядра или в буфере StartupGate.
+Замеряются: порт принимает соединения, первый HTTP-ответ, первый ответ
+бота в чат; фазы изнутри процесса берутся из /healthz -> startup.
+"""
+import asyncio
+import os
+import signal
+import socket
+import statistics
+import sys
+import tempfile
+import time
+from typing import Any, Dict, List
+
+import aiohttp
+
+from benchmarks.bot_api_stub import BotApiStub
+
+MAIN = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "main.py")
+USER_ID = 777
+BOOT_TIMEOUT = 60.0
+STOP_TIMEOUT = 5.0
+PHASES = ("listening", "gate", "imports", "dispatcher", "serving", "database", "ready")
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_update() -> Dict[str, Any]:
+    user = {"id": USER_ID, "is_bot": False, "first_name": "Bench", "username": "bench"}
+    return {
+        "update_id": 1,
+        "message": {
+            "message_id": 1,
+            "date": int(time.time()),
+            "chat": {"id": USER_ID, "type": "private", "first_name": "Bench"},
+            "from": user,
+            "text": "/start"
+        }
+    }
+
+
+async def wait_accept(port: int, deadline: float):
+    while True:
+        try:
+            _, writer = await asyncio.open_connection("127.0.0.1", port)
+            writer.close()
+            return
+        except OSError:
+            if time.perf_counter() > deadline:
+                raise TimeoutError("port never opened")
+            await asyncio.sleep(0.005)
+
+
+async def wait_ready(session: aiohttp.ClientSession, url: str, deadline: float) -> Dict[str, Any]:
+    while True:
+        async with session.get(url) as response:
+            body = await response.json()
+        if body.get("status") == "ok" and body["startup"]["first_update_s"] is not None:
+            return body["startup"]
+        if time.perf_counter() > deadline:
+            raise TimeoutError(f"bot never became ready: {body}")
+        await asyncio.sleep(0.05)
+
+
+async def cold_start(stub: BotApiStub) -> Dict[str, float]:
+    port = free_port()
+    with tempfile.TemporaryDirectory() as root:
+        env = dict(os.environ,
+                   BOT_TOKEN="42:BENCH", BOT_API_URL=stub.base_url, PORT=str(port),
+                   DB_PATH=os.path.join(root, "bot.db"), REQUIRED_CHANNEL_ID="-1001",
+                   REQUIRED_GROUP_ID="-1002", FSM_STORAGE="sqlite", WORKERS="0")
+        env.pop("REPL_DEPLOYMENT", None)
+        reply = stub.wait_reply(USER_ID)
+        started = time.perf_counter()
+        # cwd - временный каталог: main.py переписывает public/tonconnect-manifest.json
+        process = await asyncio.create_subprocess_exec(
+            sys.executable, MAIN, cwd=root, env=env,
+            stdout=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.DEVNULL
+        )
+        deadline = started + BOOT_TIMEOUT
+        try:
+            await wait_accept(port, deadline)
+            accepted = time.perf_counter() - started
+            async with aiohttp.ClientSession() as session:
+                async with session.post(f"http://127.0.0.1:{port}/webhook", json=start_update()) as response:
+                    await response.read()
+                    status = response.status
+                responded = time.perf_counter() - started
+                await asyncio.wait_for(reply, deadline - time.perf_counter())
+                replied = time.perf_counter() - started
+                phases = await wait_ready(session, f"http://127.0.0.1:{port}/healthz", deadline)
+        finally:
+            if process.returncode is None:
+                # SIGTERM только планирует graceful_shutdown - добиваем по таймауту
+                process.send_signal(signal.SIGTERM)
+                try:
+                    await asyncio.wait_for(process.wait(), STOP_TIMEOUT)
+                except asyncio.TimeoutError:
+                    process.kill()
+                    await process.wait()
+        if status != 200:
+            raise RuntimeError(f"/webhook answered {status}")
+        result = {"accept": accepted, "http": responded, "reply": replied,
+                  "first_update": phases["first_update_s"], "buffered": phases["buffered"]}
+        result.update({phase: phases["phases"].get(phase) for phase in PHASES})
+        return result
+
+
+async def main(runs: int = 5):
+    stub = await BotApiStub().start()
+    results: List[Dict[str, float]] = []
+    try:
+        for index in range(runs):
+            result = await cold_start(stub)
+            results.append(result)
+            print(f"🚀 Запуск {index + 1}: порт {result['accept']:.2f} с, HTTP-ответ {result['http']:.2f} с, "
+                  f"ответ бота {result['reply']:.2f} с (в буфере: {result['buffered']})")
+    finally:
+        await stub.stop()
+
+    def median(key: str) -> float:
+        return statistics.median(r[key] for r in results if r[key] is not None)
+
+    print(f"\n⏱ Медиана по {runs} запускам (с от старта процесса):")
+    print(f"   порт принимает соединения: {median('accept'):.2f}")
+    print(f"   первый ответ на /webhook:  {median('http'):.2f}")
+    print(f"   первый ответ бота в чат:   {median('reply'):.2f}")
+    print("   фазы внутри процесса: " + ", ".join(f"{phase} {median(phase):.2f}" for phase in PHASES)
+          + f", first_update {median('first_update'):.2f}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main(*[int(a) for a in sys.argv[1:2]]))
@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк холодной и повторной загрузки Mini App: старая раздача (FileResponse/add_static
+без кэш-заголовков и сжатия) vs предсжатая статика из памяти
+
+Запуск: python -m benchmarks.bench_static_assets
+Сеть моделируется как мобильный 3G: RTT 300 мс, 1.6 Мбит/с.
+"""
+import asyncio
+import os
+import shutil
+import tempfile
+import time
+
+from aiohttp import web
+from aiohttp.test_utils import TestClient, TestServer
+
+from app.handlers.static import setup_static_routes
+from app.middleware.cors import cors_middleware
+
+RTT = 0.3
+BANDWIDTH = 1.6e6 / 8  # байт/с
+PAGE = ["/", "/assets/index-Bk94vXp6.js", "/assets/index-Dy124E9Q.css",
+        "/tonconnect-manifest.json", "/icon.png"]
+
+
+def make_dist(root: str) -> str:
+    """Собрать dist из закоммиченных артефактов сборки"""
+    dist = os.path.join(root, "dist")
+    os.makedirs(os.path.join(dist, "assets"))
+    shutil.copy("index.html", os.path.join(dist, "index.html"))
+    for name in os.listdir("assets"):
+        shutil.copy(os.path.join("assets", name), os.path.join(dist, "assets", name))
+    return dist
+
+
+def legacy_app(dist: str) -> web.Application:
+    app = web.Application()
+    app.router.add_static("/assets", os.path.join(dist, "assets"))
+    app.router.add_get("/", lambda r: web.FileResponse(os.path.join(dist, "index.html")))
+    app.router.add_get("/tonconnect-manifest.json",
+                       lambda r: web.FileResponse("public/tonconnect-manifest.json"))
+    app.router.add_get("/icon.png", lambda r: web.FileResponse("public/icon.png"))
+    return app
+
+
+def new_app(dist: str) -> web.Application:
+    app = web.Application(middlewares=[cors_middleware()])
+    setup_static_routes(app, dist_dir=dist)
+    return app
+
+
+async def load_page(client: TestClient, cache: dict):
+    """Загрузить страницу как браузер: учитываем Cache-Control и ETag"""
+    wire_bytes = requests = 0
+    server_time = 0.0
+    for path in PAGE:
+        cached = cache.get(path)
+        if cached and "immutable" in cached.get("cache_control", ""):
+            continue  # браузер даже не спрашивает сервер
+        headers = {"Accept-Encoding": "gzip, br"}
+        if cached and cached.get("etag"):
+            headers["If-None-Match"] = cached["etag"]
+        started = time.perf_counter()
+        resp = await client.get(path, headers=headers, auto_decompress=False)
+        body = await resp.read()
+        server_time += time.perf_counter() - started
+        requests += 1
+        wire_bytes += len(body) + 300  # + примерный размер заголовков
+        cache[path] = {
+            "etag": resp.headers.get("ETag"),
+            "cache_control": resp.headers.get("Cache-Control", "")
+        }
+    # index.html -> параллельная загрузка ресурсов: 2 RTT + передача
+    network = (2 * RTT if requests else 0) + wire_bytes / BANDWIDTH
+    return requests, wire_bytes, network, server_time
+
+
+async def run(name: str, app: web.Application):
+    async with TestClient(TestServer(app)) as client:
+        cache: dict = {}
+        for label in ("cold", "repeat"):
+            requests, wire, network, server = await load_page(client, cache)
+            print(f"{name:<8} {label:<6} requests={requests}  bytes={wire / 1024:7.1f} KB  "
+                  f"3G≈{network * 1000:6.0f} ms  server={server * 1000:5.1f} ms")
+
+
+async def main():
+    with tempfile.TemporaryDirectory() as root:
+        dist = make_dist(root)
+        await run("legacy", legacy_app(dist))
+        await run("static", new_app(dist))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
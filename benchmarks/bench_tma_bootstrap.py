@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк клиента TMA API: отдельные запросы config/products/user/recipient vs /api/bootstrap
+
+Запуск: python -m benchmarks.bench_tma_bootstrap
+Меряется серверная сторона: встроенный React-клиент (src/) эти эндпоинты при
+открытии не вызывает, он ходит в Rhombis напрямую.
+Каждый HTTP запрос получает задержку мобильной сети (RTT), как у Mini App в Telegram.
+"""
+import asyncio
+import os
+import tempfile
+import time
+
+from aiohttp import web
+from aiohttp.test_utils import TestClient, TestServer
+
+import app.services.rhombis_stars_api as rhombis
+from app.config import Settings
+from app.context import set_context
+from app.db import Database
+from app.handlers import tma
+from benchmarks.rhombis_stub import RhombisStub
+
+RTT = 0.15
+USER_ID = 777000
+
+
+@web.middleware
+async def mobile_rtt(request, handler):
+    await asyncio.sleep(RTT)
+    return await handler(request)
+
+
+async def open_legacy(client: TestClient) -> int:
+    """Без bootstrap: config, products, профиль параллельно, затем получатель по username"""
+    config, products, user = await asyncio.gather(
+        client.get("/api/config"),
+        client.get("/api/products"),
+        client.get(f"/api/user/{USER_ID}")
+    )
+    username = (await user.json())["user"]["username"]
+    await config.json()
+    await products.json()
+    await (await client.get(f"/api/user/{username}")).json()
+    return 4
+
+
+async def open_bootstrap(client: TestClient, etag: str = None) -> int:
+    headers = {"If-None-Match": etag} if etag else {}
+    resp = await client.get(f"/api/bootstrap?user_id={USER_ID}", headers=headers)
+    await resp.read()
+    return 1
+
+
+async def measure(name: str, opener, client: TestClient, runs: int = 20):
+    samples = []
+    for _ in range(runs):
+        tma.bootstrap_cache.clear()
+        started = time.perf_counter()
+        requests = await opener(client)
+        samples.append(time.perf_counter() - started)
+    samples.sort()
+    print(f"{name:<22} requests={requests}  TTI p50={samples[len(samples) // 2] * 1000:6.0f} ms  "
+          f"p95={samples[int(len(samples) * 0.95) - 1] * 1000:6.0f} ms")
+
+
+async def main():
+    with tempfile.TemporaryDirectory() as root:
+        db = Database(os.path.join(root, "bench.db"))
+        db.init()
+        db.create_user(USER_ID, "bench_user", "Bench")
+        set_context(Settings(BOT_TOKEN="", REQUIRED_CHANNEL_ID="", REQUIRED_GROUP_ID=""), db)
+
+        stub = await RhombisStub(latency=0.02).start()
+        rhombis._rhombis_stars_api = rhombis.RhombisStarsAPI(stub.base_url)
+
+        app = web.Application(middlewares=[mobile_rtt])
+        tma.setup_tma_routes(app)
+        async with TestClient(TestServer(app)) as client:
+            await measure("legacy (4 endpoints)", open_legacy, client)
+            await measure("bootstrap", open_bootstrap, client)
+
+            resp = await client.get(f"/api/bootstrap?user_id={USER_ID}")
+            etag = resp.headers["ETag"]
+            revalidate = await client.get(f"/api/bootstrap?user_id={USER_ID}",
+                                          headers={"If-None-Match": etag})
+            print(f"bootstrap revalidation  status={revalidate.status}  "
+                  f"body={len(await revalidate.read())} bytes")
+        await stub.stop()
+        print(f"ℹ️  RTT={RTT * 1000:.0f} мс на запрос, получатель из Rhombis stub (20 мс)")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
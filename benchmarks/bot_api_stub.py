@@ -0,0 +1,209 @@
+"""
+Локальная заглушка Telegram Bot API для нагрузочных тестов и бенчмарков
+
+Бот направляется на неё через BOT_API_URL (Settings) или
+TelegramAPIServer.from_base(stub.base_url). Реализованы getMe, getChat,
+getChatMember, sendMessage, editMessageText, answerCallbackQuery,
+setWebhook/deleteWebhook/getWebhookInfo; остальные методы отвечают true.
+
+Поведение Telegram настраивается на лету:
+latency / method_latency - задержка ответа (общая и по методам),
+error_rate - доля ответов 500, retry_after_rate - доля 429 RetryAfter,
+flood_rate - лимит сообщений в секунду на бота (сверх него 429, как у Telegram),
+blocked / blocked_rate - пользователи, заблокировавшие бота (403 на отправку),
+left_rate - доля пользователей, не подписанных на каналы (getChatMember: left).
+
+Заглушка запоминает последнее сообщение в каждом чате (текст и клавиатуру),
+чтобы виртуальный пользователь мог "прочитать" ответ бота - например,
+решить капчу, - и будит тех, кто ждёт ответа в этом чате.
+"""
+import asyncio
+import itertools
+import json
+import random
+import time
+from collections import Counter, defaultdict
+from typing import Any, Dict, Iterable, List, Optional
+
+from aiohttp import web
+
+from app.services.rate_limiter import RatePolicy, TokenBucketLimiter
+
+BOT_USER = {"id": 42, "is_bot": True, "first_name": "Stub", "username": "stub_bot"}
+
+# Методы, которые Telegram считает сообщениями (flood control, блокировка)
+_MESSAGE_METHODS = frozenset({"sendMessage", "sendPhoto", "sendDocument", "editMessageText",
+                              "editMessageReplyMarkup", "copyMessage", "forwardMessage"})
+
+
+def _chat(chat_id: int) -> Dict[str, Any]:
+    if chat_id < 0:
+        return {"id": chat_id, "type": "supergroup", "title": f"Chat {chat_id}"}
+    return {"id": chat_id, "type": "private", "first_name": f"User {chat_id}"}
+
+
+def _chat_full(chat_id: int) -> Dict[str, Any]:
+    """Ответ getChat: ChatFullInfo требует ещё несколько обязательных полей"""
+    gifts = dict.fromkeys(("unlimited_gifts", "limited_gifts", "unique_gifts",
+                           "premium_subscription", "gifts_from_channels"), True)
+    return {**_chat(chat_id), "accent_color_id": 0, "max_reaction_count": 11, "accepted_gift_types": gifts}
+
+
+def _share(user_id: int, salt: int) -> float:
+    """Детерминированная доля [0, 1) для пользователя: один и тот же ответ при повторах"""
+    return ((user_id * 2654435761 + salt) % 1_000_003) / 1_000_003
+
+
+class BotApiError(Exception):
+    def __init__(self, code: int, description: str, retry_after: Optional[int] = None):
+        self.code = code
+        self.description = description
+        self.retry_after = retry_after
+
+
+class BotApiStub:
+    """Bot API с настраиваемыми задержками и сбоями"""
+
+    def __init__(self, latency: float = 0.0, method_latency: Optional[Dict[str, float]] = None,
+                 error_rate: float = 0.0, retry_after_rate: float = 0.0, retry_after: int = 1,
+                 flood_rate: Optional[float] = None, blocked: Iterable[int] = (),
+                 blocked_rate: float = 0.0, left_rate: float = 0.0,
+                 host: str = "127.0.0.1", port: int = 0):
+        self.latency = latency
+        self.method_latency = dict(method_latency or {})
+        self.error_rate = error_rate
+        self.retry_after_rate = retry_after_rate
+        self.retry_after = retry_after
+        self.flood = TokenBucketLimiter("telegram", RatePolicy(rate=flood_rate, burst=max(1, int(flood_rate)))) \
+            if flood_rate else None
+        self.blocked = set(blocked)
+        self.blocked_rate = blocked_rate
+        self.left_rate = left_rate
+        self.host = host
+        self.port = port
+        self.webhook_url = ""
+        self.calls: Counter = Counter()
+        self.errors: Counter = Counter()
+        self.last_message: Dict[int, Dict[str, Any]] = {}
+        self._message_ids = itertools.count(1)
+        self._waiters: Dict[int, List[asyncio.Future]] = defaultdict(list)
+        self.runner: Optional[web.AppRunner] = None
+
+    @property
+    def base_url(self) -> str:
+        return f"http://{self.host}:{self.port}"
+
+    @property
+    def flood_errors(self) -> int:
+        return self.errors[429]
+
+    def is_blocked(self, user_id: int) -> bool:
+        return user_id in self.blocked or (user_id > 0 and _share(user_id, 1) < self.blocked_rate)
+
+    def is_left(self, user_id: int) -> bool:
+        return _share(user_id, 2) < self.left_rate
+
+    def wait_reply(self, chat_id: int) -> asyncio.Future:
+        """Future следующего вызова Bot API в этот чат (вызывать до отправки апдейта)"""
+        future = asyncio.get_running_loop().create_future()
+        self._waiters[chat_id].append(future)
+        return future
+
+    def _notify(self, chat_id: int, method: str):
+        for future in self._waiters.pop(chat_id, ()):
+            if not future.done():
+                future.set_result(method)
+
+    def _message(self, chat_id: int, params: Dict[str, str], message_id: Optional[int] = None) -> Dict[str, Any]:
+        markup = params.get("reply_markup")
+        self.last_message[chat_id] = {
+            "text": params.get("text", ""),
+            "reply_markup": json.loads(markup) if markup else None
+        }
+        return {
+            "message_id": message_id or next(self._message_ids),
+            "date": int(time.time()),
+            "chat": _chat(chat_id),
+            "from": BOT_USER,
+            "text": params.get("text", "")
+        }
+
+    def _check_faults(self, method: str, chat_id: Optional[int]):
+        if self.error_rate and random.random() < self.error_rate:
+            raise BotApiError(500, "Internal Server Error")
+        if method not in _MESSAGE_METHODS:
+            return
+        if self.retry_after_rate and random.random() < self.retry_after_rate:
+            raise BotApiError(429, f"Too Many Requests: retry after {self.retry_after}", self.retry_after)
+        if self.flood is not None:
+            allowed, retry_after = self.flood.hit("bot")
+            if not allowed:
+                seconds = max(1, round(retry_after))
+                raise BotApiError(429, f"Too Many Requests: retry after {seconds}", seconds)
+        if chat_id is not None and self.is_blocked(chat_id):
+            raise BotApiError(403, "Forbidden: bot was blocked by the user")
+
+    def _result(self, method: str, params: Dict[str, str], chat_id: Optional[int]) -> Any:
+        if method == "getMe":
+            return BOT_USER
+        if method in ("sendMessage", "sendPhoto", "sendDocument") and chat_id is not None:
+            return self._message(chat_id, params)
+        if method in ("editMessageText", "editMessageReplyMarkup") and chat_id is not None:
+            return self._message(chat_id, params, int(params.get("message_id", 0)) or None)
+        if method == "getChatMember":
+            user_id = int(params["user_id"])
+            status = "left" if user_id != BOT_USER["id"] and self.is_left(user_id) else "member"
+            return {"status": status, "user": {"id": user_id, "is_bot": False, "first_name": "User"}}
+        if method == "getChat" and chat_id is not None:
+            return _chat_full(chat_id)
+        if method == "setWebhook":
+            self.webhook_url = params.get("url", "")
+        elif method == "deleteWebhook":
+            self.webhook_url = ""
+        elif method == "getWebhookInfo":
+            return {"url": self.webhook_url, "has_custom_certificate": False, "pending_update_count": 0}
+        return True
+
+    async def handle(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"]
+        params = {key: str(value) for key, value in (await request.post()).items()}
+        self.calls[method] += 1
+        delay = self.method_latency.get(method, self.latency)
+        if delay:
+            await asyncio.sleep(delay)
+
+        raw_chat = params.get("chat_id", "")
+        chat_id = int(raw_chat) if raw_chat.lstrip("-").isdigit() else None
+        try:
+            self._check_faults(method, chat_id)
+            response = web.json_response({"ok": True, "result": self._result(method, params, chat_id)})
+        except BotApiError as e:
+            self.errors[e.code] += 1
+            body = {"ok": False, "error_code": e.code, "description": e.description}
+            if e.retry_after is not None:
+                body["parameters"] = {"retry_after": e.retry_after}
+            response = web.json_response(body, status=e.code)
+
+        # answerCallbackQuery адресован callback'у: id виртуальных апдейтов - "user_id:номер"
+        target = raw_chat or params.get("callback_query_id", "").split(":", 1)[0]
+        if target.lstrip("-").isdigit():
+            self._notify(int(target), method)
+        return response
+
+    def stats(self) -> Dict[str, Any]:
+        return {"calls": dict(self.calls), "errors": dict(self.errors)}
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_post("/bot{token}/{method}", self.handle)
+        self.runner = web.AppRunner(app)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, self.host, self.port)
+        await site.start()
+        self.port = site._server.sockets[0].getsockname()[1]
+        return self
+
+    async def stop(self):
+        if self.runner:
+            await self.runner.cleanup()
+            self.runner = None
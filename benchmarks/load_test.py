@@ -0,0 +1,467 @@
+#!/usr/bin/env python3
+"""
+Нагрузочный тест: виртуальные пользователи проходят сценарии бота через /webhook
+
+Запуск: python -m benchmarks.load_test [--rate 20] [--duration 30] [--users 2000]
+        [--mix newcomer=2,capsule=3,checkin=2,tasks=2,withdrawal=1,browse=2] [--json out.json]
+        [--api-latency 0.05] [--api-errors 0.01] [--left 0.1]
+
+Поднимает BotManager (те же роутеры и middleware, что в проде) на временной
+базе, Bot API - локальная заглушка (BOT_API_URL); её задержку и сбои задают
+--api-latency, --api-errors и --left. Апдейты идут POST-запросами на /webhook,
+как от Telegram. Каждую секунду стартует --rate сценариев (открытая модель:
+если бот не успевает, растут задержки, а не падает нагрузка). Шаг сценария
+ждёт первого ответа бота в чат - это задержка, которую видит пользователь.
+
+Отчёт: пропускная способность, перцентили ответа по шагам, время апдейтов
+по хендлерам, доля базы и медленные запросы, лаг event loop.
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import logging
+import os
+import random
+import re
+import tempfile
+import time
+from collections import Counter, defaultdict
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+import aiohttp
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler
+from aiohttp import web
+
+from app.context import get_db
+from app.middleware.metrics import http_metrics_middleware
+from app.middleware.user_serial import UPDATE_DEBOUNCE_WINDOW
+from app.services.metrics import Histogram, metrics
+from app.services.query_trace import query_tracer
+from benchmarks.bot_api_stub import BOT_USER, BotApiStub
+
+STEP_TIMEOUT = 10.0
+SEED_USER_BASE = 1_000_000
+NEW_USER_BASE = 5_000_000
+
+DEFAULT_MIX = {"newcomer": 2, "capsule": 3, "checkin": 2, "tasks": 2, "withdrawal": 1, "browse": 2}
+
+_CAPTCHA = re.compile(r"(\d+) ([+\-*×]) (\d+) = \?")
+
+
+def solve_captcha(text: str) -> Optional[int]:
+    match = _CAPTCHA.search(text)
+    if not match:
+        return None
+    left, operation, right = int(match.group(1)), match.group(2), int(match.group(3))
+    if operation == "+":
+        return left + right
+    if operation == "-":
+        return left - right
+    return left * right
+
+
+class LoadRun:
+    """Общее состояние прогона: HTTP-клиент, заглушка, счётчики"""
+
+    def __init__(self, webhook_url: str, stub: BotApiStub, session: aiohttp.ClientSession,
+                 seeded_users: int, think: float):
+        self.webhook_url = webhook_url
+        self.stub = stub
+        self.session = session
+        self.seeded_users = seeded_users
+        self.think = think
+        self.update_ids = itertools.count(1)
+        self.new_user_ids = itertools.count(NEW_USER_BASE)
+        self.step_latency: Dict[str, Histogram] = defaultdict(Histogram)
+        self.timeouts: Counter = Counter()
+        self.journeys: Counter = Counter()
+        self.failed: Counter = Counter()
+        self.updates = 0
+        self.http_errors = 0
+
+    def returning_user(self) -> 'VirtualUser':
+        return VirtualUser(self, SEED_USER_BASE + random.randrange(self.seeded_users))
+
+    def new_user(self) -> 'VirtualUser':
+        return VirtualUser(self, next(self.new_user_ids))
+
+    async def post(self, user_id: int, step: str, update: Dict[str, Any]) -> bool:
+        """Отправить апдейт и дождаться первого ответа бота в чат пользователя"""
+        reply = self.stub.wait_reply(user_id)
+        started = time.perf_counter()
+        try:
+            async with self.session.post(self.webhook_url, json=update) as response:
+                self.updates += 1
+                if response.status != 200:
+                    self.http_errors += 1
+                    reply.cancel()
+                    return False
+            await asyncio.wait_for(reply, STEP_TIMEOUT)
+        except asyncio.TimeoutError:
+            self.timeouts[step] += 1
+            return False
+        except aiohttp.ClientError:
+            self.http_errors += 1
+            reply.cancel()
+            return False
+        self.step_latency[step].record(time.perf_counter() - started)
+        return True
+
+    async def journey(self, name: str):
+        try:
+            ok = await JOURNEYS[name](self)
+        except Exception as e:
+            logging.error(f"❌ Journey {name} crashed: {e}")
+            ok = False
+        self.journeys[name] += 1
+        if not ok:
+            self.failed[name] += 1
+
+
+class VirtualUser:
+    """Пользователь Telegram: пишет тексты кнопок меню и нажимает inline-кнопки"""
+
+    def __init__(self, run: LoadRun, user_id: int):
+        self.run = run
+        self.id = user_id
+        self.profile = {"id": user_id, "is_bot": False, "first_name": f"Load {user_id}", "username": f"load{user_id}"}
+        self._callback_ids = itertools.count(1)
+
+    @property
+    def last_reply(self) -> Dict[str, Any]:
+        return self.run.stub.last_message.get(self.id) or {}
+
+    def buttons(self, prefix: str) -> List[str]:
+        """callback_data inline-кнопок последнего ответа бота"""
+        markup = self.last_reply.get("reply_markup") or {}
+        return [button["callback_data"] for row in markup.get("inline_keyboard", []) for button in row
+                if button.get("callback_data", "").startswith(prefix)]
+
+    def _chat_message(self, text: str, sender: Dict[str, Any]) -> Dict[str, Any]:
+        return {
+            "message_id": random.randrange(1, 1 << 30),
+            "date": int(time.time()),
+            "chat": {"id": self.id, "type": "private", "first_name": self.profile["first_name"]},
+            "from": sender,
+            "text": text
+        }
+
+    async def say(self, text: str, step: Optional[str] = None) -> bool:
+        update = {"update_id": next(self.run.update_ids), "message": self._chat_message(text, self.profile)}
+        return await self.run.post(self.id, step or text, update)
+
+    async def press(self, data: str, step: Optional[str] = None) -> bool:
+        update = {
+            "update_id": next(self.run.update_ids),
+            "callback_query": {
+                "id": f"{self.id}:{next(self._callback_ids)}",
+                "from": self.profile,
+                "chat_instance": str(self.id),
+                "data": data,
+                "message": self._chat_message(self.last_reply.get("text", ""), BOT_USER)
+            }
+        }
+        return await self.run.post(self.id, step or data, update)
+
+    async def think(self):
+        await asyncio.sleep(self.run.think * random.uniform(0.5, 1.5))
+
+
+# ===== СЦЕНАРИИ =====
+
+async def journey_newcomer(run: LoadRun) -> bool:
+    """Переход по реферальной ссылке, капча, проверка подписки"""
+    user = run.new_user()
+    referrer = SEED_USER_BASE + random.randrange(run.seeded_users)
+    if not await user.say(f"/start ref_{referrer}", "/start ref_"):
+        return False
+    answer = solve_captcha(user.last_reply.get("text", ""))
+    choice = next((data for data in user.buttons("captcha_") if data.endswith(f"_{answer}")), None)
+    if choice is None:
+        return False
+    await user.think()
+    if not await user.press(choice, "captcha_"):
+        return False
+    await user.think()
+    return await user.press("check_subscription")
+
+
+async def journey_capsule(run: LoadRun) -> bool:
+    user = run.returning_user()
+    for _ in range(random.randint(1, 3)):
+        if not await user.say("🎁 Открыть капсулу"):
+            return False
+        # Повтор той же кнопки быстрее окна UserSerialMiddleware схлопывается без ответа
+        await asyncio.sleep(UPDATE_DEBOUNCE_WINDOW)
+        await user.think()
+    return True
+
+
+async def journey_checkin(run: LoadRun) -> bool:
+    user = run.returning_user()
+    if not await user.say("📅 Чек-ин"):
+        return False
+    await user.think()
+    return await user.say("👤 Профиль")
+
+
+async def journey_tasks(run: LoadRun) -> bool:
+    """Список заданий, выбор задания, проверка выполнения"""
+    user = run.returning_user()
+    if not await user.say("🎯 Задания"):
+        return False
+    await user.think()
+    if not await user.press("available_tasks"):
+        return False
+    tasks = user.buttons("do_task_")
+    if not tasks:
+        return True  # всё уже выполнено
+    await user.think()
+    if not await user.press(random.choice(tasks), "do_task_"):
+        return False
+    checks = user.buttons("check_task_")
+    if not checks:
+        return True
+    await user.think()
+    return await user.press(checks[0], "check_task_")
+
+
+async def journey_withdrawal(run: LoadRun) -> bool:
+    user = run.returning_user()
+    if not await user.say("💼 Кошелек"):
+        return False
+    await user.think()
+    return await user.press("request_withdrawal")
+
+
+async def journey_browse(run: LoadRun) -> bool:
+    user = run.returning_user()
+    for text in ("👤 Профиль", "👥 Рефералы", "🏆 Топ"):
+        if not await user.say(text):
+            return False
+        await user.think()
+    return True
+
+
+JOURNEYS: Dict[str, Callable[[LoadRun], Awaitable[bool]]] = {
+    "newcomer": journey_newcomer,
+    "capsule": journey_capsule,
+    "checkin": journey_checkin,
+    "tasks": journey_tasks,
+    "withdrawal": journey_withdrawal,
+    "browse": journey_browse,
+}
+
+
+def parse_mix(text: str) -> Dict[str, float]:
+    """"newcomer=2,capsule=3" -> веса сценариев"""
+    mix = {}
+    for part in filter(None, (item.strip() for item in text.split(","))):
+        name, _, weight = part.partition("=")
+        if name not in JOURNEYS:
+            raise argparse.ArgumentTypeError(f"unknown journey '{name}', expected one of: {', '.join(JOURNEYS)}")
+        mix[name] = float(weight or 1)
+    return mix
+
+
+# ===== ПРОГОН =====
+
+class DatabaseLockCounter(logging.Handler):
+    """Сколько раз в логах встретилось "database is locked" - признак конкуренции за запись"""
+
+    def __init__(self):
+        super().__init__(logging.WARNING)
+        self.locked = 0
+
+    def emit(self, record: logging.LogRecord):
+        if "database is locked" in record.getMessage():
+            self.locked += 1
+
+
+def seed(db, users: int, tasks: int):
+    """Зарегистрированные и подписанные пользователи + активные задания партнёров"""
+    with db.get_connection() as conn:
+        conn.executemany(
+            "INSERT OR IGNORE INTO users (user_id, username, first_name, subscription_checked) VALUES (?, ?, ?, 1)",
+            ((SEED_USER_BASE + i, f"seed{i}", "Seed") for i in range(users))
+        )
+        conn.commit()
+    for i in range(tasks):
+        db.add_task(f"Партнёр {i}", "Подписаться на канал партнёра", "channel_subscription",
+                    reward_capsules=1, partner_name=f"Partner {i}", partner_url=f"https://t.me/load_partner_{i}")
+
+
+async def start_bot(stub: BotApiStub, db_path: str):
+    os.environ.update({
+        "BOT_TOKEN": "42:LOAD",
+        "DB_PATH": db_path,
+        "REQUIRED_CHANNEL_ID": "-1001",
+        "REQUIRED_GROUP_ID": "-1002",
+        "FSM_STORAGE": "sqlite",
+        "WORKERS": "0",
+        "BOT_API_URL": stub.base_url,
+    })
+    from main import BotManager
+
+    manager = BotManager()
+    await manager.initialize()
+    await manager.init_database()
+    return manager
+
+
+async def monitor_loop_lag(lag: Histogram, stop: asyncio.Event, interval: float = 0.01):
+    while not stop.is_set():
+        started = time.perf_counter()
+        await asyncio.sleep(interval)
+        lag.record(max(0.0, time.perf_counter() - started - interval))
+
+
+async def drive(run: LoadRun, mix: Dict[str, float], rate: float, duration: float):
+    """Открытая модель: сценарии стартуют по расписанию, не дожидаясь предыдущих"""
+    names, weights = list(mix), list(mix.values())
+    running = set()
+    started = time.perf_counter()
+    for index in itertools.count():
+        if time.perf_counter() - started >= duration:
+            break
+        task = asyncio.create_task(run.journey(random.choices(names, weights)[0]))
+        running.add(task)
+        task.add_done_callback(running.discard)
+        await asyncio.sleep(max(0.0, started + (index + 1) / rate - time.perf_counter()))
+    if running:
+        await asyncio.wait(running)
+
+
+async def run_load(rate: float, duration: float, users: int, mix: Dict[str, float],
+                   think: float, tasks: int, stub: BotApiStub) -> Dict[str, Any]:
+    await stub.start()
+    tmp = tempfile.TemporaryDirectory()
+    manager = await start_bot(stub, os.path.join(tmp.name, "load.db"))
+    seed(get_db(), users, tasks)
+    query_tracer.reset()
+
+    app = web.Application(middlewares=[http_metrics_middleware()])
+    SimpleRequestHandler(dispatcher=manager.dp, bot=manager.bot).register(app, path="/webhook")
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+
+    locks = DatabaseLockCounter()
+    logging.getLogger().addHandler(locks)
+    lag = Histogram()
+    stop = asyncio.Event()
+    lag_task = asyncio.create_task(monitor_loop_lag(lag, stop))
+    connector = aiohttp.TCPConnector(limit=0)
+    try:
+        async with aiohttp.ClientSession(connector=connector) as session:
+            run = LoadRun(f"http://127.0.0.1:{port}/webhook", stub, session, users, think)
+            started = time.perf_counter()
+            await drive(run, mix, rate, duration)
+            # Фоновая обработка апдейтов после последнего ответа
+            await asyncio.sleep(0.2)
+            elapsed = time.perf_counter() - started
+    finally:
+        stop.set()
+        await lag_task
+        logging.getLogger().removeHandler(locks)
+        await runner.cleanup()
+        await manager.dp.storage.close()
+        await manager.bot.session.close()
+        await stub.stop()
+        tmp.cleanup()
+
+    return report(run, elapsed, lag, locks.locked, stub, manager.outbound.stats())
+
+
+def _ms(seconds: float) -> float:
+    return round(seconds * 1000, 1)
+
+
+def report(run: LoadRun, elapsed: float, lag: Histogram, locked: int, stub: BotApiStub,
+           outbound: Dict[str, Any]) -> Dict[str, Any]:
+    update_total = sum(histogram.sum for _, histogram in metrics.series("update_seconds"))
+    db_total = sum(histogram.sum for labels, histogram in metrics.series("update_component_seconds")
+                   if labels.get("component") == "db")
+    return {
+        "seconds": round(elapsed, 1),
+        "updates": run.updates,
+        "updates_per_second": round(run.updates / elapsed, 1),
+        "journeys": dict(run.journeys),
+        "failed": dict(run.failed),
+        "timeouts": dict(run.timeouts),
+        "http_errors": run.http_errors,
+        "steps": {
+            step: {"count": h.count, "p50_ms": _ms(h.percentile(50)), "p95_ms": _ms(h.percentile(95)),
+                   "p99_ms": _ms(h.percentile(99)), "max_ms": _ms(h.max)}
+            for step, h in sorted(run.step_latency.items(), key=lambda item: -item[1].count)
+        },
+        "handlers": metrics.summary("update_seconds"),
+        "db": {
+            "share_of_update_time": round(db_total / update_total, 3) if update_total else 0.0,
+            "locked_errors": locked,
+            **query_tracer.stats(),
+            "top": [{key: query[key] for key in ("query", "calls", "total_ms", "p50_ms", "p99_ms")}
+                    for query in query_tracer.top(5)]
+        },
+        "loop_lag_ms": {"p50": _ms(lag.percentile(50)), "p99": _ms(lag.percentile(99)), "max": _ms(lag.max)},
+        "outbound": outbound,
+        "bot_api": stub.stats()
+    }
+
+
+def print_report(result: Dict[str, Any], rate: float, mix: Dict[str, float]):
+    print(f"📊 Нагрузка: {rate:g} сценариев/с, {result['seconds']} с, "
+          f"микс {', '.join(f'{name}={weight:g}' for name, weight in mix.items())}")
+    print(f"🚀 Апдейтов: {result['updates']} ({result['updates_per_second']}/с), "
+          f"сценариев: {sum(result['journeys'].values())}, неудачных: {sum(result['failed'].values())}, "
+          f"без ответа: {sum(result['timeouts'].values())}, HTTP-ошибок: {result['http_errors']}")
+    print("⏱ Ответ пользователю (POST → первый вызов Bot API):")
+    for step, stats in result["steps"].items():
+        print(f"   {step:<22} {stats['count']:>6}  p50 {stats['p50_ms']:>7} мс  p95 {stats['p95_ms']:>7} мс  "
+              f"p99 {stats['p99_ms']:>7} мс")
+    print("⚙️ Обработка апдейтов по хендлерам:")
+    for handler, stats in sorted(result["handlers"].items(), key=lambda item: -item[1]["count"])[:10]:
+        print(f"   {handler:<50} {stats['count']:>6}  p50 {stats['p50_ms']} мс  p99 {stats['p99_ms']} мс")
+    db = result["db"]
+    print(f"🗄 БД: {db['share_of_update_time']:.0%} времени апдейтов, запросов {db['calls']}, "
+          f"медленных {db['slow']}, 'database is locked': {db['locked_errors']}")
+    for query in db["top"]:
+        print(f"   {query['total_ms']:>8.0f} мс  {query['calls']:>6}×  p99 {query['p99_ms']} мс  {query['query'][:90]}")
+    outbound = result["outbound"]
+    print(f"📤 Исходящие: {outbound['sent']} отправок, с учётом лимитов Telegram p50/p99: "
+          + ", ".join(f"{name} {latency['p50']}/{latency['p99']} мс" for name, latency in outbound["latency_ms"].items()
+                      if latency["p99"]))
+    lag = result["loop_lag_ms"]
+    print(f"🔁 Лаг event loop: p50 {lag['p50']} мс, p99 {lag['p99']} мс, max {lag['max']} мс")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Нагрузочный тест бота через /webhook")
+    parser.add_argument("--rate", type=float, default=20, help="сценариев в секунду")
+    parser.add_argument("--duration", type=float, default=30, help="секунд подачи нагрузки")
+    parser.add_argument("--users", type=int, default=2000, help="зарегистрированных пользователей в базе")
+    parser.add_argument("--tasks", type=int, default=5, help="активных заданий партнёров")
+    parser.add_argument("--think", type=float, default=0.5, help="пауза пользователя между шагами, с")
+    parser.add_argument("--mix", type=parse_mix, default=DEFAULT_MIX, help="веса сценариев: newcomer=2,capsule=3,...")
+    parser.add_argument("--api-latency", type=float, default=0.0, help="задержка ответа Bot API, с")
+    parser.add_argument("--api-errors", type=float, default=0.0, help="доля ответов Bot API 500")
+    parser.add_argument("--left", type=float, default=0.0, help="доля пользователей без подписки на канал")
+    parser.add_argument("--json", help="сохранить результат в JSON")
+    args = parser.parse_args()
+    stub = BotApiStub(latency=args.api_latency, error_rate=args.api_errors, left_rate=args.left)
+
+    logging.basicConfig(level=logging.WARNING)
+    logging.getLogger().setLevel(logging.WARNING)
+    result = asyncio.run(run_load(args.rate, args.duration, args.users, args.mix, args.think, args.tasks, stub))
+    print_report(result, args.rate, args.mix)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"rate": args.rate, "mix": args.mix, **result}, f, ensure_ascii=False, indent=2)
+        print(f"💾 {args.json}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+"""
+Локальная заглушка Rhombis API для бенчмарков и тестов
+"""
+import asyncio
+import random
+from typing import Optional
+from aiohttp import web
+
+
+class RhombisStub:
+    """Минимальный Rhombis API: /stars|premium/recipient и /stars|premium/transaction
+
+    Сбои настраиваются на лету: error_rate - доля ответов 503,
+    slow_rate/slow_latency - доля "хвостовых" медленных ответов,
+    slow_next - сколько ближайших запросов сделать медленными.
+    """
+
+    def __init__(self, latency: float = 0.005, error_rate: float = 0.0,
+                 slow_rate: float = 0.0, slow_latency: float = 1.0,
+                 host: str = "127.0.0.1", port: int = 0):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.slow_rate = slow_rate
+        self.slow_latency = slow_latency
+        self.slow_next = 0
+        self.host = host
+        self.port = port
+        self.requests = 0
+        self.connections = 0
+        self.runner: Optional[web.AppRunner] = None
+
+    @property
+    def base_url(self) -> str:
+        return f"http://{self.host}:{self.port}"
+
+    async def _delay(self):
+        self.requests += 1
+        if self.slow_next > 0 or (self.slow_rate and random.random() < self.slow_rate):
+            self.slow_next = max(0, self.slow_next - 1)
+            await asyncio.sleep(self.slow_latency)
+        elif self.latency:
+            await asyncio.sleep(self.latency)
+        if self.error_rate and random.random() < self.error_rate:
+            raise web.HTTPServiceUnavailable(text="stub failure")
+
+    async def recipient(self, request: web.Request) -> web.Response:
+        await self._delay()
+        username = request.query.get("username", "")
+        if not username or username.startswith("missing"):
+            return web.json_response({"error": "not found"}, status=404)
+        return web.json_response({"recipient": f"r_{username}", "name": username})
+
+    async def transaction(self, request: web.Request) -> web.Response:
+        await self._delay()
+        data = await request.json()
+        return web.json_response({
+            "message": {
+                "address": "EQStubAddress",
+                "amount": str(int(data.get("quantity", data.get("months", 1))) * 4660000),
+                "payload": "stub"
+            }
+        })
+
+    async def _on_connection(self, request, response):
+        # Считаем новые TCP соединения по первому запросу на транспорте
+        transport = request.transport
+        if transport is not None and not getattr(transport, "_stub_seen", False):
+            transport._stub_seen = True
+            self.connections += 1
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_get("/stars/recipient", self.recipient)
+        app.router.add_get("/premium/recipient", self.recipient)
+        app.router.add_post("/stars/transaction", self.transaction)
+        app.router.add_post("/premium/transaction", self.transaction)
+        app.on_response_prepare.append(self._on_connection)
+        self.runner = web.AppRunner(app)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, self.host, self.port)
+        await site.start()
+        self.port = site._server.sockets[0].getsockname()[1]
+        return self
+
+    async def stop(self):
+        if self.runner:
+            await self.runner.cleanup()
+            self.runner = None
@@ -8,6 +8,8 @@ import sqlite3
 import logging
 from datetime import datetime
 
+from app.db import Database
+
 def restore_data_integrity():
     """Восстанавливает все статистики пользователей"""
     
@@ -40,31 +42,15 @@ def restore_data_integrity():
     referrals_updated = cursor.rowcount
     print(f"✅ Обновлено {referrals_updated} пользователей с рефералами")
     
-    # 2. Пересчет доходов от капсул
-    print("💰 Пересчитываю доходы от капсул...")
-    cursor.execute("""
-        UPDATE users SET 
-            total_earnings = (
-                SELECT COALESCE(SUM(sc_amount), 0) 
-                FROM capsule_openings co 
-                WHERE co.user_id = users.user_id
-            ) + (
-                SELECT COALESCE(SUM(sc_amount), 0) 
-                FROM user_checkins uc 
-                WHERE uc.user_id = users.user_id
-            )
-    """)
-    earnings_updated = cursor.rowcount
-    print(f"✅ Обновлено {earnings_updated} пользователей с доходами")
-    
-    # 3. Пересчет балансов
-    print("💳 Пересчитываю балансы...")
-    cursor.execute("""
-        UPDATE users SET 
-            pending_balance = total_earnings - paid_balance
-    """)
-    balances_updated = cursor.rowcount
-    print(f"✅ Обновлено {balances_updated} балансов")
+    # 2-3. Балансы восстанавливаются из журнала проводок (ledger_entries)
+    print("💳 Сверяю балансы с журналом проводок...")
+    conn.commit()
+    db = Database('bot.db')
+    db.init()
+    audit = db.snapshot_ledger(repair=True)
+    earnings_updated = balances_updated = len(audit['drifted'])
+    print(f"✅ Исправлено {balances_updated} балансов "
+          f"(новых проводок: {audit['entries']}, {audit['duration_ms']} мс)")
     
     # 4. Пересчет капсул
     print("🎁 Пересчитываю капсулы...")
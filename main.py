@@ -2,27 +2,61 @@ import asyncio
 import logging
 import os
 import json
-from typing import Optional
-from aiogram import Bot, Dispatcher
-from aiogram.client.default import DefaultBotProperties
-from aiogram.enums import ParseMode
-from aiogram.fsm.storage.memory import MemoryStorage
-from aiogram.webhook.aiohttp_server import SimpleRequestHandler
+import sys
+from typing import TYPE_CHECKING, Optional
 from aiohttp import web
 
+# Первым: отсчёт фаз запуска и сокет до тяжёлых импортов
+from app.services.startup import StartupGate, bind_listener
 from app.config import Settings
 from app.db import Database
-from app.context import set_context
-from app.handlers.start_fixed import router as start_router
-from app.handlers.admin_clean import router as admin_router
-from app.handlers.core import router as core_router
-from app.handlers.mini_app import router as mini_app_router
-from app.handlers.tasks_unified import router as tasks_router
-from app.handlers.navigation_production import router as navigation_router
-from app.services.validator import validator_loop
-from app.services.comment_checker import init_comment_checker, comment_checker
+from app.context import get_db, set_context
+from app.handlers.static import setup_static_routes
+from app.middleware.cors import cors_middleware
+from app.services.task_scheduler import TaskLifecycleScheduler
+from app.services.ledger import ledger_snapshot_loop
+from app.services.rhombis_stars_api import get_rhombis_stars_api
+from app.services.metrics import metrics
+from app.services.profiler import profiler
+from app.services.query_trace import query_tracer
+from app.services.update_queue import (
+    QUEUE_DB_PATH, WORKER_CACHE_MAX_AGE, LeaderElection, QueueWorker, UpdateQueue, WorkerPool
+)
+# aiogram, роутеры, Telethon и валидатор импортируются лениво: порт занимается до них
+if TYPE_CHECKING:
+    from aiogram import Bot, Dispatcher
+    from app.middleware.throttling import ThrottlingMiddleware
+    from app.middleware.user_serial import UserSerialMiddleware
+    from app.services.outbound import OutboundScheduler
 # from deployment_config import DeploymentConfig  # Removed - not needed
 
+# Тяжёлые модули бота (aiogram ~3 с): main() грузит их в потоке, пока StartupGate уже отвечает
+BOT_MODULES = (
+    "aiogram",
+    "aiogram.client.session.aiohttp",
+    "aiogram.webhook.aiohttp_server",
+    "app.middleware.metrics",
+    "app.middleware.throttling",
+    "app.middleware.user_scope",
+    "app.middleware.user_serial",
+    "app.services.outbound",
+    "app.utils.fsm_storage",
+    "app.handlers.start_fixed",
+    "app.handlers.admin_clean",
+    "app.handlers.core",
+    "app.handlers.mini_app",
+    "app.handlers.tasks_unified",
+    "app.handlers.navigation_production",
+    "app.handlers.tma",
+)
+
+
+def preload_bot_modules():
+    """Импортировать BOT_MODULES (вызывается через asyncio.to_thread)"""
+    import importlib
+    for name in BOT_MODULES:
+        importlib.import_module(name)
+
 logging.basicConfig(level=logging.INFO)
 
 # REMOVED: All auto-fix webhook functions to prevent webhook switching
@@ -63,9 +97,39 @@ class BotManager:
         self.dp: Optional[Dispatcher] = None
         self.cfg: Optional[Settings] = None
         self.app: Optional[web.Application] = None
+        self.task_scheduler: Optional[TaskLifecycleScheduler] = None
+        self.user_serial: Optional[UserSerialMiddleware] = None
+        self.throttling: Optional[ThrottlingMiddleware] = None
+        self.outbound: Optional[OutboundScheduler] = None
+        # WORKERS > 0: этот процесс только принимает вебхуки, апдейты обрабатывают воркеры
+        self.update_queue: Optional[UpdateQueue] = None
+        self.worker_pool: Optional[WorkerPool] = None
+        # Фазы холодного старта и буфер апдейтов до готовности
+        self.gate = StartupGate()
         
     async def initialize(self):
-        """Initialize bot configuration and components"""
+        """Initialize bot configuration and components
+
+        Схема БД здесь не трогается (init_database): диспетчер и роутеры
+        собираются без единого запроса к базе.
+        """
+        from aiogram import Bot, Dispatcher
+        from aiogram.client.default import DefaultBotProperties
+        from aiogram.client.session.aiohttp import AiohttpSession
+        from aiogram.client.telegram import TelegramAPIServer
+        from aiogram.enums import ParseMode
+        from app.middleware.metrics import BotApiMetricsMiddleware, HandlerNameMiddleware, UpdateMetricsMiddleware
+        from app.middleware.throttling import ThrottlingMiddleware
+        from app.middleware.user_scope import UserScopeMiddleware
+        from app.middleware.user_serial import UserSerialMiddleware
+        from app.services.outbound import OutboundScheduler, process_global_policy
+        from app.utils.fsm_storage import create_fsm_storage
+        from app.handlers.start_fixed import router as start_router
+        from app.handlers.admin_clean import router as admin_router
+        from app.handlers.core import router as core_router
+        from app.handlers.mini_app import router as mini_app_router
+        from app.handlers.tasks_unified import router as tasks_router
+        
         token = os.getenv("BOT_TOKEN", "").strip()
         
         if not token:
@@ -75,16 +139,63 @@ class BotManager:
         self.cfg = Settings.from_env()
         
         # Initialize bot
+        session = None
+        if self.cfg.BOT_API_URL:
+            session = AiohttpSession(api=TelegramAPIServer.from_base(self.cfg.BOT_API_URL))
+            logging.info(f"✅ Bot API server: {self.cfg.BOT_API_URL}")
         self.bot = Bot(
             token=token,
+            session=session,
             default=DefaultBotProperties(parse_mode=ParseMode.HTML)
         )
-        
-        # Initialize dispatcher with FSM storage
-        self.dp = Dispatcher(storage=MemoryStorage())
+        # Время вызовов Bot API (с ожиданием в планировщике) - в метрики апдейта
+        self.bot.session.middleware(BotApiMetricsMiddleware())
+        # Все отправки через общий планировщик: лимиты Telegram и приоритет ответов над рассылками.
+        # При WORKERS > 0 initialize() идёт в каждом процессе - каждому своя доля глобального лимита
+        self.outbound = OutboundScheduler(global_policy=process_global_policy(self.cfg.WORKERS))
+        self.bot.session.middleware(self.outbound)
         
         # Set global context
-        set_context(self.cfg, Database(self.cfg.DB_PATH))
+        db = Database(self.cfg.DB_PATH)
+        set_context(self.cfg, db)
+        
+        # Initialize dispatcher with FSM storage (SQLite - диалоги переживают редеплой)
+        self.dp = Dispatcher(storage=create_fsm_storage(self.cfg.FSM_STORAGE, db, self.cfg.FSM_REDIS_URL))
+        logging.info(f"✅ FSM storage: {type(self.dp.storage).__name__}")
+        # Первый обработанный апдейт - конец холодного старта (/healthz -> startup)
+        gate = self.gate
+        
+        async def first_update(handler, event, data):
+            try:
+                return await handler(event, data)
+            finally:
+                gate.update_handled()
+        self.dp.update.outer_middleware(first_update)
+        # Время апдейтов по хендлерам: outer открывает область, inner узнаёт имя хендлера
+        self.dp.update.outer_middleware(UpdateMetricsMiddleware())
+        handler_names = HandlerNameMiddleware()
+        for event_name, observer in self.dp.observers.items():
+            if event_name not in ("update", "error"):
+                observer.middleware(handler_names)
+        metrics.add_collector(self.runtime_gauges)
+        # Лимиты частоты по пользователю - до замков и базы
+        self.throttling = ThrottlingMiddleware()
+        self.dp.update.outer_middleware(self.throttling)
+        # Апдейты пользователя по очереди, повторные нажатия отбрасываются
+        self.user_serial = UserSerialMiddleware()
+        self.dp.update.outer_middleware(self.user_serial)
+        # Мемоизация get_user в пределах одного апдейта (внутри замка пользователя)
+        self.dp.update.outer_middleware(UserScopeMiddleware())
+        
+        # Запуск/истечение заданий по расписанию
+        on_activate = None
+        if self.cfg.TASK_AUTO_ANNOUNCE:
+            from app.handlers.tasks_unified import broadcast_task_announcement
+            bot = self.bot
+            
+            async def on_activate(task):
+                await broadcast_task_announcement(bot, task)
+        self.task_scheduler = TaskLifecycleScheduler(db, on_activate=on_activate)
         
         # Register routers - КНОПКИ ПЕРВЫМИ для приоритета
         self.dp.include_router(start_router)
@@ -102,43 +213,165 @@ class BotManager:
         logging.info("✅ All handlers registered")
         
         logging.info("Bot components initialized successfully")
-        
-    async def start_webhook_mode(self, webhook_url: str, port: int = 5000):
-        """Start bot in webhook mode - FIXED ROUTING VERSION"""
-        
-        # Clear existing webhooks
-        if self.bot:
-            try:
-                await self.bot.delete_webhook(drop_pending_updates=True)
-                logging.info("✅ Cleared existing webhooks and dropped pending updates")
-            except Exception as e:
-                logging.warning(f"Webhook clearing failed: {e}")
-            
-            # Verify no webhook is set
+    
+    async def init_database(self):
+        """Схема и миграции (идемпотентны: новые таблицы/колонки появляются при старте)
+
+        В потоке: пока идут миграции, цикл событий принимает и буферизует вебхуки.
+        """
+        await asyncio.to_thread(get_db().init)
+    
+    def runtime_gauges(self):
+        """Текущие значения подсистем для /metrics"""
+        if self.outbound:
+            stats = self.outbound.stats()
+            for priority, depth in stats["queue"].items():
+                yield "outbound_queue_depth", {"priority": priority}, depth
+            yield "outbound_retry_after", {}, stats["retry_after"]
+        if self.throttling:
+            for policy, stats in self.throttling.stats().items():
+                yield "rate_limit_throttled", {"scope": "bot", "policy": policy}, stats["throttled"]
+        if self.user_serial:
+            yield "updates_collapsed", {}, self.user_serial.collapsed
+    
+    def background_jobs(self):
+        """Фоновые циклы, которые должны работать ровно в одном процессе"""
+        bot = self.bot
+        
+        async def validator():
+            from app.services.validator import validator_loop
+            await validator_loop(bot)
+        jobs = [validator, ledger_snapshot_loop]
+        if self.task_scheduler:
+            jobs.append(self.task_scheduler.run)
+        return jobs
+    
+    async def run_worker(self, shard: int, shards: int, wake):
+        """Процесс-воркер: обрабатывает апдейты своего шарда из очереди"""
+        import signal
+        await self.initialize()
+        await self.init_database()
+        # Задания и пользователей меняют и ingress (TMA API), и соседние воркеры
+        get_db().limit_cache_age(WORKER_CACHE_MAX_AGE)
+        
+        queue = UpdateQueue(QUEUE_DB_PATH, shards)
+        bot, dp = self.bot, self.dp
+        
+        async def handle(payload: str):
+            await dp.feed_raw_update(bot, json.loads(payload))
+        
+        worker = QueueWorker(queue, shard, handle, wake=wake)
+        leader = LeaderElection(queue, f"worker-{shard}-{os.getpid()}", self.background_jobs())
+        stop = asyncio.Event()
+        asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, stop.set)
+        
+        worker_task = asyncio.create_task(worker.run())
+        leader_task = asyncio.create_task(leader.run())
+        try:
+            await stop.wait()
+            logging.info(f"🔄 Worker {shard}: finishing in-flight updates...")
+        finally:
+            leader_task.cancel()
+            worker.stop()
+            await worker_task
+            await dp.storage.close()
+            await close_comment_checker()
+            await bot.session.close()
+    
+    async def enqueue_update(self, payload: bytes):
+        """Положить апдейт в очередь и разбудить воркер его шарда (ValueError - битый апдейт)"""
+        shard = await asyncio.to_thread(self.update_queue.push, payload)
+        if shard is not None:
+            self.worker_pool.wake(shard)
+    
+    async def ingress_webhook(self, request: web.Request) -> web.Response:
+        """Принять апдейт в очередь и сразу ответить Telegram"""
+        payload = await request.read()
+        try:
+            await self.enqueue_update(payload)
+        except ValueError as e:
+            logging.warning(f"⚠️ Rejected malformed update: {e}")
+            return web.Response(status=400)
+        return web.Response(text="ok")
+    
+    async def register_webhook(self, webhook_url: str):
+        """Поставить вебхук, если он другой; накопленные у Telegram апдейты не сбрасываются"""
+        try:
             webhook_info = await self.bot.get_webhook_info()
-            if webhook_info.url:
-                logging.warning(f"Webhook still active: {webhook_info.url}")
-                await asyncio.sleep(2)
-            else:
-                logging.info("✅ Confirmed: No active webhooks")
-            
-            # Set webhook with the correct URL determined by main()
+            if webhook_info.url == webhook_url:
+                logging.info(f"✅ Webhook already set: {webhook_url} (pending: {webhook_info.pending_update_count})")
+                return
             await self.bot.set_webhook(
                 url=webhook_url,
-                drop_pending_updates=True,
+                drop_pending_updates=False,
                 allowed_updates=None
             )
             logging.info(f"✅ Webhook set successfully: {webhook_url}")
+        except Exception as e:
+            logging.error(f"❌ Webhook registration failed: {e}")
+    
+    async def start_comment_checker(self):
+        """Telethon для заданий на комментарии - в фоне, после готовности бота"""
+        try:
+            from app.services.comment_checker import init_comment_checker
+            from app.services.telethon_monitor import telethon_monitor
+            await init_comment_checker()
+            
+            # Первоначальная проверка состояния
+            health_status = await telethon_monitor.health_check()
+            logging.info(f"✅ Comment checker initialization completed - Status: {health_status.get('status', 'unknown')}")
+        except Exception as e:
+            logging.warning(f"⚠️ Comment checker initialization failed: {e} - feature will be unavailable")
+        
+    async def start_webhook_mode(self, webhook_url: str, port: int = 5000, sock=None,
+                                 early_runner: Optional[web.AppRunner] = None):
+        """Start bot in webhook mode - FIXED ROUTING VERSION
+
+        Порядок холодного старта: сокет и ранний StartupGate (уже подняты в
+        main) -> полное HTTP-приложение на том же сокете -> схема БД -> разбор
+        буфера апдейтов. Регистрация
+        вебхука, Telethon и фоновые циклы не задерживают первый ответ.
+        """
+        from aiogram.webhook.aiohttp_server import SimpleRequestHandler
+        from app.middleware.metrics import http_metrics_middleware
+        from app.middleware.throttling import rate_limit_middleware
+        from app.utils.fsm_storage import SQLiteStorage
+        
+        if sock is None:
+            sock = bind_listener("0.0.0.0", port, fallback_port=5001)
+        port = sock.getsockname()[1]
         
         # Create clean aiohttp application
-        self.app = web.Application()
+        # StartupGate первым: до готовности вебхуки копятся в буфере, остальное - 503
+        api_rate_limit = rate_limit_middleware()
+        self.app = web.Application(middlewares=[
+            self.gate.middleware(), http_metrics_middleware(), api_rate_limit, cors_middleware()
+        ])
+        metrics.add_collector(lambda: (
+            ("rate_limit_throttled", {"scope": "api", "policy": policy}, stats["throttled"])
+            for policy, stats in api_rate_limit.limiters.stats().items()
+        ))
+        
+        workers = self.cfg.WORKERS if self.cfg else 0
         
         # Setup webhook handler - SINGLE REGISTRATION
-        if self.dp and self.bot:
+        if workers > 0:
+            self.app.router.add_post("/webhook", self.ingress_webhook)
+            
+            async def stop_workers(app):
+                if self.worker_pool:
+                    await asyncio.to_thread(self.worker_pool.stop)
+            self.app.on_cleanup.append(stop_workers)
+        elif self.dp and self.bot:
             SimpleRequestHandler(
                 dispatcher=self.dp,
                 bot=self.bot
             ).register(self.app, path="/webhook")
+            
+            # Дописать отложенные состояния FSM при остановке сервера
+            async def close_fsm_storage(app):
+                await self.dp.storage.close()
+            self.app.on_cleanup.append(close_fsm_storage)
         
         # Define handlers once
         async def health_check(request):
@@ -160,6 +393,8 @@ class BotManager:
                         "has_webhook": bool(webhook_info.url),
                         "pending_updates": webhook_info.pending_update_count
                     },
+                    "rhombis": get_rhombis_stars_api().health(),
+                    "user_cache": get_db().user_cache_stats(),
                     "port": port
                 })
             except Exception as e:
@@ -170,7 +405,30 @@ class BotManager:
                 }, status=503)
         
         async def simple_health(request):
-            return web.json_response({"status": "ok", "bot": "running"})
+            return web.json_response({
+                "status": "ok",
+                "bot": "running",
+                "startup": self.gate.stats(),
+                "rhombis_circuit": get_rhombis_stars_api().breaker.state,
+                "task_scheduler": self.task_scheduler.stats() if self.task_scheduler else None,
+                "fsm_storage": self.dp.storage.stats() if isinstance(self.dp.storage, SQLiteStorage) else None,
+                "user_serial": self.user_serial.stats() if self.user_serial else None,
+                "outbound": self.outbound.stats() if self.outbound else None,
+                "updates": metrics.summary("update_seconds"),
+                "profiler": profiler.stats(),
+                "queries": query_tracer.stats(),
+                "rate_limits": {
+                    "bot": self.throttling.stats() if self.throttling else None,
+                    "api": api_rate_limit.limiters.stats()
+                },
+                "workers": self.worker_pool.stats() if self.worker_pool else None,
+                "update_queue": await asyncio.to_thread(self.update_queue.depth) if self.update_queue else None
+            })
+        
+        async def metrics_endpoint(request):
+            """Метрики в текстовом формате Prometheus"""
+            return web.Response(text=metrics.render_prometheus(), content_type="text/plain",
+                                headers={"X-Content-Type-Options": "nosniff"})
         
         async def telethon_status(request):
             """Проверка состояния Telethon для мониторинга"""
@@ -201,63 +459,16 @@ class BotManager:
                     "error": str(e)
                 }, status=500)
         
-        async def serve_tma(request):
-            return web.FileResponse('dist/index.html')
-        
-        async def serve_manifest(request):
-            response = web.FileResponse('public/tonconnect-manifest.json')
-            response.headers['Access-Control-Allow-Origin'] = '*'
-            response.headers['Access-Control-Allow-Methods'] = 'GET'
-            response.headers['Access-Control-Allow-Headers'] = 'Content-Type'
-            return response
-        
-        async def serve_manifest_short(request):
-            response = web.FileResponse('public/tonconnect-manifest-short.json')
-            response.headers['Access-Control-Allow-Origin'] = '*'
-            response.headers['Access-Control-Allow-Methods'] = 'GET'
-            response.headers['Access-Control-Allow-Headers'] = 'Content-Type'
-            return response
-            
-        async def serve_manifest_minimal(request):
-            response = web.FileResponse('public/tonconnect-manifest-minimal.json')
-            response.headers['Access-Control-Allow-Origin'] = '*'
-            response.headers['Access-Control-Allow-Methods'] = 'GET'
-            response.headers['Access-Control-Allow-Headers'] = 'Content-Type'
-            return response
-        
-        async def serve_icon(request):
-            return web.FileResponse('public/icon.svg')
-        
-        async def serve_icon_png(request):
-            response = web.FileResponse('public/icon.png')
-            response.headers['Access-Control-Allow-Origin'] = '*'
-            response.headers['Access-Control-Allow-Methods'] = 'GET'
-            return response
-        
-        async def serve_terms(request):
-            return web.FileResponse('public/terms.html')
-        
-        async def serve_privacy(request):
-            return web.FileResponse('public/privacy.html')
-        
         # Register routes - NO DUPLICATES
         router = self.app.router
         router.add_get("/health", health_check)
         router.add_get("/healthz", simple_health)
+        router.add_get("/metrics", metrics_endpoint)
         router.add_get("/telethon-status", telethon_status)
         
-        # TMA routes - Fixed static serving
+        # TMA routes - precompressed, cache-busted static served from memory
         if os.path.exists('dist'):
-            # Serve assets directly from dist folder
-            router.add_static('/assets', 'dist/assets', name='tma_assets')
-            router.add_get('/', serve_tma)
-            router.add_get('/tonconnect-manifest.json', serve_manifest)
-            router.add_get('/tonconnect-manifest-short.json', serve_manifest_short)
-            router.add_get('/tonconnect-manifest-minimal.json', serve_manifest_minimal)
-            router.add_get('/icon.svg', serve_icon)
-            router.add_get('/icon.png', serve_icon_png)  
-            router.add_get('/terms', serve_terms)
-            router.add_get('/privacy', serve_privacy)
+            setup_static_routes(self.app)
             logging.info("✅ TMA routes configured with fixed assets")
         else:
             router.add_get("/", simple_health)
@@ -268,45 +479,50 @@ class BotManager:
         setup_tma_routes(self.app)
         logging.info("✅ TMA API endpoints registered")
         
-        # Start validator loop
-        if self.bot:
-            asyncio.create_task(validator_loop(self.bot))
-        
-        # Initialize comment checker for channel activity tasks (non-blocking)
-        try:
-            from app.services.telethon_monitor import telethon_monitor
-            await init_comment_checker()
-            
-            # Первоначальная проверка состояния
-            health_status = await telethon_monitor.health_check()
-            logging.info(f"✅ Comment checker initialization completed - Status: {health_status.get('status', 'unknown')}")
-        except Exception as e:
-            logging.warning(f"⚠️ Comment checker initialization failed: {e} - feature will be unavailable")
-        
-        # Production-ready server startup
+        # Production-ready server startup: сокет уже слушает, соединения ждали в backlog ядра
         runner = web.AppRunner(self.app)
         await runner.setup()
-        
-        # Force bind to all interfaces for production
-        try:
-            site = web.TCPSite(runner, "0.0.0.0", port)
-            await site.start()
-            logging.info(f"✅ HTTP server listening on 0.0.0.0:{port}")
-        except Exception as e:
-            logging.error(f"❌ Failed to start server on port {port}: {e}")
-            # Try alternative port for conflicts
-            port = 5001
-            try:
-                site = web.TCPSite(runner, "0.0.0.0", port)
-                await site.start()
-                logging.info(f"✅ HTTP server started on fallback port {port}")
-            except Exception as e2:
-                logging.error(f"❌ Failed on fallback port {port}: {e2}")
-                raise
+        site = web.SockSite(runner, sock)
+        await site.start()
+        if early_runner is not None:
+            # Новые соединения принимает полное приложение; буфер у них общий
+            await early_runner.cleanup()
+        self.gate.mark("serving")
         
         logging.info(f"✅ Webhook server started on 0.0.0.0:{port}")
         logging.info(f"✅ Available endpoints: /health, /healthz, /, /webhook")
         
+        # Вебхук ставится параллельно со схемой БД: апдейты до готовности ждут в буфере
+        if self.bot:
+            asyncio.create_task(self.register_webhook(webhook_url))
+        
+        await self.init_database()
+        self.gate.mark("database")
+        
+        if workers > 0:
+            # Очередь на диске: апдейт не теряется, даже если воркер упал
+            self.update_queue = UpdateQueue(QUEUE_DB_PATH, shards=workers)
+            await asyncio.to_thread(self.update_queue.init)
+            self.worker_pool = WorkerPool(workers, worker_process_main)
+            self.worker_pool.start()
+            get_db().limit_cache_age(WORKER_CACHE_MAX_AGE)
+            logging.info(f"✅ Ingress mode: {workers} workers behind {QUEUE_DB_PATH}")
+            self.gate.open(self.enqueue_update)
+            # Фоновые циклы и Telethon живут в воркере-лидере
+            asyncio.create_task(self.worker_pool.supervise())
+        else:
+            bot, dp = self.bot, self.dp
+            
+            async def deliver(payload: bytes):
+                await dp.feed_raw_update(bot, json.loads(payload))
+            self.gate.open(deliver)
+            # Validator loop, task lifecycle scheduler, ledger snapshots (balance audit)
+            for job in self.background_jobs():
+                asyncio.create_task(job())
+            # Initialize comment checker for channel activity tasks (non-blocking)
+            # С воркерами клиент Telethon поднимается лениво в том воркере, которому он нужен
+            asyncio.create_task(self.start_comment_checker())
+        
         # Keep running with ANTI-REPLIT-AGENT webhook protection
         # IMPORTANT FOR REPLIT AGENT: DO NOT MODIFY THIS WEBHOOK PROTECTION LOGIC
         # This prevents the bot from breaking when Agent restores old configurations
@@ -333,8 +549,6 @@ async def main():
     bot_manager = BotManager()
     
     try:
-        await bot_manager.initialize()
-        
         # Universal production configuration with deployment port fix
         deployment_port = int(os.getenv("PORT", 5000))
         # CRITICAL: Use port 80 for deployment (external port from .replit)
@@ -344,13 +558,23 @@ async def main():
         else:
             port = deployment_port
         
+        # Порт занимается до aiogram и роутеров: Telegram ждёт в backlog ядра, а не получает отказ
+        sock = bind_listener("0.0.0.0", port, fallback_port=5001)
+        port = sock.getsockname()[1]
+        bot_manager.gate.mark("listening")
+        early_runner = await bot_manager.gate.serve_early(sock)
+        
+        # aiogram и роутеры импортируются в потоке: цикл событий тем временем отвечает на вебхуки
+        await asyncio.to_thread(preload_bot_modules)
+        bot_manager.gate.mark("imports")
+        await bot_manager.initialize()
+        bot_manager.gate.mark("dispatcher")
+        
         # Smart webhook URL determination
         repl_slug = os.getenv("REPL_SLUG", "workspace")
         domains = os.getenv("REPLIT_DOMAINS", "").strip()
         
         # CRITICAL: Enhanced deployment detection for Replit deployments
-        import sys
-        
         # FIXED: Simple deployment detection - only use explicit deployment signals  
         deployment_signals = [
             "REPLIT_DEPLOYMENT" in os.environ,  # Explicit deployment flag
@@ -413,7 +637,7 @@ async def main():
         update_tonconnect_manifest(webhook_url)
         
         # Start the bot
-        await bot_manager.start_webhook_mode(webhook_url, port)
+        await bot_manager.start_webhook_mode(webhook_url, port, sock, early_runner)
         
         # PERMANENTLY DISABLED: Auto-fix webhook - causes URL switching problems
         # Auto-webhook fixing creates race conditions and conflicts
@@ -423,20 +647,31 @@ async def main():
         logging.error(f"❌ Bot startup failed: {e}")
         raise
 
+async def close_comment_checker() -> bool:
+    """Закрыть клиент Telethon, если модуль успели загрузить (импорт ленивый)"""
+    module = sys.modules.get("app.services.comment_checker")
+    if module is None or not hasattr(module.comment_checker, 'close'):
+        return False
+    await module.comment_checker.close()
+    return True
+
 async def graceful_shutdown():
     """КРИТИЧНО: Правильное завершение работы для защиты SESSION_STRING от компрометации"""
     try:
         logging.info("🔄 Начинается graceful shutdown - защищаем SESSION_STRING...")
         
         # Закрываем Telethon соединение ПЕРВЫМ ДЕЛОМ для предотвращения компрометации
-        if hasattr(comment_checker, 'close'):
-            await comment_checker.close()
+        if await close_comment_checker():
             logging.info("✅ Telethon клиент корректно закрыт")
         
         logging.info("✅ Graceful shutdown завершен - SESSION_STRING защищен")
     except Exception as e:
         logging.error(f"⚠️ Ошибка при graceful shutdown: {e}")
 
+def worker_process_main(shard: int, shards: int, wake):
+    """Точка входа процесса-воркера (WORKERS > 0)"""
+    asyncio.run(BotManager().run_worker(shard, shards, wake))
+
 def signal_handler():
     """Обработчик сигналов завершения"""
     logging.info("📡 Получен сигнал завершения - начинается корректное закрытие...")
@@ -3,36 +3,32 @@ Simple static file server for TMA production build
 Serves dist/ folder on port 80 for Telegram Mini App
 """
 import os
-from http.server import HTTPServer, SimpleHTTPRequestHandler
 import logging
+from aiohttp import web
 
-class TMATHandler(SimpleHTTPRequestHandler):
-    def __init__(self, *args, **kwargs):
-        super().__init__(*args, directory="dist", **kwargs)
-    
-    def end_headers(self):
-        # Add headers required for TMA
-        self.send_header('Access-Control-Allow-Origin', '*')
-        self.send_header('Access-Control-Allow-Methods', 'GET, POST, OPTIONS')
-        self.send_header('Access-Control-Allow-Headers', 'Content-Type')
-        super().end_headers()
+from app.handlers.static import setup_static_routes
+from app.middleware.cors import cors_middleware
+
+def create_tma_app() -> web.Application:
+    """aiohttp app with the same static subsystem the bot uses"""
+    app = web.Application(middlewares=[cors_middleware()])
+    setup_static_routes(app)
+    return app
 
 def run_tma_server():
     """Run TMA server on port 80"""
     port = 80
     
     try:
-        server = HTTPServer(('0.0.0.0', port), TMATHandler)
         logging.info(f"🌐 TMA Server running on port {port}")
         logging.info(f"📱 TMA URL: http://localhost:{port}")
-        server.serve_forever()
+        web.run_app(create_tma_app(), host='0.0.0.0', port=port)
     except PermissionError:
         # Fallback to port 8080 if 80 is restricted
         port = 8080
-        server = HTTPServer(('0.0.0.0', port), TMATHandler)
         logging.info(f"🌐 TMA Server running on port {port} (fallback)")
         logging.info(f"📱 TMA URL: http://localhost:{port}")
-        server.serve_forever()
+        web.run_app(create_tma_app(), host='0.0.0.0', port=port)
     except Exception as e:
         logging.error(f"TMA Server failed: {e}")
 
@@ -44,4 +40,4 @@ if __name__ == "__main__":
         logging.error("❌ dist/ folder not found. Run 'npm run build' first.")
         exit(1)
     
-    run_tma_server()
\ No newline at end of file
+    run_tma_server()
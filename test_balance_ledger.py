@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+"""
+Тест журнала балансов: проводки, входящие остатки и инкрементальная сверка
+"""
+import os
+import tempfile
+import threading
+
+from app.db import LEDGER_CAPSULE, LEDGER_CHECKIN, LEDGER_PAYOUT, LEDGER_TASK, Database
+
+
+def make_db(root: str, users: int = 3) -> Database:
+    db = Database(os.path.join(root, "ledger.db"))
+    db.init()
+    with db.get_connection() as conn:
+        conn.executemany(
+            "INSERT INTO users (user_id, username, first_name) VALUES (?, ?, 'Test')",
+            ((uid, f"user{uid}") for uid in range(1, users + 1))
+        )
+        conn.commit()
+    return db
+
+
+def test_every_balance_change_is_posted():
+    """Начисления и выплаты пишутся в журнал, users совпадает со снимком"""
+    with tempfile.TemporaryDirectory() as root:
+        db = make_db(root)
+        db.add_balance(1, 2.0)
+        db.update_user_balance(1, 3.0)
+        assert db.record_checkin(1, "2026-01-01", 0.5)
+        assert not db.record_checkin(1, "2026-01-01", 0.5)
+        assert db.process_payout(1, 4.0, admin_id=99)
+        assert not db.process_payout(2, 1.0, admin_id=99)
+
+        types = [e['entry_type'] for e in db.get_ledger_entries(1)]
+        assert types == [LEDGER_PAYOUT, LEDGER_CHECKIN, LEDGER_TASK, LEDGER_CAPSULE]
+
+        user = db.get_user(1)
+        assert user['total_earnings'] == 5.5
+        assert user['paid_balance'] == 4.0
+        assert user['pending_balance'] == 1.5
+
+        result = db.snapshot_ledger()
+        assert result['entries'] == 4
+        assert result['drifted'] == []
+
+
+def test_snapshot_is_incremental_and_repairs_drift():
+    """Повторный снимок учитывает только новые проводки и чинит ручные правки"""
+    with tempfile.TemporaryDirectory() as root:
+        db = make_db(root)
+        db.add_balance(1, 10.0)
+        assert db.snapshot_ledger()['entries'] == 1
+
+        db.add_balance(2, 1.0)
+        with db.get_connection() as conn:
+            conn.execute("UPDATE users SET pending_balance = 100 WHERE user_id = 1")
+            conn.commit()
+
+        audit = db.snapshot_ledger()
+        assert audit['entries'] == 1
+        assert [d['user_id'] for d in audit['drifted']] == [1]
+
+        repaired = db.snapshot_ledger(repair=True)
+        assert repaired['entries'] == 0 and repaired['repaired']
+        assert db.get_user(1)['pending_balance'] == 10.0
+        assert db.snapshot_ledger()['drifted'] == []
+
+
+def test_existing_balances_are_opened_in_ledger():
+    """База, созданная до журнала, получает входящие остатки"""
+    with tempfile.TemporaryDirectory() as root:
+        db = make_db(root)
+        with db.get_connection() as conn:
+            conn.execute("DROP TABLE ledger_entries")
+            conn.execute("UPDATE users SET total_earnings = 7, balance = 7, "
+                         "paid_balance = 2, pending_balance = 5 WHERE user_id = 3")
+            conn.commit()
+
+        db.init()
+        assert db.snapshot_ledger()['drifted'] == []
+        assert len(db.get_ledger_entries(3)) == 2
+
+
+def test_ledger_is_opened_once_by_concurrent_workers():
+    """Несколько процессов init() одновременно - входящие остатки ровно один раз"""
+    with tempfile.TemporaryDirectory() as root:
+        db = make_db(root)
+        with db.get_connection() as conn:
+            conn.execute("DROP TABLE ledger_entries")
+            conn.execute("UPDATE users SET total_earnings = 7, balance = 7, "
+                         "paid_balance = 2, pending_balance = 5 WHERE user_id = 3")
+            conn.commit()
+
+        workers = [threading.Thread(target=Database(db.db_path).init) for _ in range(4)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        assert len(db.get_ledger_entries(3)) == 2
+
+        # Повторный перенос (упавшая миграция, ручной запуск) не задваивает проводки
+        with db.get_connection() as conn:
+            Database._open_ledger(conn.cursor())
+            conn.commit()
+        assert len(db.get_ledger_entries(3)) == 2
+        assert db.snapshot_ledger()['drifted'] == []
+
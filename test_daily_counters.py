@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+"""
+Тест дневных счётчиков капсул: ключ - epoch day, без полуночного сброса
+"""
+import os
+import tempfile
+
+import app.db
+from app.db import DAILY_COUNTER_RETENTION_DAYS, Database, epoch_day
+
+
+def make_db(root: str) -> Database:
+    db = Database(os.path.join(root, "counters.db"))
+    db.init()
+    assert db.create_user(1, "alice", "Alice")
+    return db
+
+
+def test_new_day_starts_from_zero_without_reset(monkeypatch):
+    """Новый день начинается с нуля сам: ни одна строка users не переписывается"""
+    with tempfile.TemporaryDirectory() as root:
+        db = make_db(root)
+        today = epoch_day()
+        db.record_capsule_opening(1, "test", 0.1)
+        db.record_capsule_opening(1, "test", 0.1)
+        assert db.get_user(1)["daily_capsules_opened"] == 2
+        assert db.capsules_left(1, base_limit=3) == 1
+        assert not db.can_open_capsule(1, daily_limit=2)
+
+        monkeypatch.setattr(app.db, "epoch_day", lambda: today + 1)
+        user = db.get_user(1)
+        assert user.daily_capsules_opened == 0
+        assert user.total_capsules_opened == 2
+        assert db.capsules_left(1, base_limit=3) == 3
+
+        monkeypatch.setattr(app.db, "epoch_day", lambda: today + DAILY_COUNTER_RETENTION_DAYS + 1)
+        db.record_capsule_opening(1, "test", 0.1)
+        with db.get_connection() as conn:
+            days = [row[0] for row in conn.execute("SELECT day FROM daily_counters")]
+        assert days == [today + DAILY_COUNTER_RETENTION_DAYS + 1]
+
+
+def test_todays_legacy_counter_is_migrated():
+    """База со старым users.daily_capsules_opened переносит сегодняшний счётчик"""
+    with tempfile.TemporaryDirectory() as root:
+        db = make_db(root)
+        with db.get_connection() as conn:
+            conn.execute("DROP TABLE daily_counters")
+            conn.execute("UPDATE users SET daily_capsules_opened = 2, "
+                         "last_capsule_date = DATE('now') WHERE user_id = 1")
+            conn.commit()
+
+        db.init()
+        db.invalidate_all_users()
+        assert db.get_capsules_opened_today(1) == 2
+        assert db.get_user(1)["daily_capsules_opened"] == 2
@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+"""
+Тест SQLite FSM storage: переживает рестарт, склеивает записи, забывает брошенные диалоги
+"""
+import asyncio
+import os
+import tempfile
+
+from aiogram.fsm.state import State, StatesGroup
+from aiogram.fsm.storage.base import StorageKey
+
+from app.db import Database
+from app.utils.fsm_storage import SQLiteStorage
+
+KEY = StorageKey(bot_id=1, chat_id=42, user_id=42)
+
+
+class WalletStates(StatesGroup):
+    waiting_wallet = State()
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1_000_000.0
+
+    def __call__(self):
+        return self.now
+
+
+def make_db(root: str) -> Database:
+    db = Database(os.path.join(root, "fsm.db"))
+    db.init()
+    return db
+
+
+def test_state_survives_restart_and_writes_are_coalesced():
+    """Несколько изменений одного диалога - одна строка в базе, новый процесс её видит"""
+    with tempfile.TemporaryDirectory() as root:
+        db = make_db(root)
+
+        async def first_process():
+            storage = SQLiteStorage(db, flush_interval=60)
+            await storage.set_state(KEY, WalletStates.waiting_wallet)
+            await storage.update_data(KEY, {"step": 1})
+            await storage.update_data(KEY, {"step": 2, "hint": "TON"})
+            assert storage.db_reads == 1 and storage.flushes == 0
+            await storage.close()
+            return storage.stats()
+
+        stats = asyncio.run(first_process())
+        assert stats["writes"] == 3
+        assert stats["flushes"] == 1 and stats["flushed_rows"] == 1
+
+        async def second_process():
+            storage = SQLiteStorage(db)
+            state = await storage.get_state(KEY)
+            data = await storage.get_data(KEY)
+            data["step"] = 99  # копия: кэш не меняется
+            return state, await storage.get_data(KEY)
+
+        state, data = asyncio.run(second_process())
+        assert state == WalletStates.waiting_wallet.state
+        assert data == {"step": 2, "hint": "TON"}
+
+
+def test_abandoned_states_expire_and_are_purged():
+    """Диалог старше TTL не читается и удаляется при следующей записи"""
+    with tempfile.TemporaryDirectory() as root:
+        db = make_db(root)
+        clock = FakeClock()
+
+        async def scenario():
+            storage = SQLiteStorage(db, state_ttl=3600, clock=clock)
+            await storage.set_state(KEY, WalletStates.waiting_wallet)
+            await storage.flush()
+
+            clock.now += 3601
+            assert await storage.get_state(KEY) is None
+
+            other = StorageKey(bot_id=1, chat_id=7, user_id=7)
+            await storage.set_state(other, WalletStates.waiting_wallet)
+            await storage.close()
+
+        asyncio.run(scenario())
+        with db.get_connection() as conn:
+            keys = [row[0] for row in conn.execute("SELECT key FROM fsm_storage")]
+        assert len(keys) == 1 and ":7:7:" in keys[0]
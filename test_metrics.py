@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+"""
+Тест HDR-гистограмм, разбивки времени по зависимостям и семплирующего профайлера
+"""
+import random
+import time
+
+from app.services.metrics import Histogram, Metrics, metrics, request_scope, track
+from app.services.profiler import SamplingProfiler
+
+
+def test_histogram_percentiles_within_precision():
+    """Перцентили по корзинам отличаются от точных не больше чем на точность корзины"""
+    rng = random.Random(7)
+    values = sorted(rng.lognormvariate(-4, 1.2) for _ in range(20_000))
+    histogram = Histogram()
+    for value in values:
+        histogram.record(value)
+
+    for pct in (50, 90, 99, 99.9):
+        exact = values[int(len(values) * pct / 100 + 0.5) - 1]
+        assert abs(histogram.percentile(pct) - exact) <= exact * 0.07 + 2e-6, pct
+    assert histogram.count == len(values)
+    assert histogram.percentile(100) == max(values)
+    assert histogram.cumulative((0.0, 1e9)) == [0, len(values)]
+
+
+def test_prometheus_render():
+    registry = Metrics()
+    registry.describe("job_seconds", "Время задачи")
+    registry.observe("job_seconds", 0.003, job='say "hi"')
+    registry.observe("job_seconds", 0.2, job='say "hi"')
+    registry.inc("jobs_total", status=200)
+    registry.add_collector(lambda: [("queue_depth", {"priority": "bulk"}, 5)])
+    registry.add_collector(lambda: 1 / 0)  # сломанный коллектор не роняет экспорт
+
+    text = registry.render_prometheus()
+    assert "# HELP job_seconds Время задачи" in text
+    assert "# TYPE job_seconds histogram" in text
+    assert 'job_seconds_bucket{job="say \\"hi\\"",le="0.0025"} 0' in text
+    assert 'job_seconds_bucket{job="say \\"hi\\"",le="0.005"} 1' in text
+    assert 'job_seconds_bucket{job="say \\"hi\\"",le="+Inf"} 2' in text
+    assert 'job_seconds_count{job="say \\"hi\\""} 2' in text
+    assert 'jobs_total{status="200"} 1' in text
+    assert 'queue_depth{priority="bulk"} 5' in text
+
+
+def test_request_scope_breakdown():
+    """Время зависимостей вычитается из app, метки дополняются внутри области"""
+    with request_scope("test", event="message", handler="unhandled") as labels:
+        with track("db"):
+            time.sleep(0.02)
+        time.sleep(0.01)
+        labels["handler"] = "start_command"
+
+    labels = {"event": "message", "handler": "start_command"}
+    total = metrics.histogram("test_seconds", **labels)
+    db = metrics.histogram("test_component_seconds", component="db", **labels)
+    app = metrics.histogram("test_component_seconds", component="app", **labels)
+    assert total.count == db.count == app.count == 1
+    assert db.sum >= 0.02 and app.sum >= 0.01
+    assert abs(total.sum - db.sum - app.sum) < 1e-6
+    # Вне области track() пишет только общую гистограмму зависимости
+    with track("db"):
+        pass
+    assert db.count == 1
+
+
+def busy_loop(seconds):
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        sum(range(100))
+
+
+def test_profiler_collapsed_stacks():
+    profiler = SamplingProfiler(interval=0.001)
+    profiler.start()
+    assert profiler.running
+    busy_loop(0.2)
+    collapsed = profiler.stop()
+
+    assert not profiler.running and profiler.samples > 0
+    lines = collapsed.strip().splitlines()
+    counts = [int(line.rsplit(" ", 1)[1]) for line in lines]
+    assert sum(counts) == profiler.samples
+    assert any("test_metrics:busy_loop" in line for line in lines)
+    assert profiler.stop() == ""
@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+"""
+Тест планировщика исходящих: приоритеты, лимит чата, пауза по RetryAfter
+"""
+import asyncio
+import time
+
+from aiogram import Bot
+from aiogram.client.session.base import BaseSession
+from aiogram.exceptions import TelegramRetryAfter
+
+from app.services.outbound import (
+    GLOBAL_POLICY, NOTIFICATION, OutboundScheduler, bulk_sending, outbound_priority, process_global_policy
+)
+from app.services.rate_limiter import RatePolicy
+
+
+class RecordingSession(BaseSession):
+    """Сессия без сети: запоминает порядок и время отправок"""
+
+    def __init__(self, flood_first: int = 0):
+        super().__init__()
+        self.sent = []
+        self.flood_first = flood_first
+
+    async def make_request(self, bot, method, timeout=None):
+        if self.flood_first:
+            self.flood_first -= 1
+            raise TelegramRetryAfter(method=method, message="Too Many Requests", retry_after=1)
+        self.sent.append((time.monotonic(), method.chat_id, method.text))
+        return True
+
+    async def stream_content(self, *args, **kwargs):
+        yield b""
+
+    async def close(self):
+        pass
+
+
+def make_bot(scheduler: OutboundScheduler, session: RecordingSession) -> Bot:
+    session.middleware(scheduler)
+    return Bot("42:TEST", session=session)
+
+
+def test_replies_overtake_queued_broadcast():
+    """Рассылка стоит в очереди, ответ пользователю уходит раньше неё"""
+    scheduler = OutboundScheduler(global_policy=RatePolicy(rate=50.0, burst=1))
+    session = RecordingSession()
+    bot = make_bot(scheduler, session)
+
+    async def broadcast():
+        with bulk_sending():
+            await asyncio.gather(*(bot.send_message(1000 + i, f"bulk {i}") for i in range(6)))
+
+    async def notify():
+        await asyncio.sleep(0.03)
+        with outbound_priority(NOTIFICATION):
+            await bot.send_message(7, "notification")
+
+    async def reply():
+        await asyncio.sleep(0.03)
+        await bot.send_message(5, "reply")
+
+    async def scenario():
+        await asyncio.gather(broadcast(), notify(), reply())
+
+    asyncio.run(scenario())
+    order = [text for _, _, text in session.sent]
+    assert order.index("reply") < order.index("notification") < order.index("bulk 5")
+    assert order.index("reply") <= 3
+    stats = scheduler.stats()
+    assert stats["sent"] == 8 and stats["queue"] == {"interactive": 0, "notification": 0, "bulk": 0}
+
+
+def test_one_chat_is_paced_others_are_not():
+    scheduler = OutboundScheduler(chat_policy=RatePolicy(rate=10.0, burst=1))
+    session = RecordingSession()
+    bot = make_bot(scheduler, session)
+
+    async def scenario():
+        await asyncio.gather(*(bot.send_message(1, f"m{i}") for i in range(3)),
+                             *(bot.send_message(100 + i, "x") for i in range(3)))
+
+    asyncio.run(scenario())
+    same_chat = [at for at, chat, _ in session.sent if chat == 1]
+    assert [b - a >= 0.09 for a, b in zip(same_chat, same_chat[1:])] == [True, True]
+    assert scheduler.chat_delayed == 2
+
+
+def test_retry_after_pauses_and_retries():
+    """429 приостанавливает отправку на retry_after и повторяет запрос"""
+    scheduler = OutboundScheduler()
+    session = RecordingSession(flood_first=1)
+    bot = make_bot(scheduler, session)
+
+    async def scenario():
+        started = time.monotonic()
+        await bot.send_message(1, "hello")
+        return time.monotonic() - started
+
+    elapsed = asyncio.run(scenario())
+    assert elapsed >= 0.99
+    assert [text for _, _, text in session.sent] == ["hello"]
+    assert scheduler.retry_after == 1
+
+
+def test_cancelled_sends_leave_the_queue_and_keep_their_slots():
+    """Отменённые отправки сразу уходят из очереди и не съедают глобальные слоты"""
+    scheduler = OutboundScheduler(global_policy=RatePolicy(rate=10.0, burst=1))
+    session = RecordingSession()
+    bot = make_bot(scheduler, session)
+
+    async def scenario():
+        with bulk_sending():
+            sends = [asyncio.create_task(bot.send_message(2000 + i, f"bulk {i}")) for i in range(6)]
+        await asyncio.sleep(0.01)
+        for task in sends[1:5]:
+            task.cancel()
+        await asyncio.sleep(0)
+        depth = scheduler.stats()["queue"]["bulk"]
+        started = time.monotonic()
+        await asyncio.gather(*sends, return_exceptions=True)
+        return depth, time.monotonic() - started
+
+    depth, elapsed = asyncio.run(scenario())
+    assert depth == 1
+    assert [text for _, _, text in session.sent] == ["bulk 0", "bulk 5"]
+    # Последнему живому - следующий токен (0.1 с), а не шестой
+    assert elapsed < 0.2
+
+
+
+def test_worker_processes_share_the_global_limit():
+    """WORKERS=3: у каждого из 4 процессов (воркеры + ingress) своя четверть от 30 msg/s"""
+    assert process_global_policy(0) == GLOBAL_POLICY
+    policy = process_global_policy(3)
+    assert policy.rate * 4 <= GLOBAL_POLICY.rate and policy.burst * 4 <= GLOBAL_POLICY.burst
+    assert process_global_policy(100).burst == 1
+
+    scheduler = OutboundScheduler(global_policy=policy)
+    session = RecordingSession()
+    bot = make_bot(scheduler, session)
+
+    async def scenario():
+        started = time.monotonic()
+        await asyncio.gather(*(bot.send_message(3000 + i, "x") for i in range(policy.burst + 3)))
+        return time.monotonic() - started
+
+    elapsed = asyncio.run(scenario())
+    # burst сразу, ещё три - по 1/7.5 с: процесс не шлёт больше своей доли
+    assert elapsed >= 3 * policy.interval * 0.95
+    assert len(session.sent) == policy.burst + 3
@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+"""
+Тест трассировки SQL: отпечатки, учёт fetch, журнал медленных запросов
+"""
+import os
+import sqlite3
+import tempfile
+import threading
+
+from app.db import Database
+from app.services.query_trace import QueryTracer, TracedConnection, fingerprint
+
+
+def test_fingerprint_normalization():
+    assert fingerprint("SELECT * FROM users  WHERE user_id = 5\n AND name = 'O''Brien';") == \
+        "SELECT * FROM users WHERE user_id = ? AND name = ?"
+    assert fingerprint("DELETE FROM t1 WHERE id IN (?, ?,?)") == "DELETE FROM t1 WHERE id IN (?, ...)"
+    assert fingerprint("SELECT 1.5") == fingerprint("SELECT 42")
+
+
+def make_connection(tracer):
+    conn = sqlite3.connect(":memory:", factory=TracedConnection)
+    conn.tracer = tracer
+    return conn
+
+
+def test_statements_grouped_by_fingerprint():
+    tracer = QueryTracer(slow_ms=10_000)
+    conn = make_connection(tracer)
+    conn.execute("CREATE TABLE users (user_id INTEGER PRIMARY KEY, name TEXT)")
+    cursor = conn.cursor()
+    cursor.executemany("INSERT INTO users VALUES (?, ?)", ((i, f"u{i}") for i in range(100)))
+    conn.commit()
+    for user_id in range(20):
+        cursor.execute(f"SELECT name FROM users WHERE user_id = {user_id}")
+        assert cursor.fetchone()[0] == f"u{user_id}"
+    assert len(conn.execute("SELECT * FROM users").fetchall()) == 100
+    conn.close()
+
+    top = {row["query"]: row for row in tracer.top(10, order_by="calls")}
+    assert top["SELECT name FROM users WHERE user_id = ?"]["calls"] == 20
+    assert top["SELECT name FROM users WHERE user_id = ?"]["rows"] == 20
+    assert top["SELECT * FROM users"]["rows"] == 100
+    assert top["INSERT INTO users VALUES (?, ?)"]["rows"] == 100
+    assert top["COMMIT"]["calls"] == 1
+    assert tracer.stats()["slow"] == 0
+
+
+def test_slow_query_logs_plan():
+    tracer = QueryTracer(slow_ms=0)
+    conn = make_connection(tracer)
+    conn.execute("CREATE TABLE tasks (id INTEGER PRIMARY KEY, status TEXT)")
+    conn.execute("SELECT * FROM tasks WHERE status = ?", ("active",)).fetchall()
+    conn.execute("SELECT * FROM tasks WHERE status = ?", ("done",)).fetchall()
+    conn.close()
+
+    stats = tracer.top(10, order_by="slow")
+    scan = next(row for row in stats if row["query"].startswith("SELECT * FROM tasks"))
+    assert scan["slow"] == 2 and any("SCAN" in step for step in scan["plan"])
+    # EXPLAIN не чаще раза за интервал на отпечаток и сам в статистику не попадает
+    assert [entry["query"] for entry in tracer.slow_log].count(scan["query"]) == 2
+    assert not any(row["query"].startswith("EXPLAIN") for row in stats)
+
+
+def test_concurrent_slow_queries_explain_once():
+    """Один и тот же медленный запрос из нескольких потоков - один EXPLAIN на интервал"""
+    tracer = QueryTracer(slow_ms=0)
+    explains = []
+    barrier = threading.Barrier(8)
+
+    class Connection:
+        def cursor(self, factory=None):
+            return self
+
+        def execute(self, sql, params):
+            explains.append(sql)
+            return self
+
+        def fetchall(self):
+            return [(0, 0, 0, "SCAN t")]
+
+    def worker():
+        barrier.wait()
+        tracer.record(Connection(), "SELECT * FROM t WHERE a = ?", (1,), 0.5, 0)
+
+    threads = [threading.Thread(target=worker) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(explains) == 1
+    assert len(tracer.slow_log) == 8
+    assert tracer.top(1)[0]["plan"] == ["SCAN t"]
+
+def test_database_connections_are_traced():
+    with tempfile.TemporaryDirectory() as tmp:
+        db = Database(os.path.join(tmp, "test.db"))
+        db.init()
+        tracer = QueryTracer(slow_ms=10_000)
+        with db.get_connection() as conn:
+            assert isinstance(conn, TracedConnection)
+            conn.tracer = tracer
+            conn.cursor().execute("SELECT COUNT(*) FROM users").fetchone()
+        assert tracer.top(1)[0]["query"] == "SELECT COUNT(*) FROM users"
@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+"""
+Тест token bucket лимитера и middleware для бота и /api
+"""
+import asyncio
+
+from aiohttp import web
+from aiohttp.test_utils import TestClient, TestServer
+
+from app.middleware.throttling import rate_limit_middleware
+from app.services.rate_limiter import RateLimiterRegistry, RatePolicy, TokenBucketLimiter
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_burst_then_steady_rate():
+    """burst подряд, дальше по одному на интервал; retry_after говорит, сколько ждать"""
+    clock = FakeClock()
+    limiter = TokenBucketLimiter("t", RatePolicy(rate=2.0, burst=3), clock)
+    assert [limiter.allow("u") for _ in range(4)] == [True, True, True, False]
+    allowed, retry_after = limiter.hit("u")
+    assert not allowed and abs(retry_after - 0.5) < 1e-6
+
+    clock.now += 0.5
+    assert limiter.allow("u") and not limiter.allow("u")
+    assert limiter.allow("other")
+    assert limiter.stats()["throttled"] == 3
+
+
+def test_idle_keys_are_forgotten():
+    """Ключи с полным бакетом не занимают память дольше двух окон"""
+    clock = FakeClock()
+    limiter = TokenBucketLimiter("t", RatePolicy(rate=10.0, burst=10), clock)  # окно 1 с
+    for key in range(10_000):
+        limiter.allow(key)
+    assert len(limiter) == 10_000
+
+    clock.now += 1.0
+    limiter.allow("fresh")
+    assert len(limiter) == 10_001  # старые ещё в предыдущем поколении
+    clock.now += 1.0
+    limiter.allow("fresh")
+    assert len(limiter) == 1
+
+    # Ротация не обнуляет опустошённый бакет: за 0.5 с вернулось только 5 токенов
+    clock.now += 0.5
+    assert sum(limiter.allow("spammer") for _ in range(10)) == 10
+    clock.now += 0.5
+    assert sum(limiter.allow("spammer") for _ in range(10)) == 5
+
+
+def test_reserve_first_token_is_not_delayed_on_large_clock():
+    """Первая отправка в новый чат не ждёт из-за погрешности float, сколько бы ни шли часы"""
+    clock = FakeClock()
+    clock.now = 4520.917124918  # (now + 0.1) - now > 0.1
+    limiter = TokenBucketLimiter("chat", RatePolicy(rate=10.0, burst=1), clock)
+    assert [limiter.reserve(chat) for chat in range(3)] == [0.0, 0.0, 0.0]
+    assert abs(limiter.reserve(0) - 0.1) < 1e-6
+
+
+def test_api_route_policies():
+    """Покупки ограничены строже остального API, вебхук платежей не ограничен"""
+    limiters = RateLimiterRegistry({
+        "purchase": RatePolicy.per_minute(6, burst=2),
+        "api": RatePolicy.per_minute(60, burst=5),
+    })
+    routes = (("/api/payment-webhook", None), ("/api/purchase", "purchase"), ("/api/", "api"))
+    app = web.Application(middlewares=[rate_limit_middleware(limiters, routes)])
+
+    async def ok(request):
+        return web.json_response({"success": True})
+    app.router.add_post("/api/purchase", ok)
+    app.router.add_post("/api/payment-webhook", ok)
+    app.router.add_get("/api/config", ok)
+
+    async def scenario():
+        async with TestClient(TestServer(app)) as client:
+            purchase = [(await client.post("/api/purchase")).status for _ in range(3)]
+            limited = await client.post("/api/purchase")
+            body = await limited.json()
+            config = [(await client.get("/api/config")).status for _ in range(5)]
+            webhook = [(await client.post("/api/payment-webhook")).status for _ in range(10)]
+            return purchase, limited.headers["Retry-After"], body, config, webhook
+
+    purchase, retry_after, body, config, webhook = asyncio.run(scenario())
+    assert purchase == [200, 200, 429]
+    assert int(retry_after) >= 1 and body["success"] is False
+    assert config == [200] * 5
+    assert webhook == [200] * 10
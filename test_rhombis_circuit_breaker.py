@@ -0,0 +1,229 @@
+#!/usr/bin/env python3
+"""
+Тест circuit breaker и хеджирования запросов Rhombis на локальной заглушке со сбоями
+"""
+import asyncio
+
+from app.services.circuit_breaker import CircuitBreaker, CLOSED, OPEN, HALF_OPEN
+from app.services.rhombis_stars_api import RhombisStarsAPI, HEDGE_MIN_SAMPLES
+from app.utils.cache import TTLCache
+from benchmarks.rhombis_stub import RhombisStub
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_breaker_state_machine():
+    """closed -> open по доле ошибок, half_open после таймаута, closed после проб"""
+    clock = FakeClock()
+    breaker = CircuitBreaker("test", window_size=10, min_calls=4,
+                             failure_rate_threshold=0.5, open_timeout=10,
+                             half_open_max_calls=2, clock=clock)
+
+    for _ in range(2):
+        assert breaker.allow_request()
+        breaker.record_success()
+    for _ in range(2):
+        assert breaker.allow_request()
+        breaker.record_failure()
+    assert breaker.state == OPEN
+    assert not breaker.allow_request()
+
+    clock.now += 11
+    assert breaker.allow_request()
+    assert breaker.state == HALF_OPEN
+    assert breaker.allow_request()
+    assert not breaker.allow_request()  # только 2 пробы одновременно
+
+    breaker.record_success()
+    breaker.record_success()
+    assert breaker.state == CLOSED
+    print("✅ Состояния circuit breaker переключаются корректно")
+
+
+def test_half_open_failure_reopens():
+    clock = FakeClock()
+    breaker = CircuitBreaker("test", min_calls=1, open_timeout=5, clock=clock)
+    breaker.allow_request()
+    breaker.record_failure()
+    assert breaker.state == OPEN
+    clock.now += 6
+    assert breaker.allow_request()
+    breaker.record_failure()
+    assert breaker.state == OPEN
+    assert breaker.times_opened == 2
+
+
+def test_fast_fail_against_failing_stub():
+    """При падающем Rhombis клиент перестаёт слать запросы и отвечает мгновенно"""
+    async def scenario():
+        stub = await RhombisStub(latency=0, error_rate=1.0).start()
+        api = RhombisStarsAPI(stub.base_url, hedge_requests=False,
+                              breaker=CircuitBreaker("rhombis", window_size=10, min_calls=5))
+        try:
+            for i in range(20):
+                await api.create_stars_purchase(f"r{i}", 10)
+            assert api.breaker.state == OPEN
+            assert stub.requests == 5
+
+            result = await api.create_stars_purchase("r", 10)
+            assert result["circuit_open"]
+            assert api.health()["circuit"]["rejected"] >= 16
+
+            # Отказы без ответа upstream не кэшируются
+            result = await api.get_stars_recipient("bob")
+            assert result["circuit_open"]
+            assert len(api.recipient_cache) == 0
+        finally:
+            await api.close_session()
+            await stub.stop()
+
+    asyncio.run(scenario())
+    print("✅ Разомкнутая цепь отвечает быстрым отказом")
+
+
+def test_client_errors_do_not_open_circuit():
+    async def scenario():
+        stub = await RhombisStub(latency=0).start()
+        api = RhombisStarsAPI(stub.base_url, hedge_requests=False,
+                              breaker=CircuitBreaker("rhombis", min_calls=3))
+        try:
+            for i in range(10):
+                result = await api.get_stars_recipient(f"missing{i}")
+                assert result["status"] == 404
+            assert api.breaker.state == CLOSED
+        finally:
+            await api.close_session()
+            await stub.stop()
+
+    asyncio.run(scenario())
+
+
+def test_hedged_get_beats_slow_tail():
+    """Медленный первый GET перекрывается вторым запросом после p95"""
+    async def scenario():
+        stub = await RhombisStub(latency=0.005).start()
+        api = RhombisStarsAPI(stub.base_url, hedge_requests=True)
+        try:
+            # Набираем статистику латентности
+            for i in range(HEDGE_MIN_SAMPLES):
+                await api.get_stars_recipient(f"warm{i}")
+
+            # Первый запрос зависает, хеджирующий идёт быстро
+            stub.slow_next, stub.slow_latency = 1, 0.5
+            loop = asyncio.get_running_loop()
+            started = loop.time()
+            result = await api.get_stars_recipient("slowpoke")
+            assert result["success"]
+            assert loop.time() - started < 0.3
+            assert api.hedged == 1 and api.hedge_wins == 1
+        finally:
+            await api.close_session()
+            await stub.stop()
+
+    asyncio.run(scenario())
+    print("✅ Хеджированный GET не ждёт медленный хвост")
+
+
+def test_cancelled_or_crashed_probe_releases_slot():
+    """Отмена пробы возвращает слот, неожиданное исключение размыкает цепь - half_open не залипает"""
+    clock = FakeClock()
+    breaker = CircuitBreaker("test", min_calls=1, open_timeout=5, half_open_max_calls=1, clock=clock)
+    api = RhombisStarsAPI("http://127.0.0.1:9", breaker=breaker, hedge_requests=False)
+    breaker.allow_request()
+    breaker.record_failure()
+    clock.now += 6
+
+    async def hang(*args, **kwargs):
+        await asyncio.sleep(3600)
+
+    async def crash(*args, **kwargs):
+        raise RuntimeError("unexpected")
+
+    async def scenario():
+        api._send = hang
+        probe = asyncio.create_task(api._request("POST", "/x"))
+        await asyncio.sleep(0)
+        assert breaker.state == HALF_OPEN and not breaker.allow_request()
+        probe.cancel()
+        await asyncio.gather(probe, return_exceptions=True)
+        assert breaker.state == HALF_OPEN
+
+        api._send = crash
+        try:
+            await api._request("POST", "/x")
+        except RuntimeError:
+            pass
+        assert breaker.state == OPEN
+
+    asyncio.run(scenario())
+
+
+def test_cancelled_loader_does_not_fail_waiters():
+    """Отменённый загрузчик не отменяет ожидающих: ключ загружает следующий"""
+    cache = TTLCache()
+    loads = []
+
+    async def slow_loader():
+        loads.append("slow")
+        await asyncio.sleep(3600)
+
+    async def loader():
+        loads.append("fast")
+        return "value"
+
+    async def scenario():
+        first = asyncio.create_task(cache.get_or_load("k", slow_loader))
+        await asyncio.sleep(0)
+        waiters = [asyncio.create_task(cache.get_or_load("k", loader)) for _ in range(3)]
+        await asyncio.sleep(0)
+        first.cancel()
+        return await asyncio.gather(*waiters)
+
+    assert asyncio.run(scenario()) == ["value"] * 3
+    assert loads == ["slow", "fast"]
+
+
+def test_cancelled_caller_cancels_request_before_hedge():
+    """Вызывающего отменили до хеджа - первый запрос не остаётся висеть сиротой"""
+    api = RhombisStarsAPI("http://127.0.0.1:9", hedge_requests=True)
+    for _ in range(HEDGE_MIN_SAMPLES):
+        api.get_latency.record(0.5)
+    sends = []
+
+    async def hang(*args, **kwargs):
+        sends.append("started")
+        try:
+            await asyncio.sleep(3600)
+        except asyncio.CancelledError:
+            sends.append("cancelled")
+            raise
+
+    async def scenario():
+        api._send = hang
+        caller = asyncio.create_task(api._request("GET", "/x"))
+        await asyncio.sleep(0.01)
+        caller.cancel()
+        await asyncio.gather(caller, return_exceptions=True)
+        await asyncio.sleep(0)
+        # Снимок до выхода из asyncio.run: тот отменил бы оставшиеся задачи сам
+        return list(sends)
+
+    assert asyncio.run(scenario()) == ["started", "cancelled"]
+    assert api.hedged == 0 and api.breaker.state == CLOSED
+
+
+if __name__ == "__main__":
+    test_breaker_state_machine()
+    test_half_open_failure_reopens()
+    test_fast_fail_against_failing_stub()
+    test_client_errors_do_not_open_circuit()
+    test_hedged_get_beats_slow_tail()
+    test_cancelled_or_crashed_probe_releases_slot()
+    test_cancelled_loader_does_not_fail_waiters()
+    test_cancelled_caller_cancels_request_before_hedge()
@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+"""
+Тест StartupGate: вебхуки до готовности копятся и разбираются по порядку
+"""
+import asyncio
+
+from aiohttp import web
+from aiohttp.test_utils import TestClient, TestServer
+
+from app.services.startup import StartupGate
+
+
+def make_app(gate: StartupGate, handled: list) -> web.Application:
+    app = web.Application(middlewares=[gate.middleware()])
+
+    async def webhook(request):
+        handled.append(("direct", await request.text()))
+        return web.Response(text="ok")
+
+    async def healthz(request):
+        return web.json_response({"status": "ok"})
+
+    app.router.add_post("/webhook", webhook)
+    app.router.add_get("/healthz", healthz)
+    app.router.add_get("/api/config", healthz)
+    return app
+
+
+def test_updates_buffered_until_ready_then_delivered_in_order():
+    """До open() вебхук отвечает сразу, апдейты уходят в deliver в порядке поступления"""
+    gate = StartupGate(max_buffered=2)
+    handled = []
+
+    async def deliver(payload: bytes):
+        handled.append(("buffered", payload.decode()))
+
+    async def scenario():
+        async with TestClient(TestServer(make_app(gate, handled))) as client:
+            accepted = [(await client.post("/webhook", data=str(i))).status for i in range(3)]
+            starting = await (await client.get("/healthz")).json()
+            api = await client.get("/api/config")
+            gate.open(deliver)
+            await asyncio.sleep(0)
+            await client.post("/webhook", data="late")
+            ready = await (await client.get("/healthz")).json()
+            return accepted, starting, api.status, api.headers.get("Retry-After"), ready
+
+    accepted, starting, api_status, retry_after, ready = asyncio.run(scenario())
+    assert accepted == [200, 200, 503]  # третий - сверх буфера, Telegram повторит
+    assert starting["status"] == "starting" and starting["startup"]["pending"] == 2
+    assert api_status == 503 and retry_after == "1"
+    assert handled == [("buffered", "0"), ("buffered", "1"), ("direct", "late")]
+    assert ready == {"status": "ok"}
+    stats = gate.stats()
+    assert stats["ready"] and stats["buffered"] == 2 and stats["overflow"] == 1 and stats["pending"] == 0
+    assert "ready" in stats["phases"]
+
+
+def test_failed_buffered_update_does_not_stop_the_rest():
+    """Ошибка одного апдейта из буфера не мешает остальным"""
+    gate = StartupGate()
+    handled = []
+
+    async def deliver(payload: bytes):
+        if payload == b"bad":
+            raise ValueError("broken update")
+        handled.append(payload)
+
+    async def scenario():
+        async with TestClient(TestServer(make_app(gate, []))) as client:
+            for payload in ("a", "bad", "b"):
+                await client.post("/webhook", data=payload)
+            gate.open(deliver)
+            for _ in range(3):
+                await asyncio.sleep(0)
+
+    asyncio.run(scenario())
+    assert handled == [b"a", b"b"]
+
+
+def test_early_gate_serves_the_socket_until_the_full_app_takes_over():
+    """Ранний StartupGate отвечает на сокете сразу; полное приложение забирает тот же сокет и буфер"""
+    from aiohttp import ClientSession
+
+    from app.services.startup import bind_listener
+
+    gate = StartupGate()
+    handled = []
+
+    async def deliver(payload: bytes):
+        handled.append(("buffered", payload.decode()))
+
+    async def scenario():
+        sock = bind_listener("127.0.0.1", 0)
+        url = f"http://127.0.0.1:{sock.getsockname()[1]}"
+        early = await gate.serve_early(sock)
+        async with ClientSession() as session:
+            early_hook = await session.post(f"{url}/webhook", data="early")
+            early_health = await (await session.get(f"{url}/healthz")).json()
+            early_api = (await session.get(f"{url}/api/config")).status
+
+            runner = web.AppRunner(make_app(gate, handled))
+            await runner.setup()
+            await web.SockSite(runner, sock).start()
+            await early.cleanup()
+            gate.open(deliver)
+            await asyncio.sleep(0)
+            late_hook = await session.post(f"{url}/webhook", data="late")
+            ready = await (await session.get(f"{url}/healthz")).json()
+        await runner.cleanup()
+        return early_hook.status, early_health, early_api, late_hook.status, ready
+
+    early_hook, early_health, early_api, late_hook, ready = asyncio.run(scenario())
+    assert early_hook == 200 and early_health["status"] == "starting" and early_api == 503
+    assert late_hook == 200 and ready == {"status": "ok"}
+    assert handled == [("buffered", "early"), ("direct", "late")]
+    assert "gate" in gate.stats()["phases"]
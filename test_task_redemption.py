@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+"""
+Тест атомарного выполнения заданий с лимитом под конкурентной нагрузкой
+"""
+import os
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from app.db import Database
+
+REDEMPTIONS = 2000
+MAX_COMPLETIONS = 100
+
+
+def make_db(root: str, users: int) -> Database:
+    db = Database(os.path.join(root, "redeem.db"))
+    db.init()
+    with db.get_connection() as conn:
+        conn.executemany(
+            "INSERT INTO users (user_id, username, first_name) VALUES (?, ?, 'Test')",
+            ((uid, f"user{uid}") for uid in range(1, users + 1))
+        )
+        conn.commit()
+    return db
+
+
+def test_cap_is_never_exceeded_under_concurrency():
+    """Тысячи одновременных выполнений вирусного задания не превышают лимит"""
+    with tempfile.TemporaryDirectory() as root:
+        db = make_db(root, REDEMPTIONS)
+        task_id = db.add_task("Viral", "Partner task", "channel_subscription",
+                              reward_capsules=2, max_completions=MAX_COMPLETIONS)
+
+        barrier = threading.Barrier(32)
+
+        def redeem(user_id):
+            # Каждый поток - отдельный процесс бота со своим Database и соединениями
+            worker_db = Database(db.db_path)
+            if user_id <= 32:
+                barrier.wait()
+            return worker_db.redeem_task(user_id, task_id)
+
+        with ThreadPoolExecutor(max_workers=32) as pool:
+            results = list(pool.map(redeem, range(1, REDEMPTIONS + 1)))
+
+        reasons = [r["reason"] for r in results]
+        assert reasons.count("completed") == MAX_COMPLETIONS
+        assert reasons.count("limit_reached") == REDEMPTIONS - MAX_COMPLETIONS
+
+        with db.get_connection() as conn:
+            completions = conn.execute(
+                "SELECT COUNT(*) FROM user_task_completions WHERE task_id = ?", (task_id,)
+            ).fetchone()[0]
+            counter = conn.execute(
+                "SELECT current_completions FROM tasks WHERE id = ?", (task_id,)
+            ).fetchone()[0]
+            capsules = conn.execute("SELECT SUM(bonus_capsules) FROM users").fetchone()[0]
+
+        assert completions == counter == MAX_COMPLETIONS
+        assert capsules == MAX_COMPLETIONS * 2
+    print(f"✅ {REDEMPTIONS} одновременных выполнений: засчитано ровно {MAX_COMPLETIONS}")
+
+
+def test_same_user_cannot_redeem_twice_concurrently():
+    with tempfile.TemporaryDirectory() as root:
+        db = make_db(root, 1)
+        task_id = db.add_task("Once", "Partner task", "channel_subscription", reward_capsules=3)
+
+        with ThreadPoolExecutor(max_workers=16) as pool:
+            results = list(pool.map(lambda _: Database(db.db_path).redeem_task(1, task_id), range(200)))
+
+        assert [r["reason"] for r in results].count("completed") == 1
+        assert db.get_user(1)["bonus_capsules"] == 3
+        assert db.get_task(task_id)["current_completions"] == 1
+
+
+def test_redeem_updates_caches_and_rejects_inactive():
+    with tempfile.TemporaryDirectory() as root:
+        db = make_db(root, 2)
+        task_id = db.add_task("Cap1", "Partner task", "channel_subscription", max_completions=1)
+        assert [t["id"] for t in db.get_available_tasks(1)] == [task_id]
+
+        assert db.redeem_task(1, task_id)["success"]
+        assert db.is_task_completed(1, task_id)
+        # Лимит исчерпан - задание пропадает и у других пользователей
+        assert db.get_available_tasks(2) == []
+        assert db.redeem_task(2, task_id)["reason"] == "limit_reached"
+
+        other = db.add_task("Paused", "Partner task", "channel_subscription")
+        db.update_task_status(other, "paused")
+        assert db.redeem_task(2, other)["reason"] == "unavailable"
+
+
+if __name__ == "__main__":
+    test_cap_is_never_exceeded_under_concurrency()
+    test_same_user_cannot_redeem_twice_concurrently()
+    test_redeem_updates_caches_and_rejects_inactive()
@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+"""
+Тест планировщика жизненного цикла заданий с подменёнными часами
+"""
+import asyncio
+import os
+import tempfile
+from datetime import datetime, timedelta
+
+from app.db import Database
+from app.services.task_scheduler import TaskLifecycleScheduler, utc_now
+
+
+class FakeClock:
+    def __init__(self, now: datetime):
+        self.now = now
+
+    def __call__(self) -> datetime:
+        return self.now
+
+    def advance(self, **kwargs):
+        self.now += timedelta(**kwargs)
+
+
+def fmt(moment: datetime) -> str:
+    return moment.strftime("%Y-%m-%d %H:%M:%S")
+
+
+def active_ids(db: Database) -> set:
+    return {task['id'] for task in db.get_active_tasks()}
+
+
+def test_tasks_activate_and_expire_on_schedule():
+    """Задание стартует по starts_at, истекает по expires_at, каталог обновляется сразу"""
+    with tempfile.TemporaryDirectory() as root:
+        db = Database(os.path.join(root, "scheduler.db"))
+        db.init()
+        # Даты в будущем относительно реального времени, чтобы SQL-фильтр их не отсёк
+        base = utc_now().replace(microsecond=0) + timedelta(days=1)
+        clock = FakeClock(base)
+        announced = []
+
+        async def on_activate(task):
+            announced.append(task['id'])
+
+        scheduler = TaskLifecycleScheduler(db, clock=clock, on_activate=on_activate)
+        # Каталог не сверяет даты сам - за это отвечает планировщик
+        db.task_lifecycle_managed = True
+
+        scheduled = db.add_task("Launch", "Starts later", "channel_subscription",
+                                starts_at=fmt(base + timedelta(minutes=10)),
+                                expires_at=fmt(base + timedelta(hours=2)))
+        expiring = db.add_task("Promo", "Ends soon", "channel_subscription",
+                               expires_at=fmt(base + timedelta(minutes=30)))
+        permanent = db.add_task("Always", "No dates", "channel_subscription")
+
+        async def scenario():
+            assert await scheduler.process_due() == 0
+            assert active_ids(db) == {expiring, permanent}
+            assert scheduler.next_event_at() == base + timedelta(minutes=10)
+
+            clock.advance(minutes=10)
+            assert await scheduler.process_due() == 1
+            assert active_ids(db) == {scheduled, expiring, permanent}
+            await asyncio.sleep(0)  # колбэк - отдельная задача
+            assert announced == [scheduled]
+
+            clock.advance(minutes=20)
+            assert await scheduler.process_due() == 1
+            assert active_ids(db) == {scheduled, permanent}
+            assert db.get_task(expiring)['status'] == 'expired'
+
+            clock.advance(hours=2)
+            assert await scheduler.process_due() == 1
+            assert active_ids(db) == {permanent}
+            assert scheduler.next_event_at() is None
+
+        asyncio.run(scenario())
+        assert scheduler.stats()["activated"] == 1
+        assert scheduler.stats()["expired"] == 2
+
+
+def test_edited_task_is_rescheduled():
+    """Правка задания через Database пересобирает расписание"""
+    with tempfile.TemporaryDirectory() as root:
+        db = Database(os.path.join(root, "scheduler.db"))
+        db.init()
+        base = utc_now().replace(microsecond=0) + timedelta(days=1)
+        clock = FakeClock(base)
+        scheduler = TaskLifecycleScheduler(db, clock=clock)
+
+        task_id = db.add_task("Promo", "Ends soon", "channel_subscription",
+                              expires_at=fmt(base + timedelta(minutes=5)))
+        assert scheduler.next_event_at() == base + timedelta(minutes=5)
+
+        db.update_task_field(task_id, "expires_at", fmt(base + timedelta(hours=1)))
+        assert scheduler.next_event_at() == base + timedelta(hours=1)
+
+        clock.advance(minutes=30)
+        assert asyncio.run(scheduler.process_due()) == 0
+        assert db.get_task(task_id)['status'] == 'active'
+
+
+def test_slow_announcement_does_not_delay_expiry():
+    """Долгий on_activate идёт в фоне: истечение не ждёт рассылку, stop() её отменяет"""
+    with tempfile.TemporaryDirectory() as root:
+        db = Database(os.path.join(root, "scheduler.db"))
+        db.init()
+        base = utc_now().replace(microsecond=0) + timedelta(days=1)
+        clock = FakeClock(base)
+        started = []
+
+        async def broadcast(task):
+            started.append(task['id'])
+            await asyncio.sleep(3600)
+
+        scheduler = TaskLifecycleScheduler(db, clock=clock, on_activate=broadcast)
+        launch = db.add_task("Launch", "Starts later", "channel_subscription",
+                             starts_at=fmt(base + timedelta(minutes=1)))
+        promo = db.add_task("Promo", "Ends soon", "channel_subscription",
+                            expires_at=fmt(base + timedelta(minutes=2)))
+
+        async def scenario():
+            clock.advance(minutes=1)
+            assert await asyncio.wait_for(scheduler.process_due(), 1) == 1
+            await asyncio.sleep(0)
+            assert started == [launch] and scheduler.stats()["callbacks_running"] == 1
+
+            clock.advance(minutes=1)
+            assert await asyncio.wait_for(scheduler.process_due(), 1) == 1
+            assert db.get_task(promo)['status'] == 'expired'
+
+            scheduler.stop()
+            for _ in range(3):
+                await asyncio.sleep(0)
+            assert scheduler.stats()["callbacks_running"] == 0
+
+        asyncio.run(scenario())
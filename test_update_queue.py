@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+"""
+Тест очереди апдейтов: порядок по пользователю, восстановление после падения, аренда лидера
+"""
+import asyncio
+import json
+import os
+import tempfile
+
+from app.services.update_queue import QUEUE_MAX_ATTEMPTS, QueueWorker, UpdateQueue, update_shard_key
+
+
+def message(update_id: int, user_id: int, text: str) -> bytes:
+    return json.dumps({
+        "update_id": update_id,
+        "message": {"message_id": update_id, "date": 0, "text": text,
+                    "chat": {"id": user_id, "type": "private"}, "from": {"id": user_id}}
+    }).encode()
+
+
+def make_queue(root: str, shards: int = 1) -> UpdateQueue:
+    queue = UpdateQueue(os.path.join(root, "updates.db"), shards=shards)
+    queue.init()
+    return queue
+
+
+def test_shard_key_and_duplicate_webhooks():
+    """Ключ - отправитель; повтор вебхука с тем же update_id не попадает в очередь"""
+    assert update_shard_key({"update_id": 1, "callback_query": {"from": {"id": 7}}}) == 7
+    assert update_shard_key({"update_id": 2, "my_chat_member": {"chat": {"id": -100}}}) == -100
+    assert update_shard_key({"update_id": 3}) == 3
+
+    with tempfile.TemporaryDirectory() as root:
+        queue = make_queue(root, shards=4)
+        assert queue.push(message(10, 6, "a")) == 6 % 4
+        assert queue.push(message(10, 6, "a")) is None
+        assert queue.depth() == {"pending": 1}
+
+        # Повтор после обработки тоже отсекается, пока не вышло окно дедупликации
+        [(row_id, _, _)] = queue.claim(6 % 4)
+        queue.ack([row_id])
+        assert queue.depth() == {}
+        assert queue.push(message(10, 6, "a")) is None
+
+
+def test_same_user_is_sequential_other_users_concurrent():
+    """Апдейты одного пользователя идут по порядку и не пересекаются, разные - параллельно"""
+    with tempfile.TemporaryDirectory() as root:
+        queue = make_queue(root)
+        for i in range(6):
+            queue.push(message(i + 1, 100 + i % 2, f"m{i}"))
+
+        log = []
+        active = {}
+        overlap = []
+
+        async def handle(payload: str):
+            update = json.loads(payload)
+            user_id = update["message"]["from"]["id"]
+            active[user_id] = active.get(user_id, 0) + 1
+            overlap.append(sum(1 for n in active.values() if n))
+            assert active[user_id] == 1
+            await asyncio.sleep(0.01)
+            log.append((user_id, update["message"]["text"]))
+            active[user_id] -= 1
+
+        async def scenario():
+            worker = QueueWorker(queue, 0, handle, idle_wait=0.01)
+            task = asyncio.create_task(worker.run())
+            while queue.depth():
+                await asyncio.sleep(0.01)
+            worker.stop()
+            await task
+            return worker.stats()
+
+        stats = asyncio.run(scenario())
+        assert stats["processed"] == 6
+        assert [text for user, text in log if user == 100] == ["m0", "m2", "m4"]
+        assert [text for user, text in log if user == 101] == ["m1", "m3", "m5"]
+        assert max(overlap) == 2
+
+
+def test_claim_skips_busy_users_and_recover_requeues():
+    """Пользователь в обработке не забирается повторно; упавший воркер возвращает апдейты"""
+    with tempfile.TemporaryDirectory() as root:
+        queue = make_queue(root)
+        queue.push(message(1, 5, "first"))
+        queue.push(message(2, 6, "other"))
+        queue.push(message(3, 5, "second"))
+
+        assert [row[0] for row in queue.claim(0, busy_keys=[5])] == [2]
+        assert queue.claim(0) and queue.claim(0) == []
+
+        for _ in range(1, QUEUE_MAX_ATTEMPTS):
+            assert queue.recover(0) == 3
+            assert len(queue.claim(0)) == 3
+        queue.recover(0)
+        assert queue.depth() == {"dead": 3}
+
+        # Длинный хвост занятого пользователя не заслоняет остальных
+        for update_id in range(100, 110):
+            queue.push(message(update_id, 5, "spam"))
+        queue.push(message(200, 8, "late"))
+        assert [row[1] for row in queue.claim(0, busy_keys=[5], limit=5)] == [8]
+
+
+def test_leader_lease_is_exclusive_until_expiry():
+    with tempfile.TemporaryDirectory() as root:
+        queue = make_queue(root)
+        assert queue.try_lease("background", "a", ttl=60)
+        assert queue.try_lease("background", "a", ttl=60)
+        assert not queue.try_lease("background", "b", ttl=60)
+
+        queue.release_lease("background", "a")
+        assert queue.try_lease("background", "b", ttl=60)
+
+        # Истёкшая аренда переходит к другому
+        queue.try_lease("background", "b", ttl=-1)
+        assert queue.try_lease("background", "a", ttl=60)
@@ -0,0 +1,54 @@
+#!/usr/bin/env python3
+"""
+Тест кэша пользователей: попадания, сквозная запись и мемоизация на апдейт
+"""
+import os
+import tempfile
+
+import pytest
+
+from app.db import Database
+
+
+def make_db(root: str) -> Database:
+    db = Database(os.path.join(root, "users.db"))
+    db.init()
+    assert db.create_user(1, "alice", "Alice")
+    return db
+
+
+def test_cache_hits_and_write_through():
+    """Повторное чтение идёт из кэша, изменения через Database сразу видны"""
+    with tempfile.TemporaryDirectory() as root:
+        db = make_db(root)
+        first = db.get_user(1)
+        assert db.get_user(1) is first
+        stats = db.user_cache_stats()
+        assert stats["hits"] >= 1 and stats["size"] == 1
+        assert stats["bytes_per_user"] > 0 and stats["approx_bytes"] == stats["bytes_per_user"]
+
+        db.update_wallet(1, "UQD4FPq-TD7Yay6F4j-s8zr-YvdWBYkkL2xNrqjW6UQKWqqK")
+        assert db.get_user(1)["wallet_address"].startswith("UQD4")
+
+        db.add_balance(1, 2.5)
+        assert db.get_user(1)["balance"] == 2.5
+
+        with pytest.raises(AttributeError):
+            first.balance = 100
+
+
+def test_request_scope_memoizes_and_sees_own_writes():
+    """Внутри области get_user не ходит в кэш, но собственные записи видит"""
+    with tempfile.TemporaryDirectory() as root:
+        db = make_db(root)
+        with db.request_scope():
+            user = db.get_user(1)
+            lookups = db.user_cache_stats()["hits"] + db.user_cache_stats()["misses"]
+            assert db.get_user(1) is user
+            stats = db.user_cache_stats()
+            assert stats["hits"] + stats["misses"] == lookups
+            assert stats["memo_hits"] == 1
+
+            db.ban_user(1)
+            assert db.get_user(1)["banned"]
+        assert db.get_user(2) is None
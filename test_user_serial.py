@@ -0,0 +1,194 @@
+#!/usr/bin/env python3
+"""
+Тест сериализации апдейтов по пользователю и схлопывания повторных нажатий
+"""
+import asyncio
+
+from aiogram import Bot, Dispatcher, F, Router
+from aiogram.client.session.base import BaseSession
+from aiogram.methods import AnswerCallbackQuery
+from aiogram.types import Update
+
+from app.middleware.user_serial import UserSerialMiddleware
+from app.services import outbound
+from app.services.outbound import BULK, running_broadcasts, start_broadcast
+
+
+class FakeSession(BaseSession):
+    """Сессия без сети: запоминает вызовы Bot API"""
+
+    def __init__(self):
+        super().__init__()
+        self.calls = []
+
+    async def make_request(self, bot, method, timeout=None):
+        self.calls.append(method)
+        return True
+
+    async def stream_content(self, *args, **kwargs):
+        yield b""
+
+    async def close(self):
+        pass
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self):
+        return self.now
+
+
+def callback(update_id: int, user_id: int, data: str = "open_capsule") -> Update:
+    return Update.model_validate({
+        "update_id": update_id,
+        "callback_query": {
+            "id": str(update_id), "chat_instance": "1", "data": data,
+            "from": {"id": user_id, "is_bot": False, "first_name": "U"},
+            "message": {"message_id": 1, "date": 0, "chat": {"id": user_id, "type": "private"}}
+        }
+    })
+
+
+def text(update_id: int, user_id: int, value: str) -> Update:
+    return Update.model_validate({
+        "update_id": update_id,
+        "message": {"message_id": update_id, "date": 0, "text": value,
+                    "chat": {"id": user_id, "type": "private"},
+                    "from": {"id": user_id, "is_bot": False, "first_name": "U"}}
+    })
+
+
+def make_dispatcher(middleware: UserSerialMiddleware, log: list):
+    router = Router()
+    active = {}
+
+    async def track(user_id: int, what: str):
+        active[user_id] = active.get(user_id, 0) + 1
+        assert active[user_id] == 1, "handlers of one user overlapped"
+        await asyncio.sleep(0.01)
+        log.append((user_id, what))
+        active[user_id] -= 1
+
+    @router.callback_query(F.data == "open_capsule")
+    async def open_capsule(query):
+        await track(query.from_user.id, query.data)
+
+    @router.message()
+    async def any_text(message):
+        await track(message.from_user.id, message.text)
+
+    dp = Dispatcher()
+    dp.update.outer_middleware(middleware)
+    dp.include_router(router)
+    return dp
+
+
+def test_button_spam_runs_once_and_is_answered():
+    """Пять тапов по одной кнопке - один запуск хендлера, остальные только снимают часики"""
+    middleware = UserSerialMiddleware(window=1.0)
+    log = []
+    dp = make_dispatcher(middleware, log)
+    session = FakeSession()
+    bot = Bot("42:TEST", session=session)
+
+    async def scenario():
+        updates = [callback(i, 1) for i in range(5)] + [callback(10, 2)]
+        await asyncio.gather(*(dp.feed_update(bot, update) for update in updates))
+
+    asyncio.run(scenario())
+    assert sorted(log) == [(1, "open_capsule"), (2, "open_capsule")]
+    assert middleware.stats() == {"active_users": 0, "executed": 2, "collapsed": 4, "waited": 0}
+    assert sum(isinstance(call, AnswerCallbackQuery) for call in session.calls) == 4
+
+
+def test_different_updates_of_one_user_run_in_order():
+    """Разные апдейты пользователя не пересекаются и идут в порядке прихода"""
+    middleware = UserSerialMiddleware(window=1.0)
+    log = []
+    dp = make_dispatcher(middleware, log)
+    bot = Bot("42:TEST", session=FakeSession())
+
+    async def scenario():
+        updates = [text(i, 1, value) for i, value in enumerate(["a", "b", "c"])]
+        await asyncio.gather(*(dp.feed_update(bot, update) for update in updates))
+
+    asyncio.run(scenario())
+    assert log == [(1, "a"), (1, "b"), (1, "c")]
+    assert middleware.stats()["waited"] == 2
+    assert not middleware._slots
+
+
+def test_same_press_after_window_runs_again():
+    clock = FakeClock()
+    middleware = UserSerialMiddleware(window=1.0, clock=clock)
+    log = []
+    dp = make_dispatcher(middleware, log)
+    bot = Bot("42:TEST", session=FakeSession())
+
+    async def scenario():
+        await dp.feed_update(bot, callback(1, 1))
+        clock.now += 0.5
+        await dp.feed_update(bot, callback(2, 1))
+        clock.now += 1.0
+        await dp.feed_update(bot, callback(3, 1))
+
+    asyncio.run(scenario())
+    assert log == [(1, "open_capsule"), (1, "open_capsule")]
+    assert middleware.collapsed == 1
+
+
+def test_same_text_in_new_message_is_not_a_duplicate():
+    """Одна и та же сумма двумя сообщениями - два ввода; повторная доставка сообщения - дубль"""
+    clock = FakeClock()
+    middleware = UserSerialMiddleware(window=1.0, clock=clock)
+    log = []
+    dp = make_dispatcher(middleware, log)
+    bot = Bot("42:TEST", session=FakeSession())
+
+    async def scenario():
+        await dp.feed_update(bot, text(1, 1, "100"))
+        await dp.feed_update(bot, text(2, 1, "100"))
+        await dp.feed_update(bot, text(2, 1, "100"))
+
+    asyncio.run(scenario())
+    assert log == [(1, "100"), (1, "100")]
+    assert middleware.collapsed == 1
+
+
+def test_broadcast_does_not_hold_the_admin_queue():
+    """Рассылка из хендлера идёт в фоне с приоритетом BULK, следующие апдейты админа не ждут её"""
+    middleware = UserSerialMiddleware(window=1.0)
+    router = Router()
+    log = []
+    release = asyncio.Event()
+
+    async def broadcast():
+        log.append(("broadcast", outbound._priority.get()))
+        await release.wait()
+
+    @router.callback_query(F.data == "broadcast_general")
+    async def start(query):
+        start_broadcast(broadcast(), "test")
+
+    @router.message()
+    async def any_text(message):
+        log.append(("text", running_broadcasts()))
+
+    dp = Dispatcher()
+    dp.update.outer_middleware(middleware)
+    dp.include_router(router)
+    bot = Bot("42:TEST", session=FakeSession())
+
+    async def scenario():
+        await dp.feed_update(bot, callback(1, 1, "broadcast_general"))
+        await asyncio.wait_for(dp.feed_update(bot, text(2, 1, "/admin")), 1)
+        release.set()
+        for _ in range(3):
+            await asyncio.sleep(0)
+
+    asyncio.run(scenario())
+    assert log == [("broadcast", BULK), ("text", 1)]
+    assert running_broadcasts() == 0
+
@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+"""
+Стресс-тест резервирования средств под выводы: никакого двойного списания
+"""
+import os
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from app.db import Database
+from app.services.payouts import build_ton_batch
+
+USERS = 20
+BALANCE = 100.0
+AMOUNT = 30.0
+ATTEMPTS_PER_USER = 12
+
+
+def make_db(root: str) -> Database:
+    db = Database(os.path.join(root, "withdraw.db"))
+    db.init()
+    with db.get_connection() as conn:
+        conn.executemany(
+            "INSERT INTO users (user_id, username, first_name, pending_balance) VALUES (?, ?, 'Test', ?)",
+            ((uid, f"user{uid}", BALANCE) for uid in range(1, USERS + 1))
+        )
+        conn.commit()
+    return db
+
+
+def test_concurrent_withdrawals_never_overdraw():
+    """Параллельные заявки и выплаты не выводят больше баланса"""
+    with tempfile.TemporaryDirectory() as root:
+        db = make_db(root)
+        attempts = [(uid, n) for n in range(ATTEMPTS_PER_USER) for uid in range(1, USERS + 1)]
+        start = threading.Event()
+
+        def request(attempt):
+            user_id, n = attempt
+            worker_db = Database(db.db_path)
+            start.wait()
+            # Каждую заявку "доставляют" дважды - как повторный апдейт Telegram
+            key = f"tg:{user_id}:{n}"
+            first = worker_db.reserve_withdrawal(user_id, AMOUNT, idempotency_key=key)
+            second = worker_db.reserve_withdrawal(user_id, AMOUNT, idempotency_key=key)
+            assert second["reason"] == "duplicate" or not first["success"]
+            return first
+
+        with ThreadPoolExecutor(max_workers=32) as pool:
+            futures = [pool.submit(request, attempt) for attempt in attempts]
+            start.set()
+            results = [future.result() for future in futures]
+
+        created = [r for r in results if r["success"]]
+        per_user = int(BALANCE // AMOUNT)
+        assert len(created) == USERS * per_user
+
+        # Несколько админов выплачивают одни и те же заявки одновременно
+        request_ids = [r["request_id"] for r in created]
+        with ThreadPoolExecutor(max_workers=4) as pool:
+            outcomes = list(pool.map(
+                lambda admin: Database(db.db_path).process_withdrawal_requests(request_ids, admin),
+                [1, 2, 3, 4]
+            ))
+        assert sum(len(o["processed"]) for o in outcomes) == len(request_ids)
+
+        with db.get_connection() as conn:
+            rows = conn.execute("SELECT pending_balance, paid_balance FROM users").fetchall()
+            payouts = conn.execute("SELECT COUNT(*), SUM(amount) FROM payouts").fetchone()
+        for row in rows:
+            assert row["pending_balance"] == BALANCE - per_user * AMOUNT
+            assert row["paid_balance"] == per_user * AMOUNT
+        assert payouts[0] == len(request_ids)
+        assert payouts[1] == len(request_ids) * AMOUNT
+
+
+def test_rejection_releases_reservation():
+    """Отклонённая заявка возвращает средства в доступные"""
+    with tempfile.TemporaryDirectory() as root:
+        db = make_db(root)
+        first = db.reserve_withdrawal(1, 80.0, idempotency_key="a")
+        assert db.get_available_balance(1) == BALANCE - 80.0
+        assert db.reserve_withdrawal(1, 80.0, idempotency_key="b")["reason"] == "insufficient_funds"
+
+        assert db.reject_withdrawal_request(first["request_id"], admin_id=1)
+        assert not db.process_withdrawal_request(first["request_id"], admin_id=1)
+        assert db.get_available_balance(1) == BALANCE
+        assert db.reserve_withdrawal(1, 80.0, idempotency_key="b")["success"]
+
+
+def test_batch_payout_validates_in_order_and_exports():
+    """Пакетная выплата берёт заявки по порядку, пока хватает баланса"""
+    with tempfile.TemporaryDirectory() as root:
+        db = make_db(root)
+        with db.get_connection() as conn:
+            conn.execute("UPDATE users SET wallet_address = 'UQ-wallet-' || user_id WHERE user_id != 3")
+            # Заявки мимо резервирования: сумма превышает баланс пользователя 1
+            conn.executemany(
+                "INSERT INTO withdrawal_requests (user_id, amount, status) VALUES (?, ?, 'pending')",
+                [(1, 60.0), (1, 60.0), (2, 10.0), (3, 10.0)]
+            )
+            conn.commit()
+
+        result = db.process_withdrawal_batch(admin_id=7, require_wallet=True)
+        assert result['processed'] == [1, 3]
+        assert result['skipped'] == [2, 4]
+        assert result['total'] == 70.0
+        assert db.get_user(1)['pending_balance'] == 40.0
+
+        csv_lines = build_ton_batch(result['payouts']).decode().splitlines()
+        assert csv_lines == ["address,amount,comment",
+                             "UQ-wallet-1,60,SC withdrawal #1",
+                             "UQ-wallet-2,10,SC withdrawal #3"]